@@ -6,24 +6,50 @@ listed in a *file-of-files* (FOF) and outputs a single tab-separated summary.
 
 Usage
 -----
-GAQET.py -i samples.fof -o results/ -t 8
+GAQET.py -i samples.fof -o results/ -t 8 [-j 4]
+GAQET.py -i samples.fof -o results/ -t 8 --plan     # dry run with estimates
+
+Stage thread counts and memory (GB) can be fixed in a YAML config (``--config``):
+threads:
+  busco: 8
+  LTR_retriever: 4
+memory:
+  LTR_retriever: 64
+
+Several machines: the coordinator queues the stages, workers run them
+GAQET.py -i samples.fof -o results/ --queue results/queue.sqlite
+GAQET.py worker results/queue.sqlite -t 16      # on each node
 """
 
 # === Standard library imports ===
 import argparse
+import os
 import sys
 from csv import DictReader
 from pathlib import Path
 
+# === Third-party imports ===
+import yaml
+
 # === Project-specific imports ===
-from src.agat import run_agat, get_agat_stats
-from src.busco import run_busco, run_gffread, get_busco_results
-from src.LTR_retriever import (
-    create_outdir, run_suffixerator, run_harvest, run_finder,
-    concatenate_outputs, run_LTR_retriever, run_LAI, get_LAI
+from src.cache import release_pins
+from src.compression import remove_decompressed
+from src.history import (
+    fit_models, get_default_history_fpath, plan_memory, plan_threads, record_history
 )
-from src.stringtie import run_stringtie, run_gffcompare, calculate_annotation_scores
-from src.table import AGAT_COLS, RNASEQ_COLS
+from src.monitor import RunMonitor, serve_metrics, watch_status, write_status
+from src.pipeline import (
+    build_run_stages, get_input_consumers, group_by_assembly, group_by_input, group_by_lineage,
+    prune_cached, stage_id
+)
+from src.plan import get_makespan, plan_run, print_plan
+from src.profiling import write_profiles
+from src.results import (
+    get_sample_stages, open_store, update_sample, write_columnar, write_summary
+)
+from src.scheduler import run_stages, succeeded
+from src.stringtie import get_libraries
+from src.workqueue import run_queue, run_worker
 
 
 # ---------------------------------------------------------------------------
@@ -38,6 +64,85 @@ def parse_arguments() -> argparse.Namespace:
     parser.add_argument("-o", "--output", required=True, help="Output folder")
     parser.add_argument("-t", "--threads", type=int, default=1,
                         help="Threads to use (default 1)")
+    parser.add_argument("-j", "--jobs", type=int, default=None,
+                        help="Samples to process at the same time "
+                             "(default: as many as the threads allow)")
+    parser.add_argument("--max-mem", type=float, default=None,
+                        help="Memory budget in GB: stages only start when their estimated "
+                             "peak memory fits (default: no limit)")
+    parser.add_argument("--config", default=None,
+                        help="YAML config with a `threads` table (stage name -> threads "
+                             "or multi), a `memory` table (stage name -> GB) and the "
+                             "`history` file")
+    parser.add_argument("--history", default=None,
+                        help="Runtime history used to plan the threads of each stage "
+                             "(default: $GAQET_HISTORY or history.sqlite in the output "
+                             "folder; `none` to disable)")
+    parser.add_argument("--stats-backend", choices=["agat", "native", "compare"],
+                        default="agat",
+                        help="Annotation statistics engine: AGAT, the built-in "
+                             "streaming engine, or both with a comparison table "
+                             "(default agat)")
+    parser.add_argument("--proteins-backend", choices=["gffread", "native"],
+                        default="gffread",
+                        help="Protein extraction for BUSCO: gffread or the built-in "
+                             "indexed extractor (default gffread)")
+    parser.add_argument("--compare-backend", choices=["gffcompare", "native"],
+                        default="gffcompare",
+                        help="Comparison of the StringTie transcripts with the reference: "
+                             "gffcompare or the built-in interval-indexed comparator "
+                             "(default gffcompare)")
+    parser.add_argument("--lai-backend", choices=["perl", "native", "compare"],
+                        default="perl",
+                        help="LAI computation from the LTR_retriever outputs: the LAI "
+                             "script, the built-in interval engine, or both with a "
+                             "comparison table (default perl)")
+    parser.add_argument("--busco-batch", action="store_true",
+                        help="Run BUSCO once per lineage on the proteins of all the "
+                             "samples that share it (BUSCO batch mode)")
+    parser.add_argument("--stringtie-shards", type=int, default=1,
+                        help="Split the alignments in this many groups of whole "
+                             "chromosomes and assemble them in parallel (default 1; "
+                             "samples with several libraries assemble each one instead)")
+    parser.add_argument("--harvest-shards", type=int, default=1,
+                        help="Split each assembly in this many groups of whole sequences "
+                             "and run ltrharvest on them in parallel (default 1)")
+    parser.add_argument("--cache-dir", default=os.environ.get("GAQET_CACHE_DIR"),
+                        help="Artifact cache shared between runs "
+                             "(default: $GAQET_CACHE_DIR, no cache if unset)")
+    parser.add_argument("--cache-size", type=float, default=200,
+                        help="Cache size limit in GB (default 200)")
+    parser.add_argument("--scratch-dir", default=os.environ.get("GAQET_SCRATCH_DIR"),
+                        help="Folder for the decompressed copies of .gz/.bgz inputs "
+                             "(default: $GAQET_SCRATCH_DIR, or <output>/scratch)")
+    parser.add_argument("--keep-decompressed", action="store_true",
+                        help="Keep the decompressed copies of the inputs after the run")
+    parser.add_argument("--stage-timeout", type=float, default=None,
+                        help="Stop the commands of a stage after this many hours "
+                             "(default: no limit)")
+    parser.add_argument("--fail-fast", action="store_true",
+                        help="When a stage fails, stop the other stages of the same "
+                             "sample or assembly")
+    parser.add_argument("--columnar", choices=["parquet", "arrow", "none"], default="none",
+                        help="Also export the typed results as results.<format> and "
+                             "lai_windows.<format> (needs pyarrow; default none)")
+    parser.add_argument("--queue", default=None,
+                        help="Do not run the stages here: put them in this queue file on "
+                             "shared storage for `GAQET.py worker` processes, and write "
+                             "the summary when they are all done")
+    parser.add_argument("--metrics-port", type=int, default=None,
+                        help="Serve live progress metrics in the Prometheus text format "
+                             "on this port (http://<host>:<port>/metrics)")
+    parser.add_argument("--metrics-host", default="127.0.0.1",
+                        help="Address the metrics endpoint listens on (default 127.0.0.1; "
+                             "0.0.0.0 for every interface)")
+    parser.add_argument("--status-file", default=None,
+                        help="Rewrite the same metrics to this file every 15 seconds "
+                             "(e.g. for the node exporter textfile collector)")
+    parser.add_argument("--plan", action="store_true",
+                        help="Do not run anything: print the stages that are done, cached "
+                             "or to run, with their estimated time, memory and disk, and "
+                             "the estimated makespan for -t threads")
 
     if len(sys.argv) == 1:
         parser.print_help()
@@ -45,9 +150,44 @@ def parse_arguments() -> argparse.Namespace:
 
     return parser.parse_args()
 
+def parse_worker_arguments() -> argparse.Namespace:
+    """Return parsed arguments of the ``worker`` subcommand."""
+    parser = argparse.ArgumentParser(prog="GAQET.py worker",
+                                     description="Run the stages of a GAQET queue.")
+    parser.add_argument("queue", help="Queue file written by `GAQET.py --queue`")
+    parser.add_argument("-t", "--threads", type=int, default=1,
+                        help="Threads to use (default 1)")
+    parser.add_argument("--stage-timeout", type=float, default=None,
+                        help="Stop the commands of a stage after this many hours "
+                             "(default: no limit)")
+    parser.add_argument("--max-mem", type=float, default=None,
+                        help="Memory budget of this worker in GB (default: no limit)")
+    return parser.parse_args(sys.argv[2:])
+
 # ---------------------------------------------------------------------------
 # Load and validate input
 # ---------------------------------------------------------------------------
+def read_config(config_fpath):
+    """Load and check the YAML config (``threads`` and ``memory`` tables and ``history`` file)."""
+    if config_fpath is None:
+        return {"threads": {}, "memory": {}, "history": None}
+    if not Path(config_fpath).exists():
+        raise RuntimeError("Config does not exist")
+    with open(config_fpath) as config_fhand:
+        config = yaml.safe_load(config_fhand) or {}
+    unknown = set(config) - {"threads", "memory", "history"}
+    if unknown:
+        raise RuntimeError("Unknown config keys: {}".format(", ".join(sorted(unknown))))
+    threads = config.get("threads") or {}
+    for stage, value in threads.items():
+        if value != "multi" and not (isinstance(value, int) and value >= 1):
+            raise RuntimeError("Threads of {} must be a positive number or multi".format(stage))
+    memory = config.get("memory") or {}
+    for stage, value in memory.items():
+        if isinstance(value, bool) or not isinstance(value, (int, float)) or value < 0:
+            raise RuntimeError("Memory of {} must be a number of GB".format(stage))
+    return {"threads": threads, "memory": memory, "history": config.get("history")}
+
 def get_arguments():
     """Load the FOF file and return a plain dict with paths and settings."""
     parser = parse_arguments()
@@ -58,92 +198,239 @@ def get_arguments():
         samples = {}
         with open(fof_fpath) as fof_fhand:
             samples = {line["name"]: line for line in DictReader(fof_fhand, delimiter="\t")}
+    config = read_config(parser.config)
+    history = (parser.history or config["history"]
+               or get_default_history_fpath(Path(parser.output).resolve()))
+    # The alignments of a sample may be several BAMs (comma-separated or globs)
+    for values in samples.values():
+        values["libraries"] = get_libraries(values["alignments"])
+    if parser.queue:
+        # Workers may run in other folders: give them absolute paths
+        for values in samples.values():
+            for key in ("ref_assembly", "ref_annotation", "annotation"):
+                if values.get(key):
+                    values[key] = str(Path(values[key]).resolve())
+            values["libraries"] = [str(Path(library).resolve()) for library in values["libraries"]]
+    for values in samples.values():
+        if len(values["libraries"]) == 1:
+            values["alignments"] = values["libraries"][0]
                        
     return {"input": samples,
             "threads": parser.threads,
-            "output": Path(parser.output)}
+            "jobs": parser.jobs,
+            "thread_overrides": config["threads"],
+            "memory_overrides": config["memory"],
+            "max_mem": parser.max_mem * 1024 if parser.max_mem else None,
+            "history": None if str(history).lower() == "none" else Path(history).expanduser(),
+            "stats_backend": parser.stats_backend,
+            "proteins_backend": parser.proteins_backend,
+            "compare_backend": parser.compare_backend,
+            "lai_backend": parser.lai_backend,
+            "busco_batch": parser.busco_batch,
+            "stringtie_shards": max(1, parser.stringtie_shards),
+            "harvest_shards": max(1, parser.harvest_shards),
+            "cache_dir": Path(parser.cache_dir).resolve() if parser.cache_dir else None,
+            "cache_size": int(parser.cache_size * 1024 ** 3),
+            "scratch_dir": Path(parser.scratch_dir).resolve() if parser.scratch_dir else None,
+            "keep_decompressed": parser.keep_decompressed,
+            "stage_timeout": parser.stage_timeout * 3600 if parser.stage_timeout else None,
+            "fail_fast": parser.fail_fast,
+            "columnar": parser.columnar,
+            "plan": parser.plan,
+            "metrics_port": parser.metrics_port,
+            "metrics_host": parser.metrics_host,
+            "status_file": Path(parser.status_file) if parser.status_file else None,
+            "queue": Path(parser.queue).resolve() if parser.queue else None,
+            "output": Path(parser.output).resolve() if parser.queue else Path(parser.output)}
+
+def log_stage(log_fpaths: dict, stage: str, result: dict) -> None:
+    """Print a runner result and append it to its sample's log."""
+    print(stage, result)
+    group = stage.split("/")[0]
+    if group in log_fpaths:
+        with open(log_fpaths[group], "a") as log_fhand:
+            log_fhand.write("{}\t{}\n".format(stage, result))
 
 # ---------------------------------------------------------------------------
 # Main workflow
 # ---------------------------------------------------------------------------
+def worker_main():
+    """Serve a queue written by ``GAQET.py --queue`` until it is finished."""
+    parser = parse_worker_arguments()
+    timeout = parser.stage_timeout * 3600 if parser.stage_timeout else None
+    max_mem = parser.max_mem * 1024 if parser.max_mem else None
+    ran = run_worker(Path(parser.queue), parser.threads, timeout=timeout, max_mem=max_mem)
+    release_pins()
+    print("Worker finished: {} stages run".format(ran))
+
 def main():
-    """Run all analyses and write `summary.tsv`."""
+    """Run all analyses and write `summary.tsv` to the output folder.
+
+    Return the exit status: 1 if a stage failed or was skipped, or if the
+    summary row of a sample could not be parsed.
+    """
+    if sys.argv[1:2] == ["worker"]:
+        return worker_main()
     arguments = get_arguments()
+    # A plan (dry run) leaves the output folder untouched
+    dry_run = arguments["plan"]
     # Output directory
     out_dir =  arguments["output"]
-    if not out_dir.exists():
+    if not out_dir.exists() and not dry_run:
         out_dir.mkdir(parents=True, exist_ok=True)
     
-    # Dictionary for results  
-    stats = {}   
-
-    # For each sample: create a folder, run the 4 pipelines and save results in "stats"
+    # For each sample: create a folder with its own log
+    log_fpaths = {}
     for name, values in arguments["input"].items():
-        stats[name] = {}
         name_dir = out_dir / name
         values["output"] = name_dir
         values["threads"] = arguments["threads"]
-        if not name_dir.exists():
+        values["cache_dir"] = arguments["cache_dir"]
+        values["cache_size"] = arguments["cache_size"]
+        values["stats_backend"] = arguments["stats_backend"]
+        values["proteins_backend"] = arguments["proteins_backend"]
+        values["compare_backend"] = arguments["compare_backend"]
+        values["stringtie_shards"] = arguments["stringtie_shards"]
+        if not name_dir.exists() and not dry_run:
             name_dir.mkdir(parents=True, exist_ok=True)
+        log_fpaths[name] = name_dir / "GAQET.log"
+
+    # Compressed inputs: decompress each one once to the scratch folder
+    # (annotations only read by the native engines are streamed)
+    scratch_dir = arguments["scratch_dir"] or out_dir.resolve() / "scratch"
+    inputs = group_by_input(arguments["input"], out_dir, scratch_dir)
+    for key, source in inputs.items():
+        if not dry_run:
+            source["output"].mkdir(parents=True, exist_ok=True)
+        log_fpaths[key] = source["output"] / "GAQET.log"
+
+    # LAI only depends on the assembly: compute it once per distinct genome
+    assemblies = group_by_assembly(arguments["input"], out_dir)
+    for key, assembly in assemblies.items():
+        if not dry_run:
+            assembly["output"].mkdir(parents=True, exist_ok=True)
+        assembly["cache_dir"] = arguments["cache_dir"]
+        assembly["cache_size"] = arguments["cache_size"]
+        assembly["proteins_backend"] = arguments["proteins_backend"]
+        assembly["harvest_shards"] = arguments["harvest_shards"]
+        assembly["lai_backend"] = arguments["lai_backend"]
+        log_fpaths[key] = assembly["output"] / "GAQET.log"
+
+    # BUSCO batch mode: one BUSCO run per lineage shared by several samples
+    batches = group_by_lineage(arguments["input"], out_dir) if arguments["busco_batch"] else {}
+    for key, batch in batches.items():
+        if not dry_run:
+            batch["output"].mkdir(parents=True, exist_ok=True)
+        log_fpaths[key] = batch["output"] / "GAQET.log"
+
+    # Store the summary row of each sample as soon as all its stages are
+    # finished, and keep summary.tsv up to date with the stored rows
+    summary_fpath = out_dir / "summary.tsv"
+    finished = {}
+    failed_rows = set()
+
+    def record_sample(name):
+        result = update_sample(store, name, arguments["input"][name], finished,
+                               arguments["stats_backend"])
+        if succeeded(result):
+            failed_rows.discard(name)
+        else:
+            failed_rows.add(name)
+        log_stage(log_fpaths, stage_id(name, "summary"), result)
+        write_summary(store, list(arguments["input"]), summary_fpath)
+
+    def stage_done(stage, result):
+        if monitor is not None:
+            monitor.stage_finished(stage, result)
+        log_stage(log_fpaths, stage, result)
+        finished[stage] = result
+        for name, left in waiting.items():
+            if stage in left:
+                left.discard(stage)
+                if not left:
+                    record_sample(name)
+        # Remove a decompressed input once every stage reading it is finished
+        for input_stage, left in consumers.items():
+            if stage in left:
+                left.discard(stage)
+                if not left and not arguments["keep_decompressed"]:
+                    key = input_stage.split("/")[0]
+                    log_stage(log_fpaths, stage_id(key, "cleanup"),
+                              remove_decompressed(inputs[key]))
+
+    # Run the AGAT, BUSCO, LAI and RNA-seq chains of all samples concurrently,
+    # sharing the thread budget and skipping what the artifact cache holds
+    stages = prune_cached(build_run_stages(arguments["input"], assemblies, batches, inputs))
+    waiting = get_sample_stages(stages, arguments["input"])
+    consumers = get_input_consumers(stages)
+    # Threads of each stage: config overrides, then the runtime history
+    models = fit_models(arguments["history"]) if arguments["history"] else {}
+    jobs = None if arguments["queue"] else arguments["jobs"]
+    for name, stage_threads in plan_threads(stages, arguments["threads"], models,
+                                            arguments["thread_overrides"], max_groups=jobs,
+                                            limited_groups=set(arguments["input"])).items():
+        stages[name]["threads"] = stage_threads
+    # Peak memory of each stage, reserved against --max-mem
+    for name, memory in plan_memory(stages, models, arguments["memory_overrides"]).items():
+        stages[name]["memory"] = memory
+    if dry_run:
+        rows = plan_run(stages, arguments["threads"], models)
+        print_plan(rows, get_makespan(stages, rows, arguments["threads"]), arguments["threads"],
+                   sys.stdout)
+        release_pins()
+        return
+    store = open_store(out_dir)
+    # Live progress: metrics endpoint and/or status file
+    monitor, server, status_stop = None, None, None
+    if arguments["metrics_port"] is not None or arguments["status_file"]:
+        monitor = RunMonitor(stages, waiting, arguments["threads"], arguments["max_mem"])
+        if arguments["metrics_port"] is not None:
+            server = serve_metrics(monitor, arguments["metrics_port"], arguments["metrics_host"])
+            print("Metrics served on http://{}:{}/metrics".format(arguments["metrics_host"],
+                                                                 server.server_address[1]))
+        if arguments["status_file"]:
+            status_stop = watch_status(monitor, arguments["status_file"])
+    started = monitor.stage_started if monitor is not None else None
+    if arguments["queue"]:
+        results = run_queue(stages, arguments["queue"], callback=stage_done,
+                            fail_fast=arguments["fail_fast"], started=started)
+    else:
+        results = run_stages(stages, arguments["threads"], callback=stage_done,
+                             max_groups=arguments["jobs"],
+                             limited_groups=set(arguments["input"]),
+                             group_slots={key: source["sample"] for key, source in inputs.items()},
+                             timeout=arguments["stage_timeout"],
+                             fail_fast=arguments["fail_fast"],
+                             max_mem=arguments["max_mem"],
+                             started=started)
+    if status_stop is not None:
+        status_stop.set()
+        write_status(monitor, arguments["status_file"])
+    if server is not None:
+        server.shutdown()
+    if arguments["history"]:
+        record_history(arguments["history"], stages, results)
+    # Wall time, CPU, memory and I/O of every stage
+    write_profiles(results, {group: log_fpath.parent for group, log_fpath in log_fpaths.items()},
+                   out_dir)
+    # Typed columnar copy of the results
+    if arguments["columnar"] != "none":
+        try:
+            for out_fpath in write_columnar(store, list(arguments["input"]), out_dir,
+                                            arguments["columnar"]):
+                print("Written {}".format(out_fpath))
+        except ImportError:
+            print("pyarrow is not installed: {} export skipped".format(arguments["columnar"]))
+    store.close()
+    # Other runs may now evict the cache entries this one restored
+    release_pins()
+    # Batch drivers only see the exit status
+    failed_stages = [name for name, result in results.items() if not succeeded(result)]
+    if failed_stages or failed_rows:
+        print("{} stages failed or were skipped, {} summary rows failed".format(
+            len(failed_stages), len(failed_rows)))
+        return 1
+    return 0
 
-        # AGAT
-        agat_statistics = run_agat(values)
-        print(agat_statistics)
-        stats[name]["agat_statistics"] = get_agat_stats(agat_statistics)
-
-        # BUSCO
-        gffread_results = run_gffread(values)
-        print(gffread_results)
-        busco_results = run_busco(values)
-        print(busco_results)
-        stats[name]["busco_results"] = get_busco_results(busco_results, lineage=values["lineage"])
-
-        # LAI
-        LAI_out_dir =  create_outdir(values)
-        print(LAI_out_dir)
-        values["LAI_dir"] = LAI_out_dir["out_fpath"]
-        suffixerator =  run_suffixerator(values)
-        if "returncode" in suffixerator:
-            if suffixerator["returncode"] == 1:
-                raise RuntimeError("Suffixerator has failed")
-        print(suffixerator)
-        harvest = run_harvest(values)
-        print(harvest)
-        finder = run_finder(values)
-        print(finder)
-        cat = concatenate_outputs(values)
-        print(cat)
-        LTR = run_LTR_retriever(values)
-        print(LTR)
-        LAI = run_LAI(values)
-        print(LAI)
-        stats[name]["LAI"] = get_LAI(LAI)
-
-        # RNA-seq support
-        stringtie = run_stringtie(values)
-        print(stringtie)
-        gffcompare = run_gffcompare(values)
-        print(gffcompare)
-        annotation_scores = calculate_annotation_scores(values)
-        print(annotation_scores)
-        stats[name]["annotation_scores"] = annotation_scores
-
-    # Write summary as a table
-    with open("summary.tsv", "w") as summary:
-        header = ["Name"]
-        header += AGAT_COLS
-        header += ["Busco results"]
-        header += ["LAI"]
-        header += RNASEQ_COLS
-        summary.write("\t".join(header)+"\n")
-        
-        for name in arguments["input"]:
-            results = [name]
-            results += [stats[name]["agat_statistics"][stat] for stat in AGAT_COLS]
-            results += [stats[name]["busco_results"]]
-            results += [stats[name]["LAI"]]
-            results += [stats[name]["annotation_scores"][score] for score in RNASEQ_COLS]
-            summary.write("\t".join(results)+"\n")
-        
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    sys.exit(main())
\ No newline at end of file
@@ -0,0 +1,235 @@
+#!/usr/bin/env python
+"""run_benchmarks.py
+Times GAQET's own overhead offline: synthetic inputs (see :mod:`synthetic`)
+are run through ``GAQET.main()`` with stub tools (see :mod:`stub_tool`) on
+the ``PATH``, and the result parsers are timed on synthetic reports. The
+timings are written as JSON; with ``--baseline`` they are compared with an
+earlier run and the script exits with 1 when something got slower than
+the tolerance.
+
+Usage
+-----
+python benchmarks/run_benchmarks.py --samples 8 --genes 2000 -o bench.json
+python benchmarks/run_benchmarks.py -o new.json --baseline bench.json
+"""
+
+# === Standard library imports ===
+import argparse
+import contextlib
+import json
+import os
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, List
+
+BENCH_DIR = Path(__file__).resolve().parent
+sys.path.insert(0, str(BENCH_DIR.parent))
+sys.path.insert(0, str(BENCH_DIR))
+
+# === Project-specific imports ===
+import GAQET  # noqa: E402
+import synthetic  # noqa: E402
+from stub_tool import TOOLS  # noqa: E402
+from src.agat import get_agat_stats  # noqa: E402
+from src.busco import get_busco_results  # noqa: E402
+from src.LTR_retriever import get_LAI  # noqa: E402
+from src.stringtie import calculate_annotation_scores  # noqa: E402
+
+# Backend options of each timed variant of main()
+VARIANTS: Dict[str, List[str]] = {
+    "default": [],
+    "native": ["--stats-backend", "native", "--proteins-backend", "native",
+               "--compare-backend", "native", "--lai-backend", "native"],
+    "busco-batch": ["--busco-batch"],
+}
+
+
+# ---------------------------------------------------------------------------
+# CLI helpers
+# ---------------------------------------------------------------------------
+def parse_arguments() -> argparse.Namespace:
+    """Return parsed command-line arguments."""
+    parser = argparse.ArgumentParser(description="Benchmark GAQET with stub tools.")
+    parser.add_argument("--samples", type=int, default=4, help="FOF samples (default 4)")
+    parser.add_argument("--genomes", type=int, default=2,
+                        help="Distinct assemblies shared by the samples (default 2)")
+    parser.add_argument("--genes", type=int, default=2000,
+                        help="Gene models per annotation (default 2000)")
+    parser.add_argument("--seqs", type=int, default=10, help="Sequences per genome (default 10)")
+    parser.add_argument("--seq-len", type=int, default=200000,
+                        help="Mean sequence length (default 200000)")
+    parser.add_argument("-t", "--threads", type=int, default=4,
+                        help="Threads given to GAQET (default 4)")
+    parser.add_argument("--repeats", type=int, default=3, help="Runs of each benchmark (default 3)")
+    parser.add_argument("--parser-calls", type=int, default=200,
+                        help="Calls per parser timing (default 200)")
+    parser.add_argument("--sleep", type=float, default=0.05,
+                        help="Seconds each stub tool sleeps (default 0.05)")
+    parser.add_argument("--variants", nargs="+", default=list(VARIANTS), choices=list(VARIANTS),
+                        help="Backend variants of main() to time (default all)")
+    parser.add_argument("--workdir", default=None,
+                        help="Folder for the synthetic data (default: a temporary one)")
+    parser.add_argument("-o", "--output", default=None, help="JSON file for the timings")
+    parser.add_argument("--baseline", default=None, help="Earlier JSON to compare with")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="Allowed slowdown over the baseline (default 0.2 = 20%%)")
+    return parser.parse_args()
+
+
+# ---------------------------------------------------------------------------
+# 1. Environment
+# ---------------------------------------------------------------------------
+def install_stubs(bin_dir: Path, sleep: float) -> None:
+    """Link every stub tool into ``bin_dir`` and put it first in the ``PATH``."""
+    bin_dir.mkdir(parents=True, exist_ok=True)
+    for tool in TOOLS:
+        link = bin_dir / tool
+        if link.is_symlink() or link.exists():
+            link.unlink()
+        link.symlink_to(BENCH_DIR / "stub_tool.py")
+    os.environ["PATH"] = "{}{}{}".format(bin_dir, os.pathsep, os.environ.get("PATH", ""))
+    os.environ["GAQET_STUB_SLEEP"] = str(sleep)
+    # Benchmarks must not read or fill a real artifact cache
+    os.environ.pop("GAQET_CACHE_DIR", None)
+    # ... nor record their stub timings in the runtime history
+    os.environ["GAQET_HISTORY"] = "none"
+
+
+def summarize(seconds: List[float]) -> Dict[str, Any]:
+    return {"min": min(seconds), "mean": statistics.mean(seconds), "runs": seconds}
+
+
+# ---------------------------------------------------------------------------
+# 2. Benchmarks
+# ---------------------------------------------------------------------------
+def time_main(fof: Path, out_dir: Path, threads: int, options: List[str]) -> float:
+    """Run ``GAQET.main()`` once and return its wall time."""
+    sys.argv = ["GAQET.py", "-i", str(fof), "-o", str(out_dir), "-t", str(threads)] + options
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        start = time.perf_counter()
+        GAQET.main()
+        return time.perf_counter() - start
+
+
+def bench_main(workdir: Path, fof: Path, args: argparse.Namespace) -> Dict[str, Any]:
+    """Time fresh runs and fully resumed runs of every variant."""
+    results = {}
+    for variant in args.variants:
+        fresh, resumed = [], []
+        for repeat in range(args.repeats):
+            out_dir = workdir / "runs" / "{}_{}".format(variant, repeat)
+            if out_dir.exists():
+                shutil.rmtree(out_dir)
+            fresh.append(time_main(fof, out_dir, args.threads, VARIANTS[variant]))
+            # Every stage is already done: only GAQET's own work is left
+            resumed.append(time_main(fof, out_dir, args.threads, VARIANTS[variant]))
+        results["main[{}]".format(variant)] = summarize(fresh)
+        results["main[{}, resumed]".format(variant)] = summarize(resumed)
+    return results
+
+
+def time_calls(function: Callable[[], Any], calls: int, repeats: int) -> Dict[str, Any]:
+    """Return the time per call of ``function``, best of ``repeats``."""
+    seconds = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        for _ in range(calls):
+            function()
+        seconds.append((time.perf_counter() - start) / calls)
+    return summarize(seconds)
+
+
+def bench_parsers(workdir: Path, args: argparse.Namespace) -> Dict[str, Any]:
+    """Time the parsers of the tool reports on synthetic reports."""
+    reports = workdir / "reports"
+    sample = reports / "sample"
+    (sample / "RNASeqCheck").mkdir(parents=True, exist_ok=True)
+    busco_dir = reports / "BUSCOCompleteness"
+    busco_dir.mkdir(exist_ok=True)
+
+    agat_fpath = reports / "ResultAgat.txt"
+    synthetic.write_agat_report(agat_fpath, args.genes)
+    synthetic.write_busco_summary(
+        busco_dir / "short_summary.specific.eudicots_odb10.BUSCOCompleteness.txt", "eudicots_odb10")
+    lai_fpath = reports / "genome.fa.mod.out.LAI"
+    synthetic.write_lai(lai_fpath, {"chr{}".format(i): args.seq_len for i in range(args.seqs)})
+    synthetic.write_gffcompare_stats(sample / "RNASeqCheck" / "sample.stats")
+    values = {"output": sample, "alignments": "sample.bam"}
+
+    parsers = {
+        "get_agat_stats": lambda: get_agat_stats({"out_fpath": agat_fpath}),
+        "get_busco_results": lambda: get_busco_results({"out_fpath": busco_dir},
+                                                       lineage="eudicots_odb10"),
+        "get_LAI": lambda: get_LAI({"out_fpath": lai_fpath}),
+        "calculate_annotation_scores": lambda: calculate_annotation_scores(values),
+    }
+    return {name: time_calls(parser, args.parser_calls, args.repeats)
+            for name, parser in parsers.items()}
+
+
+# ---------------------------------------------------------------------------
+# 3. Regressions
+# ---------------------------------------------------------------------------
+def find_regressions(timings: Dict[str, Any], baseline: Dict[str, Any],
+                     tolerance: float) -> List[str]:
+    """Return a line per benchmark slower than ``baseline`` by more than ``tolerance``."""
+    regressions = []
+    for name, timing in timings.items():
+        before = baseline.get(name)
+        if before and before["min"] > 0 and timing["min"] > before["min"] * (1 + tolerance):
+            regressions.append("{}: {:.4g}s -> {:.4g}s (+{:.0%})".format(
+                name, before["min"], timing["min"], timing["min"] / before["min"] - 1))
+    return regressions
+
+
+# ---------------------------------------------------------------------------
+# Main workflow
+# ---------------------------------------------------------------------------
+def main():
+    """Build the synthetic data, run the benchmarks and report them."""
+    args = parse_arguments()
+    tmp_dir = None
+    if args.workdir:
+        workdir = Path(args.workdir).resolve()
+    else:
+        tmp_dir = tempfile.TemporaryDirectory(prefix="gaqet-bench-")
+        workdir = Path(tmp_dir.name)
+
+    install_stubs(workdir / "bin", args.sleep)
+    fof = synthetic.make_dataset(workdir / "data", args.samples, args.genes,
+                                 n_seqs=args.seqs, seq_len=args.seq_len, n_genomes=args.genomes)
+    try:
+        timings = bench_main(workdir, fof, args)
+        timings.update(bench_parsers(workdir, args))
+    finally:
+        if tmp_dir is not None:
+            tmp_dir.cleanup()
+
+    for name, timing in timings.items():
+        print("{:<40}min {:>10.4g}s   mean {:>10.4g}s".format(name, timing["min"], timing["mean"]))
+
+    if args.output:
+        report = {"settings": {key: value for key, value in vars(args).items()
+                               if key not in ("output", "baseline", "workdir")},
+                  "python": platform.python_version(),
+                  "timings": timings}
+        with open(args.output, "w") as out_fhand:
+            json.dump(report, out_fhand, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as baseline_fhand:
+            baseline = json.load(baseline_fhand)["timings"]
+        regressions = find_regressions(timings, baseline, args.tolerance)
+        for line in regressions:
+            print("REGRESSION {}".format(line))
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+"""
+stub_tool.py
+============
+Stand-in for the external tools GAQET runs, for offline benchmarks.
+
+The tool is chosen by the name the script is called with (the harness
+links it as ``agat_sp_statistics.pl``, ``busco``, ``gt``, ``stringtie``,
+``gffcompare``, ``gffread``, ``samtools``, ``LTR_FINDER_parallel``,
+``LTR_retriever`` and ``LAI``). Each stub sleeps ``GAQET_STUB_SLEEP``
+seconds (default 0.05) and writes canned output (see :mod:`synthetic`)
+where the real tool would.
+"""
+
+import os
+import shutil
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+import synthetic  # noqa: E402
+
+
+def option(args, name, default=None):
+    """Return the value following ``name`` in ``args``."""
+    return args[args.index(name) + 1] if name in args else default
+
+
+def count_lines(fpath, text):
+    """Return how many lines of ``fpath`` contain ``text``."""
+    with open(fpath) as fhand:
+        return sum(1 for line in fhand if text in line)
+
+
+def fasta_lengths(fpath):
+    lengths, name = {}, None
+    with open(fpath) as fhand:
+        for line in fhand:
+            if line.startswith(">"):
+                name = line[1:].split()[0]
+                lengths[name] = 0
+            elif name:
+                lengths[name] += len(line.strip())
+    return lengths
+
+
+def bam_chromosomes(bam):
+    """Chromosomes of a placeholder BAM, taken from its GTF sidecar."""
+    names = []
+    sidecar = Path("{}.gtf".format(Path(bam).resolve()))
+    if sidecar.exists():
+        with open(sidecar) as fhand:
+            for line in fhand:
+                name = line.split("\t")[0]
+                if not line.startswith("#") and name not in names:
+                    names.append(name)
+    return names
+
+
+# ---------------------------------------------------------------------------
+# 1. One function per tool
+# ---------------------------------------------------------------------------
+def agat(args):
+    n_genes = count_lines(option(args, "--gff"), "\tgene\t")
+    synthetic.write_agat_report(Path(option(args, "-o")), n_genes)
+
+
+def busco(args):
+    outdir = Path(option(args, "--out_path")) / option(args, "-o")
+    outdir.mkdir(parents=True, exist_ok=True)
+    lineage = option(args, "-l")
+    inputs = Path(option(args, "-i"))
+    if inputs.is_dir():
+        # Batch mode: one run folder per input file
+        for fasta in sorted(inputs.iterdir()):
+            (outdir / fasta.name).mkdir(exist_ok=True)
+            synthetic.write_busco_summary(
+                outdir / fasta.name / "short_summary.specific.{}.{}.txt".format(lineage, fasta.name),
+                lineage)
+        return
+    synthetic.write_busco_summary(
+        outdir / "short_summary.specific.{}.{}.txt".format(lineage, option(args, "-o")), lineage)
+
+
+def gffread(args):
+    n_proteins = count_lines(args[-1], "\tmRNA\t")
+    synthetic.write_proteins(Path(option(args, "-y")), n_proteins)
+
+
+def gt(args):
+    if args[0] == "suffixerator":
+        index = option(args, "-indexname")
+        for suffix in (".md5", ".suf", ".lcp", ".des", ".ssp", ".sds", ".tis"):
+            Path(index + suffix).touch()
+    else:
+        # ltrharvest prints its predictions
+        print("# predictions are reported in the following way")
+        print("# s(ret) e(ret) l(ret) s(lLTR) e(lLTR) l(lLTR) s(rLTR) e(rLTR) l(rLTR) sim(LTRs) seq-nr")
+        print("1000 5000 4001 1000 1400 401 4600 5000 401 95.00 chr1")
+
+
+def stringtie(args):
+    if "--merge" in args:
+        with open(option(args, "-o"), "w") as out_fhand:
+            out_fhand.write("# StringTie version synthetic\n")
+            for gtf in args[args.index("-o") + 2:]:
+                with open(gtf) as gtf_fhand:
+                    out_fhand.writelines(line for line in gtf_fhand if not line.startswith("#"))
+        return
+    bam = args[-1]
+    sidecar = Path("{}.gtf".format(bam))
+    if sidecar.exists():
+        shutil.copyfile(sidecar, option(args, "-o"))
+    else:
+        Path(option(args, "-o")).write_text("# StringTie version synthetic\n")
+
+
+def gffcompare(args):
+    synthetic.write_gffcompare_stats(Path(option(args, "-o")))
+
+
+def samtools(args):
+    if args[0] == "idxstats":
+        for name in bam_chromosomes(args[-1]):
+            print("{}\t1000\t100\t0".format(name))
+        print("*\t0\t0\t0")
+    elif args[0] == "view":
+        Path(option(args, "-o")).write_text("synthetic placeholder\n")
+
+
+def ltr_finder(args):
+    Path("{}.finder.combine.scn".format(Path(option(args, "-seq")).name)).write_text(
+        "1000 5000 4001 1000 1400 401 4600 5000 401 95.00 chr1\n")
+
+
+def ltr_retriever(args):
+    genome = option(args, "-genome")
+    synthetic.write_ltr_retriever(genome, fasta_lengths(genome))
+
+
+def lai(args):
+    genome = option(args, "-genome")
+    synthetic.write_lai(Path("{}.mod.out.LAI".format(genome)), fasta_lengths(genome))
+
+
+TOOLS = {
+    "agat_sp_statistics.pl": agat,
+    "busco": busco,
+    "gffread": gffread,
+    "gt": gt,
+    "stringtie": stringtie,
+    "gffcompare": gffcompare,
+    "samtools": samtools,
+    "LTR_FINDER_parallel": ltr_finder,
+    "LTR_retriever": ltr_retriever,
+    "LAI": lai,
+}
+
+
+# ---------------------------------------------------------------------------
+# 2. Entry point
+# ---------------------------------------------------------------------------
+def main():
+    tool = Path(sys.argv[0]).name
+    args = sys.argv[1:]
+    if not args or args[0] in ("--version", "-h", "--help", "-v"):
+        print("{} synthetic stub 1.0".format(tool))
+        return 0
+    time.sleep(float(os.environ.get("GAQET_STUB_SLEEP", "0.05")))
+    TOOLS[tool](args)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
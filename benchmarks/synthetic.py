@@ -0,0 +1,258 @@
+"""
+synthetic.py
+============
+Generators of synthetic GAQET inputs and tool reports for the benchmarks:
+
+* **write_genome**   - random multi-sequence FASTA.
+* **make_models**    - random gene models (one mRNA per gene) on a genome.
+* **write_gff3**     - the models as a GFF3 annotation.
+* **write_gtf**      - StringTie-like GTF: most models kept, some altered,
+  some novel.
+* **write_agat_report**, **write_busco_summary**, **write_gffcompare_stats**,
+  **write_lai**, **write_proteins** - canned tool reports in the formats
+  GAQET parses.
+* **make_dataset**   - a whole FOF with its files, at a given scale.
+
+Everything is seeded, so the same scale always gives the same files.
+"""
+
+import random
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+# (seqid, strand, [(start, end), ...]) of one transcript
+Model = Tuple[str, str, List[Tuple[int, int]]]
+
+
+# ---------------------------------------------------------------------------
+# 1. Genomes and annotations
+# ---------------------------------------------------------------------------
+def write_genome(fpath: Path, n_seqs: int, seq_len: int, seed: int = 1) -> Dict[str, int]:
+    """Write a random FASTA with 60-base lines; return ``{name: length}``."""
+    rng = random.Random(seed)
+    lengths = {}
+    with open(fpath, "w") as out_fhand:
+        for index in range(1, n_seqs + 1):
+            name = "chr{}".format(index)
+            # Sequences of different lengths, as in real assemblies
+            length = max(1000, int(seq_len * rng.uniform(0.5, 1.5)))
+            lengths[name] = length
+            out_fhand.write(">{}\n".format(name))
+            sequence = "".join(rng.choice("ACGT") for _ in range(length))
+            for start in range(0, length, 60):
+                out_fhand.write(sequence[start:start + 60] + "\n")
+    return lengths
+
+
+def make_models(lengths: Dict[str, int], n_genes: int, seed: int = 1) -> List[Model]:
+    """Return ``n_genes`` non-overlapping gene models spread over the sequences."""
+    rng = random.Random(seed)
+    names = sorted(lengths)
+    per_seq = max(1, n_genes // len(names) + 1)
+    models: List[Model] = []
+    for name in names:
+        slot = lengths[name] // per_seq
+        for index in range(per_seq):
+            if len(models) == n_genes or slot < 50:
+                break
+            start = index * slot + rng.randint(1, max(1, slot // 10))
+            end = index * slot + slot - rng.randint(1, max(1, slot // 10))
+            # Up to 6 exons, fewer when genes have to be packed tightly
+            n_exons = rng.randint(1, max(1, min(6, slot // 60)))
+            bounds = sorted(rng.sample(range(start + 1, end), 2 * (n_exons - 1)))
+            points = [start] + bounds + [end]
+            exons = [(points[i], points[i + 1]) for i in range(0, len(points), 2)]
+            models.append((name, rng.choice("+-"), exons))
+    return models
+
+
+def write_gff3(fpath: Path, models: List[Model]) -> None:
+    """Write the models as gene/mRNA/exon/CDS lines."""
+    with open(fpath, "w") as out_fhand:
+        out_fhand.write("##gff-version 3\n")
+        for index, (seqid, strand, exons) in enumerate(models, 1):
+            gene, mrna = "gene{}".format(index), "gene{}.t1".format(index)
+            start, end = exons[0][0], exons[-1][1]
+            prefix = "{}\tsynthetic\t".format(seqid)
+            out_fhand.write("{}gene\t{}\t{}\t.\t{}\t.\tID={}\n".format(prefix, start, end, strand, gene))
+            out_fhand.write("{}mRNA\t{}\t{}\t.\t{}\t.\tID={};Parent={}\n".format(
+                prefix, start, end, strand, mrna, gene))
+            phase = 0
+            ordered = exons if strand == "+" else exons[::-1]
+            for exon_start, exon_end in ordered:
+                out_fhand.write("{}exon\t{}\t{}\t.\t{}\t.\tParent={}\n".format(
+                    prefix, exon_start, exon_end, strand, mrna))
+                out_fhand.write("{}CDS\t{}\t{}\t.\t{}\t{}\tParent={}\n".format(
+                    prefix, exon_start, exon_end, strand, phase, mrna))
+                phase = (3 - (exon_end - exon_start + 1 - phase) % 3) % 3
+
+
+def write_gtf(fpath: Path, models: List[Model], seed: int = 1) -> None:
+    """Write a StringTie-like GTF from the reference models.
+
+    70% of the models are kept as they are, 20% get other terminal exon ends
+    and 10% are dropped; a novel single-exon transcript follows every tenth
+    model.
+    """
+    rng = random.Random(seed)
+    with open(fpath, "w") as out_fhand:
+        out_fhand.write("# StringTie version synthetic\n")
+        for index, (seqid, strand, exons) in enumerate(models, 1):
+            draw = rng.random()
+            transcripts = []
+            if draw < 0.9:
+                exons = list(exons)
+                if draw >= 0.7:
+                    exons[0] = (exons[0][0] + rng.randint(1, 20), exons[0][1])
+                    exons[-1] = (exons[-1][0], exons[-1][1] - rng.randint(1, 20))
+                transcripts.append((strand, exons))
+            if index % 10 == 0:
+                novel = exons[-1][1] + 50
+                transcripts.append((".", [(novel, novel + 150)]))
+            for number, (t_strand, t_exons) in enumerate(transcripts, 1):
+                gene = 'gene_id "STRG.{}"; transcript_id "STRG.{}.{}";'.format(index, index, number)
+                prefix = "{}\tStringTie\t".format(seqid)
+                out_fhand.write("{}transcript\t{}\t{}\t1000\t{}\t.\t{}\n".format(
+                    prefix, t_exons[0][0], t_exons[-1][1], t_strand, gene))
+                for exon_start, exon_end in t_exons:
+                    out_fhand.write("{}exon\t{}\t{}\t1000\t{}\t.\t{}\n".format(
+                        prefix, exon_start, exon_end, t_strand, gene))
+
+
+# ---------------------------------------------------------------------------
+# 2. Canned tool reports
+# ---------------------------------------------------------------------------
+AGAT_METRICS = [
+    ("Number of gene", 1), ("Number of mrna", 1), ("Number of cds", 1),
+    ("Number of exon", 4), ("Number of five_prime_utr", 0.4),
+    ("Number of three_prime_utr", 0.5), ("Number gene overlapping", 0.02),
+    ("Number of single exon gene", 0.15), ("Number of single exon mrna", 0.15),
+    ("Total gene length (bp)", 3000), ("mean gene length (bp)", None),
+    ("mean cds length (bp)", None), ("mean exon length (bp)", None),
+    ("mean intron in cds length (bp)", None), ("Longest gene (bp)", None),
+    ("Longest cds (bp)", None), ("Longest intron into cds part (bp)", None),
+    ("Shortest gene (bp)", None), ("Shortest cds piece (bp)", None),
+    ("Shortest intron into cds part (bp)", None),
+]
+
+
+def write_agat_report(fpath: Path, n_genes: int) -> None:
+    """Write an ``agat_sp_statistics.pl`` report for ``n_genes`` genes."""
+    fixed = {"mean gene length (bp)": 3000, "mean cds length (bp)": 1200,
+             "mean exon length (bp)": 300, "mean intron in cds length (bp)": 150,
+             "Longest gene (bp)": 30000, "Longest cds (bp)": 9000,
+             "Longest intron into cds part (bp)": 8000, "Shortest gene (bp)": 150,
+             "Shortest cds piece (bp)": 3, "Shortest intron into cds part (bp)": 20}
+    with open(fpath, "w") as out_fhand:
+        out_fhand.write("--- mrna ---\n\n")
+        for label, per_gene in AGAT_METRICS:
+            value = fixed[label] if per_gene is None else int(n_genes * per_gene)
+            out_fhand.write("{:<45}{}\n".format(label, value))
+        out_fhand.write("\nRe-compute intron: done\n")
+
+
+def write_busco_summary(fpath: Path, lineage: str) -> None:
+    """Write a BUSCO ``short_summary`` file."""
+    with open(fpath, "w") as out_fhand:
+        out_fhand.write("# BUSCO version is: synthetic\n")
+        out_fhand.write("# The lineage dataset is: {}\n\n".format(lineage))
+        out_fhand.write("\t***** Results: *****\n\n")
+        out_fhand.write("\tC:95.1%[S:90.2%,D:4.9%],F:1.8%,M:3.1%,n:2326\n")
+        out_fhand.write("\t2212\tComplete BUSCOs (C)\n")
+
+
+def write_gffcompare_stats(fpath: Path) -> None:
+    """Write a gffcompare ``.stats`` report."""
+    rows = [("Base", 85.3, 70.1), ("Exon", 70.2, 65.4), ("Intron", 80.1, 85.2),
+            ("Intron chain", 60.1, 55.3), ("Transcript", 50.2, 45.1), ("Locus", 55.2, 50.3)]
+    with open(fpath, "w") as out_fhand:
+        out_fhand.write("# gffcompare synthetic\n#-----------------| Sensitivity | Precision  |\n")
+        for level, sensitivity, precision in rows:
+            out_fhand.write("{:>18}:   {:>5.1f}     |   {:>5.1f}    |\n".format(
+                "{} level".format(level), sensitivity, precision))
+        out_fhand.write("\n     Matching intron chains:    5000\n"
+                        "       Matching transcripts:    6000\n"
+                        "              Matching loci:    5500\n")
+
+
+def write_lai(fpath: Path, lengths: Dict[str, int]) -> None:
+    """Write an LTR_retriever ``.LAI`` table with one row per sequence."""
+    with open(fpath, "w") as out_fhand:
+        out_fhand.write("Chr\tFrom\tTo\tIntact\tTotal\traw_LAI\tLAI\n")
+        out_fhand.write("whole_genome\t1\t{}\t0.0213\t0.4012\t5.31\t12.47\n".format(
+            sum(lengths.values()) or 1))
+        for name, length in sorted(lengths.items()):
+            out_fhand.write("{}\t1\t{}\t0.02\t0.40\t5.00\t12.00\n".format(name, length))
+
+
+def write_ltr_retriever(genome: str, lengths: Dict[str, int]) -> None:
+    """Write ``<genome>.mod.pass.list`` and the RepeatMasker ``<genome>.mod.out``.
+
+    Every sequence gets an LTR-RT hit each 10 kb, and every fifth hit is an
+    intact element.
+    """
+    with open("{}.mod.pass.list".format(genome), "w") as pass_fhand, \
+            open("{}.mod.out".format(genome), "w") as out_fhand:
+        pass_fhand.write("#LTR_loc\tCategory\tMotif\tTSD\t5'TSD\t3'TSD\tInternal\t"
+                         "Identity\tStrand\tSuperFamily\tTE_type\tInsertion_Time\n")
+        out_fhand.write("   SW   perc perc perc  query      position in query    matching"
+                        "       repeat              position in  repeat\n"
+                        "score   div. del. ins.  sequence   begin    end    (left)   repeat"
+                        "         class/family       begin  end (left)     ID\n\n")
+        hit = 0
+        for name, length in sorted(lengths.items()):
+            for start in range(1001, length - 5000, 10000):
+                hit += 1
+                end = start + 4000
+                out_fhand.write("  2500  {:.1f}  0.5  0.3  {}  {}  {}  ({})  +  LTR{}  "
+                                "LTR/Gypsy  1  4000  (0)  {}\n".format(
+                                    2 + hit % 7, name, start, end, length - end, hit % 50,
+                                    hit))
+                if hit % 5 == 0:
+                    pass_fhand.write("{}:{}..{}\tpass\tmotif:TGCA\tTSD:ATTCG\t{}..{}\t"
+                                     "{}..{}\tIN:{}..{}\t0.9731\t+\tGypsy\tLTR\t500000\n".format(
+                                         name, start, end, start - 5, start - 1, end + 1,
+                                         end + 5, start + 400, end - 400))
+
+
+def write_proteins(fpath: Path, n_proteins: int) -> None:
+    """Write a protein FASTA like ``gffread -y``."""
+    rng = random.Random(n_proteins)
+    with open(fpath, "w") as out_fhand:
+        for index in range(1, n_proteins + 1):
+            protein = "M" + "".join(rng.choice("ACDEFGHIKLMNPQRSTVWY") for _ in range(99)) + "."
+            out_fhand.write(">gene{}.t1\n{}\n".format(index, protein))
+
+
+# ---------------------------------------------------------------------------
+# 3. Whole dataset
+# ---------------------------------------------------------------------------
+def make_dataset(workdir: Path, n_samples: int, n_genes: int, n_seqs: int = 10,
+                 seq_len: int = 200000, n_genomes: int = 1) -> Path:
+    """Write ``n_samples`` samples over ``n_genomes`` genomes; return the FOF.
+
+    Every sample gets its own annotation. The "BAM" of a sample is a
+    placeholder whose ``<bam>.gtf`` sidecar is what the stub StringTie
+    reports.
+    """
+    workdir.mkdir(parents=True, exist_ok=True)
+    genomes = []
+    for index in range(1, n_genomes + 1):
+        genome = workdir / "genome{}.fa".format(index)
+        lengths = write_genome(genome, n_seqs, seq_len, seed=index)
+        genomes.append((genome, lengths))
+
+    fof = workdir / "samples.fof"
+    with open(fof, "w") as fof_fhand:
+        fof_fhand.write("name\tref_assembly\tref_annotation\tannotation\talignments\tlineage\n")
+        for index in range(1, n_samples + 1):
+            genome, lengths = genomes[(index - 1) % n_genomes]
+            models = make_models(lengths, n_genes, seed=index)
+            annotation = workdir / "sample{}.gff3".format(index)
+            write_gff3(annotation, models)
+            bam = workdir / "sample{}.bam".format(index)
+            bam.write_text("synthetic placeholder\n")
+            write_gtf(Path("{}.gtf".format(bam)), models, seed=index)
+            fof_fhand.write("sample{}\t{}\t{}\t{}\t{}\teudicots_odb10\n".format(
+                index, genome, annotation, annotation, bam))
+    return fof
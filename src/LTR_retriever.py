@@ -4,7 +4,8 @@ LTR_retriever.py
 Wrappers for the GeneTools pipeline used to compute LAI (LTR Assembly Index):
 
 * **suffixerator**   - builds a suffix-array index of the genome.
-* **ltrharvest**     - detects LTR retrotransposons (harvest step).
+* **ltrharvest**     - detects LTR retrotransposons (harvest step), either
+  on the whole genome or on parallel shards of whole sequences.
 * **LTR_FINDER**     - complementary detector (finder step).
 * **cat**            - concatenates harvest + finder output.
 * **LTR_retriever**  - filters and refines candidates.
@@ -12,31 +13,50 @@ Wrappers for the GeneTools pipeline used to compute LAI (LTR Assembly Index):
 
 Each runner returns a dictionary with the executed command, an informational message,
 the main output path, and a ``returncode`` (99 means “already done”).
+A stage is only "already done" when its completion marker records a successful
+run (see :mod:`src.checkpoint`).
 """
 
 
-import os
 import subprocess
 import shutil
 from pathlib import Path
-from typing import Any, Dict
+from typing import Any, Dict, List
 
+from src.checkpoint import commit, discard, is_done, promote, tmp_fpath
+from src.fasta import IndexedFasta, get_fai_fpath, read_fai
+from src.execution import run_command
+from src.scheduler import balance_shards
+
+# Detection settings shared by the commands and the artifact cache
+HARVEST_OPTIONS = ("-minlenltr 100 -maxlenltr 7000 -mintsd 4 -maxtsd 6 -motif TGCA "
+                   "-motifmis 1 -similar 85 -vic 10 -seed 20 -seqids yes")
+FINDER_OPTIONS = "-harvest_out -size 1000000 -time 300"
+
+# Bases copied at a time when writing the FASTA of a harvest shard
+# (a multiple of the 60-base line width)
+SHARD_CHUNK = 60 * 100000
 
 # ---------------------------------------------------------------------------
 # 0. Prepare working directory for LAI
 # ---------------------------------------------------------------------------
+def get_LAI_dir(arguments: Dict[str, Any]) -> Path:
+    """Return the LAI working directory of a sample."""
+    return arguments["output"] / "LAICompleteness"
+
+
 def create_outdir(arguments: Dict[str, Any]) -> Dict[str, Any]:
     """Ensure the LAI working directory exists and symlink the genome."""
 
     # Output directory (to save LTR_retriever input and output files)
-    outdir = arguments["output"] / "LAICompleteness"
+    outdir = get_LAI_dir(arguments)
     outfile = outdir / Path(arguments["ref_assembly"]).name
 
     if not outdir.exists():
         outdir.mkdir(parents=True)
     if not outfile.exists():
         cmd = f"ln -s {str(arguments['ref_assembly'])} {str(outfile)}"
-        run_ = subprocess.run(cmd, shell=True)
+        run_ = run_command(cmd, shell=True)
     msg = "The output directory for LAICompleteness has been created"
 
     return {"msg": msg, 
@@ -45,30 +65,46 @@ def create_outdir(arguments: Dict[str, Any]) -> Dict[str, Any]:
 # ---------------------------------------------------------------------------
 # 1. Build suffix-array index
 # ---------------------------------------------------------------------------
+def get_suffixerator_fpath(arguments: Dict[str, Any]) -> Path:
+    """Return the index file whose marker tells suffixerator is done."""
+    return arguments["LAI_dir"] / "{}.md5".format(Path(arguments["ref_assembly"]).name)
+
+
 def run_suffixerator(arguments: Dict[str, Any]) -> Dict[str, Any]:
     """Run **gt suffixerator** or skip if the index already exists."""
 
     # Output index path
     index = arguments["LAI_dir"] / Path(arguments["ref_assembly"]).name
 
-    # Suffixerator command
-    cmd = "gt suffixerator -db {} -indexname {} -tis -suf -lcp -des -ssp -sds -dna".format(arguments["ref_assembly"], index)
+    # Suffixerator command (index files are built in a temporary folder
+    # and moved next to the genome once suffixerator succeeds)
+    tmp = tmp_fpath(index)
+    cmd = "gt suffixerator -db {} -indexname {} -tis -suf -lcp -des -ssp -sds -dna".format(arguments["ref_assembly"],
+                                                                                            tmp / index.name)
 
     #Check if suffixerator is already done
-    md5 = arguments["LAI_dir"] / "{}.md5".format(Path(arguments["ref_assembly"]).name)
-    if md5.exists():
+    md5 = get_suffixerator_fpath(arguments)
+    if is_done(md5):
         return {"command": cmd,
                 "msg": "suffixerator already done",
                 "out_fpath": index,
                 "returncode": 99}
     else:
         #Run suffixerator
-        run_ = subprocess.run(cmd, shell=True, stderr=subprocess.PIPE)
+        discard(md5)
+        if tmp.exists():
+            shutil.rmtree(tmp)
+        tmp.mkdir()
+        run_ = run_command(cmd, shell=True, stderr=subprocess.PIPE)
 
         if run_.returncode == 0:
+            for index_file in tmp.iterdir():
+                promote(index_file, arguments["LAI_dir"] / index_file.name)
+            tmp.rmdir()
             msg = "suffixerator ran successfully"
         else:
             msg = "suffixerator Failed: \n {}".format(run_.stderr)
+        commit(md5, run_.returncode, cmd)
 
         return {"command": cmd,
                 "msg": msg,
@@ -78,6 +114,11 @@ def run_suffixerator(arguments: Dict[str, Any]) -> Dict[str, Any]:
 # ---------------------------------------------------------------------------
 # 2. ltrharvest
 # ---------------------------------------------------------------------------
+def get_harvest_fpath(arguments: Dict[str, Any]) -> Path:
+    """Return the ltrharvest predictions of the genome (``<genome>.harvest.scn``)."""
+    return arguments["LAI_dir"] / "{}.harvest.scn".format(Path(arguments["ref_assembly"]).name)
+
+
 def run_harvest(arguments: Dict[str, Any]) -> Dict[str, Any]:
     """Run *gt ltrharvest* or skip if done."""
 
@@ -85,13 +126,15 @@ def run_harvest(arguments: Dict[str, Any]) -> Dict[str, Any]:
     index = arguments["LAI_dir"] / Path(arguments["ref_assembly"]).name
 
     # Create output: output path + file .harvest.scn /w ref_assembly file name
-    out = arguments["LAI_dir"] / "{}.harvest.scn".format(Path(arguments["ref_assembly"]).name)
+    out = get_harvest_fpath(arguments)
 
     # HARVEST command
-    cmd = "gt ltrharvest -index {} -minlenltr 100 -maxlenltr 7000 -mintsd 4 -maxtsd 6 -motif TGCA -motifmis 1 -similar 85 -vic 10 -seed 20 -seqids yes > {}".format(index, out)
+    # (the shell redirect creates the file at once, so write a temporary one)
+    tmp = tmp_fpath(out)
+    cmd = "gt ltrharvest -index {} {} > {}".format(index, HARVEST_OPTIONS, tmp)
 
     # Check if HARVEST is already done
-    if out.exists():
+    if is_done(out):
         return {"command": cmd, 
                 "msg": "harvest already done",
                 "out_fpath": out,
@@ -99,50 +142,201 @@ def run_harvest(arguments: Dict[str, Any]) -> Dict[str, Any]:
  
     else:
         #Run harvest
-        run_ = subprocess.run(cmd, shell=True, stderr=subprocess.PIPE)
+        discard(out)
+        run_ = run_command(cmd, shell=True, stderr=subprocess.PIPE)
  
         if run_.returncode == 0:
+            promote(tmp, out)
             msg = "HARVEST ran successfully"
         else:
             msg = "HARVEST Failed: \n {}".format(run_.stderr)
+        commit(out, run_.returncode, cmd)
 
         return {"command": cmd, 
                 "msg": msg,
                 "out_fpath": out, 
                 "returncode": run_.returncode}
 
+# ---------------------------------------------------------------------------
+# 2b. Sharded ltrharvest (``harvest_shards`` > 1)
+# ---------------------------------------------------------------------------
+# Sequences are spread over shards by length. Each shard gets its own FASTA,
+# suffix array and ltrharvest run; with ``-seqids yes`` coordinates are
+# relative to each sequence and the last column is its name, so the shard
+# predictions are valid for the whole genome as they are.
+def get_harvest_shards_dir(arguments: Dict[str, Any]) -> Path:
+    """Return the working folder of the ltrharvest shards."""
+    return arguments["LAI_dir"] / "harvest_shards"
+
+
+def get_harvest_plan_fpath(arguments: Dict[str, Any]) -> Path:
+    """Return the table of the sequences of each ltrharvest shard."""
+    return get_harvest_shards_dir(arguments) / "shards.tsv"
+
+
+def get_harvest_shard_fpath(arguments: Dict[str, Any], shard: int) -> Path:
+    """Return the ltrharvest predictions of one shard."""
+    return get_harvest_shards_dir(arguments) / "shard{}.harvest.scn".format(shard)
+
+
+def plan_harvest_shards(arguments: Dict[str, Any]) -> Dict[str, Any]:
+    """Write the sequences of each ltrharvest shard, balanced by length."""
+    shards_dir = get_harvest_shards_dir(arguments)
+    shards_dir.mkdir(parents=True, exist_ok=True)
+    outfile = get_harvest_plan_fpath(arguments)
+    cmd = "split {} in {} shards".format(arguments["ref_assembly"], arguments["harvest_shards"])
+
+    if is_done(outfile):
+        return {"command": cmd,
+                "msg": "ltrharvest shards already planned",
+                "out_fpath": outfile,
+                "returncode": 99}
+
+    discard(outfile)
+    lengths = {name: record.length for name, record in read_fai(get_fai_fpath(arguments)).items()}
+    tmp = tmp_fpath(outfile)
+    with open(tmp, "w") as out_fhand:
+        for shard, names in enumerate(balance_shards(lengths, arguments["harvest_shards"]), 1):
+            for name in names:
+                out_fhand.write("{}\t{}\n".format(shard, name))
+    promote(tmp, outfile)
+    commit(outfile, 0, cmd)
+    return {"command": cmd,
+            "msg": "{} sequences split in {} shards".format(len(lengths), arguments["harvest_shards"]),
+            "out_fpath": outfile,
+            "returncode": 0}
+
+
+def write_shard_fasta(arguments: Dict[str, Any], names: List[str], out_fpath: Path) -> None:
+    """Copy the ``names`` sequences of the assembly to a new FASTA."""
+    with IndexedFasta(Path(arguments["ref_assembly"]), get_fai_fpath(arguments)) as fasta, \
+            open(out_fpath, "wb") as out_fhand:
+        for name in names:
+            out_fhand.write(">{}\n".format(name).encode())
+            length = fasta.index[name].length
+            for start in range(1, length + 1, SHARD_CHUNK):
+                chunk = fasta.fetch(name, start, min(start + SHARD_CHUNK - 1, length))
+                out_fhand.write(b"\n".join(chunk[i:i + 60] for i in range(0, len(chunk), 60)))
+                out_fhand.write(b"\n")
+
+
+def run_harvest_shard(arguments: Dict[str, Any], shard: int) -> Dict[str, Any]:
+    """Index one shard with *gt suffixerator* and run *gt ltrharvest* on it."""
+    shards_dir = get_harvest_shards_dir(arguments)
+    prefix = shards_dir / "shard{}".format(shard)
+    out = get_harvest_shard_fpath(arguments, shard)
+    tmp = tmp_fpath(out)
+    cmd = ("gt suffixerator -db {prefix}.fa -indexname {prefix} -tis -suf -lcp -des -ssp -sds -dna"
+           " && gt ltrharvest -index {prefix} {options} > {tmp}").format(prefix=prefix,
+                                                                       options=HARVEST_OPTIONS,
+                                                                       tmp=tmp)
+
+    if is_done(out):
+        return {"command": cmd,
+                "msg": "harvest shard {} already done".format(shard),
+                "out_fpath": out,
+                "returncode": 99}
+
+    discard(out)
+    with open(shards_dir / "shards.tsv") as shards_fhand:
+        names = [line.rstrip("\n").split("\t")[1] for line in shards_fhand
+                 if int(line.split("\t")[0]) == shard]
+    if not names:
+        # More shards than sequences
+        tmp.touch()
+        returncode, msg = 0, "harvest shard {} is empty".format(shard)
+    else:
+        write_shard_fasta(arguments, names, Path("{}.fa".format(prefix)))
+        run_ = run_command(cmd, shell=True, stderr=subprocess.PIPE)
+        returncode = run_.returncode
+        if returncode == 0:
+            msg = "HARVEST shard {} ran successfully".format(shard)
+        else:
+            msg = "HARVEST shard {} Failed: \n {}".format(shard, run_.stderr)
+
+    # The shard FASTA and its suffix array are only needed by ltrharvest
+    for shard_file in shards_dir.glob("shard{}.*".format(shard)):
+        if shard_file != out:
+            shard_file.unlink()
+    if returncode == 0:
+        promote(tmp, out)
+    commit(out, returncode, cmd)
+    return {"command": cmd,
+            "msg": msg,
+            "out_fpath": out,
+            "returncode": returncode}
+
+
+def merge_harvest_shards(arguments: Dict[str, Any]) -> Dict[str, Any]:
+    """Join the shard predictions into ``<genome>.harvest.scn``."""
+    out = get_harvest_fpath(arguments)
+    shard_fpaths = [get_harvest_shard_fpath(arguments, shard)
+                    for shard in range(1, arguments["harvest_shards"] + 1)]
+    cmd = "merge {} > {}".format(" ".join(str(fpath) for fpath in shard_fpaths), out)
+
+    if is_done(out):
+        return {"command": cmd,
+                "msg": "harvest already done",
+                "out_fpath": out,
+                "returncode": 99}
+
+    discard(out)
+    tmp = tmp_fpath(out)
+    header_done = False
+    with open(tmp, "w") as out_fhand:
+        for shard_fpath in shard_fpaths:
+            # Keep the comment header of the first shard only
+            has_header = False
+            with open(shard_fpath) as shard_fhand:
+                for line in shard_fhand:
+                    if line.startswith("#"):
+                        has_header = True
+                        if not header_done:
+                            out_fhand.write(line)
+                    elif line.strip():
+                        out_fhand.write(line)
+            header_done = header_done or has_header
+    promote(tmp, out)
+    commit(out, 0, cmd)
+    return {"command": cmd,
+            "msg": "HARVEST ran successfully on {} shards".format(len(shard_fpaths)),
+            "out_fpath": out,
+            "returncode": 0}
+
 # ---------------------------------------------------------------------------
 # 3. LTR_FINDER_parallel
 # ---------------------------------------------------------------------------
+def get_finder_fpath(arguments: Dict[str, Any]) -> Path:
+    """Return the LTR_FINDER predictions of the genome."""
+    return arguments["LAI_dir"] / "{}.finder.combine.scn".format(Path(arguments["ref_assembly"]).name)
+
+
 def run_finder(arguments: Dict[str, Any]) -> Dict[str, Any]:
     """Run *LTR_FINDER_parallel* or skip if done."""
-    cwd = Path(os.getcwd())
-
     # FINDER command
-    cmd = "LTR_FINDER_parallel -seq {} -threads {} -harvest_out -size 1000000 -time 300".format(arguments["ref_assembly"],
-                                                                                                arguments["threads"])
+    cmd = "LTR_FINDER_parallel -seq {} -threads {} {}".format(arguments["ref_assembly"],
+                                                              arguments["threads"],
+                                                              FINDER_OPTIONS)
 
     # Check if FINDER is already done
-    out_file = arguments["LAI_dir"] / "{}.finder.combine.scn".format(Path(arguments["ref_assembly"]).name)
-    if out_file.exists():
+    out_file = get_finder_fpath(arguments)
+    if is_done(out_file):
         return {"command": cmd,
                 "msg": "harvest already done",
                 "out_fpath": out_file,
                 "returncode": 99}
 
     else:
-        # Change the working directory to the "output" path
-        os.chdir(arguments["LAI_dir"])
-        # Run FINDER
-        run_ = subprocess.run(cmd, shell=True, stderr=subprocess.PIPE)
+        # Run FINDER inside the "output" path
+        discard(out_file)
+        run_ = run_command(cmd, shell=True, stderr=subprocess.PIPE,
+                              cwd=arguments["LAI_dir"])
 
         if run_.returncode == 0:
             msg = "FINDER ran successfully"
         else:
             msg = " FINDER Failed: \n {}".format(run_.stderr)
-
-        #Restore the original working directory
-        os.chdir(cwd)
+        commit(out_file, run_.returncode, cmd)
 
         return {"command": cmd, 
                 "msg": msg,
@@ -152,18 +346,24 @@ def run_finder(arguments: Dict[str, Any]) -> Dict[str, Any]:
 # ---------------------------------------------------------------------------
 # 4. Concatenate harvest + finder output
 # ---------------------------------------------------------------------------
+def get_raw_LTR_fpath(arguments: Dict[str, Any]) -> Path:
+    """Return the candidates of both detectors (``<genome>.rawLTR.scn``)."""
+    return arguments["LAI_dir"] / "{}.rawLTR.scn".format(Path(arguments["ref_assembly"]).name)
+
+
 def concatenate_outputs(arguments: Dict[str, Any]) -> Dict[str, Any]:
     """Concatenate harvest & finder results or skip if done."""
 
-    # "cat" command
+    # "cat" command (into a temporary file)
     outpath = arguments["LAI_dir"] / Path(arguments["ref_assembly"]).name
-    cmd = "cat {}.harvest.scn {}.finder.combine.scn > {}.rawLTR.scn".format(outpath, 
-                                                                            outpath, 
-                                                                            outpath)
+    out_file = get_raw_LTR_fpath(arguments)
+    tmp = tmp_fpath(out_file)
+    cmd = "cat {}.harvest.scn {}.finder.combine.scn > {}".format(outpath, 
+                                                                 outpath, 
+                                                                 tmp)
 
     # Check if "cat" is already done
-    out_file = arguments["LAI_dir"] / "{}.rawLTR.scn".format(Path(arguments["ref_assembly"]).name)
-    if out_file.exists():
+    if is_done(out_file):
         return {"command": cmd, 
                 "msg": "Concatenation of the output files from Harvest and Finder is already done.",
                 "out_fpath": out_file,
@@ -171,12 +371,15 @@ def concatenate_outputs(arguments: Dict[str, Any]) -> Dict[str, Any]:
 
     else:
         # Run "cat"
-        run_ = subprocess.run(cmd, shell=True, stderr=subprocess.PIPE)
+        discard(out_file)
+        run_ = run_command(cmd, shell=True, stderr=subprocess.PIPE)
 
         if run_.returncode == 0:
+            promote(tmp, out_file)
             msg = "Concatenation of the output files from Harvest and Finder successfully completed."
         else:
             msg = "Failed: \n {}".format(run_.stderr)
+        commit(out_file, run_.returncode, cmd)
 
         return {"command": cmd,
                 "msg": msg,
@@ -186,36 +389,37 @@ def concatenate_outputs(arguments: Dict[str, Any]) -> Dict[str, Any]:
 # ---------------------------------------------------------------------------
 # 5. LTR_retriever refinement
 # ---------------------------------------------------------------------------
+def get_pass_list_fpath(arguments: Dict[str, Any]) -> Path:
+    """Return the intact LTR-RTs found by LTR_retriever (``<genome>.mod.pass.list``)."""
+    return arguments["LAI_dir"] / "{}.mod.pass.list".format(Path(arguments["ref_assembly"]).name)
+
+
 def run_LTR_retriever(arguments: Dict[str, Any]) -> Dict[str, Any]:
     """Run *LTR_retriever* or skip if done."""
-    cwd = Path(os.getcwd())
-
     # LTR_retriever command
     cmd = "LTR_retriever -genome {} -inharvest {}.rawLTR.scn -threads {}".format(Path(arguments["ref_assembly"]).name,
                                                                                 Path(arguments["ref_assembly"]).name,
                                                                                 arguments["threads"])
 
     # Check if LTR_retriever is already done
-    outfile = arguments["LAI_dir"] / "{}.mod.pass.list".format(Path(arguments["ref_assembly"]).name)
-    if outfile.exists():
+    outfile = get_pass_list_fpath(arguments)
+    if is_done(outfile):
         return {"command": cmd, 
                 "msg": "LTR_retriever already done",
                 "out_fpath": outfile,
                 "returncode": 99}
 
     else:
-        # Change the working directory to the "output" path
-        os.chdir(arguments["LAI_dir"])
-        # Run LTR_retriever
-        run_ = subprocess.run(cmd, shell=True, stderr=subprocess.PIPE)
+        # Run LTR_retriever inside the "output" path
+        discard(outfile)
+        run_ = run_command(cmd, shell=True, stderr=subprocess.PIPE,
+                              cwd=arguments["LAI_dir"])
 
         if run_.returncode == 0:
             msg = "LTR_retriever ran successfully"
         else:
             msg = "LTR_retriever Failed: \n {}".format(run_.stderr)
-
-        #Restore the original working directory
-        os.chdir(cwd)
+        commit(outfile, run_.returncode, cmd)
 
         return {"command": cmd, 
                 "msg": msg,
@@ -225,10 +429,23 @@ def run_LTR_retriever(arguments: Dict[str, Any]) -> Dict[str, Any]:
 # ---------------------------------------------------------------------------
 # 6. Compute LAI
 # ---------------------------------------------------------------------------
+def get_LAI_artifacts(arguments: Dict[str, Any]) -> Dict[str, Any]:
+    """Describe the whole LAI chain for the artifact cache.
+
+    The key only depends on the assembly, so a cached LAI makes the
+    suffixerator to LTR_retriever stages unnecessary.
+    """
+    name = Path(arguments["ref_assembly"]).name
+    return {"inputs": [arguments["ref_assembly"]],
+            "tools": ["gt", "LTR_FINDER_parallel", "LTR_retriever", "LAI"],
+            "params": "ltrharvest {}; LTR_FINDER_parallel {}".format(HARVEST_OPTIONS, FINDER_OPTIONS),
+            "outputs": [arguments["LAI_dir"] / "{}.mod.out.LAI".format(name),
+                        arguments["LAI_dir"] / "{}.mod.pass.list".format(name),
+                        arguments["LAI_dir"] / "{}.mod.out".format(name)]}
+
+
 def run_LAI(arguments: Dict[str, Any]) -> Dict[str, Any]:
     """Run *LAI* tool or skip if done."""
-    cwd = Path(os.getcwd())
-
     # LAI command
     cmd = "LAI -genome {} -intact {}.mod.pass.list -all {}.mod.out".format(Path(arguments["ref_assembly"]).name,
                                                                             Path(arguments["ref_assembly"]).name,
@@ -236,24 +453,22 @@ def run_LAI(arguments: Dict[str, Any]) -> Dict[str, Any]:
 
 
     outfile = arguments["LAI_dir"] / "{}.mod.out.LAI".format(Path(arguments["ref_assembly"]).name)
-    if outfile.exists():
+    if is_done(outfile):
         return {"command": cmd, 
                 "msg": "LAI already done",
                 "out_fpath": outfile,
                 "returncode": 99}
 
     else:
-        # Change the working directory to the "output" path
-        os.chdir(arguments["LAI_dir"])
-        # Run
-        run_ = subprocess.run(cmd, shell=True, stderr=subprocess.PIPE)
+        # Run inside the "output" path
+        discard(outfile)
+        run_ = run_command(cmd, shell=True, stderr=subprocess.PIPE,
+                              cwd=arguments["LAI_dir"])
         if run_.returncode == 0:
             msg = "LAI ran successfully"
         else:
             msg = "LAI Failed: \n {}".format(run_.stderr)
-
-        #Restore the original working directory
-        os.chdir(cwd)
+        commit(outfile, run_.returncode, cmd)
 
         return {"command": cmd, 
                 "msg": msg,
@@ -261,15 +476,44 @@ def run_LAI(arguments: Dict[str, Any]) -> Dict[str, Any]:
                 "returncode": run_.returncode}
 
 # ---------------------------------------------------------------------------
-# 7. Retrieve LAI value
+# 7. Retrieve LAI values
 # ---------------------------------------------------------------------------
-def get_LAI(lai_run: Dict[str, Any]) -> str:
-    """Return ``"LAI:<value>"`` from the final *.LAI* file."""
+def _lai_value(value: str):
+    """LAI writes ``NA`` where it cannot compute a value."""
+    return None if value == "NA" else float(value)
+
+
+def get_LAI(lai_run: Dict[str, Any]) -> Dict[str, Any]:
+    """Return the values of the final *.LAI* file.
 
+    The ``whole_genome`` row gives ``LAI_COLS``; every other row is a window,
+    returned in ``"windows"`` as ``(Chr, From, To, Intact, Total, Raw LAI,
+    LAI, LAI_native)``. The corrected LAI of the native engine (whose last
+    header column is ``LAI_native``) goes to ``LAI_native``, the one of the
+    LAI script to ``LAI``; the other is ``None``.
+    """
+    lai, windows, native = None, [], False
     with open(lai_run["out_fpath"], encoding="utf-8") as fh:
         for line in fh:
-            if "whole_genome" in line:
-                line = line.strip()
-                line = line.split()
-                LAI_value = line[6]
-                return f"LAI:{LAI_value}"
\ No newline at end of file
+            fields = line.split()
+            if fields and fields[0] == "Chr":
+                native = fields[-1] == "LAI_native"
+                continue
+            if len(fields) < 7:
+                continue
+            values = tuple(_lai_value(value) for value in fields[3:7])
+            values = values[:3] + (None, values[3]) if native else values + (None,)
+            if fields[0] == "whole_genome":
+                lai = values
+            else:
+                windows.append((fields[0], int(fields[1]), int(fields[2])) + values)
+    if lai is None:
+        raise ValueError("No whole_genome row in {}".format(lai_run["out_fpath"]))
+    intact, total, raw_lai, lai_value, native_value = lai
+    return {"LAI": lai_value,
+            "LAI_native": native_value,
+            "Raw LAI": raw_lai,
+            "Intact LTR-RT Fraction": intact,
+            "Total LTR-RT Fraction": total,
+            "LAI Windows (N)": len(windows),
+            "windows": windows}
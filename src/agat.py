@@ -7,42 +7,64 @@ Wrapper helper for a single external tool:
 
 Each runner returns a dictionary with the executed command, an informational message,
 the main output path, and a ``returncode`` (99 means “already done”).
+A stage is only "already done" when its completion marker records a successful
+run (see :mod:`src.checkpoint`).
 """
 
 import subprocess
 from pathlib import Path
 from typing import Dict, Any
 
+from src.checkpoint import commit, discard, is_done, promote, tmp_fpath
+from src.execution import run_command
+
 
 # ---------------------------------------------------------------------------
 # 1. Run AGAT statistics (extracts metrics from a GFF/GTF file)
 # ---------------------------------------------------------------------------
+def get_agat_fpath(arguments: Dict[str, Any]) -> Path:
+    """Return the AGAT statistics report of a sample."""
+    return arguments["output"] / "GenomeAnnStats" / "ResultAgat.txt"
+
+
+def get_agat_artifacts(arguments: Dict[str, Any]) -> Dict[str, Any]:
+    """Describe the AGAT stage for the artifact cache."""
+    return {"inputs": [arguments["annotation"]],
+            "tools": ["agat_sp_statistics.pl"],
+            "params": "",
+            "outputs": [get_agat_fpath(arguments)]}
+
+
 def run_agat(arguments: Dict[str, Any]) -> Dict[str, Any]:
     """Run AGAT statistics (or skip if already done)."""
 
     # Output directory and file
-    outdir = arguments["output"] / "GenomeAnnStats"
+    out_fpath = get_agat_fpath(arguments)
+    outdir = out_fpath.parent
     outdir.mkdir(parents=True, exist_ok=True)
-    out_fpath = outdir / "ResultAgat.txt"
 
-    # AGAT command
-    cmd_list = ["agat_sp_statistics.pl", "--gff", "{}".format(arguments["annotation"]), "-o", "{}".format(out_fpath)]
+    # AGAT command (writes a temporary report, promoted once AGAT succeeds)
+    tmp = tmp_fpath(out_fpath)
+    cmd_list = ["agat_sp_statistics.pl", "--gff", "{}".format(arguments["annotation"]), "-o", "{}".format(tmp)]
     command = ' '.join(cmd_list)
 
 # Check if AGAT is already done
-    if out_fpath.exists():
+    if is_done(out_fpath):
         return {"command": command,
                 "msg": "AGAT already done",
                 "out_fpath": out_fpath, 
                 "returncode": 99}
     else:
         # Run AGAT
-        run_ = subprocess.run(command, shell=True, stdout=subprocess.PIPE)
+        discard(out_fpath)
+        run_ = run_command(command, shell=True, stdout=subprocess.PIPE)
 
         if run_.returncode == 0:
+            promote(tmp, out_fpath)
             msg = "AGAT run successfully"
         else:
             msg = "AGAT Failed: \n {}".format(run_.stdout)
+        commit(out_fpath, run_.returncode, command)
 
         return {"command": command,
                 "msg": msg,
@@ -144,7 +166,7 @@ def get_agat_stats(agat_statistics: Dict[str, Any]) -> Dict[str, Any]:
             try:
                 key, val = line.rsplit(maxsplit=1)
                 key = key.strip()
-                val = int(val.strip())
+                val = float(val) if "." in val else int(val)
                 if key in mapping:
                     result_key = mapping[key]
                     if result_key == "Total Gene Space (Mb)":
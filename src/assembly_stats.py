@@ -0,0 +1,190 @@
+"""
+assembly_stats.py
+=================
+Native statistics of the assembly itself, computed once per distinct
+assembly in a single pass over the memory-mapped FASTA:
+
+* **scan_assembly**       - per-sequence length, GC, N content and runs of N
+  (gaps), plus the ``.fai`` record of every sequence.
+* **summarize_sequences** - assembly totals: length, sequences, N50/L50, GC,
+  N content, gaps and longest sequence.
+* **run_assembly_stats**  - stage runner. It writes ``AssemblyStats.json``,
+  ``AssemblySequences.tsv`` and the shared ``.fai`` index, which the protein
+  extractor and the ltrharvest sharding read instead of scanning the
+  genome again.
+* **get_assembly_stats**  - ``ASSEMBLY_COLS`` values for the summary.
+
+Sequences are processed in fixed-size chunks with C-level byte operations
+(``bytes.translate``/``bytes.count`` and a regex for N runs), so memory
+stays flat whatever the chromosome size.
+"""
+
+import json
+import mmap
+import re
+from pathlib import Path
+from typing import Any, Dict, List, NamedTuple, Tuple
+
+from src.checkpoint import commit, discard, is_done, promote, tmp_fpath
+from src.fasta import FaiRecord, get_fai_fpath, write_fai
+from src.table import ASSEMBLY_COLS
+
+ENGINE_VERSION = "gaqet-assembly-stats 1"
+
+# Bytes of sequence processed at a time
+CHUNK_SIZE = 8 * 1024 * 1024
+
+_N_RUN = re.compile(rb"[Nn]+")
+_GC = (b"G", b"C", b"g", b"c", b"S", b"s")
+
+
+class SequenceStats(NamedTuple):
+    """Composition of one sequence."""
+    name: str
+    length: int
+    gc: int
+    n: int
+    gaps: int
+
+
+# ---------------------------------------------------------------------------
+# 1. Single pass over the FASTA
+# ---------------------------------------------------------------------------
+def _scan_sequence(data: mmap.mmap, start: int, end: int) -> Tuple[int, int, int, int]:
+    """Return ``(length, gc, n, gaps)`` of the sequence lines in ``data[start:end]``."""
+    length = gc = n = gaps = 0
+    in_gap = False
+    for position in range(start, end, CHUNK_SIZE):
+        bases = data[position:min(position + CHUNK_SIZE, end)].translate(None, b"\r\n \t")
+        if not bases:
+            continue
+        length += len(bases)
+        gc += sum(bases.count(base) for base in _GC)
+        chunk_n = bases.count(b"N") + bases.count(b"n")
+        if chunk_n:
+            n += chunk_n
+            gaps += len(_N_RUN.findall(bases))
+            # A run that goes on from the previous chunk is not a new gap
+            if in_gap and bases[:1] in (b"N", b"n"):
+                gaps -= 1
+        in_gap = bases[-1:] in (b"N", b"n")
+    return length, gc, n, gaps
+
+
+def scan_assembly(fasta_fpath: Path) -> Tuple[List[FaiRecord], List[SequenceStats]]:
+    """Return the ``.fai`` records and the composition of every sequence."""
+    records: List[FaiRecord] = []
+    sequences: List[SequenceStats] = []
+    with open(fasta_fpath, "rb") as fasta_fhand:
+        if not fasta_fhand.seek(0, 2):
+            return records, sequences
+        with mmap.mmap(fasta_fhand.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            size = len(data)
+            header = data.find(b">")
+            while header != -1:
+                header_end = data.find(b"\n", header)
+                header_end = size if header_end == -1 else header_end
+                name = data[header + 1:header_end].split()[0].decode()
+                start = min(header_end + 1, size)
+                next_header = data.find(b"\n>", header_end)
+                end = size if next_header == -1 else next_header + 1
+
+                first_line_end = data.find(b"\n", start, end)
+                first_line = data[start:end if first_line_end == -1 else first_line_end + 1]
+                length, gc, n, gaps = _scan_sequence(data, start, end)
+                records.append(FaiRecord(name, length, start, len(first_line.rstrip(b"\r\n")),
+                                         len(first_line)))
+                sequences.append(SequenceStats(name, length, gc, n, gaps))
+                header = -1 if next_header == -1 else next_header + 1
+    return records, sequences
+
+
+def summarize_sequences(sequences: List[SequenceStats]) -> Dict[str, Any]:
+    """Return the assembly totals (``ASSEMBLY_COLS``)."""
+    lengths = sorted((sequence.length for sequence in sequences), reverse=True)
+    total = sum(lengths)
+    n50 = l50 = cumulative = 0
+    for index, length in enumerate(lengths, 1):
+        cumulative += length
+        if cumulative * 2 >= total:
+            n50, l50 = length, index
+            break
+    n = sum(sequence.n for sequence in sequences)
+    gc = sum(sequence.gc for sequence in sequences)
+    values = [total,
+              len(lengths),
+              n50,
+              l50,
+              round(100 * gc / (total - n), 2) if total > n else 0.0,
+              round(100 * n / total, 4) if total else 0.0,
+              sum(sequence.gaps for sequence in sequences),
+              lengths[0] if lengths else 0]
+    return dict(zip(ASSEMBLY_COLS, values))
+
+
+# ---------------------------------------------------------------------------
+# 2. Stage
+# ---------------------------------------------------------------------------
+def get_assembly_stats_fpath(arguments: Dict[str, Any]) -> Path:
+    return arguments["assembly_dir"] / "AssemblyStats.json"
+
+
+def get_assembly_sequences_fpath(arguments: Dict[str, Any]) -> Path:
+    return arguments["assembly_dir"] / "AssemblySequences.tsv"
+
+
+def get_assembly_stats_artifacts(arguments: Dict[str, Any]) -> Dict[str, Any]:
+    """Describe the assembly statistics stage for the artifact cache."""
+    return {"inputs": [arguments["ref_assembly"]],
+            "tools": [],
+            "params": ENGINE_VERSION,
+            "outputs": [get_assembly_stats_fpath(arguments),
+                        get_assembly_sequences_fpath(arguments),
+                        get_fai_fpath(arguments)]}
+
+
+def run_assembly_stats(arguments: Dict[str, Any]) -> Dict[str, Any]:
+    """Scan the assembly once (or skip if already done)."""
+    out_fpath = get_assembly_stats_fpath(arguments)
+    outputs = [out_fpath, get_assembly_sequences_fpath(arguments), get_fai_fpath(arguments)]
+    command = "{} {}".format(ENGINE_VERSION, arguments["ref_assembly"])
+
+    if all(is_done(fpath) for fpath in outputs):
+        return {"command": command,
+                "msg": "Assembly statistics already done",
+                "out_fpath": out_fpath,
+                "returncode": 99}
+
+    for fpath in outputs:
+        discard(fpath)
+    try:
+        records, sequences = scan_assembly(Path(arguments["ref_assembly"]))
+    except (OSError, ValueError, IndexError) as error:
+        commit(out_fpath, 1, command)
+        return {"command": command,
+                "msg": "Assembly statistics Failed: \n {}".format(error),
+                "out_fpath": out_fpath,
+                "returncode": 1}
+
+    stats_tmp, sequences_tmp, fai_tmp = (tmp_fpath(fpath) for fpath in outputs)
+    with open(stats_tmp, "w") as stats_fhand:
+        json.dump(summarize_sequences(sequences), stats_fhand, indent=2)
+    with open(sequences_tmp, "w") as sequences_fhand:
+        sequences_fhand.write("Sequence\tLength\tGC\tN\tGaps\n")
+        for sequence in sequences:
+            sequences_fhand.write("\t".join(str(field) for field in sequence) + "\n")
+    write_fai(records, fai_tmp)
+    for tmp, fpath in zip((stats_tmp, sequences_tmp, fai_tmp), outputs):
+        promote(tmp, fpath)
+        commit(fpath, 0, command)
+    return {"command": command,
+            "msg": "Assembly statistics run successfully ({} sequences)".format(len(sequences)),
+            "out_fpath": out_fpath,
+            "returncode": 0}
+
+
+def get_assembly_stats(assembly_stats: Dict[str, Any]) -> Dict[str, Any]:
+    """Return the ``ASSEMBLY_COLS`` values written by :func:`run_assembly_stats`."""
+    with open(assembly_stats["out_fpath"]) as stats_fhand:
+        stats = json.load(stats_fhand)
+    return {col: stats[col] for col in ASSEMBLY_COLS}
@@ -4,31 +4,60 @@ busco.py
 Wrapper helpers for two external tools:
 
 * **GFFread** - extracts protein FASTA from a genome + annotation GFF/GTF.
-* **BUSCO**   - computes completeness metrics on those proteins.
+* **BUSCO**   - computes completeness metrics on those proteins, one sample
+  at a time or, in batch mode, for every sample of a lineage in a single
+  BUSCO run (the lineage dataset is loaded once) whose per-sample short
+  summaries are then copied back to each sample.
 
 Each runner returns a dictionary with the executed command, an informational message,
 the main output path, and a ``returncode`` (99 means “already done”).
+A stage is only "already done" when its completion marker records a successful
+run (see :mod:`src.checkpoint`).
 """
 
 
+import re
+import shutil
 import subprocess
 from pathlib import Path
 from typing import Any, Dict
 
+from src.checkpoint import commit, discard, is_done, promote, tmp_fpath
+from src.execution import run_command
+from src.table import BUSCO_COLS
+
+# "C:95.1%" -> ("C", "95.1"), "n:2326" -> ("n", "2326")
+BUSCO_VALUE = re.compile(r"([CSDFMEn]):([\d.]+)")
+
 # ---------------------------------------------------------------------------
 # 1.  Extract protein sequences with GFFread
 # ---------------------------------------------------------------------------
+def get_proteins_fpath(arguments: Dict[str, Any]) -> Path:
+    """Return the protein FASTA that BUSCO reads for a sample."""
+    outdir = arguments["output"] / "input_sequences"
+    return outdir / "{}.proteins.fasta".format(Path(arguments["ref_assembly"]).stem)
+
+
+def get_gffread_artifacts(arguments: Dict[str, Any]) -> Dict[str, Any]:
+    """Describe the GFFread stage for the artifact cache."""
+    return {"inputs": [arguments["ref_assembly"], arguments["annotation"]],
+            "tools": ["gffread"],
+            "params": "-y",
+            "outputs": [get_proteins_fpath(arguments)]}
+
+
 def run_gffread(arguments: Dict[str, Any]) -> Dict[str, Any]:
     """Run *gffread* (or skip if output already exists)."""
 
     # Output directory and file
-    outdir = arguments["output"] / "input_sequences"
+    outfile = get_proteins_fpath(arguments)
+    outdir = outfile.parent
     if not outdir.exists():
         outdir.mkdir(parents=True, exist_ok=True)
-    outfile = outdir / "{}.proteins.fasta".format(Path(arguments["ref_assembly"]).stem)
 
-    # GFFread command
-    cmd = "gffread -y {} -g {} {}".format(outfile, 
+    # GFFread command (writes a temporary FASTA, promoted once GFFread succeeds)
+    tmp = tmp_fpath(outfile)
+    cmd = "gffread -y {} -g {} {}".format(tmp, 
                                             arguments["ref_assembly"],
                                             arguments["annotation"])
 
@@ -36,19 +65,22 @@ def run_gffread(arguments: Dict[str, Any]) -> Dict[str, Any]:
     arguments["input"] = outfile
 
     # Check if GFFread is already done
-    if outfile.exists():
+    if is_done(outfile):
         return {"command": cmd, 
                 "msg": "Extract sequences already done",
                 "out_fpath": outfile,
                 "returncode": 99}
     else:
         #Run GFFread 
-        run_ = subprocess.run(cmd, shell=True, stderr=subprocess.PIPE)
+        discard(outfile)
+        run_ = run_command(cmd, shell=True, stderr=subprocess.PIPE)
 
         if run_.returncode == 0:
+            promote(tmp, outfile)
             msg = "GFFread run successfully"
         else:
             msg = "GFFread Failed: \n {}".format(run_.stderr)
+        commit(outfile, run_.returncode, cmd)
 
         return {"command": cmd,
                 "msg": msg,
@@ -58,45 +90,167 @@ def run_gffread(arguments: Dict[str, Any]) -> Dict[str, Any]:
 # ---------------------------------------------------------------------------
 # 2.  Run BUSCO completeness
 # ---------------------------------------------------------------------------
+def get_busco_artifacts(arguments: Dict[str, Any]) -> Dict[str, Any]:
+    """Describe the BUSCO stage for the artifact cache."""
+    return {"inputs": [arguments["input"]],
+            "tools": ["busco"],
+            "params": "--mode prot -l {}".format(arguments["lineage"]),
+            "outputs": [arguments["output"] / "BUSCOCompleteness"]}
+
+
 def run_busco(arguments: Dict[str, Any]) -> Dict[str, Any]:
     """Run *BUSCO* on the protein FASTA generated by :func:`run_gffread`."""
 
     #Create output directory
     outdir = arguments["output"] / "BUSCOCompleteness"
 
-    # BUSCO command
+    # BUSCO command (runs in a temporary out_path, promoted once BUSCO succeeds)
+    tmp = tmp_fpath(outdir)
     cmd = "busco -i {} -c {} -o BUSCOCompleteness --out_path {} --mode prot -l {}".format(arguments["input"],
                                                                 arguments["threads"],
-                                                                arguments["output"],
+                                                                tmp,
                                                                 arguments["lineage"])
 
-    if outdir.exists():
+    if is_done(outdir):
         return {"command": cmd,
                 "msg": "BUSCO already done",
                 "out_fpath": outdir,
                 "returncode": 99}
     else: 
         #Run BUSCO
-        run_ = subprocess.run(cmd, shell=True, stderr=subprocess.PIPE)
+        discard(outdir)
+        run_ = run_command(cmd, shell=True, stderr=subprocess.PIPE)
 
         if run_.returncode == 0:
+            promote(tmp / "BUSCOCompleteness", outdir)
+            shutil.rmtree(tmp)
             msg = "BUSCO run successfully"
         else:
             msg = "BUSCO Failed: \n {}".format(run_.stderr)
+        commit(outdir, run_.returncode, cmd)
 
         return {"command": cmd, 
                 "msg": msg,
                 "out_fpath": outdir, 
                 "returncode": run_.returncode}
 
+def get_busco_batch_dir(arguments: Dict[str, Any]) -> Path:
+    """Return the folder of a batch BUSCO run (its ``-o`` under ``output``)."""
+    return arguments["output"] / "BUSCOBatch"
+
+
+def run_busco_batch(arguments: Dict[str, Any]) -> Dict[str, Any]:
+    """Run one *BUSCO* on the protein FASTAs of every sample of a lineage.
+
+    ``arguments["samples"]`` maps sample names to their values. BUSCO batch
+    mode evaluates each file of the input folder (``<sample>.fasta``) and
+    writes its results to ``BUSCOBatch/<sample>.fasta``. Samples whose
+    protein FASTA was not written (their extraction failed) are left out;
+    a batch run without one of the samples it could now include is run
+    again.
+    """
+    outdir = get_busco_batch_dir(arguments)
+    inputs_dir = arguments["output"] / "inputs"
+    tmp = tmp_fpath(outdir)
+    cmd = "busco -i {} -c {} -o BUSCOBatch --out_path {} --mode prot -l {}".format(inputs_dir,
+                                                                           arguments["threads"],
+                                                                           tmp,
+                                                                           arguments["lineage"])
+    proteins = {name: Path(values["input"]) for name, values in arguments["samples"].items()
+                if is_done(Path(values["input"]))}
+
+    if is_done(outdir) and all((outdir / "{}.fasta".format(name)).exists() for name in proteins):
+        return {"command": cmd,
+                "msg": "BUSCO batch already done",
+                "out_fpath": outdir,
+                "returncode": 99}
+    if not proteins:
+        return {"command": cmd,
+                "msg": "BUSCO batch Failed: \n no protein FASTA was written",
+                "out_fpath": outdir,
+                "returncode": 1}
+
+    discard(outdir)
+    if inputs_dir.exists():
+        shutil.rmtree(inputs_dir)
+    inputs_dir.mkdir(parents=True)
+    for name, fasta in proteins.items():
+        (inputs_dir / "{}.fasta".format(name)).symlink_to(fasta.resolve())
+
+    run_ = run_command(cmd, shell=True, stderr=subprocess.PIPE)
+    if run_.returncode == 0:
+        promote(tmp / "BUSCOBatch", outdir)
+        shutil.rmtree(tmp)
+        msg = "BUSCO batch of {} samples run successfully".format(len(proteins))
+        left_out = sorted(set(arguments["samples"]) - set(proteins))
+        if left_out:
+            msg += " (without {}: no proteins)".format(", ".join(left_out))
+    else:
+        msg = "BUSCO batch Failed: \n {}".format(run_.stderr)
+    commit(outdir, run_.returncode, cmd)
+
+    return {"command": cmd,
+            "msg": msg,
+            "out_fpath": outdir,
+            "returncode": run_.returncode}
+
+
+def collect_busco_batch(arguments: Dict[str, Any]) -> Dict[str, Any]:
+    """Copy the short summaries of a sample out of its batch BUSCO run.
+
+    They are renamed as :func:`run_busco` would have written them, so
+    :func:`get_busco_results` works the same; ``BUSCOCompleteness/batch_run``
+    links to the full BUSCO output of the sample.
+    """
+    outdir = arguments["output"] / "BUSCOCompleteness"
+    sample_input = "{}.fasta".format(arguments["name"])
+    batch_run = arguments["busco_batch_dir"] / sample_input
+    command = "collect {}".format(batch_run)
+
+    if is_done(outdir):
+        return {"command": command,
+                "msg": "BUSCO already done",
+                "out_fpath": outdir,
+                "returncode": 99}
+
+    discard(outdir)
+    tmp = tmp_fpath(outdir)
+    tmp.mkdir(parents=True)
+    summaries = list(batch_run.glob("short_summary*.{}.*".format(sample_input)))
+    for summary in summaries:
+        renamed = summary.name.replace(".{}.".format(sample_input), ".BUSCOCompleteness.")
+        shutil.copyfile(summary, tmp / renamed)
+    (tmp / "batch_run").symlink_to(batch_run.resolve())
+    promote(tmp, outdir)
+    returncode = 0 if summaries else 1
+    commit(outdir, returncode, command)
+    msg = ("BUSCO results collected from the batch run" if summaries else
+           "BUSCO Failed: \n no short summary for {} in {}".format(sample_input, batch_run))
+    return {"command": command,
+            "msg": msg,
+            "out_fpath": outdir,
+            "returncode": returncode}
+
 # ---------------------------------------------------------------------------
-# 3.  Extract the single line that contains the BUSCO percentage
+# 3.  Extract the values of the BUSCO summary line
 # ---------------------------------------------------------------------------
-def get_busco_results(busco_results: Dict[str, Any], lineage: str = "") -> str:
-    """Return the summary line (with `%`) from BUSCO's *short_summary* file."""
-    
-    busco_fpath = busco_results["out_fpath"] / "short_summary.specific.{}.BUSCOCompleteness.txt".format(lineage)
+def get_busco_summary_fpath(busco_dir: Path, lineage: str = "") -> Path:
+    """Return BUSCO's *short_summary* file in ``busco_dir``."""
+    return Path(busco_dir) / "short_summary.specific.{}.BUSCOCompleteness.txt".format(lineage)
+
+
+def get_busco_results(busco_results: Dict[str, Any], lineage: str = "") -> Dict[str, Any]:
+    """Return the values of the summary line of BUSCO's *short_summary* file.
+
+    ``C:95.1%[S:90.2%,D:4.9%],F:1.8%,M:3.1%,n:2326`` becomes the
+    ``BUSCO_COLS`` percentages (floats) and lineage size (int).
+    """
+    busco_fpath = get_busco_summary_fpath(busco_results["out_fpath"], lineage)
     with open(busco_fpath, encoding="utf-8") as fh:
         for line in fh:
             if "%" in line:
-                return line.strip()
\ No newline at end of file
+                values = dict(BUSCO_VALUE.findall(line))
+                results = {col: float(values[key]) for col, key in zip(BUSCO_COLS, "CSDFM")}
+                results[BUSCO_COLS[-1]] = int(values["n"])
+                return results
+    raise ValueError("No BUSCO summary line in {}".format(busco_fpath))
@@ -0,0 +1,323 @@
+"""
+cache.py
+========
+Persistent, content-addressed store of stage outputs shared by every GAQET
+run that points to the same cache folder (``--cache-dir`` or the
+``GAQET_CACHE_DIR`` environment variable).
+
+An entry is keyed by the SHA-256 of:
+
+* the digests of the stage input files (see :mod:`src.digest`),
+* the version string of the tools involved,
+* the command parameters that change the result.
+
+Entries live in ``<cache_dir>/artifacts/<key[:2]>/<key>/`` with one numbered
+subfolder per output and a ``meta.json``. Reading an entry refreshes its
+modification time, which is used for least-recently-used eviction once the
+cache grows over its size limit. Entries a run plans to restore are pinned
+(see :func:`pin`) and never evicted while it lasts, by any process: each pin
+is a lease file ``<cache_dir>/leases/<key>.<host>-<pid>`` holding its
+expiry. A lease ends with its process (checked on the same host) or, seen
+from other hosts, once it expires; pinning processes renew their leases.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import socket
+import subprocess
+import time
+import uuid
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+from src.checkpoint import commit, is_done
+from src.digest import file_digest
+
+# Command used to get the version of each tool (default: ``<tool> --version``)
+VERSION_COMMANDS: Dict[str, str] = {
+    "agat_sp_statistics.pl": "agat_sp_statistics.pl --help | head -n 5",
+    "LTR_FINDER_parallel": "LTR_FINDER_parallel -h | head -n 5",
+    "LTR_retriever": "LTR_retriever -h | head -n 5",
+    "LAI": "LAI -h | head -n 5",
+}
+
+_VERSIONS: Dict[str, str] = {}
+
+# Seconds a pin lease lasts for other hosts (renewed halfway)
+LEASE_TTL = 24 * 3600
+
+# Entries this process relies on (kept by evict): {key: (cache_dir, lease expiry)}
+_PINNED: Dict[str, Tuple[Path, float]] = {}
+
+
+# ---------------------------------------------------------------------------
+# 1. Cache keys
+# ---------------------------------------------------------------------------
+def tool_version(tool: str) -> str:
+    """Return the version banner of a tool (memoised per process)."""
+    if tool not in _VERSIONS:
+        cmd = VERSION_COMMANDS.get(tool, "{} --version".format(tool))
+        run_ = subprocess.run(cmd, shell=True, stdout=subprocess.PIPE,
+                              stderr=subprocess.STDOUT, text=True)
+        _VERSIONS[tool] = " ".join(run_.stdout.split())
+    return _VERSIONS[tool]
+
+
+def cache_key(inputs: List[Path], tools: List[str], params: str) -> str:
+    """Return the cache key of a stage."""
+    sha256 = hashlib.sha256()
+    for tool in tools:
+        sha256.update("{}\t{}\n".format(tool, tool_version(tool)).encode())
+    sha256.update("{}\n".format(params).encode())
+    for fpath in inputs:
+        sha256.update("{}\n".format(file_digest(fpath)).encode())
+    return sha256.hexdigest()
+
+
+def entry_dir(cache_dir: Path, key: str) -> Path:
+    """Return the folder of a cache entry."""
+    return Path(cache_dir) / "artifacts" / key[:2] / key
+
+
+def has_entry(cache_dir: Path, key: str) -> bool:
+    """Return True if the cache holds a complete entry for ``key``."""
+    return (entry_dir(cache_dir, key) / "meta.json").exists()
+
+
+# ---------------------------------------------------------------------------
+# 2. Copy helpers (hard links when source and target share a filesystem)
+# ---------------------------------------------------------------------------
+def _link_or_copy(src: str, dst: str) -> None:
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+
+
+def _copy_output(src: Path, dst: Path) -> None:
+    if src.is_dir():
+        shutil.copytree(src, dst, symlinks=True, copy_function=_link_or_copy)
+    else:
+        _link_or_copy(str(src), str(dst))
+
+
+def _size(fpath: Path) -> int:
+    if fpath.is_dir():
+        return sum(child.stat().st_size for child in fpath.rglob("*") if child.is_file())
+    return fpath.stat().st_size
+
+
+# ---------------------------------------------------------------------------
+# 3. Store, fetch and evict
+# ---------------------------------------------------------------------------
+def fetch(cache_dir: Path, key: str, outputs: List[Path]) -> bool:
+    """Restore the outputs of an entry to ``outputs``; return True on a hit."""
+    entry = entry_dir(cache_dir, key)
+    meta_fpath = entry / "meta.json"
+    if not meta_fpath.exists():
+        return False
+    for index, output in enumerate(outputs):
+        stored = entry / str(index) / output.name
+        if not stored.exists():
+            stored = next((entry / str(index)).iterdir())
+        output.parent.mkdir(parents=True, exist_ok=True)
+        if output.is_dir():
+            shutil.rmtree(output)
+        elif output.exists() or output.is_symlink():
+            output.unlink()
+        _copy_output(stored, output)
+    # Refresh the entry for LRU eviction
+    os.utime(meta_fpath)
+    return True
+
+
+def store(cache_dir: Path, key: str, outputs: List[Path],
+          max_size: Optional[int] = None) -> None:
+    """Save ``outputs`` under ``key`` and evict old entries over ``max_size``."""
+    entry = entry_dir(cache_dir, key)
+    if (entry / "meta.json").exists():
+        return
+    # Build the entry aside and move it in place in one step
+    tmp_entry = entry.parent / "{}.tmp-{}".format(key, uuid.uuid4().hex)
+    tmp_entry.mkdir(parents=True)
+    for index, output in enumerate(outputs):
+        (tmp_entry / str(index)).mkdir()
+        _copy_output(output, tmp_entry / str(index) / output.name)
+    meta = {"outputs": [str(output) for output in outputs],
+            "size": sum(_size(output) for output in outputs),
+            "created": time.time()}
+    with open(tmp_entry / "meta.json", "w") as meta_fhand:
+        json.dump(meta, meta_fhand)
+    try:
+        os.rename(tmp_entry, entry)
+    except OSError:
+        # Another process stored the same entry first
+        shutil.rmtree(tmp_entry, ignore_errors=True)
+    if max_size is not None:
+        evict(cache_dir, max_size)
+
+
+def _lease_fpath(cache_dir: Path, key: str) -> Path:
+    return Path(cache_dir) / "leases" / "{}.{}-{}".format(key, socket.gethostname(), os.getpid())
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def pin(cache_dir: Path, keys: Iterable[str]) -> None:
+    """Keep the entries of ``keys`` out of eviction for the rest of the process.
+
+    Stages pruned because an entry exists (see
+    :func:`src.pipeline.prune_cached`) need it to still be there when they
+    run. A lease file tells the other processes sharing the cache; leases
+    past half their life are renewed.
+    """
+    now = time.time()
+    for key in keys:
+        if key in _PINNED and _PINNED[key][1] > now + LEASE_TTL / 2:
+            continue
+        lease_fpath = _lease_fpath(cache_dir, key)
+        lease_fpath.parent.mkdir(parents=True, exist_ok=True)
+        tmp = lease_fpath.parent / ".{}.tmp".format(lease_fpath.name)
+        with open(tmp, "w") as lease_fhand:
+            json.dump({"host": socket.gethostname(), "pid": os.getpid(),
+                       "expires": now + LEASE_TTL}, lease_fhand)
+        os.replace(tmp, lease_fpath)
+        _PINNED[key] = (Path(cache_dir), now + LEASE_TTL)
+
+
+def renew_pins() -> None:
+    """Renew the leases of this process that are past half their life."""
+    for cache_dir in set(cache_dir for cache_dir, _ in _PINNED.values()):
+        pin(cache_dir, [key for key, (other, _) in _PINNED.items() if other == cache_dir])
+
+
+def release_pins() -> None:
+    """Drop every pin of this process and remove its lease files."""
+    for key, (cache_dir, _) in _PINNED.items():
+        try:
+            _lease_fpath(cache_dir, key).unlink()
+        except OSError:
+            pass
+    _PINNED.clear()
+
+
+def get_pinned() -> Dict[str, Path]:
+    """Return ``{key: cache_dir}`` of the entries pinned by this process."""
+    return {key: cache_dir for key, (cache_dir, _) in _PINNED.items()}
+
+
+def get_leased(cache_dir: Path) -> Set[str]:
+    """Return the keys pinned by any live process; remove the leases that ended."""
+    leased = {key for key, (other, _) in _PINNED.items() if other == Path(cache_dir)}
+    lease_dir = Path(cache_dir) / "leases"
+    if not lease_dir.is_dir():
+        return leased
+    host, now = socket.gethostname(), time.time()
+    for lease_fpath in lease_dir.iterdir():
+        if lease_fpath.name.startswith("."):
+            continue
+        try:
+            with open(lease_fpath) as lease_fhand:
+                lease = json.load(lease_fhand)
+            if lease["host"] == host:
+                alive = _pid_alive(lease["pid"])
+            else:
+                alive = lease["expires"] > now
+        except (OSError, ValueError, KeyError):
+            continue
+        if alive:
+            leased.add(lease_fpath.name.partition(".")[0])
+        else:
+            try:
+                lease_fpath.unlink()
+            except OSError:
+                pass
+    return leased
+
+
+def evict(cache_dir: Path, max_size: int) -> List[str]:
+    """Remove least recently used entries until the cache fits ``max_size`` bytes.
+
+    Entries pinned by any live process are never removed, even if the cache
+    stays over the limit.
+    """
+    leased = get_leased(cache_dir)
+    entries = []
+    for meta_fpath in (Path(cache_dir) / "artifacts").glob("*/*/meta.json"):
+        try:
+            with open(meta_fpath) as meta_fhand:
+                size = json.load(meta_fhand)["size"]
+            entries.append((meta_fpath.stat().st_mtime, size, meta_fpath.parent))
+        except (OSError, ValueError, KeyError):
+            continue
+    total = sum(size for _, size, _ in entries)
+    evicted = []
+    for _, size, entry in sorted(entries):
+        if total <= max_size:
+            break
+        if entry.name in leased:
+            continue
+        trash = entry.parent / "{}.evicted-{}".format(entry.name, uuid.uuid4().hex)
+        try:
+            os.rename(entry, trash)
+        except OSError:
+            continue
+        shutil.rmtree(trash, ignore_errors=True)
+        total -= size
+        evicted.append(entry.name)
+    return evicted
+
+
+# ---------------------------------------------------------------------------
+# 4. Cached runner
+# ---------------------------------------------------------------------------
+def get_stage_key(artifacts: Callable[[Dict[str, Any]], Dict[str, Any]],
+                  arguments: Dict[str, Any]) -> Optional[str]:
+    """Return the cache key of a stage, or None if its inputs are not ready."""
+    spec = artifacts(arguments)
+    if not all(Path(fpath).exists() for fpath in spec["inputs"]):
+        return None
+    return cache_key([Path(fpath) for fpath in spec["inputs"]], spec["tools"], spec["params"])
+
+
+def run_cached(runner: Callable[[Dict[str, Any]], Dict[str, Any]],
+               artifacts: Callable[[Dict[str, Any]], Dict[str, Any]],
+               arguments: Dict[str, Any]) -> Dict[str, Any]:
+    """Run a stage through the artifact cache.
+
+    ``artifacts(arguments)`` describes the stage as ``{"inputs", "tools",
+    "params", "outputs"}``; the first output is the one the runner checks.
+    Outputs not committed yet are restored from the cache when possible and
+    committed, so the runner then reports them as already done (99).
+    Successful outputs are stored for later runs.
+    """
+    cache_dir = arguments.get("cache_dir")
+    if not cache_dir:
+        return runner(arguments)
+
+    renew_pins()
+    outputs = [Path(fpath) for fpath in artifacts(arguments)["outputs"]]
+    key = get_stage_key(artifacts, arguments)
+    restored = False
+    if key is not None and not is_done(outputs[0]):
+        restored = fetch(cache_dir, key, outputs)
+        if restored:
+            for output in outputs:
+                commit(output, 0, "restored from cache entry {}".format(key))
+
+    results = runner(arguments)
+    if restored:
+        results["msg"] = "{} (restored from cache)".format(results["msg"])
+    elif key is not None and results.get("returncode") in (0, 99):
+        store(cache_dir, key, outputs, max_size=arguments.get("cache_size"))
+    return results
@@ -0,0 +1,134 @@
+"""
+checkpoint.py
+=============
+Crash-safe completion markers for the runners.
+
+A stage writes its output to a temporary ``.<name>.partial`` path next to the
+final one and promotes it with a rename once the tool succeeds. Whatever the
+outcome, a ``.<name>.done`` marker recording the return code is then written
+atomically. A stage is only considered done (``returncode`` 99) when its
+marker records a return code of 0 and the output exists, so outputs left by
+killed or failed jobs are discarded and recomputed on resume.
+
+Queue workers run each stage under a claim (:func:`claim_outputs`): its
+temporary paths are named after the claim, and its outputs are only
+promoted and committed while the worker still owns the stage, so a worker
+wrongly taken as dead cannot clash with the one that took its stage over.
+"""
+
+import json
+import os
+import re
+import shutil
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Callable, Iterator, Optional
+
+# Claim of the stage run by the current thread (set by queue workers)
+_local = threading.local()
+
+
+# ---------------------------------------------------------------------------
+# 1. Paths
+# ---------------------------------------------------------------------------
+def marker_fpath(out_fpath: Path) -> Path:
+    """Return the completion marker of an output."""
+    out_fpath = Path(out_fpath)
+    return out_fpath.parent / ".{}.done".format(out_fpath.name)
+
+
+def tmp_fpath(out_fpath: Path) -> Path:
+    """Return the temporary path a stage writes before promotion.
+
+    Under a claim the path is ``.<name>.<claim>.partial``.
+    """
+    out_fpath = Path(out_fpath)
+    return out_fpath.parent / _partial_name(".{}".format(out_fpath.name))
+
+
+def _partial_name(name: str) -> str:
+    claim = getattr(_local, "claim", None)
+    if claim is not None:
+        return "{}.{}.partial".format(name, claim[0])
+    return "{}.partial".format(name)
+
+
+# ---------------------------------------------------------------------------
+# 2. Claims
+# ---------------------------------------------------------------------------
+@contextmanager
+def claim_outputs(owner: str, still_owned: Callable[[], bool]) -> Iterator[None]:
+    """Run the stage of this thread under the claim of ``owner``.
+
+    Temporary paths get the name of the owner, and :func:`promote` and
+    :func:`commit` raise ``RuntimeError`` once ``still_owned()`` is False.
+    """
+    _local.claim = (re.sub(r"[^\w.-]", "_", owner), still_owned)
+    try:
+        yield
+    finally:
+        _local.claim = None
+
+
+def _check_claim(out_fpath: Path) -> None:
+    claim = getattr(_local, "claim", None)
+    if claim is not None and not claim[1]():
+        raise RuntimeError("{} was not written: its stage is now run by another worker".format(
+            out_fpath))
+
+
+# ---------------------------------------------------------------------------
+# 3. Markers
+# ---------------------------------------------------------------------------
+def read_marker(out_fpath: Path) -> Optional[dict]:
+    """Return the content of an output's marker, or None if there is none."""
+    try:
+        with open(marker_fpath(out_fpath)) as marker_fhand:
+            return json.load(marker_fhand)
+    except (OSError, ValueError):
+        return None
+
+
+def is_done(out_fpath: Path) -> bool:
+    """Return True if the output was committed by a successful run."""
+    marker = read_marker(out_fpath)
+    return (marker is not None and marker.get("returncode") == 0
+            and (Path(out_fpath).exists() or Path(out_fpath).is_symlink()))
+
+
+def commit(out_fpath: Path, returncode: int, command: str = "") -> None:
+    """Atomically write the completion marker of an output."""
+    _check_claim(out_fpath)
+    marker = marker_fpath(out_fpath)
+    partial = marker.parent / _partial_name(marker.name)
+    with open(partial, "w") as marker_fhand:
+        json.dump({"returncode": returncode,
+                   "command": command,
+                   "finished": time.time()}, marker_fhand)
+    os.replace(partial, marker)
+
+
+# ---------------------------------------------------------------------------
+# 4. Temporary outputs
+# ---------------------------------------------------------------------------
+def _remove(fpath: Path) -> None:
+    if fpath.is_dir() and not fpath.is_symlink():
+        shutil.rmtree(fpath)
+    elif fpath.exists() or fpath.is_symlink():
+        fpath.unlink()
+
+
+def discard(out_fpath: Path) -> None:
+    """Remove the marker, the temporary path and any stale output."""
+    out_fpath = Path(out_fpath)
+    for fpath in (marker_fpath(out_fpath), tmp_fpath(out_fpath), out_fpath):
+        _remove(fpath)
+
+
+def promote(tmp: Path, out_fpath: Path) -> None:
+    """Move a finished temporary output to its final path."""
+    _check_claim(out_fpath)
+    _remove(Path(out_fpath))
+    os.replace(tmp, out_fpath)
@@ -0,0 +1,204 @@
+"""
+compression.py
+==============
+Transparent support for gzip-compressed FOF inputs (FASTA, GFF3 and GTF
+ending in ``.gz`` or ``.bgz``):
+
+* **is_gzipped** / **is_bgzf** - recognise compressed files by their header,
+  whatever their extension.
+* **open_text**       - open a plain or compressed text file; the native
+  GFF/GTF readers stream compressed annotations through it, so they need no
+  decompressed copy.
+* **decompress_file** - decompress to a plain file. BGZF files (``bgzip``)
+  are made of independent blocks, which are inflated in parallel by a pool
+  of threads (zlib releases the GIL); plain gzip is a single stream and is
+  inflated in one thread.
+* **run_decompress**  - stage runner: writes the plain copy of one input to
+  the scratch folder. **remove_decompressed** deletes it again once every
+  stage that reads it is finished.
+
+Each runner returns a dictionary with the executed command, an informational message,
+the main output path, and a ``returncode`` (99 means “already done”).
+"""
+
+import gzip
+import shutil
+import zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import IO, Any, Dict, List
+
+from src.checkpoint import commit, discard, is_done, promote, tmp_fpath
+
+GZIP_MAGIC = b"\x1f\x8b"
+
+# Extensions removed from the name of the decompressed copy
+COMPRESSED_SUFFIXES = (".gz", ".bgz", ".bgzf")
+
+# BGZF blocks inflated by each task (a block holds up to 64 kB of data)
+BLOCKS_PER_TASK = 64
+
+# Bytes read at a time from plain gzip files
+CHUNK_SIZE = 8 * 1024 * 1024
+
+
+# ---------------------------------------------------------------------------
+# 1. Detection
+# ---------------------------------------------------------------------------
+def is_gzipped(fpath: Path) -> bool:
+    """Return True if a file starts with the gzip magic number."""
+    with open(fpath, "rb") as fhand:
+        return fhand.read(2) == GZIP_MAGIC
+
+
+def _bgzf_block_size(header: bytes, extra: bytes) -> int:
+    """Return the size of a BGZF block from its ``BC`` extra subfield (0 if none)."""
+    if header[3] & 4 == 0:
+        return 0
+    position = 0
+    while position + 4 <= len(extra):
+        subfield_length = int.from_bytes(extra[position + 2:position + 4], "little")
+        if extra[position:position + 2] == b"BC" and subfield_length == 2:
+            return int.from_bytes(extra[position + 4:position + 6], "little") + 1
+        position += 4 + subfield_length
+    return 0
+
+
+def is_bgzf(fpath: Path) -> bool:
+    """Return True if a file is BGZF (blocked gzip, as written by ``bgzip``)."""
+    with open(fpath, "rb") as fhand:
+        header = fhand.read(12)
+        if len(header) < 12 or header[:2] != GZIP_MAGIC:
+            return False
+        return _bgzf_block_size(header, fhand.read(int.from_bytes(header[10:12], "little"))) > 0
+
+
+def get_decompressed_name(fpath: Path) -> str:
+    """Return the file name of the decompressed copy (``g1.fa.gz`` -> ``g1.fa``)."""
+    fpath = Path(fpath)
+    return fpath.stem if fpath.suffix.lower() in COMPRESSED_SUFFIXES else fpath.name
+
+
+def open_text(fpath: Path) -> IO[str]:
+    """Open a text file for reading, decompressing it on the fly if needed."""
+    if is_gzipped(fpath):
+        return gzip.open(fpath, "rt")
+    return open(fpath)
+
+
+# ---------------------------------------------------------------------------
+# 2. Decompression
+# ---------------------------------------------------------------------------
+def _read_bgzf_block(in_fhand: IO[bytes]) -> bytes:
+    """Return the deflated data, CRC and size of the next BGZF block (``b""`` at the end)."""
+    header = in_fhand.read(12)
+    if not header:
+        return b""
+    if len(header) < 12 or header[:2] != GZIP_MAGIC:
+        raise ValueError("Not a BGZF block at offset {}".format(in_fhand.tell() - len(header)))
+    extra = in_fhand.read(int.from_bytes(header[10:12], "little"))
+    block_size = _bgzf_block_size(header, extra)
+    if not block_size:
+        raise ValueError("Gzip member without BGZF block size at offset {}".format(
+            in_fhand.tell() - len(header) - len(extra)))
+    body = in_fhand.read(block_size - len(header) - len(extra))
+    if len(body) < 8:
+        raise ValueError("Truncated BGZF block")
+    return body
+
+
+def _inflate_blocks(blocks: List[bytes]) -> bytes:
+    """Inflate BGZF blocks and check their CRC."""
+    data = []
+    for block in blocks:
+        inflated = zlib.decompress(block[:-8], -15)
+        if zlib.crc32(inflated) != int.from_bytes(block[-8:-4], "little"):
+            raise ValueError("CRC mismatch in BGZF block")
+        data.append(inflated)
+    return b"".join(data)
+
+
+def _decompress_bgzf(in_fpath: Path, out_fhand: IO[bytes], threads: int) -> None:
+    """Inflate the blocks of a BGZF file in parallel, writing them in order."""
+    pending = deque()
+    with open(in_fpath, "rb", buffering=CHUNK_SIZE) as in_fhand, \
+            ThreadPoolExecutor(max_workers=threads) as pool:
+        while True:
+            blocks = []
+            while len(blocks) < BLOCKS_PER_TASK:
+                block = _read_bgzf_block(in_fhand)
+                if not block:
+                    break
+                blocks.append(block)
+            if blocks:
+                pending.append(pool.submit(_inflate_blocks, blocks))
+            # Keep a bounded number of tasks in flight
+            while pending and (len(pending) > 2 * threads or not blocks):
+                out_fhand.write(pending.popleft().result())
+            if not blocks:
+                break
+
+
+def decompress_file(in_fpath: Path, out_fpath: Path, threads: int = 1) -> None:
+    """Write the decompressed content of ``in_fpath`` to ``out_fpath``."""
+    with open(out_fpath, "wb") as out_fhand:
+        if is_bgzf(in_fpath):
+            _decompress_bgzf(in_fpath, out_fhand, max(1, threads))
+        else:
+            with gzip.open(in_fpath, "rb") as in_fhand:
+                shutil.copyfileobj(in_fhand, out_fhand, CHUNK_SIZE)
+
+
+# ---------------------------------------------------------------------------
+# 3. Stage
+# ---------------------------------------------------------------------------
+def get_decompressed_fpath(arguments: Dict[str, Any]) -> Path:
+    """Return the plain copy of a compressed input in the scratch folder."""
+    return arguments["scratch_dir"] / get_decompressed_name(arguments["source"])
+
+
+def run_decompress(arguments: Dict[str, Any]) -> Dict[str, Any]:
+    """Decompress one input to the scratch folder (or skip if already done)."""
+    outfile = get_decompressed_fpath(arguments)
+    cmd = "decompress {} > {} ({} threads)".format(arguments["source"], outfile,
+                                                  arguments["threads"])
+
+    if is_done(outfile):
+        return {"command": cmd,
+                "msg": "Decompression already done",
+                "out_fpath": outfile,
+                "returncode": 99}
+
+    discard(outfile)
+    outfile.parent.mkdir(parents=True, exist_ok=True)
+    tmp = tmp_fpath(outfile)
+    try:
+        decompress_file(Path(arguments["source"]), tmp, arguments["threads"])
+    except (OSError, EOFError, ValueError, zlib.error) as error:
+        discard(outfile)
+        commit(outfile, 1, cmd)
+        return {"command": cmd,
+                "msg": "Decompression Failed: \n {}".format(error),
+                "out_fpath": outfile,
+                "returncode": 1}
+    promote(tmp, outfile)
+    commit(outfile, 0, cmd)
+    return {"command": cmd,
+            "msg": "Decompression run successfully",
+            "out_fpath": outfile,
+            "returncode": 0}
+
+
+def remove_decompressed(arguments: Dict[str, Any]) -> Dict[str, Any]:
+    """Delete the plain copy of an input (and its marker) from the scratch folder."""
+    outfile = get_decompressed_fpath(arguments)
+    discard(outfile)
+    try:
+        outfile.parent.rmdir()
+    except OSError:
+        pass
+    return {"command": "rm {}".format(outfile),
+            "msg": "Decompressed copy removed",
+            "out_fpath": outfile,
+            "returncode": 0}
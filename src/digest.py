@@ -0,0 +1,35 @@
+"""
+digest.py
+=========
+Content digests of input files, used to recognise identical inputs listed
+under different paths (e.g. the same assembly shared by several samples).
+
+Digests are memoised per process by path, size and modification time so a
+large genome is only read once per run.
+"""
+
+import hashlib
+from pathlib import Path
+from typing import Dict, Tuple, Union
+
+# Bytes read at a time while hashing
+CHUNK_SIZE = 8 * 1024 * 1024
+
+_DIGESTS: Dict[Tuple[str, int, int], str] = {}
+
+
+# ---------------------------------------------------------------------------
+# 1. Digest of a single file
+# ---------------------------------------------------------------------------
+def file_digest(fpath: Union[str, Path]) -> str:
+    """Return the SHA-1 hex digest of a file's content."""
+    fpath = Path(fpath).resolve()
+    stat = fpath.stat()
+    key = (str(fpath), stat.st_size, stat.st_mtime_ns)
+    if key not in _DIGESTS:
+        sha1 = hashlib.sha1()
+        with open(fpath, "rb") as fhand:
+            for chunk in iter(lambda: fhand.read(CHUNK_SIZE), b""):
+                sha1.update(chunk)
+        _DIGESTS[key] = sha1.hexdigest()
+    return _DIGESTS[key]
@@ -0,0 +1,255 @@
+"""
+execution.py
+============
+Shared execution layer for the external tools.
+
+All child processes are started and supervised by one asyncio event loop
+running in a background thread; :func:`run_command` (a drop-in for
+``subprocess.run``) hands a command over to it and waits for the result, so
+the scheduler threads never read tool output themselves.
+
+* stdout and stderr are streamed straight to the stage log files
+  (``<sample or assembly folder>/logs/<stage>.log``), never buffered in
+  memory; the result only keeps the last lines of stderr for ``msg``.
+* each command runs in its own process group, so a timeout or a cancellation
+  stops the whole tree of processes it started.
+* a stage timeout (``--stage-timeout``) is shared by all the commands of the
+  stage; a timed-out command returns ``124``.
+* :func:`cancel_group` stops the running commands of a sample or assembly
+  and refuses new ones (``--fail-fast``); cancelled commands return ``-15``.
+* exits are waited for with ``os.wait4`` so the resource usage of each
+  command is recorded (see :mod:`src.profiling`).
+
+Commands always get an explicit working directory (``cwd``); nothing here
+changes the working directory of the GAQET process.
+"""
+
+import asyncio
+import os
+import signal
+import subprocess
+import tempfile
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Dict, Iterator, Optional, Set
+
+from src.profiling import record_command
+
+# Lines of stderr kept for the runner messages
+TAIL_LINES = 20
+
+# Seconds between SIGTERM and SIGKILL when stopping a command
+KILL_GRACE = 10
+
+# Return codes of commands that did not finish by themselves
+TIMEOUT_RETURNCODE = 124
+CANCEL_RETURNCODE = -signal.SIGTERM
+
+_loop: Optional[asyncio.AbstractEventLoop] = None
+_loop_lock = threading.Lock()
+_local = threading.local()
+
+# Running processes and cancelled groups (only touched from the loop thread)
+_running: Dict[str, Set[subprocess.Popen]] = {}
+_cancelled: Dict[str, str] = {}
+# Pending SIGKILL escalations (only touched from the loop thread)
+_kill_timers: Dict[subprocess.Popen, asyncio.TimerHandle] = {}
+
+
+# ---------------------------------------------------------------------------
+# 1. Background event loop
+# ---------------------------------------------------------------------------
+def get_loop() -> asyncio.AbstractEventLoop:
+    """Return the supervising event loop, starting its thread on first use."""
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name="gaqet-execution",
+                             daemon=True).start()
+        return _loop
+
+
+def _call_in_loop(function, *args) -> Any:
+    async def call():
+        return function(*args)
+    return asyncio.run_coroutine_threadsafe(call(), get_loop()).result()
+
+
+# ---------------------------------------------------------------------------
+# 2. Stage context (set by the scheduler for the thread that runs a stage)
+# ---------------------------------------------------------------------------
+@contextmanager
+def stage_context(stage: str, group: Optional[str], log_dir: Optional[Path],
+                  timeout: Optional[float] = None) -> Iterator[Dict[str, Any]]:
+    """Send the commands run by this thread to the log file of ``stage``.
+
+    The context yielded gets a ``stopped`` note once a command of the stage
+    was stopped by GAQET (timeout or cancellation), not by itself.
+    """
+    log_fpath = None
+    if log_dir is not None:
+        Path(log_dir).mkdir(parents=True, exist_ok=True)
+        log_fpath = Path(log_dir) / "{}.log".format(stage.rpartition("/")[2])
+        # A new attempt starts a new log
+        log_fpath.write_text("")
+    _local.context = {"group": group, "log_fpath": log_fpath,
+                      "deadline": None if timeout is None else time.monotonic() + timeout,
+                      "stopped": None}
+    try:
+        yield _local.context
+    finally:
+        _local.context = None
+
+
+def cancel_group(group: str, reason: str) -> None:
+    """Stop the running commands of ``group`` and refuse its next ones."""
+    _call_in_loop(_cancel_group, group, reason)
+
+
+def _cancel_group(group: str, reason: str) -> None:
+    _cancelled[group] = reason
+    for process in list(_running.get(group, ())):
+        _stop(process)
+
+
+def reset_cancellations() -> None:
+    """Forget cancelled groups (at the start of a run)."""
+    _call_in_loop(_cancelled.clear)
+
+
+def _stop(process: subprocess.Popen) -> None:
+    """SIGTERM the process group of ``process``, SIGKILL it if it lingers.
+
+    Nothing is sent once the process is reaped: its group id may then belong
+    to an unrelated process. The SIGKILL timer is cancelled at the reaping.
+    """
+    def signal_group(signum):
+        if process.returncode is not None:
+            return
+        try:
+            os.killpg(process.pid, signum)
+        except (ProcessLookupError, PermissionError):
+            pass
+
+    def escalate():
+        _kill_timers.pop(process, None)
+        signal_group(signal.SIGKILL)
+
+    signal_group(signal.SIGTERM)
+    if process not in _kill_timers:
+        _kill_timers[process] = get_loop().call_later(KILL_GRACE, escalate)
+
+
+# ---------------------------------------------------------------------------
+# 3. Supervised commands
+# ---------------------------------------------------------------------------
+async def _wait_exit(process: subprocess.Popen):
+    """Wait for ``process`` without blocking the loop; return ``(status, rusage)``.
+
+    The return code of ``process`` is set as soon as it is reaped, so
+    :func:`_stop` stops signalling it and Popen does not wait again.
+    """
+    loop = asyncio.get_running_loop()
+    try:
+        pidfd = os.pidfd_open(process.pid)
+    except (AttributeError, OSError):
+        # No pidfd (not Linux, or old kernel): wait in a helper thread
+        _, status, usage = await loop.run_in_executor(None, os.wait4, process.pid, 0)
+        process.returncode = os.waitstatus_to_exitcode(status)
+        return status, usage
+    exited = loop.create_future()
+    loop.add_reader(pidfd, lambda: exited.done() or exited.set_result(None))
+    try:
+        await exited
+    finally:
+        loop.remove_reader(pidfd)
+        os.close(pidfd)
+    _, status, usage = os.wait4(process.pid, 0)
+    process.returncode = os.waitstatus_to_exitcode(status)
+    return status, usage
+
+
+async def _supervise(cmd: Any, kwargs: Dict[str, Any], stdout, stderr,
+                     group: Optional[str], timeout: Optional[float]) -> Dict[str, Any]:
+    if group in _cancelled:
+        return {"returncode": CANCEL_RETURNCODE, "usage": None,
+                "note": "cancelled: {}".format(_cancelled[group])}
+    start = time.perf_counter()
+    process = subprocess.Popen(cmd, stdout=stdout, stderr=stderr, start_new_session=True,
+                               **kwargs)
+    _running.setdefault(group, set()).add(process)
+    waiter = asyncio.ensure_future(_wait_exit(process))
+    note = None
+    try:
+        status, usage = await asyncio.wait_for(asyncio.shield(waiter), timeout)
+    except asyncio.TimeoutError:
+        note = "timed out after {:.0f} s".format(timeout)
+        _stop(process)
+        status, usage = await waiter
+    finally:
+        _running[group].discard(process)
+        kill_timer = _kill_timers.pop(process, None)
+        if kill_timer is not None:
+            kill_timer.cancel()
+    returncode = process.returncode
+    if note is not None:
+        returncode = TIMEOUT_RETURNCODE
+    elif group in _cancelled and returncode < 0:
+        note = "cancelled: {}".format(_cancelled[group])
+    return {"returncode": returncode, "usage": usage, "note": note,
+            "wall_s": time.perf_counter() - start}
+
+
+def _tail(fpath: Path, lines: int) -> str:
+    """Return the last ``lines`` lines of a (possibly large) text file."""
+    with open(fpath, "rb") as fhand:
+        fhand.seek(0, os.SEEK_END)
+        fhand.seek(max(0, fhand.tell() - 256 * lines))
+        return "".join(deque(fhand.read().decode(errors="replace").splitlines(True),
+                             maxlen=lines))
+
+
+def run_command(cmd: Any, **kwargs: Any) -> subprocess.CompletedProcess:
+    """Run ``cmd`` like ``subprocess.run``, supervised by the execution loop.
+
+    Output that ``subprocess.run`` would capture (``PIPE``) or print goes to
+    the stage log instead; ``stdout``/``stderr`` of the result hold the last
+    ``TAIL_LINES`` lines of it. An explicit file for ``stdout`` is honoured.
+    """
+    context = getattr(_local, "context", None) or {}
+    stdout = kwargs.pop("stdout", None)
+    kwargs.pop("stderr", None)
+    kwargs.pop("text", None)
+
+    log_fpath = context.get("log_fpath")
+    tmp_log = None
+    if log_fpath is None:
+        tmp_log = tempfile.NamedTemporaryFile(prefix="gaqet-", suffix=".log", delete=False)
+        tmp_log.close()
+        log_fpath = Path(tmp_log.name)
+    with open(log_fpath, "ab") as log_fhand:
+        log_fhand.write("## {}\n".format(cmd).encode())
+        log_fhand.flush()
+        deadline = context.get("deadline")
+        timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+        outcome = asyncio.run_coroutine_threadsafe(
+            _supervise(cmd, kwargs,
+                       log_fhand if stdout in (None, subprocess.PIPE) else stdout,
+                       log_fhand, context.get("group"), timeout),
+            get_loop()).result()
+        if outcome["note"]:
+            log_fhand.write("## {}\n".format(outcome["note"]).encode())
+            context["stopped"] = outcome["note"]
+
+    tail = _tail(log_fpath, TAIL_LINES)
+    if tmp_log is not None:
+        os.unlink(tmp_log.name)
+    run_ = subprocess.CompletedProcess(cmd, outcome["returncode"], tail, tail)
+    run_.log_fpath = None if tmp_log is not None else log_fpath
+    if outcome["usage"] is not None:
+        run_.profile = record_command(outcome["usage"], outcome["wall_s"])
+    return run_
@@ -0,0 +1,88 @@
+"""
+fasta.py
+========
+Indexed, memory-mapped access to genome FASTA files.
+
+* **write_fai** / **read_fai** - ``samtools faidx``-compatible ``.fai``
+  index, written once per assembly by the assembly statistics stage (see
+  :mod:`src.assembly_stats`).
+* **IndexedFasta** - memory-maps the assembly and returns any region with
+  random access, without reading the rest of the genome.
+"""
+
+import mmap
+from pathlib import Path
+from typing import Any, Dict, List, NamedTuple
+
+
+class FaiRecord(NamedTuple):
+    """One line of a ``.fai`` index."""
+    name: str
+    length: int
+    offset: int
+    linebases: int
+    linewidth: int
+
+
+# ---------------------------------------------------------------------------
+# 1. Write and read .fai indexes
+# ---------------------------------------------------------------------------
+def write_fai(records: List[FaiRecord], fai_fpath: Path) -> None:
+    """Write ``.fai`` records (built by :func:`src.assembly_stats.scan_assembly`)."""
+    with open(fai_fpath, "w") as fai_fhand:
+        for record in records:
+            fai_fhand.write("\t".join(str(field) for field in record) + "\n")
+
+
+def read_fai(fai_fpath: Path) -> Dict[str, FaiRecord]:
+    """Return ``{sequence_name: FaiRecord}`` from a ``.fai`` file."""
+    records = {}
+    with open(fai_fpath) as fai_fhand:
+        for line in fai_fhand:
+            fields = line.rstrip("\n").split("\t")
+            records[fields[0]] = FaiRecord(fields[0], *(int(field) for field in fields[1:5]))
+    return records
+
+
+def get_fai_fpath(arguments: Dict[str, Any]) -> Path:
+    """Return the shared ``.fai`` index of an assembly.
+
+    It is named after the assembly folder, not the FASTA file, because samples
+    may give the same genome under different file names.
+    """
+    return arguments["assembly_dir"] / "{}.fai".format(Path(arguments["assembly_dir"]).name)
+
+
+# ---------------------------------------------------------------------------
+# 2. Random access to sequences
+# ---------------------------------------------------------------------------
+class IndexedFasta:
+    """Memory-mapped FASTA with a ``.fai`` index (use as a context manager)."""
+
+    def __init__(self, fasta_fpath: Path, fai_fpath: Path):
+        self.index = read_fai(fai_fpath)
+        self._fhand = open(fasta_fpath, "rb")
+        self._map = mmap.mmap(self._fhand.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def __enter__(self) -> "IndexedFasta":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def close(self) -> None:
+        self._map.close()
+        self._fhand.close()
+
+    def _position(self, record: FaiRecord, base: int) -> int:
+        return (record.offset + (base // record.linebases) * record.linewidth
+                + base % record.linebases)
+
+    def fetch(self, name: str, start: int, end: int) -> bytes:
+        """Return the bases of ``name`` from ``start`` to ``end`` (1-based, inclusive)."""
+        record = self.index[name]
+        start, end = max(start, 1), min(end, record.length)
+        if end < start:
+            return b""
+        chunk = self._map[self._position(record, start - 1):self._position(record, end - 1) + 1]
+        return chunk.replace(b"\n", b"").replace(b"\r", b"")
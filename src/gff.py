@@ -0,0 +1,133 @@
+"""
+gff.py
+======
+Streaming reader for GFF3 and GTF annotations shared by the native stages.
+
+Features are yielded one at a time as tuples, so callers can keep only the
+columns they need in compact arrays instead of loading the whole file.
+GFF3 ``ID``/``Parent`` and GTF ``transcript_id``/``gene_id`` attributes are
+both mapped to the same ``(ids, parents)`` fields. Compressed (gzip/BGZF)
+files are decompressed on the fly.
+"""
+
+from array import array
+from pathlib import Path
+from typing import Dict, Iterator, NamedTuple, Tuple, Union
+
+from src.compression import open_text
+
+# Feature types (lower case) understood as transcripts and their parts
+MRNA_TYPES = ("mrna",)
+TRANSCRIPT_TYPES = ("mrna", "transcript")
+UTR5_TYPES = ("five_prime_utr", "5utr", "five_prime_utr_region")
+UTR3_TYPES = ("three_prime_utr", "3utr", "three_prime_utr_region")
+
+
+class Feature(NamedTuple):
+    """One annotation line."""
+    seqid: str
+    type: str
+    start: int
+    end: int
+    strand: str
+    phase: str
+    ids: Tuple[str, ...]
+    parents: Tuple[str, ...]
+    gene: str = ""          # GTF gene_id of any line (empty for GFF3)
+
+
+# ---------------------------------------------------------------------------
+# 1. Attribute parsing
+# ---------------------------------------------------------------------------
+def _gff3_ids(attributes: str) -> Tuple[Tuple[str, ...], Tuple[str, ...]]:
+    ids, parents = (), ()
+    for field in attributes.split(";"):
+        key, _, value = field.strip().partition("=")
+        if key == "ID":
+            ids = (value,)
+        elif key == "Parent":
+            parents = tuple(value.split(","))
+    return ids, parents
+
+
+def _gtf_ids(feature_type: str, attributes: str) -> Tuple[Tuple[str, ...], Tuple[str, ...], str]:
+    values = {}
+    for field in attributes.split(";"):
+        key, _, value = field.strip().partition(" ")
+        if key in ("gene_id", "transcript_id"):
+            values[key] = value.strip().strip('"')
+    gene_id = values.get("gene_id")
+    transcript_id = values.get("transcript_id")
+    gene = gene_id or ""
+    if feature_type == "gene":
+        return ((gene_id,) if gene_id else ()), (), gene
+    if feature_type in TRANSCRIPT_TYPES:
+        return ((transcript_id,) if transcript_id else ()), ((gene_id,) if gene_id else ()), gene
+    return (), ((transcript_id,) if transcript_id else ()), gene
+
+
+# ---------------------------------------------------------------------------
+# 2. Streaming reader
+# ---------------------------------------------------------------------------
+def iter_features(fpath: Union[str, Path]) -> Iterator[Feature]:
+    """Yield the features of a GFF3 or GTF file, one line at a time.
+
+    Types are lower-cased. Reading stops at a ``##FASTA`` section.
+    """
+    with open_text(fpath) as gff_fhand:
+        for line in gff_fhand:
+            if line.startswith("#"):
+                if line.startswith("##FASTA"):
+                    break
+                continue
+            fields = line.rstrip("\n").split("\t")
+            if len(fields) < 9:
+                continue
+            feature_type = fields[2].lower()
+            attributes = fields[8]
+            # GTF attributes are 'key "value";', GFF3 ones 'key=value;'
+            if "=" in attributes.split(";", 1)[0]:
+                ids, parents = _gff3_ids(attributes)
+                gene = ""
+            else:
+                ids, parents, gene = _gtf_ids(feature_type, attributes)
+            yield Feature(fields[0], feature_type, int(fields[3]), int(fields[4]),
+                          fields[6], fields[7], ids, parents, gene)
+
+
+# ---------------------------------------------------------------------------
+# 3. Compact index helpers
+# ---------------------------------------------------------------------------
+def get_index(ids: Dict[str, int], key: str, *columns: array) -> int:
+    """Return the row of ``key``, appending a placeholder row if it is new.
+
+    Each array in ``columns`` gets a zero for new rows.
+    """
+    index = ids.get(key)
+    if index is None:
+        index = len(ids)
+        ids[key] = index
+        for column in columns:
+            column.append(0)
+    return index
+
+
+
+def group_rows(owners: array, n_owners: int) -> Tuple[array, array]:
+    """Group the rows of a child column by owner without building per-owner lists.
+
+    Return ``(offsets, order)``: the rows of owner ``i`` are
+    ``order[offsets[i]:offsets[i + 1]]``, in file order (a counting sort,
+    so both arrays take one machine word per row).
+    """
+    offsets = array("l", bytes(array("l").itemsize * (n_owners + 1)))
+    for owner in owners:
+        offsets[owner + 1] += 1
+    for owner in range(n_owners):
+        offsets[owner + 1] += offsets[owner]
+    order = array("l", bytes(array("l").itemsize * len(owners)))
+    fill = offsets[:-1]
+    for row, owner in enumerate(owners):
+        order[fill[owner]] = row
+        fill[owner] += 1
+    return offsets, order
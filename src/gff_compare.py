@@ -0,0 +1,390 @@
+"""
+gff_compare.py
+==============
+Native replacement for ``gffcompare`` (``--compare-backend native``).
+
+The reference annotation and the StringTie transcripts are streamed once
+(see :mod:`src.gff`) into ``array`` columns, with the exons of each
+transcript laid out contiguously. Each sequence is then compared on its own,
+so memory beyond the columns is bounded by the largest chromosome:
+
+* exons and introns are matched by their exact coordinates and strand,
+* multi-exon transcripts match when their intron chains are identical,
+  single-exon ones when they overlap by at least 80% of the longer one
+  (looked up by bisection in the reference sorted by start),
+* loci are clusters of transcripts overlapping on the same strand and match
+  when any of their transcripts does.
+
+The result is written as a gffcompare-style ``<alignments>.stats`` report so
+:func:`src.stringtie.calculate_annotation_scores` parses both backends the
+same way. Matching counts refer to reference transcripts and loci, and
+unstranded query transcripts match either strand.
+"""
+
+import re
+from array import array
+from bisect import bisect_left
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Tuple
+
+from src.checkpoint import commit, discard, is_done, promote, tmp_fpath
+from src.compression import open_text
+from src.gff import TRANSCRIPT_TYPES, get_index
+from src.stringtie import get_alignments_stem
+
+# Bumped whenever the computed metrics change (part of the cache key)
+ENGINE_VERSION = "gaqet-gff-compare 1"
+
+# Minimum overlap (fraction of the longer one) for single-exon matches
+SINGLE_EXON_OVERLAP = 0.8
+
+_STRANDS = {"+": 1, "-": -1}
+
+# Transcript of exon/CDS lines and ID of transcript lines (GTF, GFF3)
+_TRANSCRIPT_ID = re.compile(r'transcript_id "([^"]+)"')
+_PARENT = re.compile(r'(?:^|;)\s*Parent=([^;]+)')
+_ID = re.compile(r'(?:^|;)\s*ID=([^;]+)')
+
+
+# ---------------------------------------------------------------------------
+# 1. Transcripts and their exons
+# ---------------------------------------------------------------------------
+def _iter_exon_lines(fpath: Path) -> Iterator[Tuple[str, str, int, int, str, List[str]]]:
+    """Yield ``(seqid, type, start, end, strand, keys)`` of exon, CDS and transcript lines.
+
+    A trimmed-down :func:`src.gff.iter_features`: attributes are only parsed
+    for the lines used here, which are most of a StringTie GTF.
+    """
+    with open_text(fpath) as gff_fhand:
+        for line in gff_fhand:
+            if line.startswith("#"):
+                if line.startswith("##FASTA"):
+                    break
+                continue
+            fields = line.rstrip("\n").split("\t")
+            if len(fields) < 9:
+                continue
+            feature_type = fields[2].lower()
+            if feature_type == "exon" or feature_type == "cds":
+                gff3_key = _PARENT
+            elif feature_type in TRANSCRIPT_TYPES:
+                gff3_key = _ID
+            else:
+                continue
+            match = (_TRANSCRIPT_ID if "transcript_id" in fields[8] else gff3_key).search(fields[8])
+            if match:
+                yield (fields[0], feature_type, int(fields[3]), int(fields[4]), fields[6],
+                       match.group(1).split(","))
+
+
+def read_transcripts(fpath: Path) -> Dict[str, Any]:
+    """Load the exons of every transcript into array columns.
+
+    Transcripts without exon lines take their exons from their CDS, or
+    from their own span when they have neither. The exons of transcript
+    ``t`` are ``starts/ends[offsets[t]:offsets[t + 1]]``, sorted by start.
+    """
+    seqids: Dict[str, int] = {}
+    transcripts: Dict[str, int] = {}
+    t_seq, t_strand, t_exons = array("l"), array("b"), array("l")
+    columns = {"exon": (array("l"), array("q"), array("q")),
+               "cds": (array("l"), array("q"), array("q")),
+               "span": (array("l"), array("q"), array("q"))}
+
+    for seqid, feature_type, start, end, strand, keys in _iter_exon_lines(fpath):
+        seq = seqids.setdefault(seqid, len(seqids))
+        rows, starts, ends = columns[feature_type if feature_type in columns else "span"]
+        for key in keys:
+            row = transcripts.get(key)
+            if row is None:
+                row = get_index(transcripts, key, t_seq, t_strand, t_exons)
+                t_seq[row] = seq
+                t_strand[row] = _STRANDS.get(strand, 0)
+            if feature_type == "exon":
+                t_exons[row] += 1
+            rows.append(row)
+            starts.append(start)
+            ends.append(end)
+
+    # CDS only count for transcripts without exons, spans for those with neither
+    e_tx, e_start, e_end = columns["exon"]
+    if not all(t_exons):
+        with_cds = set(columns["cds"][0])
+        for kind in ("cds", "span"):
+            rows, starts, ends = columns[kind]
+            for i, row in enumerate(rows):
+                if not t_exons[row] and (kind == "cds" or row not in with_cds):
+                    e_tx.append(row)
+                    e_start.append(starts[i])
+                    e_end.append(ends[i])
+
+    # Sort the exons by transcript, then start (both sorts are stable)
+    order = sorted(range(len(e_tx)), key=e_start.__getitem__)
+    order.sort(key=e_tx.__getitem__)
+    e_tx = array("l", map(e_tx.__getitem__, order))
+    offsets = array("l", (bisect_left(e_tx, row) for row in range(len(transcripts) + 1)))
+    return {"seqids": list(seqids), "t_seq": t_seq, "t_strand": t_strand,
+            "offsets": offsets,
+            "starts": array("q", map(e_start.__getitem__, order)),
+            "ends": array("q", map(e_end.__getitem__, order))}
+
+
+def _rows_by_seqid(data: Dict[str, Any]) -> Dict[str, array]:
+    rows: Dict[str, array] = {}
+    for row, seq in enumerate(data["t_seq"]):
+        rows.setdefault(data["seqids"][seq], array("l")).append(row)
+    return rows
+
+
+def _exons(data: Dict[str, Any], row: int) -> List[Tuple[int, int]]:
+    first, last = data["offsets"][row], data["offsets"][row + 1]
+    return list(zip(data["starts"][first:last], data["ends"][first:last]))
+
+
+def _introns(exons: List[Tuple[int, int]]) -> Tuple[Tuple[int, int], ...]:
+    return tuple((exons[i][1] + 1, exons[i + 1][0] - 1) for i in range(len(exons) - 1))
+
+
+# ---------------------------------------------------------------------------
+# 2. Comparison of one sequence
+# ---------------------------------------------------------------------------
+def _strands(strand: int) -> Tuple[int, ...]:
+    """Reference strands an (un)stranded query feature can match."""
+    return (1, -1) if strand == 0 else (strand,)
+
+
+def _match_keys(ref_keys: set, query_keys: set) -> Tuple[int, int]:
+    """Return how many reference and query ``(strand, start, end)`` keys match."""
+    matched_ref = set()
+    matched_query = 0
+    for strand, start, end in query_keys:
+        found = [(ref_strand, start, end) for ref_strand in _strands(strand)
+                 if (ref_strand, start, end) in ref_keys]
+        if found:
+            matched_query += 1
+            matched_ref.update(found)
+    return len(matched_ref), matched_query
+
+
+def _merged(intervals: List[Tuple[int, int]]) -> List[Tuple[int, int]]:
+    merged: List[Tuple[int, int]] = []
+    for start, end in sorted(intervals):
+        if merged and start <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def _covered(merged: List[Tuple[int, int]]) -> int:
+    return sum(end - start + 1 for start, end in merged)
+
+
+def _shared_bases(first: List[Tuple[int, int]], second: List[Tuple[int, int]]) -> int:
+    """Bases covered by two merged, sorted interval lists."""
+    shared = i = j = 0
+    while i < len(first) and j < len(second):
+        start = max(first[i][0], second[j][0])
+        end = min(first[i][1], second[j][1])
+        if start <= end:
+            shared += end - start + 1
+        if first[i][1] < second[j][1]:
+            i += 1
+        else:
+            j += 1
+    return shared
+
+
+def _loci(spans: Dict[int, Tuple[int, int, int]]) -> List[List[int]]:
+    """Cluster transcripts ``{row: (strand, start, end)}`` that overlap on a strand."""
+    loci: List[List[int]] = []
+    last = {}
+    for row, (strand, start, end) in sorted(spans.items(), key=lambda item: item[1]):
+        current = last.get(strand)
+        if current is not None and start <= current[1]:
+            current[0].append(row)
+            current[1] = max(current[1], end)
+        else:
+            last[strand] = [[row], end]
+            loci.append(last[strand][0])
+    return loci
+
+
+def compare_sequence(reference: Dict[str, Any], ref_rows: array,
+                     query: Dict[str, Any], query_rows: array,
+                     counts: Dict[str, List[int]]) -> None:
+    """Add the matches of one sequence to ``counts``.
+
+    ``counts`` maps each level to ``[reference, query, matched reference,
+    matched query]``.
+    """
+    sides = []
+    for data, rows in ((reference, ref_rows), (query, query_rows)):
+        exons, introns, chains, spans, intervals = set(), set(), {}, {}, []
+        for row in rows:
+            strand = data["t_strand"][row]
+            row_exons = _exons(data, row)
+            row_introns = _introns(row_exons)
+            exons.update((strand, start, end) for start, end in row_exons)
+            introns.update((strand, start, end) for start, end in row_introns)
+            chains[row] = (strand, row_introns)
+            spans[row] = (strand, row_exons[0][0], row_exons[-1][1])
+            intervals.extend(row_exons)
+        sides.append((exons, introns, chains, spans, _merged(intervals)))
+    (r_exons, r_introns, r_chains, r_spans, r_merged) = sides[0]
+    (q_exons, q_introns, q_chains, q_spans, q_merged) = sides[1]
+
+    shared = _shared_bases(r_merged, q_merged)
+    _add(counts["Base"], _covered(r_merged), _covered(q_merged), shared, shared)
+    _add(counts["Exon"], len(r_exons), len(q_exons), *_match_keys(r_exons, q_exons))
+    _add(counts["Intron"], len(r_introns), len(q_introns), *_match_keys(r_introns, q_introns))
+
+    # Multi-exon transcripts: identical intron chains
+    ref_by_chain: Dict[tuple, List[int]] = {}
+    for row, chain in r_chains.items():
+        if chain[1]:
+            ref_by_chain.setdefault(chain, []).append(row)
+    matched_ref, matched_query = set(), set()
+    for row, (strand, introns) in q_chains.items():
+        if not introns:
+            continue
+        for ref_strand in _strands(strand):
+            hits = ref_by_chain.get((ref_strand, introns))
+            if hits:
+                matched_query.add(row)
+                matched_ref.update(hits)
+    _add(counts["Intron chain"], sum(len(rows) for rows in ref_by_chain.values()),
+         sum(1 for _, introns in q_chains.values() if introns),
+         len(matched_ref), len(matched_query))
+
+    # Single-exon transcripts: overlap of the longer one, by bisection
+    singles = sorted((r_spans[row][1], r_spans[row][2], r_spans[row][0], row)
+                     for row, (_, introns) in r_chains.items() if not introns)
+    single_starts = [start for start, _, _, _ in singles]
+    longest = max((end - start + 1 for start, end, _, _ in singles), default=0)
+    for row, (strand, introns) in q_chains.items():
+        if introns:
+            continue
+        _, start, end = q_spans[row]
+        index = bisect_left(single_starts, start - longest)
+        while index < len(singles) and singles[index][0] <= end:
+            r_start, r_end, r_strand, r_row = singles[index]
+            overlap = min(end, r_end) - max(start, r_start) + 1
+            longer = max(end - start, r_end - r_start) + 1
+            if r_strand in _strands(strand) and overlap >= SINGLE_EXON_OVERLAP * longer:
+                matched_query.add(row)
+                matched_ref.add(r_row)
+            index += 1
+    _add(counts["Transcript"], len(r_chains), len(q_chains), len(matched_ref), len(matched_query))
+
+    # Loci with at least one matching transcript
+    r_loci, q_loci = _loci(r_spans), _loci(q_spans)
+    _add(counts["Locus"], len(r_loci), len(q_loci),
+         sum(1 for locus in r_loci if any(row in matched_ref for row in locus)),
+         sum(1 for locus in q_loci if any(row in matched_query for row in locus)))
+
+
+def _add(level: List[int], *values: int) -> None:
+    for index, value in enumerate(values):
+        level[index] += value
+
+
+# ---------------------------------------------------------------------------
+# 3. Whole comparison and gffcompare-style report
+# ---------------------------------------------------------------------------
+LEVELS = ["Base", "Exon", "Intron", "Intron chain", "Transcript", "Locus"]
+
+
+def compare_annotations(reference_fpath: Path, query_fpath: Path) -> Dict[str, List[int]]:
+    """Return ``{level: [reference, query, matched reference, matched query]}``."""
+    reference = read_transcripts(reference_fpath)
+    query = read_transcripts(query_fpath)
+    ref_by_seqid, query_by_seqid = _rows_by_seqid(reference), _rows_by_seqid(query)
+    counts = {level: [0, 0, 0, 0] for level in LEVELS}
+    for seqid in sorted(set(ref_by_seqid) | set(query_by_seqid)):
+        compare_sequence(reference, ref_by_seqid.get(seqid, array("l")),
+                         query, query_by_seqid.get(seqid, array("l")), counts)
+    return counts
+
+
+def _percent(part: int, total: int) -> float:
+    return 100.0 * part / total if total else 0.0
+
+
+def write_report(counts: Dict[str, List[int]], command: str, out_fhand) -> None:
+    """Write ``counts`` in the layout of a gffcompare ``.stats`` file."""
+    out_fhand.write("# {} | Command line was:\n#{}\n#\n\n".format(ENGINE_VERSION, command))
+    ref_tx, query_tx = counts["Transcript"][:2]
+    ref_loci, query_loci = counts["Locus"][:2]
+    out_fhand.write("#     Query mRNAs : {:>7} in {:>7} loci  ({} multi-exon transcripts)\n"
+                    .format(query_tx, query_loci, counts["Intron chain"][1]))
+    out_fhand.write("# Reference mRNAs : {:>7} in {:>7} loci  ({} multi-exon)\n"
+                    .format(ref_tx, ref_loci, counts["Intron chain"][0]))
+    out_fhand.write("#-----------------| Sensitivity | Precision  |\n")
+    for level in LEVELS:
+        reference, query, matched_ref, matched_query = counts[level]
+        out_fhand.write("{:>18}:   {:>5.1f}     |   {:>5.1f}    |\n".format(
+            "{} level".format(level), _percent(matched_ref, reference),
+            _percent(matched_query, query)))
+    out_fhand.write("\n")
+    for label, level in (("Matching intron chains", "Intron chain"),
+                         ("Matching transcripts", "Transcript"),
+                         ("Matching loci", "Locus")):
+        out_fhand.write("{:>27}: {:>7}\n".format(label, counts[level][2]))
+    out_fhand.write("\n")
+    for label, index, level in (("Missed introns", 0, "Intron"), ("Novel introns", 1, "Intron"),
+                                ("Missed loci", 0, "Locus"), ("Novel loci", 1, "Locus")):
+        total, matched = counts[level][index], counts[level][index + 2]
+        out_fhand.write("{:>22}: {:>7}/{:<7} ({:>5.1f}%)\n".format(
+            label, total - matched, total, _percent(total - matched, total)))
+
+
+# ---------------------------------------------------------------------------
+# 4. Runner
+# ---------------------------------------------------------------------------
+def get_gff_compare_fpath(arguments: Dict[str, Any]) -> Path:
+    """Return the ``.stats`` report, at the same path gffcompare uses."""
+    return arguments["output"] / "RNASeqCheck" / "{}.stats".format(get_alignments_stem(arguments))
+
+
+def get_gff_compare_artifacts(arguments: Dict[str, Any]) -> Dict[str, Any]:
+    """Describe the native comparison for the artifact cache."""
+    outdir = arguments["output"] / "RNASeqCheck"
+    return {"inputs": [outdir / "{}.gtf".format(get_alignments_stem(arguments)),
+                       arguments["ref_annotation"]],
+            "tools": [],
+            "params": ENGINE_VERSION,
+            "outputs": [get_gff_compare_fpath(arguments)]}
+
+
+def run_gff_compare(arguments: Dict[str, Any]) -> Dict[str, Any]:
+    """Compare the StringTie transcripts with the reference natively (or skip if done)."""
+    out_fpath = get_gff_compare_fpath(arguments)
+    gtf_fpath = out_fpath.parent / "{}.gtf".format(get_alignments_stem(arguments))
+    command = "{} -r {} {}".format(ENGINE_VERSION, arguments["ref_annotation"], gtf_fpath)
+
+    if is_done(out_fpath):
+        return {"command": command,
+                "msg": "Native comparison already done",
+                "out_fpath": out_fpath,
+                "returncode": 99}
+
+    discard(out_fpath)
+    try:
+        counts = compare_annotations(Path(arguments["ref_annotation"]), gtf_fpath)
+    except (OSError, ValueError, IndexError) as error:
+        commit(out_fpath, 1, command)
+        return {"command": command,
+                "msg": "Native comparison Failed: \n {}".format(error),
+                "out_fpath": out_fpath,
+                "returncode": 1}
+
+    tmp = tmp_fpath(out_fpath)
+    with open(tmp, "w") as report_fhand:
+        write_report(counts, command, report_fhand)
+    promote(tmp, out_fpath)
+    commit(out_fpath, 0, command)
+    return {"command": command,
+            "msg": "Native comparison run successfully",
+            "out_fpath": out_fpath,
+            "returncode": 0}
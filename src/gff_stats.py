@@ -0,0 +1,312 @@
+"""
+gff_stats.py
+============
+Native replacement for ``agat_sp_statistics.pl`` (``--stats-backend native``).
+
+The annotation is streamed once (see :mod:`src.gff`) and only coordinates
+and parent rows are kept, in ``array`` columns; pieces are grouped by
+transcript through an index array, and each transcript's exons and CDS are
+only turned into Python tuples while it is being measured. The metrics listed in
+``table.AGAT_COLS`` are then written as an AGAT-style report
+(``GenomeAnnStats/ResultNative.txt``), so :func:`src.agat.get_agat_stats`
+parses both backends the same way.
+
+Conventions follow AGAT for the level-2 type found in the file (``mrna``,
+or ``transcript`` when there are no mRNAs): ``Number of cds`` counts
+transcripts with CDS, CDS length is the total CDS of a transcript, introns
+are taken between consecutive CDS pieces (exons for ``transcript``), genes
+overlap when they share bases on the same sequence and strand, and
+transcripts without exon lines get their exons from their CDS and UTRs.
+With ``--stats-backend compare`` both engines run and
+:func:`compare_gff_stats` reports the differences.
+"""
+
+from array import array
+from pathlib import Path
+from typing import Any, Dict, List
+
+from src.agat import get_agat_stats
+from src.checkpoint import commit, discard, is_done, promote, tmp_fpath
+from src.gff import (
+    MRNA_TYPES, TRANSCRIPT_TYPES, UTR3_TYPES, UTR5_TYPES, get_index, group_rows, iter_features
+)
+from src.table import AGAT_COLS
+
+# Bumped whenever the computed metrics change (part of the cache key)
+ENGINE_VERSION = "gaqet-gff-stats 1"
+
+# Transcript kinds
+_PLACEHOLDER, _MRNA, _TRANSCRIPT, _IMPLICIT = 0, 1, 2, 3
+
+
+# ---------------------------------------------------------------------------
+# 1. Single streaming pass over the annotation
+# ---------------------------------------------------------------------------
+def read_annotation(fpath: Path) -> Dict[str, Any]:
+    """Load the coordinates needed for the statistics into array columns."""
+    locations: Dict[str, int] = {}
+    genes: Dict[str, int] = {}
+    g_start, g_end, g_loc, g_seen = array("q"), array("q"), array("l"), array("b")
+    transcripts: Dict[str, int] = {}
+    t_gene, t_start, t_end, t_loc, t_kind = array("l"), array("q"), array("q"), array("l"), array("b")
+    t_utr5, t_utr3 = array("l"), array("l")
+    e_tx, e_start, e_end = array("l"), array("q"), array("q")
+    c_tx, c_start, c_end = array("l"), array("q"), array("q")
+    u_tx, u_start, u_end = array("l"), array("q"), array("q")
+
+    def gene_row(key):
+        return get_index(genes, key, g_start, g_end, g_loc, g_seen)
+
+    def transcript_row(key):
+        return get_index(transcripts, key, t_gene, t_start, t_end, t_loc, t_kind, t_utr5, t_utr3)
+
+    for feature in iter_features(fpath):
+        loc = locations.setdefault("{}\t{}".format(feature.seqid, feature.strand), len(locations))
+        if feature.type == "gene":
+            for gene_id in feature.ids:
+                row = gene_row(gene_id)
+                g_start[row], g_end[row], g_loc[row], g_seen[row] = feature.start, feature.end, loc, 1
+        elif feature.type in TRANSCRIPT_TYPES:
+            kind = _MRNA if feature.type in MRNA_TYPES else _TRANSCRIPT
+            for transcript_id in feature.ids:
+                row = transcript_row(transcript_id)
+                t_start[row], t_end[row], t_loc[row], t_kind[row] = feature.start, feature.end, loc, kind
+                t_gene[row] = gene_row(feature.parents[0] if feature.parents else transcript_id)
+        elif feature.type in ("exon", "cds") or feature.type in UTR5_TYPES + UTR3_TYPES:
+            for parent in feature.parents:
+                row = transcript_row(parent)
+                # GTF files may only list exons: the transcript is implicit
+                if t_kind[row] in (_PLACEHOLDER, _IMPLICIT) and feature.gene:
+                    if t_kind[row] == _PLACEHOLDER:
+                        t_start[row], t_end[row], t_loc[row] = feature.start, feature.end, loc
+                        t_gene[row] = gene_row(feature.gene)
+                        t_kind[row] = _IMPLICIT
+                    t_start[row] = min(t_start[row], feature.start)
+                    t_end[row] = max(t_end[row], feature.end)
+                if feature.type == "exon":
+                    rows = (e_tx, e_start, e_end)
+                elif feature.type == "cds":
+                    rows = (c_tx, c_start, c_end)
+                else:
+                    rows = (u_tx, u_start, u_end)
+                    if feature.type in UTR5_TYPES:
+                        t_utr5[row] += 1
+                    else:
+                        t_utr3[row] += 1
+                for column, value in zip(rows, (row, feature.start, feature.end)):
+                    column.append(value)
+
+    return {"g_start": g_start, "g_end": g_end, "g_loc": g_loc, "g_seen": g_seen,
+            "t_gene": t_gene, "t_start": t_start, "t_end": t_end, "t_loc": t_loc,
+            "t_kind": t_kind, "t_utr5": t_utr5, "t_utr3": t_utr3,
+            "exons": (e_tx, e_start, e_end),
+            "cds": (c_tx, c_start, c_end),
+            "utrs": (u_tx, u_start, u_end)}
+
+
+# ---------------------------------------------------------------------------
+# 2. Metrics
+# ---------------------------------------------------------------------------
+def _group_pieces(columns, n_transcripts: int) -> tuple:
+    """Return ``(columns, offsets, order)``: the pieces grouped by transcript."""
+    return (columns,) + group_rows(columns[0], n_transcripts)
+
+
+def _pieces(grouped: tuple, row: int) -> List[tuple]:
+    """Return the sorted ``(start, end)`` pieces of one transcript."""
+    (_, starts, ends), offsets, order = grouped
+    return sorted((starts[piece], ends[piece]) for piece in order[offsets[row]:offsets[row + 1]])
+
+
+def _merge(intervals: List[tuple]) -> List[tuple]:
+    merged: List[list] = []
+    for start, end in sorted(intervals):
+        if merged and start <= merged[-1][1] + 1:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return [tuple(interval) for interval in merged]
+
+
+def _introns(intervals: List[tuple]) -> List[int]:
+    return [nxt[0] - prev[1] - 1 for prev, nxt in zip(intervals, intervals[1:])
+            if nxt[0] - prev[1] - 1 > 0]
+
+
+def _overlapping(rows: List[int], starts: array, ends: array, locs: array) -> int:
+    """Count the genes sharing bases with another gene on the same strand."""
+    order = sorted(rows, key=lambda row: (locs[row], starts[row]))
+    flagged = set()
+    max_end, max_loc = None, None
+    for position, row in enumerate(order):
+        if max_loc == locs[row] and starts[row] <= max_end:
+            flagged.add(row)
+        nxt = order[position + 1] if position + 1 < len(order) else None
+        if nxt is not None and locs[nxt] == locs[row] and ends[row] >= starts[nxt]:
+            flagged.add(row)
+        if max_loc != locs[row]:
+            max_loc, max_end = locs[row], ends[row]
+        else:
+            max_end = max(max_end, ends[row])
+    return len(flagged)
+
+
+def compute_stats(annotation: Dict[str, Any]) -> Dict[str, Any]:
+    """Return the AGAT report lines (``{agat_label: value}``) and the section."""
+    t_kind, t_gene = annotation["t_kind"], annotation["t_gene"]
+    exons = _group_pieces(annotation["exons"], len(t_kind))
+    cds = _group_pieces(annotation["cds"], len(t_kind))
+    utrs = _group_pieces(annotation["utrs"], len(t_kind))
+    cds_offsets = cds[1]
+
+    # Level-2 type reported, as AGAT does for the first one of the file
+    if _MRNA in t_kind:
+        section = "mrna"
+        kept = [row for row, kind in enumerate(t_kind) if kind == _MRNA]
+    elif len(annotation["cds"][0]):
+        section = "mrna"
+        kept = [row for row, kind in enumerate(t_kind)
+                if kind != _PLACEHOLDER and cds_offsets[row + 1] > cds_offsets[row]]
+    else:
+        section = "transcript"
+        kept = [row for row, kind in enumerate(t_kind) if kind != _PLACEHOLDER]
+
+    # Genes: span from the gene line or from their transcripts
+    g_start, g_end, g_loc, g_seen = (annotation["g_start"], annotation["g_end"],
+                                     annotation["g_loc"], annotation["g_seen"])
+    gene_rows = sorted({t_gene[row] for row in kept})
+    for row in kept:
+        gene = t_gene[row]
+        if not g_seen[gene]:
+            t_start, t_end = annotation["t_start"][row], annotation["t_end"][row]
+            if g_end[gene] == 0:
+                g_start[gene], g_end[gene] = t_start, t_end
+                g_loc[gene] = annotation["t_loc"][row]
+            g_start[gene] = min(g_start[gene], t_start)
+            g_end[gene] = max(g_end[gene], t_end)
+    gene_lengths = [g_end[gene] - g_start[gene] + 1 for gene in gene_rows]
+
+    # One transcript at a time: exons built from CDS + UTR when missing
+    exon_lengths, cds_lengths, cds_pieces, introns = array("q"), array("q"), array("q"), array("q")
+    multi_exon_genes = set()
+    single_exon_transcripts = 0
+    for row in kept:
+        tx_cds = _pieces(cds, row)
+        tx_exons = _pieces(exons, row) or _merge(tx_cds + _pieces(utrs, row))
+        exon_lengths.extend(end - start + 1 for start, end in tx_exons)
+        if len(tx_exons) > 1:
+            multi_exon_genes.add(t_gene[row])
+        elif tx_exons:
+            single_exon_transcripts += 1
+        if tx_cds:
+            cds_lengths.append(sum(end - start + 1 for start, end in tx_cds))
+            cds_pieces.extend(end - start + 1 for start, end in tx_cds)
+        introns.extend(_introns(tx_cds if section == "mrna" else tx_exons))
+
+    def mean(values):
+        return round(sum(values) / len(values)) if values else 0
+
+    stats = {"Number of gene": len(gene_rows),
+             "Number of {}".format(section): len(kept),
+             "Number of exon": len(exon_lengths),
+             "Number gene overlapping": _overlapping(gene_rows, g_start, g_end, g_loc),
+             "Number of single exon gene": len(gene_rows) - len(multi_exon_genes),
+             "Number of single exon {}".format(section): single_exon_transcripts,
+             "Total gene length (bp)": sum(gene_lengths),
+             "mean gene length (bp)": mean(gene_lengths),
+             "mean exon length (bp)": mean(exon_lengths),
+             "Longest gene (bp)": max(gene_lengths, default=0),
+             "Shortest gene (bp)": min(gene_lengths, default=0)}
+    if section == "mrna":
+        stats.update({"Number of cds": len(cds_lengths),
+                      "Number of five_prime_utr": sum(annotation["t_utr5"][row] for row in kept),
+                      "Number of three_prime_utr": sum(annotation["t_utr3"][row] for row in kept),
+                      "mean cds length (bp)": mean(cds_lengths),
+                      "mean intron in cds length (bp)": mean(introns),
+                      "Longest cds (bp)": max(cds_lengths, default=0),
+                      "Longest intron into cds part (bp)": max(introns, default=0),
+                      "Shortest cds piece (bp)": min(cds_pieces, default=0),
+                      "Shortest intron into cds part (bp)": min(introns, default=0)})
+    else:
+        stats["Shortest intron into exon part (bp)"] = min(introns, default=0)
+    return {"section": section, "stats": stats}
+
+
+# ---------------------------------------------------------------------------
+# 3. Runner
+# ---------------------------------------------------------------------------
+def get_gff_stats_fpath(arguments: Dict[str, Any]) -> Path:
+    """Return the native statistics report of a sample."""
+    return arguments["output"] / "GenomeAnnStats" / "ResultNative.txt"
+
+
+def get_gff_stats_artifacts(arguments: Dict[str, Any]) -> Dict[str, Any]:
+    """Describe the native statistics stage for the artifact cache."""
+    return {"inputs": [arguments["annotation"]],
+            "tools": [],
+            "params": ENGINE_VERSION,
+            "outputs": [get_gff_stats_fpath(arguments)]}
+
+
+def run_gff_stats(arguments: Dict[str, Any]) -> Dict[str, Any]:
+    """Compute the annotation statistics natively (or skip if already done)."""
+    out_fpath = get_gff_stats_fpath(arguments)
+    out_fpath.parent.mkdir(parents=True, exist_ok=True)
+    command = "{} --gff {}".format(ENGINE_VERSION, arguments["annotation"])
+
+    if is_done(out_fpath):
+        return {"command": command,
+                "msg": "Native statistics already done",
+                "out_fpath": out_fpath,
+                "returncode": 99}
+
+    discard(out_fpath)
+    try:
+        report = compute_stats(read_annotation(Path(arguments["annotation"])))
+    except (OSError, ValueError, IndexError) as error:
+        commit(out_fpath, 1, command)
+        return {"command": command,
+                "msg": "Native statistics Failed: \n {}".format(error),
+                "out_fpath": out_fpath,
+                "returncode": 1}
+
+    # AGAT-style report so get_agat_stats parses it
+    tmp = tmp_fpath(out_fpath)
+    with open(tmp, "w") as report_fhand:
+        report_fhand.write("--- {} ---\n\n".format(report["section"]))
+        for label, value in report["stats"].items():
+            report_fhand.write("{:<45}{}\n".format(label, value))
+    promote(tmp, out_fpath)
+    commit(out_fpath, 0, command)
+    return {"command": command,
+            "msg": "Native statistics run successfully",
+            "out_fpath": out_fpath,
+            "returncode": 0}
+
+
+# ---------------------------------------------------------------------------
+# 4. Check the native engine against AGAT
+# ---------------------------------------------------------------------------
+def compare_gff_stats(arguments: Dict[str, Any]) -> Dict[str, Any]:
+    """Write a table of AGAT vs native metrics and count the mismatches."""
+    agat_fpath = arguments["output"] / "GenomeAnnStats" / "ResultAgat.txt"
+    native_fpath = get_gff_stats_fpath(arguments)
+    out_fpath = arguments["output"] / "GenomeAnnStats" / "BackendComparison.tsv"
+
+    agat = get_agat_stats({"out_fpath": agat_fpath})
+    native = get_agat_stats({"out_fpath": native_fpath})
+    mismatches = [col for col in AGAT_COLS if agat[col] != native[col]]
+    with open(out_fpath, "w") as out_fhand:
+        out_fhand.write("Metric\tAGAT\tNative\tMatch\n")
+        for col in AGAT_COLS:
+            out_fhand.write("{}\t{}\t{}\t{}\n".format(col, agat[col], native[col],
+                                                      "no" if col in mismatches else "yes"))
+
+    if mismatches:
+        msg = "Native statistics differ from AGAT in: {}".format(", ".join(mismatches))
+    else:
+        msg = "Native statistics match AGAT"
+    return {"command": "compare {} {}".format(agat_fpath, native_fpath),
+            "msg": msg,
+            "out_fpath": out_fpath,
+            "returncode": 0}
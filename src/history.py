@@ -0,0 +1,435 @@
+"""
+history.py
+==========
+Runtime history of the stages, and the threads and memory planned from it.
+
+* **record_history** - after each run, store the wall time of every stage
+  that ran with the threads it got and the size of its inputs, in a local
+  SQLite file (``<output>/history.sqlite`` by default; point several runs
+  to the same file to share it).
+* **fit_models**     - fit an Amdahl model per kind of stage (``busco``,
+  ``stringtie_shard``, ...): ``wall = size * (serial + parallel / threads)``.
+* **plan_threads**   - give every scalable stage of the current graph the
+  fixed thread count that minimises the estimated makespan of the run.
+* **plan_memory**    - estimate the peak memory of every stage, from the
+  peak RSS of earlier runs (``rss = base + slope * size``) or, without
+  history, from rough defaults per MB of its main input (assembly, BAM or
+  GFF). The scheduler reserves it against ``--max-mem``.
+* **estimate_runtime** / **estimate_disk** - wall time and disk written by a
+  stage, from the history or rough defaults, for the ``--plan`` report.
+
+The plan follows the critical path and area rule: all modelled stages
+start with one thread, and the stage of the critical path that gains the
+most from one more thread gets it, as long as the critical path is longer
+than the total work divided by the threads of the run (with ``-j``, the
+work of the samples that run at the same time). Stages without
+history keep sharing the free threads (``"multi"``), and the ``threads``
+table of the config overrides both.
+"""
+
+import math
+import os
+import re
+import sqlite3
+import time
+from pathlib import Path
+from typing import Any, Dict, Optional, Set, Tuple, Union
+
+from src.profiling import stage_status
+from src.scheduler import check_graph, get_deps
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    kind TEXT,
+    threads INTEGER,
+    input_bytes INTEGER,
+    wall_s REAL,
+    recorded REAL,
+    max_rss_mb REAL,
+    written_mb REAL
+);
+CREATE INDEX IF NOT EXISTS runs_kind ON runs (kind);
+"""
+
+# Argument fields whose files give the input size of a stage
+INPUT_FIELDS = ("ref_assembly", "annotation", "ref_annotation", "alignments", "source")
+
+# Runs kept per kind of stage (the most recent ones)
+MAX_RUNS = 200
+
+# Peak memory of a stage without history: MB per MB of its main input.
+# Shard stages divide it by the number of shards.
+MEMORY_FACTORS = {
+    "suffixerator": ("ref_assembly", 12.0),
+    "harvest": ("ref_assembly", 6.0),
+    "harvest_shard": ("ref_assembly", 12.0),
+    "finder": ("ref_assembly", 2.0),
+    "LTR_retriever": ("ref_assembly", 10.0),
+    "LAI": ("ref_assembly", 2.0),
+    "gffread": ("ref_assembly", 1.5),
+    "stringtie": ("alignments", 1.0),
+    "stringtie_shard": ("alignments", 1.0),
+    "stringtie_library": ("alignments", 1.0),
+    "agat": ("annotation", 20.0),
+    "gffcompare": ("ref_annotation", 3.0),
+}
+
+# Expected size ratio of compressed inputs (gzip/BGZF) for the defaults above
+COMPRESSION_RATIO = 3.5
+
+# Margin added to the memory fitted from the history
+MEMORY_MARGIN = 1.25
+
+# Wall time of a stage without history: seconds per MB of its main input on
+# one thread, and the fraction of that time that scales with threads
+RUNTIME_FACTORS = {
+    "decompress": ("source", 0.02, 0.9),
+    "assembly_stats": ("ref_assembly", 0.02, 0.0),
+    "suffixerator": ("ref_assembly", 0.5, 0.0),
+    "harvest": ("ref_assembly", 1.0, 0.0),
+    "harvest_shard": ("ref_assembly", 1.5, 0.0),
+    "finder": ("ref_assembly", 30.0, 0.95),
+    "LTR_retriever": ("ref_assembly", 20.0, 0.8),
+    "LAI": ("ref_assembly", 10.0, 0.0),
+    "lai_native": ("ref_assembly", 0.1, 0.0),
+    "gffread": ("annotation", 0.1, 0.0),
+    "proteins": ("annotation", 0.05, 0.0),
+    "busco": ("annotation", 20.0, 0.9),
+    "stringtie": ("alignments", 0.1, 0.7),
+    "stringtie_shard": ("alignments", 0.1, 0.7),
+    "stringtie_library": ("alignments", 0.1, 0.7),
+    "agat": ("annotation", 5.0, 0.0),
+    "gff_stats": ("annotation", 0.1, 0.0),
+    "gffcompare": ("ref_annotation", 0.5, 0.0),
+    "gff_compare": ("ref_annotation", 0.1, 0.0),
+}
+
+# Disk written by a stage without history: MB per MB of its main input
+DISK_FACTORS = {
+    "decompress": ("source", COMPRESSION_RATIO),
+    "suffixerator": ("ref_assembly", 12.0),
+    "harvest_shard": ("ref_assembly", 13.0),
+    "finder": ("ref_assembly", 0.5),
+    "LTR_retriever": ("ref_assembly", 3.0),
+    "busco": ("annotation", 5.0),
+    "stringtie": ("alignments", 0.02),
+    "stringtie_shard": ("alignments", 0.05),
+    "stringtie_library": ("alignments", 0.02),
+}
+
+
+# ---------------------------------------------------------------------------
+# 1. History file
+# ---------------------------------------------------------------------------
+def get_default_history_fpath(out_dir: Path) -> Path:
+    """Return ``$GAQET_HISTORY`` or ``<out_dir>/history.sqlite``.
+
+    Nothing is written outside the output folder unless asked for.
+    """
+    return Path(os.environ.get("GAQET_HISTORY", Path(out_dir) / "history.sqlite"))
+
+
+def open_history(history_fpath: Path) -> sqlite3.Connection:
+    """Open (or create) a history file."""
+    history_fpath = Path(history_fpath)
+    history_fpath.parent.mkdir(parents=True, exist_ok=True)
+    connection = sqlite3.connect(str(history_fpath), timeout=60)
+    connection.executescript(SCHEMA)
+    columns = [row[1] for row in connection.execute("PRAGMA table_info(runs)")]
+    if "max_rss_mb" not in columns:
+        # History written before peak memory was recorded
+        connection.execute("ALTER TABLE runs ADD COLUMN max_rss_mb REAL")
+    if "written_mb" not in columns:
+        # History written before disk writes were recorded
+        connection.execute("ALTER TABLE runs ADD COLUMN written_mb REAL")
+    return connection
+
+
+def stage_kind(name: str) -> str:
+    """Return the kind of a stage: its name without group and shard number."""
+    return re.sub(r"\d+$", "", name.split("/", 1)[-1])
+
+
+def _field_bytes(args: Dict[str, Any], field: str) -> int:
+    """Return the size of the FOF file of a field (its original file if compressed)."""
+    fpath = args.get("sources", {}).get(field) or args.get(field)
+    if fpath and Path(fpath).is_file():
+        return Path(fpath).stat().st_size
+    return 0
+
+
+def get_input_bytes(stage: Dict[str, Any]) -> int:
+    """Return the size of the FOF files a stage reads (compressed size if compressed)."""
+    return sum(_field_bytes(stage["args"], field) for field in INPUT_FIELDS)
+
+
+def record_history(history_fpath: Path, stages: Dict[str, Dict[str, Any]],
+                   results: Dict[str, Dict[str, Any]]) -> int:
+    """Store the stages that ran successfully; return how many."""
+    rows = []
+    for name, result in results.items():
+        profile = result.get("profile")
+        if (name not in stages or not profile or stage_status(result) != "ran"
+                or result.get("returncode") not in (0, None)):
+            continue
+        rows.append((stage_kind(name), profile["threads"], get_input_bytes(stages[name]),
+                     profile["wall_s"], time.time(), profile.get("max_rss_mb"),
+                     profile.get("written_mb")))
+    connection = open_history(history_fpath)
+    with connection:
+        connection.executemany("INSERT INTO runs (kind, threads, input_bytes, wall_s, recorded, "
+                               "max_rss_mb, written_mb) VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+        for kind in {row[0] for row in rows}:
+            connection.execute("DELETE FROM runs WHERE kind = ? AND rowid NOT IN "
+                               "(SELECT rowid FROM runs WHERE kind = ? "
+                               "ORDER BY recorded DESC LIMIT ?)", (kind, kind, MAX_RUNS))
+    connection.close()
+    return len(rows)
+
+
+# ---------------------------------------------------------------------------
+# 2. Scaling model
+# ---------------------------------------------------------------------------
+def _fit(points: list) -> Tuple[float, float]:
+    """Least-squares ``y = serial + parallel * x`` with both terms >= 0."""
+    n = len(points)
+    mean_x = sum(x for x, _ in points) / n
+    mean_y = sum(y for _, y in points) / n
+    var_x = sum((x - mean_x) ** 2 for x, _ in points)
+    if not var_x:
+        return mean_y, 0.0
+    parallel = sum((x - mean_x) * (y - mean_y) for x, y in points) / var_x
+    serial = mean_y - parallel * mean_x
+    if parallel < 0:
+        return mean_y, 0.0
+    if serial < 0:
+        return 0.0, sum(x * y for x, y in points) / sum(x * x for x, _ in points)
+    return serial, parallel
+
+
+def fit_models(history_fpath: Path) -> Dict[str, Dict[str, Any]]:
+    """Return ``{kind: {"serial", "parallel", "runs", "scales", "rss", "disk"}}`` fitted from the history.
+
+    Times are per input byte (per run for stages without input files).
+    ``scales`` is False when the kind only ran with a single thread count,
+    so the split between serial and parallel time is unknown. ``rss`` is
+    the ``(base, slope)`` of the peak RSS in MB against the input size in
+    MB, raised to cover every recorded peak, or ``None`` if no peak was
+    recorded; ``disk`` is the same fit of the MB written.
+    """
+    if not Path(history_fpath).exists():
+        return {}
+    connection = open_history(history_fpath)
+    points: Dict[str, list] = {}
+    rss_points: Dict[str, list] = {}
+    disk_points: Dict[str, list] = {}
+    threads_seen: Dict[str, set] = {}
+    for kind, threads, input_bytes, wall_s, max_rss_mb, written_mb in connection.execute(
+            "SELECT kind, threads, input_bytes, wall_s, max_rss_mb, written_mb FROM runs"):
+        threads = max(1, threads or 1)
+        points.setdefault(kind, []).append((1 / threads, wall_s / max(1, input_bytes)))
+        threads_seen.setdefault(kind, set()).add(threads)
+        if max_rss_mb is not None:
+            rss_points.setdefault(kind, []).append(((input_bytes or 0) / 1024 ** 2, max_rss_mb))
+        if written_mb is not None:
+            disk_points.setdefault(kind, []).append(((input_bytes or 0) / 1024 ** 2, written_mb))
+    connection.close()
+
+    models = {}
+    for kind, kind_points in points.items():
+        serial, parallel = _fit(kind_points)
+        models[kind] = {"serial": serial, "parallel": parallel, "runs": len(kind_points),
+                        "scales": len(threads_seen[kind]) > 1,
+                        "rss": _fit_envelope(rss_points[kind]) if kind in rss_points else None,
+                        "disk": _fit_envelope(disk_points[kind]) if kind in disk_points else None}
+    return models
+
+
+def _fit_envelope(points: list) -> Tuple[float, float]:
+    """Return the least-squares line of ``points`` raised above all of them."""
+    base, slope = _fit(points)
+    return base + max(max(y - base - slope * x for x, y in points), 0.0), slope
+
+
+def predict(model: Dict[str, Any], input_bytes: int, threads: int) -> float:
+    """Return the estimated wall time of a stage."""
+    return max(1, input_bytes) * (model["serial"] + model["parallel"] / max(1, threads))
+
+
+# ---------------------------------------------------------------------------
+# 3. Thread plan
+# ---------------------------------------------------------------------------
+def plan_threads(stages: Dict[str, Dict[str, Any]], threads: int,
+                 models: Dict[str, Dict[str, Any]],
+                 overrides: Optional[Dict[str, Union[int, str]]] = None,
+                 max_groups: Optional[int] = None,
+                 limited_groups: Optional[Set[str]] = None
+                 ) -> Dict[str, Union[int, str]]:
+    """Return ``{stage_name: threads}`` for the stages whose thread count changes.
+
+    ``overrides`` maps kinds of stage to a thread count (or ``"multi"``) and
+    always wins. Scalable stages with a model of several thread counts get
+    the count of the critical path and area plan; the others are left as
+    they are. With ``max_groups`` (``-j``) only that many of the
+    ``limited_groups`` (samples) share the threads at a time, so the area
+    is the work of the largest ones plus their share of the other groups.
+    """
+    total = max(1, threads)
+    overrides = overrides or {}
+    plan: Dict[str, Union[int, str]] = {}
+    sizes = {name: get_input_bytes(stage) for name, stage in stages.items()}
+
+    tunable = []
+    for name, stage in stages.items():
+        kind = stage_kind(name)
+        if kind in overrides:
+            plan[name] = overrides[kind] if overrides[kind] == "multi" else \
+                max(1, min(int(overrides[kind]), total))
+        elif stage["threads"] == "multi" and models.get(kind, {}).get("scales"):
+            tunable.append(name)
+    if not tunable:
+        return plan
+
+    allocation = {name: 1 for name in tunable}
+
+    def threads_of(name):
+        if name in allocation:
+            return allocation[name]
+        given = plan.get(name, stages[name]["threads"])
+        return total if given == "multi" else int(given)
+
+    def duration(name, given=None):
+        model = models.get(stage_kind(name))
+        if model is None:
+            return 0.0
+        return predict(model, sizes[name], given or threads_of(name))
+
+    def get_area():
+        work: Dict[Optional[str], float] = {}
+        for name, stage in stages.items():
+            group = stage.get("group")
+            work[group] = work.get(group, 0.0) + threads_of(name) * duration(name)
+        limited = sorted((load for group, load in work.items()
+                          if group is not None and (limited_groups is None
+                                                    or group in limited_groups)),
+                         reverse=True)
+        if max_groups is None or len(limited) <= max_groups:
+            return sum(work.values()) / total
+        shared = sum(work.values()) - sum(limited)
+        waves = math.ceil(len(limited) / max(1, max_groups))
+        return (sum(limited[:max_groups]) + shared / waves) / total
+
+    order = check_graph(stages)
+    while True:
+        # Longest path through the graph with the current allocation
+        finish, previous = {}, {}
+        for name in order:
+            deps = get_deps(stages[name])
+            start = max((finish[dep] for dep in deps), default=0.0)
+            previous[name] = max(deps, key=lambda dep: finish[dep]) if deps else None
+            finish[name] = start + duration(name)
+        critical_length = max(finish.values(), default=0.0)
+        area = get_area()
+        if critical_length <= area:
+            break
+
+        critical, name = [], max(finish, key=finish.get)
+        while name is not None:
+            critical.append(name)
+            name = previous[name]
+        candidates = [name for name in critical
+                      if name in allocation and allocation[name] < total]
+        if not candidates:
+            break
+        best = max(candidates, key=lambda name: (duration(name) / allocation[name]
+                                                 - duration(name, allocation[name] + 1)
+                                                 / (allocation[name] + 1)))
+        if duration(best, allocation[best] + 1) >= duration(best):
+            break
+        allocation[best] += 1
+
+    plan.update(allocation)
+    return plan
+
+
+# ---------------------------------------------------------------------------
+# 4. Memory estimates
+# ---------------------------------------------------------------------------
+def estimate_memory(name: str, stage: Dict[str, Any],
+                    models: Dict[str, Dict[str, Any]]) -> float:
+    """Return the estimated peak memory of a stage in MB (0 if unknown)."""
+    kind = stage_kind(name)
+    args = stage["args"]
+    rss = models.get(kind, {}).get("rss")
+    if rss is not None:
+        base, slope = rss
+        return (base + slope * get_input_bytes(stage) / 1024 ** 2) * MEMORY_MARGIN
+    if kind not in MEMORY_FACTORS:
+        return 0.0
+    field, factor = MEMORY_FACTORS[kind]
+    return _default_size_mb(kind, args, field) * factor
+
+
+def _default_size_mb(kind: str, args: Dict[str, Any], field: str) -> float:
+    """Return the uncompressed MB of the main input of a stage (per shard for shard stages)."""
+    size_mb = _field_bytes(args, field) / 1024 ** 2
+    if field in args.get("sources", {}):
+        size_mb *= COMPRESSION_RATIO
+    if kind.endswith("_shard"):
+        size_mb /= max(1, args.get("{}s".format(kind), 1))
+    return size_mb
+
+
+def plan_memory(stages: Dict[str, Dict[str, Any]], models: Dict[str, Dict[str, Any]],
+                overrides: Optional[Dict[str, float]] = None) -> Dict[str, float]:
+    """Return ``{stage_name: MB}`` to reserve for every stage.
+
+    ``overrides`` maps kinds of stage to their memory in GB (config
+    ``memory`` table).
+    """
+    overrides = overrides or {}
+    memory = {}
+    for name, stage in stages.items():
+        kind = stage_kind(name)
+        if kind in overrides:
+            memory[name] = float(overrides[kind]) * 1024
+        else:
+            memory[name] = estimate_memory(name, stage, models)
+    return memory
+
+
+# ---------------------------------------------------------------------------
+# 5. Runtime and disk estimates
+# ---------------------------------------------------------------------------
+def estimate_runtime(name: str, stage: Dict[str, Any], models: Dict[str, Dict[str, Any]],
+                     threads: int) -> Tuple[Optional[float], str]:
+    """Return the estimated wall time of a stage in seconds and its basis.
+
+    The basis is ``history`` (fitted model), ``default`` (``RUNTIME_FACTORS``),
+    ``quick`` (bookkeeping stages without a factor, taken as instant) or
+    ``none`` (input size unknown, the time is ``None``).
+    """
+    kind = stage_kind(name)
+    if kind in models:
+        return predict(models[kind], get_input_bytes(stage), threads), "history"
+    if kind not in RUNTIME_FACTORS:
+        return 0.0, "quick"
+    field, seconds, parallel = RUNTIME_FACTORS[kind]
+    size_mb = _default_size_mb(kind, stage["args"], field)
+    if not size_mb:
+        return None, "none"
+    return size_mb * seconds * (1 - parallel + parallel / max(1, threads)), "default"
+
+
+def estimate_disk(name: str, stage: Dict[str, Any],
+                  models: Dict[str, Dict[str, Any]]) -> float:
+    """Return the estimated MB written by a stage (0 if unknown)."""
+    kind = stage_kind(name)
+    disk = models.get(kind, {}).get("disk")
+    if disk is not None:
+        base, slope = disk
+        return base + slope * get_input_bytes(stage) / 1024 ** 2
+    if kind not in DISK_FACTORS:
+        return 0.0
+    field, factor = DISK_FACTORS[kind]
+    return _default_size_mb(kind, stage["args"], field) * factor
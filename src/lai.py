@@ -0,0 +1,298 @@
+"""
+lai.py
+======
+Native replacement for the ``LAI`` script of LTR_retriever
+(``--lai-backend native``).
+
+* **read_intact**    - intact LTR-RTs of ``<genome>.mod.pass.list``.
+* **read_ltr_hits**  - LTR-RT hits of the RepeatMasker ``<genome>.mod.out``
+  and their length-weighted identity (100 - divergence).
+* **Coverage**       - per sequence, the hits merged into sorted, disjoint
+  ``array`` intervals with a prefix sum of their lengths, so the bases
+  covered in any window are two binary searches away instead of a walk
+  over the file.
+* **compute_lai**    - ``whole_genome`` and sliding-window (3 Mb, step
+  300 kb) rows: intact and total LTR-RT fractions, raw LAI
+  (``100 * intact / total``) and LAI
+  (``raw LAI + 2.8138 * (94 - identity)``).
+* **run_native_LAI** - stage runner, writes the table of ``LAI`` with the
+  corrected value under ``LAI_native``, so
+  :func:`src.LTR_retriever.get_LAI` parses both backends the same way.
+
+The Perl script takes the LTR identity from a BLAST of the LTR sequences;
+the native engine takes it from the divergence RepeatMasker reports for
+each hit. The two corrections are not the same metric, so the native one
+is reported as ``LAI_native`` rather than ``LAI``. With
+``--lai-backend compare`` both engines run and :func:`compare_LAI`
+reports the differences.
+"""
+
+from array import array
+from bisect import bisect_right
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from src.checkpoint import commit, discard, is_done, promote, tmp_fpath
+from src.fasta import FaiRecord, get_fai_fpath, read_fai
+from src.LTR_retriever import get_LAI, get_LAI_artifacts
+
+# Bumped whenever the computed values change (part of the cache key)
+ENGINE_VERSION = "gaqet-lai 2"
+
+# Defaults of the LAI script
+WINDOW = 3000000
+STEP = 300000
+IDENTITY_SLOPE = 2.8138
+IDENTITY_REFERENCE = 94
+
+HEADER = "Chr\tFrom\tTo\tIntact\tTotal\traw_LAI\tLAI_native\n"
+
+# Where each backend takes the LTR identity of the LAI correction from
+IDENTITY_SOURCES = ("BLAST of the LTR sequences",
+                    "length-weighted RepeatMasker divergence of the LTR hits")
+
+
+# ---------------------------------------------------------------------------
+# 1. Read the LTR_retriever outputs
+# ---------------------------------------------------------------------------
+def read_intact(pass_list_fpath: Path) -> Dict[str, List[Tuple[int, int]]]:
+    """Return ``{sequence: [(start, end)]}`` of the intact LTR-RTs (``chr:start..end``)."""
+    intact: Dict[str, List[Tuple[int, int]]] = {}
+    with open(pass_list_fpath) as pass_fhand:
+        for line in pass_fhand:
+            if line.startswith("#") or not line.strip():
+                continue
+            seqid, _, coords = line.split(None, 1)[0].rpartition(":")
+            start, _, end = coords.partition("..")
+            intact.setdefault(seqid, []).append((int(start), int(end)))
+    return intact
+
+
+def read_ltr_hits(mod_out_fpath: Path) -> Tuple[Dict[str, List[Tuple[int, int]]], Optional[float]]:
+    """Return ``({sequence: [(start, end)]}, identity)`` of the LTR hits of a RepeatMasker ``.out``.
+
+    ``identity`` is the mean of ``100 - divergence`` weighted by hit length
+    (``None`` without hits).
+    """
+    hits: Dict[str, List[Tuple[int, int]]] = {}
+    identity_sum = length_sum = 0.0
+    with open(mod_out_fpath) as out_fhand:
+        for line in out_fhand:
+            fields = line.split()
+            # Header lines have no coordinates
+            if len(fields) < 11 or not fields[5].isdigit() or not fields[10].startswith("LTR"):
+                continue
+            start, end = int(fields[5]), int(fields[6])
+            hits.setdefault(fields[4], []).append((start, end))
+            length = end - start + 1
+            identity_sum += (100 - float(fields[1])) * length
+            length_sum += length
+    return hits, (identity_sum / length_sum if length_sum else None)
+
+
+# ---------------------------------------------------------------------------
+# 2. Covered bases
+# ---------------------------------------------------------------------------
+class Coverage:
+    """Bases covered by a set of intervals, per sequence."""
+
+    def __init__(self, intervals: Dict[str, List[Tuple[int, int]]]):
+        self._index = {}
+        for seqid, seq_intervals in intervals.items():
+            starts, ends, before = array("q"), array("q"), array("q")
+            covered = 0
+            for start, end in sorted(seq_intervals):
+                if starts and start <= ends[-1] + 1:
+                    if end > ends[-1]:
+                        covered += end - ends[-1]
+                        ends[-1] = end
+                    continue
+                starts.append(start)
+                ends.append(end)
+                before.append(covered)
+                covered += end - start + 1
+            self._index[seqid] = (starts, ends, before)
+
+    def _upto(self, seqid: str, position: int) -> int:
+        """Return the covered bases in ``1..position``."""
+        starts, ends, before = self._index[seqid]
+        index = bisect_right(starts, position) - 1
+        if index < 0:
+            return 0
+        return before[index] + min(ends[index], position) - starts[index] + 1
+
+    def covered(self, seqid: str, start: int, end: int) -> int:
+        """Return the covered bases in ``start..end`` (1-based, inclusive)."""
+        if seqid not in self._index:
+            return 0
+        return self._upto(seqid, end) - self._upto(seqid, start - 1)
+
+
+# ---------------------------------------------------------------------------
+# 3. LAI
+# ---------------------------------------------------------------------------
+def _lai_row(seqid: str, start: int, end: int, intact: int, total: int,
+             identity: Optional[float]) -> Tuple:
+    length = end - start + 1
+    if not total:
+        return (seqid, start, end, 0.0, 0.0, None, None)
+    raw_lai = 100 * intact / total
+    lai = None if identity is None else raw_lai + IDENTITY_SLOPE * (IDENTITY_REFERENCE - identity)
+    return (seqid, start, end, intact / length, total / length, raw_lai, lai)
+
+
+def compute_lai(records: Dict[str, FaiRecord], intact: Coverage, total: Coverage,
+                identity: Optional[float], window: int = WINDOW,
+                step: int = STEP) -> List[Tuple]:
+    """Return the ``whole_genome`` row and the window rows.
+
+    Rows are ``(Chr, From, To, Intact, Total, raw LAI, LAI)``; LAI values
+    are ``None`` where no LTR-RT is found.
+    """
+    rows = []
+    genome_intact = genome_total = genome_length = 0
+    for seqid, record in records.items():
+        genome_intact += intact.covered(seqid, 1, record.length)
+        genome_total += total.covered(seqid, 1, record.length)
+        genome_length += record.length
+        for start in range(1, record.length + 1, step):
+            end = min(start + window - 1, record.length)
+            rows.append(_lai_row(seqid, start, end, intact.covered(seqid, start, end),
+                                 total.covered(seqid, start, end), identity))
+            if end == record.length:
+                break
+    whole_genome = _lai_row("whole_genome", 1, max(1, genome_length), genome_intact,
+                            genome_total, identity)
+    return [whole_genome] + rows
+
+
+def write_lai(rows: List[Tuple], out_fpath: Path) -> None:
+    """Write rows in the format of the ``LAI`` script, with the last column named ``LAI_native``."""
+    def value(number, digits):
+        return "NA" if number is None else "{:.{}f}".format(number, digits)
+
+    with open(out_fpath, "w") as out_fhand:
+        out_fhand.write(HEADER)
+        for seqid, start, end, intact, total, raw_lai, lai in rows:
+            out_fhand.write("{}\t{}\t{}\t{}\t{}\t{}\t{}\n".format(
+                seqid, start, end, value(intact, 4), value(total, 4),
+                value(raw_lai, 2), value(lai, 2)))
+
+
+# ---------------------------------------------------------------------------
+# 4. Runner
+# ---------------------------------------------------------------------------
+def get_native_LAI_fpath(arguments: Dict[str, Any]) -> Path:
+    """Return the LAI table written by the native engine."""
+    return arguments["LAI_dir"] / "{}.mod.out.native.LAI".format(Path(arguments["ref_assembly"]).name)
+
+
+def get_native_LAI_artifacts(arguments: Dict[str, Any]) -> Dict[str, Any]:
+    """Describe the LAI chain ending in the native engine for the artifact cache."""
+    spec = get_LAI_artifacts(arguments)
+    return {"inputs": spec["inputs"],
+            "tools": [tool for tool in spec["tools"] if tool != "LAI"],
+            "params": "{}; {}".format(spec["params"], ENGINE_VERSION),
+            "outputs": [get_native_LAI_fpath(arguments)] + spec["outputs"][1:]}
+
+
+def run_native_LAI(arguments: Dict[str, Any]) -> Dict[str, Any]:
+    """Compute LAI natively from the LTR_retriever outputs (or skip if already done)."""
+    name = Path(arguments["ref_assembly"]).name
+    pass_list = arguments["LAI_dir"] / "{}.mod.pass.list".format(name)
+    mod_out = arguments["LAI_dir"] / "{}.mod.out".format(name)
+    out_fpath = get_native_LAI_fpath(arguments)
+    command = "{} -intact {} -all {}".format(ENGINE_VERSION, pass_list, mod_out)
+
+    if is_done(out_fpath):
+        return {"command": command,
+                "msg": "Native LAI already done",
+                "out_fpath": out_fpath,
+                "returncode": 99}
+
+    discard(out_fpath)
+    try:
+        hits, identity = read_ltr_hits(mod_out)
+        rows = compute_lai(read_fai(get_fai_fpath(arguments)), Coverage(read_intact(pass_list)),
+                           Coverage(hits), identity)
+    except (OSError, ValueError, IndexError) as error:
+        commit(out_fpath, 1, command)
+        return {"command": command,
+                "msg": "Native LAI Failed: \n {}".format(error),
+                "out_fpath": out_fpath,
+                "returncode": 1}
+
+    tmp = tmp_fpath(out_fpath)
+    write_lai(rows, tmp)
+    promote(tmp, out_fpath)
+    commit(out_fpath, 0, command)
+    return {"command": command,
+            "msg": "Native LAI run successfully ({} windows)".format(len(rows) - 1),
+            "out_fpath": out_fpath,
+            "returncode": 0}
+
+
+# ---------------------------------------------------------------------------
+# 5. Check the native engine against the LAI script
+# ---------------------------------------------------------------------------
+def _identity(lai: Dict[str, Any], col: str) -> Optional[float]:
+    """Return the LTR identity implied by the raw LAI and the corrected LAI in ``col``."""
+    if lai[col] is None or lai["Raw LAI"] is None:
+        return None
+    return IDENTITY_REFERENCE - (lai[col] - lai["Raw LAI"]) / IDENTITY_SLOPE
+
+
+def compare_LAI(arguments: Dict[str, Any]) -> Dict[str, Any]:
+    """Write a table of LAI script vs native values and count the mismatches.
+
+    Values match when they agree to the precision the LAI script writes.
+    The ``LAI`` of the script is set against the ``LAI_native`` of the
+    engine, and the table says where each takes its LTR identity from.
+    """
+    name = Path(arguments["ref_assembly"]).name
+    perl_fpath = arguments["LAI_dir"] / "{}.mod.out.LAI".format(name)
+    native_fpath = get_native_LAI_fpath(arguments)
+    out_fpath = arguments["LAI_dir"] / "BackendComparison.tsv"
+
+    perl = get_LAI({"out_fpath": perl_fpath})
+    native = get_LAI({"out_fpath": native_fpath})
+    metrics = [("Intact LTR-RT Fraction", 1e-4), ("Total LTR-RT Fraction", 1e-4),
+               ("Raw LAI", 0.01), ("LAI Windows (N)", 0)]
+    rows = [(metric, perl[metric], native[metric], tolerance) for metric, tolerance in metrics]
+    rows.append(("LAI / LAI_native", perl["LAI"], native["LAI_native"], 0.01))
+    rows.append(("LTR identity", _identity(perl, "LAI"), _identity(native, "LAI_native"), 0.01))
+
+    # Windows present in both tables
+    native_windows = {window[:3]: window for window in native["windows"]}
+    window_mismatches = 0
+    for window in perl["windows"]:
+        other = native_windows.get(window[:3])
+        if other is None or any(
+                (a is None) != (b is None) or (a is not None and abs(a - b) > tolerance + 1e-9)
+                for a, b, tolerance in zip(window[3:7], other[3:6] + other[7:],
+                                           (1e-4, 1e-4, 0.01, 0.01))):
+            window_mismatches += 1
+    rows.append(("Windows differing", 0, window_mismatches, 0))
+
+    mismatches = []
+    with open(out_fpath, "w") as out_fhand:
+        out_fhand.write("Metric\tLAI\tNative\tMatch\n")
+        out_fhand.write("LTR identity source\t{}\t{}\tNA\n".format(*IDENTITY_SOURCES))
+        for metric, perl_value, native_value, tolerance in rows:
+            match = ((perl_value is None) == (native_value is None) and
+                     (perl_value is None or abs(perl_value - native_value) <= tolerance + 1e-9))
+            if not match:
+                mismatches.append(metric)
+            out_fhand.write("{}\t{}\t{}\t{}\n".format(metric,
+                                                      "NA" if perl_value is None else perl_value,
+                                                      "NA" if native_value is None else native_value,
+                                                      "yes" if match else "no"))
+
+    if mismatches:
+        msg = "Native LAI differs from the LAI script in: {}".format(", ".join(mismatches))
+    else:
+        msg = "Native LAI matches the LAI script"
+    return {"command": "compare {} {}".format(perl_fpath, native_fpath),
+            "msg": msg,
+            "out_fpath": out_fpath,
+            "returncode": 0}
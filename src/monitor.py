@@ -0,0 +1,227 @@
+"""
+monitor.py
+==========
+Live progress of a run in the Prometheus text format, for long batch runs:
+
+* **RunMonitor**    - follows the stages as they start and end (through the
+  ``started`` and ``callback`` hooks of :func:`src.scheduler.run_stages` and
+  :func:`src.workqueue.run_queue`) and renders the state of every stage and
+  sample, the elapsed time, the throughput in samples per hour, the threads
+  and memory reserved by the running stages, and the ETA.
+* **serve_metrics** - serves the metrics over HTTP (``/metrics``) from a
+  background thread.
+* **watch_status**  - rewrites a status file with the same metrics every
+  few seconds (atomically, so it suits the textfile collector of the node
+  exporter).
+
+Stage states are ``queued``, ``running``, ``cached`` (already done or
+restored from the artifact cache), ``done``, ``failed`` and ``skipped``.
+A sample is ``done`` once all its stages (and those of its assembly) ended
+well, and ``failed`` once one of them failed or was skipped.
+"""
+
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Any, Dict, Optional, Set
+
+from src.profiling import stage_status
+
+# Seconds between two writes of the status file
+STATUS_INTERVAL = 15.0
+
+STAGE_STATES = ("queued", "running", "cached", "done", "failed", "skipped")
+SAMPLE_STATES = ("queued", "running", "done", "failed")
+
+# State of a finished stage from its profiling status
+_FINISHED_STATES = {"ran": "done", "cached": "cached", "failed": "failed", "skipped": "skipped"}
+
+
+# ---------------------------------------------------------------------------
+# 1. Run state
+# ---------------------------------------------------------------------------
+class RunMonitor:
+    """State of the stages and samples of a run (safe to read from other threads)."""
+
+    def __init__(self, stages: Dict[str, Dict[str, Any]], sample_stages: Dict[str, Set[str]],
+                 threads: int, max_mem: Optional[float] = None):
+        """``sample_stages`` maps every sample to the stages it waits for
+        (:func:`src.results.get_sample_stages`); ``max_mem`` is in MB."""
+        self.groups = {name: stage.get("group") for name, stage in stages.items()}
+        self.sample_stages = {name: set(names) for name, names in sample_stages.items()}
+        self.stage_samples: Dict[str, Set[str]] = {}
+        for sample, names in self.sample_stages.items():
+            for name in names:
+                self.stage_samples.setdefault(name, set()).add(sample)
+        self.threads = threads
+        self.max_mem = max_mem
+        self.start = time.time()
+        self.states = {name: "queued" for name in stages}
+        self.started_at: Dict[str, float] = {}
+        self.wall_s: Dict[str, float] = {}
+        self.reserved: Dict[str, tuple] = {}
+        self.samples_done: Dict[str, float] = {}
+        self.lock = threading.Lock()
+
+    def stage_started(self, name: str, threads: int, memory: float) -> None:
+        """Record that a stage started with ``threads`` and ``memory`` MB reserved."""
+        with self.lock:
+            self.states[name] = "running"
+            self.started_at[name] = time.time()
+            self.reserved[name] = (threads or 0, memory or 0.0)
+
+    def stage_finished(self, name: str, result: Dict[str, Any]) -> None:
+        """Record the result of a stage."""
+        with self.lock:
+            self.states[name] = _FINISHED_STATES[stage_status(result)]
+            if name in self.started_at:
+                self.wall_s[name] = time.time() - self.started_at[name]
+            self.reserved.pop(name, None)
+            for sample in self.stage_samples.get(name, ()):
+                if all(self.states[stage] not in ("queued", "running")
+                       for stage in self.sample_stages[sample]):
+                    self.samples_done.setdefault(sample, time.time())
+
+    def sample_state(self, sample: str) -> str:
+        """Return ``queued``, ``running``, ``done`` or ``failed`` (call with the lock held)."""
+        states = [self.states[name] for name in self.sample_stages[sample]]
+        if any(state in ("failed", "skipped") for state in states):
+            return "failed"
+        if sample in self.samples_done:
+            return "done"
+        if all(state == "queued" for state in states):
+            return "queued"
+        return "running"
+
+    # -----------------------------------------------------------------------
+    # Prometheus text format
+    # -----------------------------------------------------------------------
+    def render(self) -> str:
+        """Return the metrics of the run in the Prometheus text format."""
+        with self.lock:
+            now = time.time()
+            elapsed = now - self.start
+            lines = []
+
+            def metric(name, kind, help_text, samples):
+                lines.append("# HELP {} {}".format(name, help_text))
+                lines.append("# TYPE {} {}".format(name, kind))
+                for labels, value in samples:
+                    label_text = ",".join('{}="{}"'.format(key, _escape(label))
+                                          for key, label in labels.items())
+                    lines.append("{}{} {}".format(name, "{" + label_text + "}" if labels else "",
+                                                  _number(value)))
+
+            metric("gaqet_run_start_time_seconds", "gauge", "Unix time the run started.",
+                   [({}, self.start)])
+            metric("gaqet_run_elapsed_seconds", "gauge", "Seconds since the run started.",
+                   [({}, elapsed)])
+            counts = {state: 0 for state in STAGE_STATES}
+            for state in self.states.values():
+                counts[state] += 1
+            metric("gaqet_stages", "gauge", "Stages of the run by state.",
+                   [({"state": state}, count) for state, count in counts.items()])
+            metric("gaqet_stage_state", "gauge", "Current state of each stage (1 for its state).",
+                   [({"stage": name, "group": self.groups[name] or "", "state": state}, 1)
+                    for name, state in self.states.items()])
+            metric("gaqet_stage_elapsed_seconds", "gauge",
+                   "Wall time of the running and finished stages.",
+                   [({"stage": name}, self.wall_s.get(name, now - started))
+                    for name, started in self.started_at.items()])
+
+            sample_states = {sample: self.sample_state(sample) for sample in self.sample_stages}
+            sample_counts = {state: 0 for state in SAMPLE_STATES}
+            for state in sample_states.values():
+                sample_counts[state] += 1
+            metric("gaqet_samples", "gauge", "Samples of the FOF by state.",
+                   [({"state": state}, count) for state, count in sample_counts.items()])
+            metric("gaqet_sample_state", "gauge", "Current state of each sample (1 for its state).",
+                   [({"sample": sample, "state": state}, 1)
+                    for sample, state in sample_states.items()])
+
+            # A sample is finished once all its stages ended, well or not
+            rate = len(self.samples_done) / (elapsed / 3600) if self.samples_done and elapsed else 0.0
+            left = len(sample_states) - len(self.samples_done)
+            metric("gaqet_samples_per_hour", "gauge", "Samples finished per hour since the start.",
+                   [({}, rate)])
+            metric("gaqet_eta_seconds", "gauge",
+                   "Estimated seconds until every sample is finished (NaN until one is).",
+                   [({}, left / rate * 3600 if rate else (0.0 if not left else float("nan")))])
+
+            metric("gaqet_threads", "gauge", "Threads of the run.", [({}, self.threads)])
+            metric("gaqet_threads_reserved", "gauge", "Threads given to the running stages.",
+                   [({}, sum(threads for threads, _ in self.reserved.values()))])
+            metric("gaqet_memory_reserved_bytes", "gauge",
+                   "Memory reserved by the running stages (with --max-mem).",
+                   [({}, sum(memory for _, memory in self.reserved.values()) * 1024 ** 2)])
+            if self.max_mem is not None:
+                metric("gaqet_memory_budget_bytes", "gauge", "Memory budget of the run (--max-mem).",
+                       [({}, self.max_mem * 1024 ** 2)])
+        return "\n".join(lines) + "\n"
+
+
+def _escape(value: Any) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _number(value: float) -> str:
+    if value != value:
+        return "NaN"
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+# ---------------------------------------------------------------------------
+# 2. Outputs
+# ---------------------------------------------------------------------------
+def serve_metrics(monitor: RunMonitor, port: int, host: str = "127.0.0.1") -> ThreadingHTTPServer:
+    """Serve ``/metrics`` from a daemon thread; return the server (``shutdown()`` stops it)."""
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] not in ("/", "/metrics"):
+                self.send_error(404)
+                return
+            body = monitor.render().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="gaqet-metrics", daemon=True).start()
+    return server
+
+
+def write_status(monitor: RunMonitor, status_fpath: Path) -> None:
+    """Write the metrics to ``status_fpath``, replacing it atomically."""
+    status_fpath = Path(status_fpath)
+    tmp = status_fpath.parent / ".{}.partial".format(status_fpath.name)
+    with open(tmp, "w") as status_fhand:
+        status_fhand.write(monitor.render())
+    os.replace(tmp, status_fpath)
+
+
+def watch_status(monitor: RunMonitor, status_fpath: Path,
+                 interval: float = STATUS_INTERVAL) -> threading.Event:
+    """Rewrite the status file every ``interval`` seconds from a daemon thread.
+
+    Return an event that stops the thread once set.
+    """
+    stop = threading.Event()
+    Path(status_fpath).parent.mkdir(parents=True, exist_ok=True)
+
+    def loop():
+        while True:
+            write_status(monitor, status_fpath)
+            if stop.wait(interval):
+                return
+
+    threading.Thread(target=loop, name="gaqet-status", daemon=True).start()
+    return stop
@@ -0,0 +1,496 @@
+"""
+pipeline.py
+===========
+Declares the GAQET stages of a sample as a dependency graph (see
+:mod:`src.scheduler`):
+
+* **AGAT**     - ``agat`` (independent, single-threaded), or the native
+  ``gff_stats`` engine depending on ``stats_backend`` (``compare`` runs both
+  and a ``stats_comparison`` stage).
+* **BUSCO**    - ``gffread`` → ``busco``, or with the native
+  ``proteins_backend`` the assembly's ``assembly_stats`` (which writes the
+  ``.fai`` index) → ``proteins`` → ``busco``.
+  In batch mode the proteins of every sample of a lineage go to a single
+  ``busco_batch`` stage, and each sample's ``busco`` stage collects its
+  results from it. The batch waits for every sample's proteins but leaves
+  out those that failed.
+* **LAI**      - ``LAI_outdir`` → ``suffixerator`` → ``harvest`` and
+  ``LAI_outdir`` → ``finder``, then ``cat`` → ``LTR_retriever`` → ``LAI``.
+  With ``lai_backend`` set to ``native`` the last stage is the native
+  LAI engine (after ``assembly_stats``); ``compare`` runs both and an
+  ``lai_comparison`` stage.
+  With ``harvest_shards`` > 1, ``assembly_stats`` → ``harvest_plan`` →
+  ``harvest_shard<N>`` (in parallel) → ``harvest`` (merge) replaces the
+  whole-genome suffix array and ltrharvest.
+* **RNA-seq**  - ``stringtie`` → ``gffcompare``, or the native
+  ``gff_compare`` with ``compare_backend`` set to ``native``. With
+  ``stringtie_shards`` > 1, ``stringtie_plan`` → ``stringtie_shard<N>``
+  (one per shard, in parallel) → ``stringtie`` (merge). A sample with
+  several libraries gets ``stringtie_library<N>`` (one per BAM, in
+  parallel) → ``stringtie`` (``stringtie --merge``) instead.
+
+The four chains only meet in the summary, so they run concurrently. The
+graphs of all FOF samples are merged into a single run graph whose stage names
+are prefixed with the sample name (``sample/stage``).
+
+The LAI chain only depends on ``ref_assembly``: it runs once per distinct
+assembly content, under ``<output>/assemblies/<genome>_<digest>``, and its
+stages are prefixed with that assembly key instead of a sample name. A
+dependency written as ``group/stage`` points to a stage of another group.
+
+Compressed inputs (gzip or BGZF) that a stage cannot read as they are get a
+``decompress`` stage, once per distinct input, in an ``input_<name>_<digest>``
+group; every stage of the samples and assemblies using it waits for it, and
+reads the plain copy in the scratch folder. The decompression counts against
+``-j`` with the first sample that reads it, so copies are only written for
+the samples that can start. Annotations only read by native
+engines are streamed instead.
+
+Stages built with an ``artifacts`` description go through the artifact cache
+(:mod:`src.cache`); stages only needed to produce cached outputs are pruned.
+"""
+
+import hashlib
+from functools import partial
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Set, Union
+
+from src.agat import run_agat, get_agat_artifacts
+from src.busco import (
+    run_busco, run_gffread, get_proteins_fpath, get_busco_artifacts, get_gffread_artifacts,
+    get_busco_batch_dir, run_busco_batch, collect_busco_batch
+)
+from src.cache import get_stage_key, has_entry, pin, run_cached
+from src.compression import get_decompressed_fpath, is_bgzf, is_gzipped, run_decompress
+from src.digest import file_digest
+from src.assembly_stats import get_assembly_stats_artifacts, run_assembly_stats
+from src.gff_compare import get_gff_compare_artifacts, run_gff_compare
+from src.gff_stats import compare_gff_stats, get_gff_stats_artifacts, run_gff_stats
+from src.lai import compare_LAI, get_native_LAI_artifacts, get_native_LAI_fpath, run_native_LAI
+from src.LTR_retriever import (
+    get_LAI_dir, create_outdir, run_suffixerator, run_harvest, run_finder,
+    concatenate_outputs, run_LTR_retriever, run_LAI, get_LAI_artifacts,
+    plan_harvest_shards, run_harvest_shard, merge_harvest_shards,
+    get_suffixerator_fpath, get_harvest_fpath, get_finder_fpath, get_raw_LTR_fpath,
+    get_pass_list_fpath, get_harvest_plan_fpath, get_harvest_shard_fpath
+)
+from src.proteins import get_proteins_artifacts, run_proteins
+from src.scheduler import check_graph, get_deps
+from src.stringtie import (
+    run_stringtie, run_gffcompare, get_stringtie_artifacts, get_gffcompare_artifacts,
+    plan_stringtie_shards, run_stringtie_shard, merge_stringtie_shards,
+    get_stringtie_library_artifacts, run_stringtie_library, merge_stringtie_libraries,
+    get_stringtie_plan_fpath, get_stringtie_shard_fpath
+)
+
+# Stages whose results the summary row of a sample is parsed from
+SUMMARY_STAGES = ("agat", "gff_stats", "busco", "LAI", "assembly_stats")
+
+
+# ---------------------------------------------------------------------------
+# 1. Stage constructor
+# ---------------------------------------------------------------------------
+def make_stage(run: Callable[[Dict[str, Any]], Dict[str, Any]],
+               args: Dict[str, Any],
+               deps: List[str],
+               threads: Union[int, str] = 1,
+               group: Optional[str] = None,
+               artifacts: Optional[Callable[[Dict[str, Any]], Dict[str, Any]]] = None,
+               checkpoint: Optional[Callable[[Dict[str, Any]], Path]] = None,
+               after: Optional[List[str]] = None
+               ) -> Dict[str, Any]:
+    """Return a stage dict for :func:`src.scheduler.run_stages`.
+
+    With ``artifacts`` the runner is wrapped by :func:`src.cache.run_cached`.
+    ``checkpoint`` returns the output whose completion marker tells the
+    stage is done, for stages without ``artifacts`` (see :mod:`src.plan`).
+    ``after`` lists stages that must end first, whether they succeed or not.
+    """
+    if artifacts is not None:
+        run = partial(run_cached, run, artifacts)
+    return {"run": run,
+            "args": args,
+            "deps": deps,
+            "after": after or [],
+            "threads": threads,
+            "group": group,
+            "artifacts": artifacts,
+            "checkpoint": checkpoint}
+
+
+def stage_id(group: str, stage: str) -> str:
+    """Return the run-wide name of a stage (``group/stage``)."""
+    return "{}/{}".format(group, stage)
+
+
+# ---------------------------------------------------------------------------
+# 2. Stages of one sample
+# ---------------------------------------------------------------------------
+def build_sample_stages(values: Dict[str, Any]) -> Dict[str, Dict[str, Any]]:
+    """Return the AGAT, BUSCO and RNA-seq stage graph of one FOF sample.
+
+    The protein FASTA that BUSCO reads from GFFread (``input``) is set on
+    ``values`` up-front.
+    """
+    values["input"] = get_proteins_fpath(values)
+    stats_backend = values.get("stats_backend", "agat")
+    if values.get("compare_backend", "gffcompare") == "native":
+        compare, compare_stage = "gff_compare", make_stage(run_gff_compare, values, ["stringtie"],
+                                                           artifacts=get_gff_compare_artifacts)
+    else:
+        compare, compare_stage = "gffcompare", make_stage(run_gffcompare, values, ["stringtie"],
+                                                          artifacts=get_gffcompare_artifacts)
+    proteins = get_proteins_stage(values)
+    if proteins == "proteins":
+        proteins_stage = make_stage(run_proteins, values,
+                                    [stage_id(values["assembly_key"], "assembly_stats")],
+                                    artifacts=get_proteins_artifacts)
+    else:
+        proteins_stage = make_stage(run_gffread, values, [], artifacts=get_gffread_artifacts)
+    if values.get("busco_batch"):
+        busco_stage = make_stage(collect_busco_batch, values,
+                                 [proteins, stage_id(values["busco_batch"], "busco_batch")],
+                                 artifacts=get_busco_artifacts)
+    else:
+        busco_stage = make_stage(run_busco, values, [proteins], threads="multi",
+                                 artifacts=get_busco_artifacts)
+
+    stages = {
+        # BUSCO
+        proteins: proteins_stage,
+        "busco": busco_stage,
+        # RNA-seq support
+        compare: compare_stage,
+    }
+    stages.update(build_stringtie_stages(values))
+    # Annotation statistics
+    if stats_backend in ("agat", "compare"):
+        stages["agat"] = make_stage(run_agat, values, [], artifacts=get_agat_artifacts)
+    if stats_backend in ("native", "compare"):
+        stages["gff_stats"] = make_stage(run_gff_stats, values, [],
+                                         artifacts=get_gff_stats_artifacts)
+    if stats_backend == "compare":
+        stages["stats_comparison"] = make_stage(compare_gff_stats, values, ["agat", "gff_stats"])
+    return stages
+
+
+def get_proteins_stage(values: Dict[str, Any]) -> str:
+    """Return the name of the stage that writes the protein FASTA of a sample."""
+    return "proteins" if values.get("proteins_backend", "gffread") == "native" else "gffread"
+
+
+def build_stringtie_stages(values: Dict[str, Any]) -> Dict[str, Dict[str, Any]]:
+    """Return the StringTie stage, or its shards or libraries and their merge, named ``stringtie``.
+
+    Each library stage gets its own copy of ``values`` with its BAM as
+    ``alignments``.
+    """
+    libraries = values.get("libraries") or [values["alignments"]]
+    if len(libraries) > 1:
+        names = ["stringtie_library{}".format(index) for index in range(1, len(libraries) + 1)]
+        stages = {}
+        for name, library in zip(names, libraries):
+            stages[name] = make_stage(run_stringtie_library,
+                                      dict(values, alignments=library, libraries=[library]), [],
+                                      threads="multi", artifacts=get_stringtie_library_artifacts)
+        stages["stringtie"] = make_stage(merge_stringtie_libraries, values, names,
+                                         threads="multi", artifacts=get_stringtie_artifacts)
+        return stages
+    n_shards = values.get("stringtie_shards", 1)
+    if n_shards <= 1:
+        return {"stringtie": make_stage(run_stringtie, values, [], threads="multi",
+                                        artifacts=get_stringtie_artifacts)}
+    shards = ["stringtie_shard{}".format(shard) for shard in range(1, n_shards + 1)]
+    stages = {"stringtie_plan": make_stage(plan_stringtie_shards, values, [], threads="multi",
+                                           checkpoint=get_stringtie_plan_fpath)}
+    for shard, name in enumerate(shards, 1):
+        stages[name] = make_stage(partial(run_stringtie_shard, shard=shard), values,
+                                  ["stringtie_plan"], threads="multi",
+                                  checkpoint=partial(get_stringtie_shard_fpath, shard=shard))
+    stages["stringtie"] = make_stage(merge_stringtie_shards, values, shards,
+                                     artifacts=get_stringtie_artifacts)
+    return stages
+
+
+# ---------------------------------------------------------------------------
+# 3. Compressed inputs
+# ---------------------------------------------------------------------------
+def get_plain_fields(values: Dict[str, Any]) -> List[str]:
+    """Return the FOF columns of a sample that its stages must read uncompressed.
+
+    The assembly is memory-mapped and read by external tools. Annotations
+    are only streamed (left compressed) when the native engines are the
+    only ones reading them.
+    """
+    fields = ["ref_assembly"]
+    if not (values.get("stats_backend") == "native" and values.get("proteins_backend") == "native"):
+        fields.append("annotation")
+    if values.get("compare_backend", "gffcompare") != "native":
+        fields.append("ref_annotation")
+    return fields
+
+
+def group_by_input(samples: Dict[str, Dict[str, Any]], out_dir: Path,
+                   scratch_dir: Path) -> Dict[str, Dict[str, Any]]:
+    """Plan the decompression of the compressed inputs of the samples.
+
+    Return ``{input_key: arguments}``, one per distinct compressed content,
+    where ``arguments`` holds the ``source`` file, its ``scratch_dir``, an
+    ``output`` folder for the logs and the first ``sample`` that reads it
+    (whose ``-j`` slot the decompression takes). Each sample field read uncompressed
+    is pointed to the plain copy; its original path is kept in
+    ``sources`` and the decompression stage to wait for in ``input_stages``.
+    """
+    inputs = {}
+    keys = {}
+    for name, values in samples.items():
+        values.setdefault("sources", {})
+        values.setdefault("input_stages", {})
+        for field in get_plain_fields(values):
+            source = Path(values[field])
+            if not is_gzipped(source):
+                continue
+            digest = file_digest(source)
+            if digest not in keys:
+                key = "input_{}_{}".format(source.name.split(".")[0], digest[:10])
+                keys[digest] = key
+                inputs[key] = {"source": source,
+                               "scratch_dir": scratch_dir / key,
+                               "output": out_dir / "inputs" / key,
+                               "sample": name,
+                               "threads_mode": "multi" if is_bgzf(source) else 1}
+            values["sources"][field] = values[field]
+            values["input_stages"][field] = stage_id(keys[digest], "decompress")
+            values[field] = get_decompressed_fpath(inputs[keys[digest]])
+    return inputs
+
+
+def build_decompress_stages(arguments: Dict[str, Any]) -> Dict[str, Dict[str, Any]]:
+    """Return the decompression stage of one input (parallel for BGZF)."""
+    return {"decompress": make_stage(run_decompress, arguments, [],
+                                     threads=arguments["threads_mode"],
+                                     checkpoint=get_decompressed_fpath)}
+
+
+def get_input_consumers(stages: Dict[str, Dict[str, Any]]) -> Dict[str, Set[str]]:
+    """Return ``{decompress_stage: stages}``: the stages that read each plain copy.
+
+    Once they are all finished the copy can be removed.
+    """
+    consumers = {name: set() for name in stages if name.endswith("/decompress")}
+    for name, stage in stages.items():
+        for input_stage in stage["args"].get("input_stages", {}).values():
+            if input_stage in consumers:
+                consumers[input_stage].add(name)
+    return consumers
+
+
+# ---------------------------------------------------------------------------
+# 4. Stages of one assembly (LAI and the assembly statistics)
+# ---------------------------------------------------------------------------
+def group_by_assembly(samples: Dict[str, Dict[str, Any]],
+                      out_dir: Path) -> Dict[str, Dict[str, Any]]:
+    """Group the samples by assembly content.
+
+    Return ``{assembly_key: arguments}`` where ``arguments`` holds the
+    ``ref_assembly``, the shared ``output`` folder and the sample names. The
+    key and the shared folder are also stored in each sample as
+    ``assembly_key`` and ``assembly_dir``.
+    """
+    assemblies = {}
+    keys = {}
+    for name, values in samples.items():
+        ref_assembly = Path(values["ref_assembly"])
+        # A decompressed copy may not exist yet: digest the compressed file
+        digest = file_digest(values.get("sources", {}).get("ref_assembly", ref_assembly))
+        # The first sample of each genome names its folder
+        if digest not in keys:
+            key = "{}_{}".format(ref_assembly.stem, digest[:10])
+            keys[digest] = key
+            assemblies[key] = {"ref_assembly": values["ref_assembly"],
+                               "output": out_dir / "assemblies" / key,
+                               "assembly_dir": out_dir / "assemblies" / key,
+                               "sources": {field: source for field, source
+                                           in values.get("sources", {}).items()
+                                           if field == "ref_assembly"},
+                               "input_stages": {field: input_stage for field, input_stage
+                                                in values.get("input_stages", {}).items()
+                                                if field == "ref_assembly"},
+                               "samples": []}
+        values["assembly_key"] = keys[digest]
+        values["assembly_dir"] = assemblies[keys[digest]]["assembly_dir"]
+        assemblies[keys[digest]]["samples"].append(name)
+    return assemblies
+
+
+def build_assembly_stages(arguments: Dict[str, Any]) -> Dict[str, Dict[str, Any]]:
+    """Return the stage graph of one assembly.
+
+    It holds the LAI chain and the assembly statistics, whose ``.fai`` index
+    the native protein extraction and the sharded ltrharvest read.
+    """
+    arguments["LAI_dir"] = get_LAI_dir(arguments)
+    n_shards = arguments.get("harvest_shards", 1)
+    lai_backend = arguments.get("lai_backend", "perl")
+
+    stages = {
+        "LAI_outdir": make_stage(create_outdir, arguments, []),
+        "finder": make_stage(run_finder, arguments, ["LAI_outdir"], threads="multi",
+                             checkpoint=get_finder_fpath),
+        "cat": make_stage(concatenate_outputs, arguments, ["harvest", "finder"],
+                          checkpoint=get_raw_LTR_fpath),
+        "LTR_retriever": make_stage(run_LTR_retriever, arguments, ["cat"], threads="multi",
+                                    checkpoint=get_pass_list_fpath),
+    }
+    if lai_backend == "native":
+        stages["LAI"] = make_stage(run_native_LAI, arguments, ["LTR_retriever", "assembly_stats"],
+                                   artifacts=get_native_LAI_artifacts)
+    else:
+        stages["LAI"] = make_stage(run_LAI, arguments, ["LTR_retriever"],
+                                   artifacts=get_LAI_artifacts)
+    if lai_backend == "compare":
+        stages["lai_native"] = make_stage(run_native_LAI, arguments,
+                                          ["LTR_retriever", "assembly_stats"],
+                                          checkpoint=get_native_LAI_fpath)
+        stages["lai_comparison"] = make_stage(compare_LAI, arguments, ["LAI", "lai_native"])
+    if n_shards <= 1:
+        stages["suffixerator"] = make_stage(run_suffixerator, arguments, ["LAI_outdir"],
+                                            checkpoint=get_suffixerator_fpath)
+        stages["harvest"] = make_stage(run_harvest, arguments, ["suffixerator"],
+                                       checkpoint=get_harvest_fpath)
+    else:
+        shards = ["harvest_shard{}".format(shard) for shard in range(1, n_shards + 1)]
+        stages["harvest_plan"] = make_stage(plan_harvest_shards, arguments,
+                                            ["LAI_outdir", "assembly_stats"],
+                                            checkpoint=get_harvest_plan_fpath)
+        for shard, name in enumerate(shards, 1):
+            stages[name] = make_stage(partial(run_harvest_shard, shard=shard), arguments,
+                                      ["harvest_plan"],
+                                      checkpoint=partial(get_harvest_shard_fpath, shard=shard))
+        stages["harvest"] = make_stage(merge_harvest_shards, arguments, shards,
+                                       checkpoint=get_harvest_fpath)
+    stages["assembly_stats"] = make_stage(run_assembly_stats, arguments, [],
+                                          artifacts=get_assembly_stats_artifacts)
+    return stages
+
+
+# ---------------------------------------------------------------------------
+# 5. Batch BUSCO runs (one per lineage)
+# ---------------------------------------------------------------------------
+def group_by_lineage(samples: Dict[str, Dict[str, Any]],
+                     out_dir: Path) -> Dict[str, Dict[str, Any]]:
+    """Group the samples that share a BUSCO lineage for batch BUSCO runs.
+
+    Return ``{batch_key: arguments}`` for every lineage with two or more
+    samples; ``arguments`` holds the ``lineage``, the batch ``output``
+    folder and the ``samples``. The key is stored in each of those samples as
+    ``busco_batch`` (and the batch run folder as ``busco_batch_dir``). The
+    key depends on the samples of the batch, so a changed FOF gets a new
+    batch.
+    """
+    lineages: Dict[str, Dict[str, Dict[str, Any]]] = {}
+    for name, values in samples.items():
+        lineages.setdefault(values["lineage"], {})[name] = values
+
+    batches = {}
+    for lineage, members in lineages.items():
+        if len(members) < 2:
+            continue
+        inputs = "\n".join("{}\t{}".format(name, get_proteins_fpath(values))
+                           for name, values in sorted(members.items()))
+        key = "busco_{}_{}".format(lineage, hashlib.sha1(inputs.encode()).hexdigest()[:10])
+        batches[key] = {"lineage": lineage,
+                        "output": out_dir / "busco_batches" / key,
+                        "samples": members}
+        for values in members.values():
+            values["busco_batch"] = key
+            values["busco_batch_dir"] = get_busco_batch_dir(batches[key])
+    return batches
+
+
+def build_busco_batch_stages(arguments: Dict[str, Any]) -> Dict[str, Dict[str, Any]]:
+    """Return the batch BUSCO stage of a lineage.
+
+    It runs once the proteins of all its samples ended; a sample whose
+    proteins failed is left out instead of skipping the whole batch.
+    """
+    after = [stage_id(name, get_proteins_stage(values))
+             for name, values in arguments["samples"].items()]
+    return {"busco_batch": make_stage(run_busco_batch, arguments, [], threads="multi",
+                                      checkpoint=get_busco_batch_dir, after=after)}
+
+
+# ---------------------------------------------------------------------------
+# 6. Stages of the whole FOF
+# ---------------------------------------------------------------------------
+def build_run_stages(samples: Dict[str, Dict[str, Any]],
+                     assemblies: Dict[str, Dict[str, Any]],
+                     batches: Optional[Dict[str, Dict[str, Any]]] = None,
+                     inputs: Optional[Dict[str, Dict[str, Any]]] = None
+                     ) -> Dict[str, Dict[str, Any]]:
+    """Return a single stage graph with the stages of every sample, assembly, batch and input.
+
+    Each stage is renamed to ``group/stage`` and tagged with its sample name
+    or assembly key in ``group`` so the scheduler can limit how many groups
+    are in flight. Every stage of a group waits for the decompression of
+    the inputs of the group.
+    """
+    graphs = {name: build_sample_stages(values) for name, values in samples.items()}
+    for key, arguments in assemblies.items():
+        graphs[key] = build_assembly_stages(arguments)
+    for key, arguments in (batches or {}).items():
+        graphs[key] = build_busco_batch_stages(arguments)
+    for key, arguments in (inputs or {}).items():
+        graphs[key] = build_decompress_stages(arguments)
+
+    stages = {}
+    for group, graph in graphs.items():
+        for stage_name, stage in graph.items():
+            input_stages = sorted(set(stage["args"].get("input_stages", {}).values()))
+            stage["deps"] = [dep if "/" in dep else stage_id(group, dep)
+                             for dep in stage["deps"]] + input_stages
+            stage["after"] = [dep if "/" in dep else stage_id(group, dep)
+                              for dep in stage["after"]]
+            stage["group"] = group
+            stages[stage_id(group, stage_name)] = stage
+    return stages
+
+
+# ---------------------------------------------------------------------------
+# 7. Skip stages made unnecessary by the artifact cache
+# ---------------------------------------------------------------------------
+def prune_cached(stages: Dict[str, Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+    """Drop the stages that are only needed to produce cached outputs.
+
+    A stage whose inputs already exist and whose entry is in the cache no
+    longer waits for its dependencies (it is restored instead of run), and
+    its entry is pinned so eviction cannot remove it before then. Its
+    ancestors are kept only if another stage still needs them. The stages
+    of ``SUMMARY_STAGES`` are always kept, even when every stage that needed
+    them is restored, since the summary reads their results.
+    """
+    has_dependents = set(dep for stage in stages.values() for dep in get_deps(stage))
+    kept = {name for name in stages
+            if name.rpartition("/")[2] in SUMMARY_STAGES or name not in has_dependents}
+
+    for stage in stages.values():
+        args = stage["args"]
+        if stage["artifacts"] is None or not args.get("cache_dir"):
+            continue
+        key = get_stage_key(stage["artifacts"], args)
+        if key is not None and has_entry(args["cache_dir"], key):
+            # The entry must outlive the evictions of every run
+            pin(args["cache_dir"], [key])
+            stage["deps"] = []
+            stage["after"] = []
+
+    # Stages that still need each stage, once the cached ones dropped theirs
+    dependents: Dict[str, List[str]] = {}
+    for name, stage in stages.items():
+        for dep in get_deps(stage):
+            dependents.setdefault(dep, []).append(name)
+    needed = set()
+    for name in reversed(check_graph(stages)):
+        if name in kept or any(other in needed for other in dependents.get(name, [])):
+            needed.add(name)
+    return {name: stage for name, stage in stages.items() if name in needed}
@@ -0,0 +1,151 @@
+"""
+plan.py
+=======
+Dry run of a GAQET run (``--plan``): what would run and what it would cost,
+without running anything.
+
+* **get_stage_status** - ``done`` (its output was committed by an earlier
+  run, so the runner would return 99), ``cached`` (restored from the
+  artifact cache) or ``run``.
+* **plan_run**         - status, threads, wall time, CPU hours, peak memory
+  and disk written of every stage, estimated from the runtime history or
+  the default factors of :mod:`src.history`.
+* **get_makespan**     - critical path of the stages left to run and the
+  makespan estimate for the threads of the run.
+* **print_plan**       - the per-stage table and the totals.
+
+The makespan is the longest of the critical path and the total work
+divided by the threads (``-t``); ``-j`` and ``--max-mem`` can only make a
+run longer.
+"""
+
+from pathlib import Path
+from typing import Any, Dict, List, Optional, TextIO
+
+from src.cache import get_stage_key, has_entry
+from src.checkpoint import is_done
+from src.history import estimate_disk, estimate_memory, estimate_runtime
+from src.scheduler import check_graph, get_deps
+
+PLAN_COLS: List[str] = ["stage", "status", "threads", "wall_s", "cpu_h", "memory_gb",
+                        "disk_gb", "estimate"]
+
+
+# ---------------------------------------------------------------------------
+# 1. Stage status
+# ---------------------------------------------------------------------------
+def get_checkpoint_fpath(stage: Dict[str, Any]) -> Optional[Path]:
+    """Return the output whose completion marker tells a stage is done (None if unknown)."""
+    if stage.get("artifacts") is not None:
+        return Path(stage["artifacts"](stage["args"])["outputs"][0])
+    if stage.get("checkpoint") is not None:
+        return Path(stage["checkpoint"](stage["args"]))
+    return None
+
+
+def get_stage_status(stage: Dict[str, Any]) -> str:
+    """Return ``done``, ``cached`` or ``run`` for a stage.
+
+    Stages without a known output (directory set-up, comparisons) always run.
+    """
+    checkpoint = get_checkpoint_fpath(stage)
+    if checkpoint is not None and is_done(checkpoint):
+        return "done"
+    args = stage["args"]
+    if stage.get("artifacts") is not None and args.get("cache_dir"):
+        key = get_stage_key(stage["artifacts"], args)
+        if key is not None and has_entry(args["cache_dir"], key):
+            return "cached"
+    return "run"
+
+
+# ---------------------------------------------------------------------------
+# 2. Estimates
+# ---------------------------------------------------------------------------
+def plan_run(stages: Dict[str, Dict[str, Any]], threads: int,
+             models: Dict[str, Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+    """Return ``{stage_name: row}`` with the columns of ``PLAN_COLS``.
+
+    ``"multi"`` stages are estimated with all the threads of the run. Stages
+    that are done or cached cost nothing; the stages that run get the
+    ``memory`` planned for them, or its estimate.
+    """
+    total = max(1, threads)
+    rows = {}
+    for name, stage in stages.items():
+        status = get_stage_status(stage)
+        given = total if stage["threads"] == "multi" else max(1, int(stage["threads"]))
+        row = {"stage": name, "status": status, "threads": given, "wall_s": 0.0, "cpu_h": 0.0,
+               "memory_gb": 0.0, "disk_gb": 0.0, "estimate": "-"}
+        if status == "run":
+            wall_s, basis = estimate_runtime(name, stage, models, given)
+            memory = stage.get("memory") or estimate_memory(name, stage, models)
+            row.update({"wall_s": wall_s, "cpu_h": None if wall_s is None else wall_s * given / 3600,
+                        "memory_gb": memory / 1024,
+                        "disk_gb": estimate_disk(name, stage, models) / 1024,
+                        "estimate": basis})
+        rows[name] = row
+    return rows
+
+
+def get_makespan(stages: Dict[str, Dict[str, Any]], rows: Dict[str, Dict[str, Any]],
+                 threads: int) -> Dict[str, Any]:
+    """Return the ``critical_path`` (stage names), its length and the ``makespan`` in seconds."""
+    finish, previous = {}, {}
+    for name in check_graph(stages):
+        deps = get_deps(stages[name])
+        start = max((finish[dep] for dep in deps), default=0.0)
+        previous[name] = max(deps, key=lambda dep: finish[dep]) if deps else None
+        finish[name] = start + (rows[name]["wall_s"] or 0.0)
+    critical_length = max(finish.values(), default=0.0)
+    area = sum((row["cpu_h"] or 0.0) * 3600 for row in rows.values()) / max(1, threads)
+
+    critical, name = [], max(finish, key=finish.get) if finish else None
+    while name is not None:
+        if rows[name]["wall_s"]:
+            critical.append(name)
+        name = previous[name]
+    return {"critical_path": critical[::-1],
+            "critical_s": critical_length,
+            "area_s": area,
+            "makespan_s": max(critical_length, area)}
+
+
+# ---------------------------------------------------------------------------
+# 3. Report
+# ---------------------------------------------------------------------------
+def _hours(seconds: float) -> str:
+    return "{:.1f} h".format(seconds / 3600) if seconds >= 3600 else "{:.0f} min".format(seconds / 60)
+
+
+def _cell(value: Any) -> str:
+    if value is None:
+        return "NA"
+    return "{:.3f}".format(value) if isinstance(value, float) else str(value)
+
+
+def print_plan(rows: Dict[str, Dict[str, Any]], makespan: Dict[str, Any], threads: int,
+               out_fhand: TextIO) -> None:
+    """Write the per-stage table (TSV) and the totals of a plan."""
+    out_fhand.write("\t".join(PLAN_COLS) + "\n")
+    for row in rows.values():
+        out_fhand.write("\t".join(_cell(row[col]) for col in PLAN_COLS) + "\n")
+
+    counts = {status: sum(1 for row in rows.values() if row["status"] == status)
+              for status in ("done", "cached", "run")}
+    to_run = [row for row in rows.values() if row["status"] == "run"]
+    unknown = [row["stage"] for row in to_run if row["wall_s"] is None]
+    out_fhand.write("\n{} stages: {} done, {} restored from the cache, {} to run\n".format(
+        len(rows), counts["done"], counts["cached"], counts["run"]))
+    out_fhand.write("CPU time: {:.1f} CPU hours\n".format(
+        sum(row["cpu_h"] or 0.0 for row in to_run)))
+    out_fhand.write("Peak memory of a stage: {:.1f} GB\n".format(
+        max((row["memory_gb"] for row in to_run), default=0.0)))
+    out_fhand.write("Disk written: {:.1f} GB\n".format(sum(row["disk_gb"] for row in to_run)))
+    out_fhand.write("Critical path: {} ({})\n".format(_hours(makespan["critical_s"]),
+                                                      " -> ".join(makespan["critical_path"]) or "-"))
+    out_fhand.write("Estimated makespan with {} threads: {}\n".format(
+        threads, _hours(makespan["makespan_s"])))
+    if unknown:
+        out_fhand.write("No estimate for {} stages (not counted): {}\n".format(
+            len(unknown), ", ".join(unknown[:10]) + (", ..." if len(unknown) > 10 else "")))
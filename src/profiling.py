@@ -0,0 +1,139 @@
+"""
+profiling.py
+============
+Resource usage of the GAQET stages.
+
+* **record_command** - profile of one command from the ``os.wait4`` usage
+  collected by :mod:`src.execution`: wall time, user/sys CPU, peak RSS and
+  block I/O (the child and every descendant it waited for).
+* **profile_call**  - runs a stage runner and attaches a ``profile`` entry
+  to its result with the totals of the commands it ran, plus the CPU time
+  spent in Python (native backends).
+* **write_profiles** - writes ``profile.tsv``/``profile.json`` for the whole
+  run and for every sample or assembly folder.
+
+Peak RSS is that of the largest process of the tree, as reported by the
+kernel; Linux counts the GAQET process a child was forked from, so values
+close to GAQET's own size only mean "small". I/O counts blocks actually read
+from or written to disk (not page-cache hits).
+"""
+
+import json
+import os
+import sys
+import threading
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, List
+
+# Commands run by the stage of the current thread
+_local = threading.local()
+
+# ru_maxrss is in kilobytes on Linux and in bytes on macOS
+_RSS_UNIT = 1 if sys.platform == "darwin" else 1024
+
+# Block size of ru_inblock / ru_oublock
+_BLOCK_SIZE = 512
+
+PROFILE_COLS: List[str] = ["stage", "group", "status", "returncode", "threads", "commands",
+                           "wall_s", "user_s", "sys_s", "python_cpu_s", "max_rss_mb",
+                           "read_mb", "written_mb"]
+
+
+# ---------------------------------------------------------------------------
+# 1. Profiled commands
+# ---------------------------------------------------------------------------
+def record_command(usage: Any, wall_s: float) -> Dict[str, float]:
+    """Return the profile of a command from its ``os.wait4`` usage.
+
+    The profile is also added to the stage that runs in the current thread.
+    """
+    profile = {"wall_s": wall_s,
+               "user_s": usage.ru_utime,
+               "sys_s": usage.ru_stime,
+               "max_rss_mb": usage.ru_maxrss * _RSS_UNIT / 1024 ** 2,
+               "read_mb": usage.ru_inblock * _BLOCK_SIZE / 1024 ** 2,
+               "written_mb": usage.ru_oublock * _BLOCK_SIZE / 1024 ** 2}
+    commands = getattr(_local, "commands", None)
+    if commands is not None:
+        commands.append(profile)
+    return profile
+
+
+# ---------------------------------------------------------------------------
+# 2. Profiled stages
+# ---------------------------------------------------------------------------
+def profile_call(run: Callable[[Dict[str, Any]], Dict[str, Any]],
+                 args: Dict[str, Any]) -> Dict[str, Any]:
+    """Call a stage runner and add a ``profile`` entry to its result."""
+    _local.commands = []
+    start, cpu_start = time.perf_counter(), time.thread_time()
+    try:
+        result = run(args)
+    finally:
+        commands, _local.commands = _local.commands, None
+    result["profile"] = {
+        "threads": args.get("threads"),
+        "commands": len(commands),
+        "wall_s": time.perf_counter() - start,
+        "user_s": sum(command["user_s"] for command in commands),
+        "sys_s": sum(command["sys_s"] for command in commands),
+        "python_cpu_s": time.thread_time() - cpu_start,
+        "max_rss_mb": max((command["max_rss_mb"] for command in commands), default=0.0),
+        "read_mb": sum(command["read_mb"] for command in commands),
+        "written_mb": sum(command["written_mb"] for command in commands),
+    }
+    return result
+
+
+def stage_status(result: Dict[str, Any]) -> str:
+    """Return ``ran``, ``cached`` (restored or already done), ``failed`` or ``skipped``."""
+    returncode = result.get("returncode")
+    if returncode is None and "returncode" in result:
+        return "skipped"
+    if returncode == 99 or "(restored from cache)" in str(result.get("msg", "")):
+        return "cached"
+    if returncode in (0, None):
+        return "ran"
+    return "failed"
+
+
+# ---------------------------------------------------------------------------
+# 3. Reports
+# ---------------------------------------------------------------------------
+def get_profile_rows(results: Dict[str, Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Return one row (see ``PROFILE_COLS``) per stage result."""
+    rows = []
+    for stage, result in results.items():
+        row = {"stage": stage,
+               "group": stage.split("/")[0],
+               "status": stage_status(result),
+               "returncode": result.get("returncode")}
+        row.update(result.get("profile", {}))
+        rows.append({col: row.get(col) for col in PROFILE_COLS})
+    return rows
+
+
+def _write_rows(rows: List[Dict[str, Any]], out_dir: Path) -> None:
+    with open(out_dir / "profile.tsv", "w") as tsv_fhand:
+        tsv_fhand.write("\t".join(PROFILE_COLS) + "\n")
+        for row in rows:
+            tsv_fhand.write("\t".join("" if row[col] is None else
+                                      "{:.3f}".format(row[col]) if isinstance(row[col], float)
+                                      else str(row[col]) for col in PROFILE_COLS) + "\n")
+    totals = {col: sum(row[col] or 0 for row in rows)
+              for col in ("wall_s", "user_s", "sys_s", "python_cpu_s", "read_mb", "written_mb")}
+    totals["max_rss_mb"] = max((row["max_rss_mb"] or 0 for row in rows), default=0.0)
+    totals["stages"] = len(rows)
+    totals["cached"] = len([row for row in rows if row["status"] == "cached"])
+    with open(out_dir / "profile.json", "w") as json_fhand:
+        json.dump({"totals": totals, "stages": rows}, json_fhand, indent=2)
+
+
+def write_profiles(results: Dict[str, Dict[str, Any]], group_dirs: Dict[str, Path],
+                   out_dir: Path) -> None:
+    """Write the profile of the whole run and of each group folder."""
+    rows = get_profile_rows(results)
+    _write_rows(rows, out_dir)
+    for group, group_dir in group_dirs.items():
+        _write_rows([row for row in rows if row["group"] == group], group_dir)
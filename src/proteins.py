@@ -0,0 +1,171 @@
+"""
+proteins.py
+===========
+Native replacement for ``gffread -y`` (``--proteins-backend native``).
+
+CDS coordinates are streamed from the annotation into array columns and
+grouped by transcript through an index array, then each transcript's CDS is
+spliced from the memory-mapped assembly through its shared ``.fai`` index
+(see :mod:`src.fasta`), translated and written in batches. Only the CDS regions are read, so the run time follows the size of
+the annotation rather than the size of the genome. The output is the same
+``input_sequences/<genome>.proteins.fasta`` that :func:`src.busco.run_busco`
+reads; like gffread, stop codons are written as ``.``.
+"""
+
+from array import array
+from pathlib import Path
+from typing import Any, Dict, List, Tuple
+
+from src.busco import get_proteins_fpath
+from src.checkpoint import commit, discard, is_done, promote, tmp_fpath
+from src.fasta import IndexedFasta, get_fai_fpath
+from src.gff import get_index, group_rows, iter_features
+
+# Bumped whenever the extracted proteins change (part of the cache key)
+ENGINE_VERSION = "gaqet-proteins 1"
+
+# Transcripts translated and written at a time
+BATCH_SIZE = 2000
+
+_BASES = "TCAG"
+_AMINO_ACIDS = "FFLLSSSSYY..CC.WLLLLPPPPHHQQRRRRIIIMTTTTNNKKSSRRVVVVAAAADDEEGGGG"
+CODON_TABLE: Dict[bytes, str] = {
+    (first + second + third).encode(): _AMINO_ACIDS[16 * i + 4 * j + k]
+    for i, first in enumerate(_BASES)
+    for j, second in enumerate(_BASES)
+    for k, third in enumerate(_BASES)
+}
+_COMPLEMENT = bytes.maketrans(b"ACGTUNacgtun", b"TGCAANtgcaan")
+
+
+# ---------------------------------------------------------------------------
+# 1. Sequence helpers
+# ---------------------------------------------------------------------------
+def reverse_complement(sequence: bytes) -> bytes:
+    """Return the reverse complement of a DNA sequence."""
+    return sequence.translate(_COMPLEMENT)[::-1]
+
+
+def translate(cds: bytes) -> str:
+    """Translate a CDS with the standard genetic code (``X`` for ambiguous codons)."""
+    cds = cds.upper()
+    return "".join([CODON_TABLE.get(cds[i:i + 3], "X") for i in range(0, len(cds) - 2, 3)])
+
+
+# ---------------------------------------------------------------------------
+# 2. CDS coordinates of every transcript
+# ---------------------------------------------------------------------------
+def read_cds(annotation_fpath: Path) -> Dict[str, Any]:
+    """Stream the CDS lines of an annotation into array columns."""
+    transcripts: Dict[str, int] = {}
+    seqids: Dict[str, int] = {}
+    c_tx, c_seq, c_start, c_end, c_phase = array("l"), array("l"), array("q"), array("q"), array("b")
+    t_strand = array("b")
+    for feature in iter_features(annotation_fpath):
+        if feature.type != "cds":
+            continue
+        seq = seqids.setdefault(feature.seqid, len(seqids))
+        phase = int(feature.phase) if feature.phase in ("0", "1", "2") else 0
+        for parent in feature.parents:
+            row = get_index(transcripts, parent, t_strand)
+            t_strand[row] = -1 if feature.strand == "-" else 1
+            for column, value in zip((c_tx, c_seq, c_start, c_end, c_phase),
+                                     (row, seq, feature.start, feature.end, phase)):
+                column.append(value)
+    return {"transcripts": list(transcripts), "seqids": list(seqids), "t_strand": t_strand,
+            "cds": (c_tx, c_seq, c_start, c_end, c_phase)}
+
+
+def _segments(cds_columns, offsets: array, order: array, row: int) -> List[tuple]:
+    """Return the ``(seq, start, end, phase)`` CDS pieces of one transcript, by start."""
+    c_seq, c_start, c_end, c_phase = cds_columns[1:]
+    return sorted(((c_seq[piece], c_start[piece], c_end[piece], c_phase[piece])
+                   for piece in order[offsets[row]:offsets[row + 1]]),
+                  key=lambda piece: piece[1])
+
+
+# ---------------------------------------------------------------------------
+# 3. Extraction
+# ---------------------------------------------------------------------------
+def extract_proteins(fasta: IndexedFasta, cds: Dict[str, Any], out_fhand) -> Tuple[int, int]:
+    """Splice, translate and write the protein of every transcript.
+
+    Return how many proteins were written and how many transcripts were
+    skipped because their sequence is not in the assembly (as gffread does).
+    """
+    names, seqids, strands = cds["transcripts"], cds["seqids"], cds["t_strand"]
+    offsets, order = group_rows(cds["cds"][0], len(names))
+    written = skipped = 0
+    batch = []
+    for row in range(len(names)):
+        pieces = _segments(cds["cds"], offsets, order, row)
+        if not pieces:
+            continue
+        if any(seqids[seq] not in fasta.index for seq, _, _, _ in pieces):
+            skipped += 1
+            continue
+        spliced = b"".join(fasta.fetch(seqids[seq], start, end) for seq, start, end, _ in pieces)
+        if strands[row] < 0:
+            spliced = reverse_complement(spliced)
+            phase = pieces[-1][3]
+        else:
+            phase = pieces[0][3]
+        batch.append((names[row], spliced[phase:]))
+        if len(batch) >= BATCH_SIZE:
+            written += _write_batch(batch, out_fhand)
+            batch = []
+    written += _write_batch(batch, out_fhand)
+    return written, skipped
+
+
+def _write_batch(batch: List[tuple], out_fhand) -> int:
+    out_fhand.write("".join(">{}\n{}\n".format(name, translate(cds)) for name, cds in batch))
+    return len(batch)
+
+
+# ---------------------------------------------------------------------------
+# 4. Runner
+# ---------------------------------------------------------------------------
+def get_proteins_artifacts(arguments: Dict[str, Any]) -> Dict[str, Any]:
+    """Describe the native protein extraction for the artifact cache."""
+    return {"inputs": [arguments["ref_assembly"], arguments["annotation"]],
+            "tools": [],
+            "params": ENGINE_VERSION,
+            "outputs": [get_proteins_fpath(arguments)]}
+
+
+def run_proteins(arguments: Dict[str, Any]) -> Dict[str, Any]:
+    """Write the protein FASTA natively (or skip if already done)."""
+    outfile = get_proteins_fpath(arguments)
+    outfile.parent.mkdir(parents=True, exist_ok=True)
+    command = "{} -g {} {}".format(ENGINE_VERSION, arguments["ref_assembly"], arguments["annotation"])
+
+    # BUSCO will need this file
+    arguments["input"] = outfile
+
+    if is_done(outfile):
+        return {"command": command,
+                "msg": "Extract sequences already done",
+                "out_fpath": outfile,
+                "returncode": 99}
+
+    discard(outfile)
+    tmp = tmp_fpath(outfile)
+    try:
+        cds = read_cds(Path(arguments["annotation"]))
+        with IndexedFasta(Path(arguments["ref_assembly"]), get_fai_fpath(arguments)) as fasta, \
+                open(tmp, "w") as out_fhand:
+            written, skipped = extract_proteins(fasta, cds, out_fhand)
+    except (OSError, ValueError, KeyError) as error:
+        commit(outfile, 1, command)
+        return {"command": command,
+                "msg": "Protein extraction Failed: \n {}".format(error),
+                "out_fpath": outfile,
+                "returncode": 1}
+    promote(tmp, outfile)
+    commit(outfile, 0, command)
+    return {"command": command,
+            "msg": "{} proteins extracted successfully ({} transcripts on missing "
+                   "sequences skipped)".format(written, skipped),
+            "out_fpath": outfile,
+            "returncode": 0}
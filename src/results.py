@@ -0,0 +1,250 @@
+"""
+results.py
+==========
+Results store of a run: the parsed summary row of every sample is kept in
+``results.sqlite`` in the output folder as soon as the sample is finished,
+and ``summary.tsv`` is regenerated from it.
+
+* **get_sample_stages** - stages each sample row waits for.
+* **update_sample**     - parse the reports of a finished sample and store
+  its row; reports that did not change since the stored row are not parsed
+  again (see **get_fingerprint**).
+* **write_summary**     - write ``summary.tsv`` from the stored rows.
+* **write_columnar**    - export the stored rows and the LAI windows as typed
+  Parquet or Arrow files (needs the optional ``pyarrow``).
+
+Values are stored with the types of ``COL_TYPES``, so every metric is a number.
+
+A sample whose reports cannot be parsed gets its error stored instead of a
+row, and the other samples carry on.
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Set
+
+from src.agat import get_agat_stats
+from src.assembly_stats import get_assembly_stats
+from src.busco import get_busco_results, get_busco_summary_fpath
+from src.LTR_retriever import get_LAI
+from src.pipeline import stage_id
+from src.stringtie import calculate_annotation_scores, get_annotation_stats_fpath
+from src.table import (
+    AGAT_COLS, ASSEMBLY_COLS, BUSCO_COLS, COL_TYPES, LAI_COLS, LAI_WINDOW_COLS, RNASEQ_COLS, SUMMARY_COLS
+)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS samples (
+    name TEXT PRIMARY KEY,
+    fingerprint TEXT,
+    row TEXT,
+    error TEXT,
+    updated REAL
+);
+CREATE TABLE IF NOT EXISTS lai_windows (
+    assembly TEXT,
+    window TEXT
+);
+CREATE INDEX IF NOT EXISTS lai_windows_assembly ON lai_windows (assembly);
+"""
+
+_CASTS = {"int": int, "float": float, "str": str}
+
+
+# ---------------------------------------------------------------------------
+# 1. Store
+# ---------------------------------------------------------------------------
+def get_store_fpath(out_dir: Path) -> Path:
+    return Path(out_dir) / "results.sqlite"
+
+
+def open_store(out_dir: Path) -> sqlite3.Connection:
+    """Open (or create) the results store of an output folder."""
+    connection = sqlite3.connect(str(get_store_fpath(out_dir)))
+    connection.executescript(SCHEMA)
+    return connection
+
+
+def get_sample_stages(stages: Dict[str, Dict[str, Any]],
+                      samples: Dict[str, Dict[str, Any]]) -> Dict[str, Set[str]]:
+    """Return ``{sample: stages}``: its own stages and the statistics and LAI of its assembly."""
+    waiting = {}
+    for name, values in samples.items():
+        waiting[name] = {stage_name for stage_name, stage in stages.items()
+                         if stage.get("group") == name}
+        for stage in ("assembly_stats", "LAI"):
+            assembly_stage = stage_id(values["assembly_key"], stage)
+            if assembly_stage in stages:
+                waiting[name].add(assembly_stage)
+    return waiting
+
+
+# ---------------------------------------------------------------------------
+# 2. Parse a sample
+# ---------------------------------------------------------------------------
+def _out_fpath(results: Dict[str, Dict[str, Any]], stage: str) -> Optional[Path]:
+    out_fpath = results.get(stage, {}).get("out_fpath")
+    return Path(out_fpath) if out_fpath is not None else None
+
+
+def get_report_fpaths(name: str, values: Dict[str, Any],
+                      results: Dict[str, Dict[str, Any]], stats_backend: str) -> List[Optional[Path]]:
+    """Return the reports the summary row of a sample is parsed from."""
+    stats_stage = "gff_stats" if stats_backend == "native" else "agat"
+    busco_dir = _out_fpath(results, stage_id(name, "busco"))
+    return [_out_fpath(results, stage_id(name, stats_stage)),
+            get_busco_summary_fpath(busco_dir, values["lineage"]) if busco_dir else None,
+            _out_fpath(results, stage_id(values["assembly_key"], "LAI")),
+            _out_fpath(results, stage_id(values["assembly_key"], "assembly_stats")),
+            get_annotation_stats_fpath(values)]
+
+
+def get_fingerprint(fpaths: List[Optional[Path]]) -> str:
+    """Return a digest of the reports (path, size and mtime) and the columns."""
+    digest = hashlib.sha256("\t".join(SUMMARY_COLS).encode())
+    for fpath in fpaths:
+        if fpath is None or not fpath.exists():
+            digest.update("{}:missing\n".format(fpath).encode())
+        else:
+            stat = fpath.stat()
+            digest.update("{}:{}:{}\n".format(fpath, stat.st_size, stat.st_mtime_ns).encode())
+    return digest.hexdigest()
+
+
+def typed(col: str, value: Any) -> Any:
+    """Return ``value`` with the type of ``col`` (``None`` stays ``None``)."""
+    return None if value is None else _CASTS[COL_TYPES[col]](value)
+
+
+def _stage_result(results: Dict[str, Dict[str, Any]], stage: str) -> Dict[str, Any]:
+    """Return the result of a stage the summary row needs.
+
+    Raise ``RuntimeError`` if the stage has no result (it was not part of
+    the run), so the error stored for the sample names it.
+    """
+    if stage not in results:
+        raise RuntimeError("No result for stage {}".format(stage))
+    return results[stage]
+
+
+def parse_sample(name: str, values: Dict[str, Any],
+                 results: Dict[str, Dict[str, Any]], stats_backend: str) -> Dict[str, Any]:
+    """Return the summary row of a sample (``{column: value}``).
+
+    The LAI windows of its assembly are returned under ``"windows"``.
+    """
+    stats_stage = "gff_stats" if stats_backend == "native" else "agat"
+    agat_statistics = get_agat_stats(_stage_result(results, stage_id(name, stats_stage)))
+    busco_results = get_busco_results(_stage_result(results, stage_id(name, "busco")),
+                                      lineage=values["lineage"])
+    lai = get_LAI(_stage_result(results, stage_id(values["assembly_key"], "LAI")))
+    annotation_scores = calculate_annotation_scores(values)
+    assembly = get_assembly_stats(_stage_result(results, stage_id(values["assembly_key"],
+                                                                   "assembly_stats")))
+    row = {"Name": name}
+    row.update({col: assembly[col] for col in ASSEMBLY_COLS})
+    row.update({stat: agat_statistics[stat] for stat in AGAT_COLS})
+    row.update({col: busco_results[col] for col in BUSCO_COLS})
+    row.update({col: lai[col] for col in LAI_COLS})
+    row.update({score: annotation_scores.get(score) for score in RNASEQ_COLS})
+    row = {col: typed(col, value) for col, value in row.items()}
+    row["windows"] = lai["windows"]
+    return row
+
+
+def update_sample(connection: sqlite3.Connection, name: str, values: Dict[str, Any],
+                  results: Dict[str, Dict[str, Any]], stats_backend: str) -> Dict[str, Any]:
+    """Store the summary row of a finished sample, parsing it only if its reports changed.
+
+    Return ``{"msg", "returncode"}`` like a runner (``99`` if the stored row
+    is still valid).
+    """
+    fingerprint = get_fingerprint(get_report_fpaths(name, values, results, stats_backend))
+    stored = connection.execute("SELECT fingerprint, error FROM samples WHERE name = ?",
+                                (name,)).fetchone()
+    if stored is not None and stored[0] == fingerprint:
+        return {"msg": "Summary row of {} already stored".format(name),
+                "returncode": 99 if stored[1] is None else 1}
+
+    row, error, windows = None, None, None
+    try:
+        parsed = parse_sample(name, values, results, stats_backend)
+        windows = parsed.pop("windows")
+        row = json.dumps(parsed)
+    except Exception as parse_error:
+        error = "{}: {}".format(type(parse_error).__name__, parse_error)
+    with connection:
+        connection.execute("INSERT OR REPLACE INTO samples (name, fingerprint, row, error, updated) "
+                           "VALUES (?, ?, ?, ?, ?)", (name, fingerprint, row, error, time.time()))
+        if windows is not None:
+            # Samples of the same assembly share its windows
+            connection.execute("DELETE FROM lai_windows WHERE assembly = ?",
+                               (values["assembly_key"],))
+            connection.executemany("INSERT INTO lai_windows (assembly, window) VALUES (?, ?)",
+                                   ((values["assembly_key"], json.dumps(window))
+                                    for window in windows))
+    if error is not None:
+        return {"msg": "Summary row of {} Failed: \n {}".format(name, error), "returncode": 1}
+    return {"msg": "Summary row of {} stored".format(name), "returncode": 0}
+
+
+# ---------------------------------------------------------------------------
+# 3. Summary table
+# ---------------------------------------------------------------------------
+def write_summary(connection: sqlite3.Connection, names: List[str], out_fpath: Path) -> None:
+    """Write the stored rows of ``names`` (in that order) as a TSV.
+
+    Samples without a row yet (unfinished or failed) are left out. The file
+    is replaced atomically, so it is always complete.
+    """
+    rows = {name: json.loads(row) for name, row in
+            connection.execute("SELECT name, row FROM samples WHERE row IS NOT NULL")}
+    tmp_fpath = Path("{}.partial".format(out_fpath))
+    with open(tmp_fpath, "w") as summary:
+        summary.write("\t".join(SUMMARY_COLS) + "\n")
+        for name in names:
+            if name in rows:
+                summary.write("\t".join("NA" if rows[name].get(col) is None else
+                                        str(rows[name][col]) for col in SUMMARY_COLS) + "\n")
+    os.replace(tmp_fpath, out_fpath)
+
+
+def write_columnar(connection: sqlite3.Connection, names: List[str], out_dir: Path,
+                   fmt: str = "parquet") -> List[Path]:
+    """Write ``results.<fmt>`` (rows of ``names``) and ``lai_windows.<fmt>``.
+
+    ``fmt`` is ``parquet`` or ``arrow`` (Arrow IPC file). Return the files
+    written; raise ``ImportError`` if ``pyarrow`` is not installed.
+    """
+    import pyarrow
+    if fmt == "parquet":
+        import pyarrow.parquet as writer
+    else:
+        import pyarrow.feather as writer
+    arrow_types = {"int": pyarrow.int64(), "float": pyarrow.float64(), "str": pyarrow.string()}
+
+    def table(cols, rows):
+        return pyarrow.table({col: pyarrow.array([row.get(col) for row in rows],
+                                                 type=arrow_types[COL_TYPES[col]])
+                              for col in cols})
+
+    stored = {name: json.loads(row) for name, row in
+              connection.execute("SELECT name, row FROM samples WHERE row IS NOT NULL")}
+    rows = [stored[name] for name in names if name in stored]
+    windows = [dict(zip(LAI_WINDOW_COLS, [assembly] + json.loads(window))) for assembly, window in
+               connection.execute("SELECT assembly, window FROM lai_windows ORDER BY rowid")]
+
+    out_fpaths = []
+    for name, cols, table_rows in (("results", SUMMARY_COLS, rows),
+                                   ("lai_windows", LAI_WINDOW_COLS, windows)):
+        out_fpath = Path(out_dir) / "{}.{}".format(name, fmt)
+        if fmt == "parquet":
+            writer.write_table(table(cols, table_rows), out_fpath)
+        else:
+            writer.write_feather(table(cols, table_rows), out_fpath)
+        out_fpaths.append(out_fpath)
+    return out_fpaths
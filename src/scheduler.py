@@ -0,0 +1,332 @@
+"""
+scheduler.py
+============
+Dependency-graph executor for the GAQET stages.
+
+A *stage graph* is a plain dict ``{stage_name: stage}`` where every stage is
+itself a dict with:
+
+* **run**     - runner to call (e.g. ``run_busco``); it receives ``args``.
+* **args**    - arguments dict for the runner. It is copied before the call
+  and its ``threads`` entry is filled in by the scheduler.
+* **deps**    - names of the stages that must finish successfully first.
+* **after**   - optional names of stages that must only finish first, well
+  or not (a batch stage that leaves out the samples whose input failed).
+* **threads** - ``"multi"`` for tools that scale with threads, or a fixed
+  number of threads (``1`` for single-threaded tools).
+* **group**   - optional label (the sample name) used to cap how many
+  samples have stages in flight at once.
+* **memory**  - optional estimate of the peak memory of the stage in MB.
+
+Stages whose dependencies are done run concurrently as long as the threads
+they get fit in the ``-t`` budget. Stages of samples that already started are
+preferred over opening a new sample. A stage whose dependency failed is not run
+and gets a result with ``returncode`` ``None``. The result of every stage that
+runs gets a ``profile`` entry (see :mod:`src.profiling`).
+
+With a memory budget, a stage only starts when its estimate fits in the
+memory left by the running stages (a stage larger than the budget runs on
+its own). A stage whose command was killed by ``SIGKILL``, which is what the
+kernel OOM killer sends, is retried with twice its reservation, unless GAQET
+stopped the command itself (timeout or ``fail_fast`` cancellation).
+
+The commands of a stage log to ``<output>/logs/<stage>.log`` and can be given
+a timeout. With ``fail_fast`` the first failure of a group cancels its running
+siblings and skips the rest of the group (see :mod:`src.execution`).
+"""
+
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Set
+
+from src.execution import cancel_group, reset_cancellations, stage_context
+from src.profiling import profile_call
+
+# Retries of a stage killed by the OOM killer
+MAX_OOM_RETRIES = 2
+
+
+# ---------------------------------------------------------------------------
+# 1. Graph helpers
+# ---------------------------------------------------------------------------
+def succeeded(result: Dict[str, Any]) -> bool:
+    """Return True if a runner result means the stage output is usable."""
+    return result.get("returncode", 0) in (0, 99)
+
+
+def get_deps(stage: Dict[str, Any]) -> List[str]:
+    """Return the stages that must finish before ``stage``: ``deps`` and ``after``."""
+    return list(stage["deps"]) + list(stage.get("after") or [])
+
+
+def check_graph(stages: Dict[str, Dict[str, Any]]) -> List[str]:
+    """Return the stage names in topological order.
+
+    Raise ``ValueError`` if a dependency is unknown or the graph has a cycle.
+    """
+    for name, stage in stages.items():
+        for dep in get_deps(stage):
+            if dep not in stages:
+                raise ValueError("Stage {} depends on unknown stage {}".format(name, dep))
+
+    order = []
+    visiting = set()
+    visited = set()
+
+    def visit(name):
+        if name in visited:
+            return
+        if name in visiting:
+            raise ValueError("Cycle in stage graph at stage {}".format(name))
+        visiting.add(name)
+        for dep in get_deps(stages[name]):
+            visit(dep)
+        visiting.discard(name)
+        visited.add(name)
+        order.append(name)
+
+    for name in stages:
+        visit(name)
+    return order
+
+
+# ---------------------------------------------------------------------------
+# 2. Thread allocation
+# ---------------------------------------------------------------------------
+def allocate_threads(stage: Dict[str, Any], free: int, total: int,
+                     multi_waiting: int) -> int:
+    """Return the threads to give a stage now, or 0 if it has to wait.
+
+    Fixed-size stages get what they ask for (capped by ``total``). Stages
+    that scale share the free threads with the other scalable stages that
+    are ready at the same time.
+    """
+    if stage["threads"] == "multi":
+        return max(1, free // max(1, multi_waiting)) if free else 0
+    wanted = min(int(stage["threads"]), total)
+    return wanted if wanted <= free else 0
+
+
+def get_memory(stage: Dict[str, Any], max_mem: Optional[float]) -> float:
+    """Return the memory (MB) to reserve for a stage, capped by the budget."""
+    if max_mem is None:
+        return 0.0
+    return min(float(stage.get("memory") or 0.0), max_mem)
+
+
+def killed_by_oom(result: Dict[str, Any]) -> bool:
+    """Return True if a stage failed because a command got ``SIGKILL`` (-9, or 137 from a shell).
+
+    Stages whose commands GAQET stopped (``stopped`` in the result, see
+    :func:`call_stage`) were not killed for their memory.
+    """
+    return result.get("returncode") in (-9, 137) and not result.get("stopped")
+
+
+def balance_shards(loads: Dict[str, int], n_shards: int) -> List[List[str]]:
+    """Split items in ``n_shards`` groups of similar total load (greedy).
+
+    Used to spread whole chromosomes over parallel stages.
+    """
+    shards: List[List[str]] = [[] for _ in range(n_shards)]
+    totals = [0] * n_shards
+    for item, load in sorted(loads.items(), key=lambda pair: (-pair[1], pair[0])):
+        lightest = totals.index(min(totals))
+        shards[lightest].append(item)
+        totals[lightest] += load
+    return shards
+
+
+# ---------------------------------------------------------------------------
+# 3. Execute the graph
+# ---------------------------------------------------------------------------
+def call_stage(name: str, stage: Dict[str, Any], threads: int,
+               timeout: Optional[float] = None) -> Dict[str, Any]:
+    """Run a stage with its own copy of the arguments (profiled and logged).
+
+    A stage whose commands timed out or were cancelled gets the reason in
+    ``stopped``.
+    """
+    args = dict(stage["args"])
+    args["threads"] = threads
+    log_dir = Path(args["output"]) / "logs" if args.get("output") else None
+    with stage_context(name, stage.get("group"), log_dir, timeout) as context:
+        result = profile_call(stage["run"], args)
+    if context["stopped"]:
+        result["stopped"] = context["stopped"]
+    return result
+
+
+def run_stages(stages: Dict[str, Dict[str, Any]], threads: int,
+               callback: Optional[Callable[[str, Dict[str, Any]], None]] = None,
+               max_groups: Optional[int] = None,
+               timeout: Optional[float] = None,
+               fail_fast: bool = False,
+               max_mem: Optional[float] = None,
+               started: Optional[Callable[[str, int, float], None]] = None,
+               limited_groups: Optional[Set[str]] = None,
+               group_slots: Optional[Dict[str, str]] = None
+               ) -> Dict[str, Dict[str, Any]]:
+    """Run every stage of the graph and return ``{stage_name: result}``.
+
+    ``callback(stage_name, result)`` is called as soon as each stage ends, and
+    ``started(stage_name, threads, memory)`` when it starts. ``max_groups``
+    limits how many groups (samples) may have started but unfinished stages at
+    the same time; with ``limited_groups`` only those groups count (the
+    samples, not the assemblies they share), and groups only waiting for other
+    groups do not count. ``group_slots`` counts a group in the slot of another
+    one (the decompression of an input with the first sample that reads it). If
+    nothing runs and no stage can start, the stages left fail. ``timeout``
+    (seconds) bounds the commands of each stage. With ``fail_fast`` a failed
+    stage cancels the other stages of its group. ``max_mem`` (MB) is the memory
+    budget shared by the running stages.
+    """
+    order = check_graph(stages)
+    reset_cancellations()
+    total = max(1, threads)
+    pending = list(order)
+    results = {}
+    running = {}
+    free = total
+    free_mem = max_mem
+    oom_retries = {}
+
+    # Unfinished stages per group, and groups that already started
+    left = {}
+    for name in order:
+        group = stages[name].get("group")
+        left[group] = left.get(group, 0) + 1
+    active = set()
+
+    def finish(name, result):
+        results[name] = result
+        group = stages[name].get("group")
+        left[group] -= 1
+        if not left[group]:
+            active.discard(group)
+        if callback is not None:
+            callback(name, result)
+        if fail_fast and result.get("returncode") is not None and not succeeded(result):
+            cancel(name, group)
+
+    def cancel(failed, group):
+        """Stop the running stages of ``group`` and skip its pending ones."""
+        cancel_group(group, "{} failed".format(failed))
+        for name in [name for name in pending if stages[name].get("group") == group]:
+            pending.remove(name)
+            finish(name, {"msg": "{} cancelled: {} failed".format(name, failed),
+                          "out_fpath": None,
+                          "returncode": None})
+
+    slots = group_slots or {}
+
+    def counted(group):
+        return group is not None and (limited_groups is None or group in limited_groups
+                                      or group in slots)
+
+    def slot(group):
+        return slots.get(group, group)
+
+    def get_open_groups():
+        """Return the ``max_groups`` slots held by the counted groups.
+
+        A started group that runs nothing and whose pending stages all wait
+        for unfinished stages of other groups (a batch stage shared by
+        several samples) is parked: it does not hold a slot, so the groups
+        it waits for can open.
+        """
+        busy = {stages[name].get("group") for name, _, _ in running.values()}
+        blocked = {}
+        for name in pending:
+            group = stages[name].get("group")
+            blocked[name] = any(dep not in results
+                                and (stages[dep].get("group") != group or blocked.get(dep))
+                                for dep in get_deps(stages[name]))
+        parked = {group for group in active if group not in busy}
+        for name in pending:
+            if not blocked[name]:
+                parked.discard(stages[name].get("group"))
+        return {slot(group) for group in active if counted(group) and group not in parked}
+
+    def can_open(group, open_groups):
+        return (not counted(group) or group in active or max_groups is None
+                or slot(group) in open_groups or len(open_groups) < max_groups)
+
+    with ThreadPoolExecutor(max_workers=total) as pool:
+        while pending or running:
+            # Drop stages that can no longer run because a dependency failed
+            for name in list(pending):
+                failed = [dep for dep in stages[name]["deps"]
+                          if dep in results and not succeeded(results[dep])]
+                if failed:
+                    pending.remove(name)
+                    finish(name, {"msg": "{} skipped: {} failed".format(name, failed[0]),
+                                  "out_fpath": None,
+                                  "returncode": None})
+
+            # Start every ready stage that fits in the free threads (and memory)
+            if not running:
+                free_mem = max_mem
+            ready = [name for name in pending
+                     if all(dep in results for dep in get_deps(stages[name]))]
+            ready.sort(key=lambda name: stages[name].get("group") not in active)
+            multi_waiting = len([name for name in ready if stages[name]["threads"] == "multi"])
+            open_groups = get_open_groups() if max_groups is not None else set()
+            for name in ready:
+                stage = stages[name]
+                if not can_open(stage.get("group"), open_groups):
+                    continue
+                given = allocate_threads(stage, free, total, multi_waiting)
+                if stage["threads"] == "multi":
+                    multi_waiting -= 1
+                memory = get_memory(stage, max_mem)
+                if not given or (max_mem is not None and memory > free_mem):
+                    continue
+                free -= given
+                if max_mem is not None:
+                    free_mem -= memory
+                pending.remove(name)
+                active.add(stage.get("group"))
+                if counted(stage.get("group")):
+                    open_groups.add(slot(stage.get("group")))
+                running[pool.submit(call_stage, name, stage, given, timeout)] = (name, given, memory)
+                if started is not None:
+                    started(name, given, memory if max_mem is not None else 0.0)
+
+            if not running:
+                # Nothing runs and nothing could start: fail what is left
+                # instead of waiting forever
+                for name in list(pending):
+                    if name not in pending:  # cancelled by fail_fast meanwhile
+                        continue
+                    pending.remove(name)
+                    finish(name, {"msg": "{} could not be scheduled: no stage can start "
+                                         "(max_groups={})".format(name, max_groups),
+                                  "out_fpath": None,
+                                  "returncode": 1})
+                continue
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name, given, memory = running.pop(future)
+                free += given
+                if max_mem is not None:
+                    free_mem += memory
+                try:
+                    result = future.result()
+                except Exception as error:
+                    result = {"msg": "{} Failed: \n {}".format(name, error),
+                              "out_fpath": None,
+                              "returncode": 1}
+                if (max_mem is not None and killed_by_oom(result)
+                        and oom_retries.get(name, 0) < MAX_OOM_RETRIES):
+                    # Run it again with a larger reservation
+                    oom_retries[name] = oom_retries.get(name, 0) + 1
+                    stages[name]["memory"] = min(max_mem, max(2 * memory, max_mem / 4))
+                    pending.insert(0, name)
+                    continue
+                if name in oom_retries:
+                    result["msg"] = "{} (after {} OOM retries)".format(result.get("msg"),
+                                                                       oom_retries[name])
+                finish(name, result)
+    return results
@@ -3,16 +3,89 @@ stringtie.py
 ============
 Helpers that run **StringTie** and **GFFcompare** on RNA-seq alignments
 and derive simple F1-like support scores for each genome annotation.
+Large BAMs can be assembled in parallel shards of whole chromosomes, and
+samples with several RNA-seq libraries get one assembly per library,
+combined with ``stringtie --merge``.
+The ``.stats`` report can also be written by the native comparator
+(:mod:`src.gff_compare`).
 """
 
 
+import glob
+import hashlib
+import shutil
 import subprocess
 from pathlib import Path
-from typing import Any, Dict
+from typing import Any, Dict, List
+
+from src.checkpoint import commit, discard, is_done, promote, tmp_fpath
+from src.execution import run_command
+from src.scheduler import balance_shards
 
 # ---------------------------------------------------------------------------
 # 1.  Assemble transcripts with StringTie
 # ---------------------------------------------------------------------------
+def get_libraries(alignments: str) -> List[str]:
+    """Return the BAMs of the ``alignments`` field of a FOF sample.
+
+    The field holds one BAM or several separated by commas, and each of
+    them may be a glob pattern (``rnaseq/*.bam``, expanded in sorted
+    order). Every library must have a distinct file name, which names its
+    GTF.
+    """
+    libraries = []
+    for item in alignments.split(","):
+        item = item.strip()
+        if not item:
+            continue
+        if any(char in item for char in "*?["):
+            matches = sorted(glob.glob(item))
+            if not matches:
+                raise RuntimeError("No alignments match {}".format(item))
+            libraries.extend(matches)
+        else:
+            libraries.append(item)
+    libraries = list(dict.fromkeys(libraries))
+    if not libraries:
+        raise RuntimeError("Empty alignments field")
+    stems = [Path(library).stem for library in libraries]
+    repeated = sorted({stem for stem in stems if stems.count(stem) > 1})
+    if repeated:
+        raise RuntimeError("Several alignments are named {}".format(", ".join(repeated)))
+    return libraries
+
+
+def get_alignments_stem(arguments: Dict[str, Any]) -> str:
+    """Return the name of the StringTie GTF and the ``.stats`` report of a sample.
+
+    It is the stem of the BAM, or ``merged_<digest>`` for several libraries:
+    the digest depends on the library names, so a changed set of libraries
+    gets a new merge and comparison.
+    """
+    libraries = arguments.get("libraries") or [arguments["alignments"]]
+    if len(libraries) == 1:
+        return Path(libraries[0]).stem
+    names = "\n".join(sorted(Path(library).stem for library in libraries))
+    return "merged_{}".format(hashlib.sha1(names.encode()).hexdigest()[:10])
+
+
+def get_stringtie_artifacts(arguments: Dict[str, Any]) -> Dict[str, Any]:
+    """Describe the StringTie stage (or the merge of the libraries) for the artifact cache."""
+    outdir = arguments["output"] / "RNASeqCheck"
+    outputs = [outdir / "{}.gtf".format(get_alignments_stem(arguments))]
+    libraries = arguments.get("libraries") or [arguments["alignments"]]
+    if len(libraries) > 1:
+        return {"inputs": [get_library_gtf_fpath(arguments, library) for library in libraries],
+                "tools": ["stringtie"],
+                "params": "merge",
+                "outputs": outputs}
+    shards = arguments.get("stringtie_shards", 1)
+    return {"inputs": [arguments["alignments"]],
+            "tools": ["stringtie"] if shards == 1 else ["stringtie", "samtools"],
+            "params": "" if shards == 1 else "shards={}".format(shards),
+            "outputs": outputs}
+
+
 def run_stringtie(arguments: Dict[str, Any]) -> Dict[str, Any]:
     """Run *stringtie* on the BAM file (or skip if the GTF already exists)."""
     
@@ -21,60 +94,325 @@ def run_stringtie(arguments: Dict[str, Any]) -> Dict[str, Any]:
     if not outdir.exists():
         outdir.mkdir(parents=True, exist_ok=True)
     
-    # sample‑specific prefix for outputs
-    output_name = outdir / Path(arguments["alignments"]).stem
+    # sample‑specific output, written to a temporary file first
+    outfile = outdir / "{}.gtf".format(get_alignments_stem(arguments))
+    tmp = tmp_fpath(outfile)
     
     # StringTie command line
-    cmd = "stringtie -o {}.gtf -p {} {}".format(output_name,
-                                                arguments["threads"],
-                                                arguments["alignments"])
+    cmd = "stringtie -o {} -p {} {}".format(tmp,
+                                            arguments["threads"],
+                                            arguments["alignments"])
 
-    outfile = outdir / "{}.gtf".format(Path(arguments["alignments"]).stem)
-    if outfile.exists():
+    if is_done(outfile):
         return {"command": cmd, 
                 "msg": "stringtie already done",
                 "out_fpath": outdir,
                 "returncode": 99}
     else:
         # Run stringtie
-        run_ = subprocess.run(cmd, shell=True, stderr=subprocess.PIPE)
+        discard(outfile)
+        run_ = run_command(cmd, shell=True, stderr=subprocess.PIPE)
         if run_.returncode == 0:
+            promote(tmp, outfile)
             msg = "stringtie ran successfully"
         else:
             msg = "stringtie Failed: \n {}".format(run_.stderr)
+        commit(outfile, run_.returncode, cmd)
         return {"command": cmd,
                 "msg": msg,
                 "out_fpath": outdir,
                 "returncode": run_.returncode}
 
 
+# ---------------------------------------------------------------------------
+# 1b. Region-sharded StringTie (``stringtie_shards`` > 1)
+# ---------------------------------------------------------------------------
+# Whole chromosomes are balanced across shards by mapped reads, so no locus
+# is ever split and the transcripts are the same as in a single run.
+def get_shards_dir(arguments: Dict[str, Any]) -> Path:
+    """Return the working folder of the StringTie shards."""
+    return arguments["output"] / "RNASeqCheck" / "shards"
+
+
+def get_stringtie_plan_fpath(arguments: Dict[str, Any]) -> Path:
+    """Return the table of the chromosomes of each StringTie shard."""
+    return get_shards_dir(arguments) / "shards.tsv"
+
+
+def get_stringtie_shard_fpath(arguments: Dict[str, Any], shard: int) -> Path:
+    """Return the StringTie GTF of one shard."""
+    return get_shards_dir(arguments) / "shard{}.gtf".format(shard)
+
+
+def plan_stringtie_shards(arguments: Dict[str, Any]) -> Dict[str, Any]:
+    """Index the BAM if needed and write the chromosomes of each shard."""
+    shards_dir = get_shards_dir(arguments)
+    shards_dir.mkdir(parents=True, exist_ok=True)
+    outfile = get_stringtie_plan_fpath(arguments)
+    bam = Path(arguments["alignments"])
+    # The BAM is linked into the shard folder so its index can be created there
+    shard_bam = shards_dir / bam.name
+    cmd = "samtools idxstats {}".format(shard_bam)
+
+    if is_done(outfile):
+        return {"command": cmd,
+                "msg": "StringTie shards already planned",
+                "out_fpath": outfile,
+                "returncode": 99}
+
+    discard(outfile)
+    if shard_bam.is_symlink() or shard_bam.exists():
+        shard_bam.unlink()
+    shard_bam.symlink_to(bam.resolve())
+    for index in (Path("{}.bai".format(bam)), Path("{}.csi".format(bam))):
+        if index.exists():
+            shutil.copyfile(index, shards_dir / index.name)
+            break
+    else:
+        index_cmd = "samtools index -@ {} {}".format(arguments["threads"], shard_bam)
+        run_ = run_command(index_cmd, shell=True, stderr=subprocess.PIPE)
+        if run_.returncode != 0:
+            commit(outfile, run_.returncode, index_cmd)
+            return {"command": index_cmd,
+                    "msg": "samtools index Failed: \n {}".format(run_.stderr),
+                    "out_fpath": outfile,
+                    "returncode": run_.returncode}
+
+    idxstats_fpath = shards_dir / "idxstats.tsv"
+    with open(idxstats_fpath, "w") as idxstats_fhand:
+        run_ = run_command(cmd, shell=True, stdout=idxstats_fhand, stderr=subprocess.PIPE)
+    if run_.returncode != 0:
+        commit(outfile, run_.returncode, cmd)
+        return {"command": cmd,
+                "msg": "samtools idxstats Failed: \n {}".format(run_.stderr),
+                "out_fpath": outfile,
+                "returncode": run_.returncode}
+
+    # idxstats: name, length, mapped, unmapped ('*' holds unplaced reads)
+    mapped = {}
+    with open(idxstats_fpath) as idxstats_fhand:
+        for line in idxstats_fhand:
+            fields = line.rstrip("\n").split("\t")
+            if len(fields) >= 3 and fields[0] != "*" and int(fields[2]) > 0:
+                mapped[fields[0]] = int(fields[2])
+    tmp = tmp_fpath(outfile)
+    with open(tmp, "w") as out_fhand:
+        for shard, chroms in enumerate(balance_shards(mapped, arguments["stringtie_shards"]), 1):
+            for chrom in chroms:
+                out_fhand.write("{}\t{}\n".format(shard, chrom))
+    promote(tmp, outfile)
+    commit(outfile, 0, cmd)
+    return {"command": cmd,
+            "msg": "{} chromosomes split in {} shards".format(len(mapped),
+                                                              arguments["stringtie_shards"]),
+            "out_fpath": outfile,
+            "returncode": 0}
+
+
+def read_shard_chroms(arguments: Dict[str, Any], shard: int) -> List[str]:
+    """Return the chromosomes planned for ``shard``."""
+    with open(get_stringtie_plan_fpath(arguments)) as shards_fhand:
+        return [line.split("\t")[1].rstrip("\n") for line in shards_fhand
+                if int(line.split("\t")[0]) == shard]
+
+
+def run_stringtie_shard(arguments: Dict[str, Any], shard: int) -> Dict[str, Any]:
+    """Extract the reads of one shard and run *stringtie* on them."""
+    shards_dir = get_shards_dir(arguments)
+    outfile = get_stringtie_shard_fpath(arguments, shard)
+    shard_bam = shards_dir / "shard{}.bam".format(shard)
+    tmp = tmp_fpath(outfile)
+    chroms = read_shard_chroms(arguments, shard)
+    cmd = ("samtools view -b -@ {threads} -o {shard_bam} {bam} {chroms} && "
+           "stringtie -o {tmp} -p {threads} {shard_bam}").format(
+        threads=arguments["threads"], shard_bam=shard_bam,
+        bam=shards_dir / Path(arguments["alignments"]).name,
+        chroms=" ".join("'{}'".format(chrom) for chrom in chroms), tmp=tmp)
+
+    if is_done(outfile):
+        return {"command": cmd,
+                "msg": "stringtie shard {} already done".format(shard),
+                "out_fpath": outfile,
+                "returncode": 99}
+
+    discard(outfile)
+    if not chroms:
+        # More shards than chromosomes with reads
+        tmp.touch()
+        returncode, msg = 0, "stringtie shard {} is empty".format(shard)
+    else:
+        run_ = run_command(cmd, shell=True, stderr=subprocess.PIPE)
+        returncode = run_.returncode
+        if returncode == 0:
+            msg = "stringtie shard {} ran successfully".format(shard)
+        else:
+            msg = "stringtie shard {} Failed: \n {}".format(shard, run_.stderr)
+    if shard_bam.exists():
+        shard_bam.unlink()
+    if returncode == 0:
+        promote(tmp, outfile)
+    commit(outfile, returncode, cmd)
+    return {"command": cmd,
+            "msg": msg,
+            "out_fpath": outfile,
+            "returncode": returncode}
+
+
+def merge_stringtie_shards(arguments: Dict[str, Any]) -> Dict[str, Any]:
+    """Join the shard GTFs into ``RNASeqCheck/<bam>.gtf``.
+
+    StringTie numbers its genes from ``STRG.1`` in every run, so the ids of
+    each shard are prefixed with the shard number to keep them unique.
+    """
+    outdir = arguments["output"] / "RNASeqCheck"
+    outfile = outdir / "{}.gtf".format(get_alignments_stem(arguments))
+    n_shards = arguments["stringtie_shards"]
+    shard_fpaths = [get_stringtie_shard_fpath(arguments, shard)
+                    for shard in range(1, n_shards + 1)]
+    cmd = "merge {} > {}".format(" ".join(str(fpath) for fpath in shard_fpaths), outfile)
+
+    if is_done(outfile):
+        return {"command": cmd,
+                "msg": "stringtie already done",
+                "out_fpath": outdir,
+                "returncode": 99}
+
+    discard(outfile)
+    tmp = tmp_fpath(outfile)
+    with open(tmp, "w") as out_fhand:
+        for shard, shard_fpath in enumerate(shard_fpaths, 1):
+            with open(shard_fpath) as shard_fhand:
+                for line in shard_fhand:
+                    if line.startswith("#"):
+                        if shard == 1:
+                            out_fhand.write(line)
+                        continue
+                    out_fhand.write(line.replace('"STRG.', '"STRG.{}_'.format(shard)))
+    promote(tmp, outfile)
+    commit(outfile, 0, cmd)
+    return {"command": cmd,
+            "msg": "stringtie ran successfully on {} shards".format(n_shards),
+            "out_fpath": outdir,
+            "returncode": 0}
+
+
+# ---------------------------------------------------------------------------
+# 1c. Several libraries per sample
+# ---------------------------------------------------------------------------
+# Each library is assembled on its own into ``RNASeqCheck/libraries`` and
+# kept there, so adding a library to a sample only assembles that one before
+# the merge is run again.
+def get_library_gtf_fpath(arguments: Dict[str, Any], library: str) -> Path:
+    """Return the StringTie GTF of one library of a sample."""
+    return arguments["output"] / "RNASeqCheck" / "libraries" / "{}.gtf".format(Path(library).stem)
+
+
+def get_stringtie_library_artifacts(arguments: Dict[str, Any]) -> Dict[str, Any]:
+    """Describe the StringTie stage of one library for the artifact cache."""
+    return {"inputs": [arguments["alignments"]],
+            "tools": ["stringtie"],
+            "params": "",
+            "outputs": [get_library_gtf_fpath(arguments, arguments["alignments"])]}
+
+
+def run_stringtie_library(arguments: Dict[str, Any]) -> Dict[str, Any]:
+    """Run *stringtie* on one library (``alignments``) of a sample."""
+    outfile = get_library_gtf_fpath(arguments, arguments["alignments"])
+    tmp = tmp_fpath(outfile)
+    cmd = "stringtie -o {} -p {} {}".format(tmp, arguments["threads"], arguments["alignments"])
+
+    if is_done(outfile):
+        return {"command": cmd,
+                "msg": "stringtie already done for {}".format(Path(arguments["alignments"]).name),
+                "out_fpath": outfile,
+                "returncode": 99}
+
+    discard(outfile)
+    outfile.parent.mkdir(parents=True, exist_ok=True)
+    run_ = run_command(cmd, shell=True, stderr=subprocess.PIPE)
+    if run_.returncode == 0:
+        promote(tmp, outfile)
+        msg = "stringtie ran successfully on {}".format(Path(arguments["alignments"]).name)
+    else:
+        msg = "stringtie Failed on {}: \n {}".format(Path(arguments["alignments"]).name,
+                                                      run_.stderr)
+    commit(outfile, run_.returncode, cmd)
+    return {"command": cmd,
+            "msg": msg,
+            "out_fpath": outfile,
+            "returncode": run_.returncode}
+
+
+def merge_stringtie_libraries(arguments: Dict[str, Any]) -> Dict[str, Any]:
+    """Combine the library GTFs with *stringtie --merge* into ``RNASeqCheck/<merged>.gtf``."""
+    outdir = arguments["output"] / "RNASeqCheck"
+    outfile = outdir / "{}.gtf".format(get_alignments_stem(arguments))
+    tmp = tmp_fpath(outfile)
+    gtf_fpaths = [get_library_gtf_fpath(arguments, library) for library in arguments["libraries"]]
+    cmd = "stringtie --merge -p {} -o {} {}".format(arguments["threads"], tmp,
+                                                    " ".join(str(fpath) for fpath in gtf_fpaths))
+
+    if is_done(outfile):
+        return {"command": cmd,
+                "msg": "stringtie merge already done",
+                "out_fpath": outdir,
+                "returncode": 99}
+
+    discard(outfile)
+    run_ = run_command(cmd, shell=True, stderr=subprocess.PIPE)
+    if run_.returncode == 0:
+        promote(tmp, outfile)
+        msg = "stringtie merged {} libraries successfully".format(len(gtf_fpaths))
+    else:
+        msg = "stringtie merge Failed: \n {}".format(run_.stderr)
+    commit(outfile, run_.returncode, cmd)
+    return {"command": cmd,
+            "msg": msg,
+            "out_fpath": outdir,
+            "returncode": run_.returncode}
+
+
 # ---------------------------------------------------------------------------
 # 2.  Compare transcripts with GFFcompare
 # ---------------------------------------------------------------------------
+def get_gffcompare_artifacts(arguments: Dict[str, Any]) -> Dict[str, Any]:
+    """Describe the GFFcompare stage for the artifact cache."""
+    outdir = arguments["output"] / "RNASeqCheck"
+    stem = get_alignments_stem(arguments)
+    return {"inputs": [outdir / "{}.gtf".format(stem), arguments["ref_annotation"]],
+            "tools": ["gffcompare"],
+            "params": "",
+            "outputs": [outdir / "{}.stats".format(stem)]}
+
+
 def run_gffcompare(arguments: Dict[str, Any]) -> Dict[str, Any]:
     """Run *gffcompare* against the reference annotation (or skip if done)."""
     
     outdir = arguments["output"] / "RNASeqCheck"
-    gtffile = outdir / "{}.gtf".format(Path(arguments["alignments"]).stem)
-    output_name = outdir / Path(arguments["alignments"]).stem
+    gtffile = outdir / "{}.gtf".format(get_alignments_stem(arguments))
+    output_name = outdir / get_alignments_stem(arguments)
     
     # GFFcompare command line
     cmd = "gffcompare -r {} {} -o {}.stats".format(arguments["ref_annotation"],
                                             gtffile,
                                             output_name)
     
-    outfile = outdir / "{}.stats".format(Path(arguments["alignments"]).stem)
-    if outfile.exists():
+    outfile = outdir / "{}.stats".format(get_alignments_stem(arguments))
+    if is_done(outfile):
         return {"command": cmd, 
                 "msg": "gffcompare already done",
                 "out_fpath": outfile,
                 "returncode": 99}
     else:
-        run_ = subprocess.run(cmd, shell=True, stderr=subprocess.PIPE)
+        # gffcompare writes several files from the prefix: only the marker
+        # of the .stats report tells whether it finished
+        discard(outfile)
+        run_ = run_command(cmd, shell=True, stderr=subprocess.PIPE)
         if run_.returncode == 0:
             msg = "gffcompare ran successfully"
         else:
             msg = "gffcompare Failed: \n {}".format(run_.stderr)
+        commit(outfile, run_.returncode, cmd)
         return {"command": cmd, 
                 "msg": msg,
                 "out_fpath": outfile, 
@@ -84,14 +422,19 @@ def run_gffcompare(arguments: Dict[str, Any]) -> Dict[str, Any]:
 # ---------------------------------------------------------------------------
 # 3.  Derive simple F1-style support scores from *.stats*
 # ---------------------------------------------------------------------------
+def get_annotation_stats_fpath(arguments: Dict[str, Any]) -> Path:
+    """Return the *.stats* file written by GFFcompare (or the native comparator)."""
+    return arguments["output"] / "RNASeqCheck" / "{}.stats".format(get_alignments_stem(arguments))
+
+
 def calculate_annotation_scores(arguments: Dict[str, Any]) -> Dict[str, Any]:
     """Return F1 scores and matching counts parsed from the *.stats* file."""
     
     # Locate the stats file produced by GFFcompare
-    statsfile = arguments["output"] / "RNASeqCheck"/ "{}.stats".format(Path(arguments["alignments"]).stem)
+    statsfile = get_annotation_stats_fpath(arguments)
 
     # Headings we look for in the .stats report
-    f1_checks = ["Transcript level:", "Locus level:"]
+    f1_checks = ["Exon level:", "Intron level:", "Transcript level:", "Locus level:"]
     number_check = ["Matching transcripts:", "Matching loci:"]
     
     f1_scores = {} # dictionary for F1 scores
@@ -105,14 +448,17 @@ def calculate_annotation_scores(arguments: Dict[str, Any]) -> Dict[str, Any]:
                     line = line.split()
                     sensitivity = float(line[2])
                     precision = float(line[4])
-                    f1_calc = 2*(sensitivity*precision)/(sensitivity+precision)
+                    if sensitivity + precision:
+                        f1_calc = 2*(sensitivity*precision)/(sensitivity+precision)
+                    else:
+                        f1_calc = 0.0
                     f1_scores[check[:-1]+"_f1"] = f1_calc
             # Matching numbers
             for check in number_check:
                 if check in line:
                     line = line.strip()
                     line = line.split()
-                    matching_number = line[-1]
+                    matching_number = int(line[-1])
                     f1_scores[check] = matching_number
     return f1_scores
 
@@ -3,11 +3,29 @@ table.py
 ========
 Defines the column orders for the final summary TSV:
 
+- ASSEMBLY_COLS: native statistics of the assembly.
 - AGAT_COLS: metrics produced by AGAT statistics.
+- BUSCO_COLS: BUSCO completeness percentages and lineage size.
+- LAI_COLS: genome-wide LAI values of the assembly.
 - RNASEQ_COLS: support scores and counts from the RNA-seq pipeline.
+- SUMMARY_COLS: every column of the summary, in order.
+- COL_TYPES: type of every column (``int``, ``float`` or ``str``).
+- LAI_WINDOW_COLS: columns of the per-window LAI table.
 """
 
-from typing import List
+from typing import Dict, List
+
+# ---------------------------------------------------------------------------
+# 0. Columns from the assembly statistics
+# ---------------------------------------------------------------------------
+ASSEMBLY_COLS: List[str] = ["Assembly Length (bp)",
+                            "Assembly Sequences (N)",
+                            "Assembly N50 (bp)",
+                            "Assembly L50 (N)",
+                            "Assembly GC (%)",
+                            "Assembly N (%)",
+                            "Assembly Gaps (N)",
+                            "Longest Sequence (bp)"]
 
 # ---------------------------------------------------------------------------
 # 1. Columns from AGAT statistics
@@ -40,7 +58,51 @@ AGAT_COLS: List[str] = ["Gene_Models (N)",
 # ---------------------------------------------------------------------------
 # These headers correspond to the F1-style scores and matching counts
 # produced by the StringTie + GFFcompare step.
-RNASEQ_COLS: List[str] = ["Transcript level_f1", 
+RNASEQ_COLS: List[str] = ["Exon level_f1",
+                        "Intron level_f1",
+                        "Transcript level_f1",
                         "Locus level_f1",
                         "Matching transcripts:",
                         "Matching loci:"]
+
+# ---------------------------------------------------------------------------
+# 3. Columns from BUSCO and LAI
+# ---------------------------------------------------------------------------
+# Values of the BUSCO "C:..%[S:..%,D:..%],F:..%,M:..%,n:.." line.
+BUSCO_COLS: List[str] = ["BUSCO Complete (%)",
+                         "BUSCO Single (%)",
+                         "BUSCO Duplicated (%)",
+                         "BUSCO Fragmented (%)",
+                         "BUSCO Missing (%)",
+                         "BUSCO Lineage Size (N)"]
+
+# "whole_genome" row of the .mod.out.LAI file, plus the number of windows.
+# The native engine corrects the raw LAI with another LTR identity, so its
+# value goes to LAI_native instead of LAI.
+LAI_COLS: List[str] = ["LAI",
+                       "LAI_native",
+                       "Raw LAI",
+                       "Intact LTR-RT Fraction",
+                       "Total LTR-RT Fraction",
+                       "LAI Windows (N)"]
+
+# Rows of the .mod.out.LAI file other than "whole_genome".
+LAI_WINDOW_COLS: List[str] = ["Assembly", "Chr", "From", "To", "Intact", "Total",
+                              "Raw LAI", "LAI", "LAI_native"]
+
+# ---------------------------------------------------------------------------
+# 4. Whole summary row
+# ---------------------------------------------------------------------------
+# Order of the columns of summary.tsv (one row per sample).
+SUMMARY_COLS: List[str] = ["Name"] + ASSEMBLY_COLS + AGAT_COLS + BUSCO_COLS + LAI_COLS + RNASEQ_COLS
+
+_FLOAT_COLS = ["Total Gene Space (Mb)", "Mean Gene Model Length (bp)", "Mean CDS Model Length (bp)",
+               "Mean Exon Length (bp)", "Mean Intron Length (bp)"]
+_FLOAT_COLS += ["Assembly GC (%)", "Assembly N (%)"]
+_FLOAT_COLS += BUSCO_COLS[:-1] + LAI_COLS[:-1] + RNASEQ_COLS[:4]
+_FLOAT_COLS += ["Intact", "Total", "Raw LAI"]
+_STR_COLS = ["Name", "Assembly", "Chr"]
+
+COL_TYPES: Dict[str, str] = {col: "float" if col in _FLOAT_COLS else
+                             "str" if col in _STR_COLS else "int"
+                             for col in SUMMARY_COLS + LAI_WINDOW_COLS}
@@ -0,0 +1,392 @@
+"""
+workqueue.py
+============
+Shared-filesystem work queue to spread the stages of a run over several
+machines.
+
+* **run_queue**  - coordinator side: puts the stage graph in a SQLite file,
+  then follows it until every stage is done, skipping stages whose
+  dependencies failed, and returns the results like
+  :func:`src.scheduler.run_stages`.
+* **run_worker** - worker side (``GAQET.py worker QUEUE``): claims ready
+  stages that fit in its threads (and ``--max-mem``), runs them and stores
+  their results. Any number of workers, on any node that sees the queue file
+  and the output folder, can serve the same queue.
+
+Stages are stored pickled (runner and arguments), so workers need the same
+GAQET version and the same tools on their ``PATH``. Claims are atomic
+(``BEGIN IMMEDIATE``); workers write a heartbeat, and the stages of a worker
+that stops beating are put back in the queue (stage outputs are
+checkpointed, so running one again is safe). A worker wrongly taken as dead
+may still be running the stage: it writes its own temporary outputs, and
+neither promotes its outputs nor stores its result once another worker owns
+the stage. A queue file is only replaced when no live worker runs its
+stages. Workers also pin (and keep renewing) the cache entries the
+coordinator planned to restore, so no eviction removes them. A stage killed by the OOM killer
+is put back with twice its memory reservation, like in
+:func:`src.scheduler.run_stages`. The default rollback journal is used
+instead of WAL, which does not work on network filesystems.
+"""
+
+import json
+import os
+import pickle
+import socket
+import sqlite3
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from src.cache import get_pinned, pin
+from src.checkpoint import claim_outputs
+from src.scheduler import (
+    MAX_OOM_RETRIES, allocate_threads, call_stage, check_graph, get_memory, killed_by_oom,
+    succeeded
+)
+
+# Seconds between queue polls
+POLL_INTERVAL = 2.0
+
+# Seconds without heartbeat after which a worker is taken as dead
+STALE_AFTER = 600
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS tasks (
+    name TEXT PRIMARY KEY,
+    position INTEGER,
+    grp TEXT,
+    deps TEXT,
+    after TEXT DEFAULT '[]',
+    threads TEXT,
+    memory REAL DEFAULT 0,
+    attempts INTEGER DEFAULT 0,
+    payload BLOB,
+    state TEXT DEFAULT 'pending',
+    ok INTEGER,
+    worker TEXT,
+    given INTEGER,
+    result BLOB,
+    reported INTEGER DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS workers (
+    id TEXT PRIMARY KEY,
+    heartbeat REAL
+);
+CREATE TABLE IF NOT EXISTS pins (
+    key TEXT PRIMARY KEY,
+    cache_dir TEXT
+);
+"""
+
+
+# ---------------------------------------------------------------------------
+# 1. Queue file
+# ---------------------------------------------------------------------------
+def connect(queue_fpath: Path) -> sqlite3.Connection:
+    """Open the queue (autocommit; transactions are explicit)."""
+    connection = sqlite3.connect(str(queue_fpath), timeout=120, isolation_level=None)
+    connection.executescript(SCHEMA)
+    return connection
+
+
+def create_queue(queue_fpath: Path, stages: Dict[str, Dict[str, Any]]) -> None:
+    """Write a new queue holding every stage of the graph.
+
+    An earlier queue in the same file is replaced, unless live workers are
+    still running some of its stages (``RuntimeError``).
+    """
+    order = check_graph(stages)
+    queue_fpath = Path(queue_fpath)
+    queue_fpath.parent.mkdir(parents=True, exist_ok=True)
+    if queue_fpath.exists():
+        connection = connect(queue_fpath)
+        running = connection.execute(
+            "SELECT COUNT(*) FROM tasks JOIN workers ON tasks.worker = workers.id "
+            "WHERE tasks.state = 'running' AND workers.heartbeat >= ?",
+            (time.time() - STALE_AFTER,)).fetchone()[0]
+        connection.close()
+        if running:
+            raise RuntimeError("Queue {} still has {} stages run by live workers; stop them or "
+                               "use another queue file".format(queue_fpath, running))
+        queue_fpath.unlink()
+    connection = connect(queue_fpath)
+    with connection:
+        connection.execute("BEGIN")
+        for position, name in enumerate(order):
+            stage = stages[name]
+            payload = pickle.dumps({"run": stage["run"], "args": stage["args"],
+                                    "group": stage.get("group")})
+            connection.execute(
+                "INSERT INTO tasks (name, position, grp, deps, after, threads, memory, payload) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (name, position, stage.get("group"), json.dumps(stage["deps"]),
+                 json.dumps(stage.get("after") or []), str(stage["threads"]),
+                 stage.get("memory") or 0, payload))
+        # Cache entries the pruned graph relies on, for the workers to pin
+        connection.executemany("INSERT OR IGNORE INTO pins (key, cache_dir) VALUES (?, ?)",
+                               ((key, str(cache_dir))
+                                for key, cache_dir in get_pinned().items()))
+    connection.close()
+
+
+def _finish_task(connection: sqlite3.Connection, name: str, state: str,
+                 result: Dict[str, Any], worker: Optional[str] = None) -> bool:
+    """Store the result of a task; return False if it was not stored.
+
+    With ``worker`` the result is only stored while that worker still owns
+    the running task: a worker taken as dead may still be running a stage
+    that was given to another one.
+    """
+    values = (state, int(succeeded(result)) if state == "done" else 0, pickle.dumps(result), name)
+    if worker is None:
+        cursor = connection.execute("UPDATE tasks SET state = ?, ok = ?, result = ? "
+                                    "WHERE name = ?", values)
+    else:
+        cursor = connection.execute("UPDATE tasks SET state = ?, ok = ?, result = ? "
+                                    "WHERE name = ? AND state = 'running' AND worker = ?",
+                                    values + (worker,))
+    return cursor.rowcount > 0
+
+
+# ---------------------------------------------------------------------------
+# 2. Coordinator
+# ---------------------------------------------------------------------------
+def _skip_blocked(connection: sqlite3.Connection, fail_fast: bool) -> None:
+    """Skip pending stages that can no longer run."""
+    connection.execute("BEGIN IMMEDIATE")
+    try:
+        rows = connection.execute("SELECT name, grp, deps, state, ok FROM tasks "
+                                  "ORDER BY position").fetchall()
+        failed = {name: group for name, group, _, state, ok in rows
+                  if state == "done" and not ok}
+        failed_groups = {group: name for name, group in failed.items()} if fail_fast else {}
+        # Skipped stages block their dependents too (rows are in dependency order)
+        skipped = {name for name, _, _, state, _ in rows if state == "skipped"}
+        for name, group, deps, state, _ in rows:
+            if state != "pending":
+                continue
+            blocked = [dep for dep in json.loads(deps) if dep in failed or dep in skipped]
+            if blocked:
+                skipped.add(name)
+                _finish_task(connection, name, "skipped",
+                             {"msg": "{} skipped: {} failed".format(name, blocked[0]),
+                              "out_fpath": None,
+                              "returncode": None})
+            elif group in failed_groups:
+                skipped.add(name)
+                _finish_task(connection, name, "skipped",
+                             {"msg": "{} cancelled: {} failed".format(name, failed_groups[group]),
+                              "out_fpath": None,
+                              "returncode": None})
+        connection.execute("COMMIT")
+    except BaseException:
+        connection.execute("ROLLBACK")
+        raise
+
+
+def _requeue_stale(connection: sqlite3.Connection) -> None:
+    """Put back the running stages of workers that stopped beating."""
+    limit = time.time() - STALE_AFTER
+    connection.execute("UPDATE tasks SET state = 'pending', worker = NULL "
+                       "WHERE state = 'running' AND worker IN "
+                       "(SELECT id FROM workers WHERE heartbeat < ?)", (limit,))
+
+
+def run_queue(stages: Dict[str, Dict[str, Any]], queue_fpath: Path,
+              callback: Optional[Callable[[str, Dict[str, Any]], None]] = None,
+              fail_fast: bool = False,
+              poll: float = POLL_INTERVAL,
+              started: Optional[Callable[[str, int, float], None]] = None
+              ) -> Dict[str, Dict[str, Any]]:
+    """Queue the stage graph, wait for the workers and return ``{stage_name: result}``.
+
+    ``callback(stage_name, result)`` is called as each stage result comes in,
+    and ``started(stage_name, threads, memory)`` when a worker is seen
+    running it.
+    With ``fail_fast`` a failed stage skips the pending stages of its group
+    (stages already running on other workers finish).
+    """
+    create_queue(queue_fpath, stages)
+    connection = connect(queue_fpath)
+    results = {}
+    seen_running = set()
+    while len(results) < len(stages):
+        _skip_blocked(connection, fail_fast)
+        _requeue_stale(connection)
+        if started is not None:
+            for name, given, memory, worker in connection.execute(
+                    "SELECT name, given, memory, worker FROM tasks WHERE state = 'running'"
+                    ).fetchall():
+                if (name, worker) not in seen_running:
+                    seen_running.add((name, worker))
+                    started(name, given or 0, memory or 0.0)
+        rows = connection.execute("SELECT name, result FROM tasks WHERE reported = 0 AND "
+                                  "state IN ('done', 'skipped') ORDER BY position").fetchall()
+        for name, result in rows:
+            results[name] = pickle.loads(result)
+            connection.execute("UPDATE tasks SET reported = 1 WHERE name = ?", (name,))
+            if callback is not None:
+                callback(name, results[name])
+        if not rows and len(results) < len(stages):
+            time.sleep(poll)
+    connection.close()
+    return results
+
+
+# ---------------------------------------------------------------------------
+# 3. Worker
+# ---------------------------------------------------------------------------
+def _claim_task(connection: sqlite3.Connection, worker: str, free: int, total: int,
+                free_mem: Optional[float] = None, max_mem: Optional[float] = None
+                ) -> Optional[Tuple[str, Dict[str, Any], int, float]]:
+    """Claim the first ready stage that fits in ``free`` threads and ``free_mem`` MB.
+
+    Return ``(name, stage, threads, memory)`` or ``None``.
+    """
+    connection.execute("BEGIN IMMEDIATE")
+    try:
+        rows = connection.execute("SELECT name, deps, after, threads, memory, state, ok "
+                                  "FROM tasks ORDER BY position").fetchall()
+        ok = {name for name, _, _, _, _, state, task_ok in rows if state == "done" and task_ok}
+        ended = {name for name, _, _, _, _, state, _ in rows if state in ("done", "skipped")}
+        ready = [(name, threads, memory) for name, deps, after, threads, memory, state, _ in rows
+                 if state == "pending" and all(dep in ok for dep in json.loads(deps))
+                 and all(dep in ended for dep in json.loads(after))]
+        multi_waiting = len([name for name, threads, _ in ready if threads == "multi"])
+        for name, threads, memory in ready:
+            given = allocate_threads({"threads": threads}, free, total, multi_waiting)
+            memory = get_memory({"memory": memory}, max_mem)
+            if given and (max_mem is None or memory <= free_mem):
+                connection.execute("UPDATE tasks SET state = 'running', worker = ?, given = ? "
+                                   "WHERE name = ?", (worker, given, name))
+                payload = connection.execute("SELECT payload FROM tasks WHERE name = ?",
+                                             (name,)).fetchone()[0]
+                connection.execute("COMMIT")
+                stage = pickle.loads(payload)
+                stage["threads"] = threads
+                return name, stage, given, memory
+        connection.execute("COMMIT")
+    except BaseException:
+        connection.execute("ROLLBACK")
+        raise
+    return None
+
+
+def _queue_finished(connection: sqlite3.Connection) -> bool:
+    left = connection.execute("SELECT COUNT(*) FROM tasks "
+                              "WHERE state IN ('pending', 'running')").fetchone()[0]
+    total = connection.execute("SELECT COUNT(*) FROM tasks").fetchone()[0]
+    return total > 0 and not left
+
+
+def _get_pins(connection: sqlite3.Connection) -> Dict[str, List[str]]:
+    """Return ``{cache_dir: [key]}`` of the entries the coordinator pinned."""
+    pins: Dict[str, List[str]] = {}
+    for key, cache_dir in connection.execute("SELECT key, cache_dir FROM pins"):
+        pins.setdefault(cache_dir, []).append(key)
+    return pins
+
+
+def _retry_oom(connection: sqlite3.Connection, name: str, worker: str, memory: float,
+               max_mem: float) -> bool:
+    """Put back a stage killed by the OOM killer with a larger reservation.
+
+    Return False once it ran out of retries (its result is then stored).
+    Nothing is changed if ``worker`` no longer owns the task.
+    """
+    attempts = connection.execute("SELECT attempts FROM tasks WHERE name = ?",
+                                  (name,)).fetchone()[0]
+    if attempts >= MAX_OOM_RETRIES:
+        return False
+    connection.execute("UPDATE tasks SET state = 'pending', worker = NULL, memory = ?, "
+                       "attempts = attempts + 1 "
+                       "WHERE name = ? AND state = 'running' AND worker = ?",
+                       (min(max_mem, max(2 * memory, max_mem / 4)), name, worker))
+    return True
+
+
+def _run_claimed(queue_fpath: Path, worker: str, name: str, stage: Dict[str, Any],
+                 threads: int, timeout: Optional[float]) -> Dict[str, Any]:
+    """Run a claimed stage; its outputs are only promoted while ``worker`` owns it."""
+    connection = sqlite3.connect(str(queue_fpath), timeout=120, isolation_level=None)
+
+    def still_owned():
+        return connection.execute("SELECT state, worker FROM tasks WHERE name = ?",
+                                  (name,)).fetchone() == ("running", worker)
+
+    try:
+        with claim_outputs(worker, still_owned):
+            return call_stage(name, stage, threads, timeout)
+    finally:
+        connection.close()
+
+
+def run_worker(queue_fpath: Path, threads: int, timeout: Optional[float] = None,
+               poll: float = POLL_INTERVAL, max_mem: Optional[float] = None,
+               worker: Optional[str] = None) -> int:
+    """Run queued stages until the queue is finished; return how many ran.
+
+    ``max_mem`` (MB) is the memory budget of this worker. ``worker`` names
+    it in the queue (default ``<host>:<pid>``; set it to run several
+    workers in one process). Results of stages that were put back in the
+    queue while they ran are dropped, and their outputs are neither
+    promoted nor committed (see :func:`src.checkpoint.claim_outputs`).
+    """
+    queue_fpath = Path(queue_fpath)
+    while not queue_fpath.exists():
+        time.sleep(poll)
+    worker = worker or "{}:{}".format(socket.gethostname(), os.getpid())
+    connection = connect(queue_fpath)
+    total = max(1, threads)
+    free = total
+    free_mem = max_mem
+    running = {}
+    done_count = 0
+    with ThreadPoolExecutor(max_workers=total) as pool:
+        while True:
+            connection.execute("INSERT OR REPLACE INTO workers (id, heartbeat) VALUES (?, ?)",
+                               (worker, time.time()))
+            for cache_dir, keys in _get_pins(connection).items():
+                pin(cache_dir, keys)
+            if not running:
+                free_mem = max_mem
+            while free:
+                claimed = _claim_task(connection, worker, free, total, free_mem, max_mem)
+                if claimed is None:
+                    break
+                name, stage, given, memory = claimed
+                free -= given
+                if max_mem is not None:
+                    free_mem -= memory
+                running[pool.submit(_run_claimed, queue_fpath, worker, name, stage, given,
+                                    timeout)] = (name, given, memory)
+
+            if not running:
+                if _queue_finished(connection):
+                    break
+                time.sleep(poll)
+                continue
+
+            done, _ = wait(running, timeout=poll, return_when=FIRST_COMPLETED)
+            for future in done:
+                name, given, memory = running.pop(future)
+                free += given
+                if max_mem is not None:
+                    free_mem += memory
+                try:
+                    result = future.result()
+                except Exception as error:
+                    result = {"msg": "{} Failed: \n {}".format(name, error),
+                              "out_fpath": None,
+                              "returncode": 1}
+                if (max_mem is not None and killed_by_oom(result)
+                        and _retry_oom(connection, name, worker, memory, max_mem)):
+                    continue
+                # Another worker may own it now (this one was taken as dead)
+                if _finish_task(connection, name, "done", result, worker):
+                    done_count += 1
+    connection.execute("DELETE FROM workers WHERE id = ?", (worker,))
+    connection.close()
+    return done_count
+
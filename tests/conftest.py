@@ -0,0 +1,7 @@
+"""Shared set-up of the GAQET tests."""
+
+import sys
+from pathlib import Path
+
+# The tests import the modules as ``src.<module>``, like GAQET.py does
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
@@ -0,0 +1,69 @@
+"""Tests of the sharded ltrharvest stages (src/LTR_retriever.py)."""
+
+from src import LTR_retriever
+from src.checkpoint import commit, is_done
+from src.fasta import FaiRecord, get_fai_fpath, write_fai
+from src.LTR_retriever import (
+    get_harvest_fpath, get_harvest_plan_fpath, get_harvest_shard_fpath, merge_harvest_shards,
+    plan_harvest_shards, run_harvest_shard, write_shard_fasta
+)
+
+# Lines of 4 bases: chr1 10 bases, chr2 6 and chr3 4
+FASTA = ">chr1\nACGT\nACGT\nAC\n>chr2\nGGGG\nCC\n>chr3\nTTTT\n"
+
+
+def assembly(tmp_path, n_shards):
+    genome = tmp_path / "genome.fa"
+    genome.write_text(FASTA)
+    arguments = {"ref_assembly": genome, "assembly_dir": tmp_path / "asm",
+                 "LAI_dir": tmp_path / "asm" / "LAICompleteness", "harvest_shards": n_shards}
+    arguments["LAI_dir"].mkdir(parents=True)
+    write_fai([FaiRecord("chr1", 10, 6, 4, 5), FaiRecord("chr2", 6, 25, 4, 5),
+               FaiRecord("chr3", 4, 39, 4, 5)], get_fai_fpath(arguments))
+    return arguments
+
+
+def test_whole_sequences_are_balanced_by_length(tmp_path):
+    arguments = assembly(tmp_path, 2)
+    assert plan_harvest_shards(arguments)["returncode"] == 0
+    assert get_harvest_plan_fpath(arguments).read_text() == "1\tchr1\n2\tchr2\n2\tchr3\n"
+
+
+def test_shard_fasta_holds_its_sequences(tmp_path, monkeypatch):
+    # Sequences longer than a chunk are copied in several pieces
+    monkeypatch.setattr(LTR_retriever, "SHARD_CHUNK", 4)
+    arguments = assembly(tmp_path, 2)
+    out_fpath = tmp_path / "shard2.fa"
+    write_shard_fasta(arguments, ["chr2", "chr1"], out_fpath)
+    assert out_fpath.read_text() == ">chr2\nGGGG\nCC\n>chr1\nACGT\nACGT\nAC\n"
+
+
+def test_shard_without_sequences_is_empty(tmp_path):
+    arguments = assembly(tmp_path, 4)
+    plan_harvest_shards(arguments)
+    result = run_harvest_shard(arguments, 4)
+    assert result["returncode"] == 0 and "empty" in result["msg"]
+    assert is_done(get_harvest_shard_fpath(arguments, 4))
+
+
+def write_shard(arguments, shard, lines):
+    fpath = get_harvest_shard_fpath(arguments, shard)
+    fpath.parent.mkdir(parents=True, exist_ok=True)
+    fpath.write_text("".join(line + "\n" for line in lines))
+    commit(fpath, 0, "ltrharvest")
+
+
+def test_merge_keeps_the_first_header_and_every_prediction(tmp_path):
+    arguments = assembly(tmp_path, 3)
+    header = ["# args=-index shard", "# predictions are reported in the following way"]
+    write_shard(arguments, 1, header + ["100 900 801 100 199 100 800 900 101 95.0 chr1", ""])
+    # An empty shard has no header
+    write_shard(arguments, 2, [])
+    write_shard(arguments, 3, header + ["5 500 496 5 50 46 450 500 51 90.0 chr3"])
+
+    result = merge_harvest_shards(arguments)
+    assert result["returncode"] == 0
+    assert get_harvest_fpath(arguments).read_text().splitlines() == header + [
+        "100 900 801 100 199 100 800 900 101 95.0 chr1",
+        "5 500 496 5 50 46 450 500 51 90.0 chr3"]
+    assert merge_harvest_shards(arguments)["returncode"] == 99
@@ -0,0 +1,70 @@
+"""Tests of the native assembly statistics (src/assembly_stats.py)."""
+
+import pytest
+
+from src import assembly_stats
+from src.assembly_stats import (
+    SequenceStats, get_assembly_stats, run_assembly_stats, scan_assembly, summarize_sequences
+)
+from src.fasta import IndexedFasta, get_fai_fpath, read_fai
+from src.table import ASSEMBLY_COLS
+
+# chr1: 12 bases over two lines, two gaps; chr2: 4 bases, lower case, no N
+FASTA = ">chr1 first chromosome\nACGTNN\nNNGCAN\n>chr2\nacgg\n"
+
+
+def test_scan_counts_composition_and_index_records(tmp_path):
+    fasta = tmp_path / "genome.fa"
+    fasta.write_text(FASTA)
+    records, sequences = scan_assembly(fasta)
+
+    assert sequences == [SequenceStats("chr1", 12, 4, 5, 2), SequenceStats("chr2", 4, 3, 0, 0)]
+    assert [(record.name, record.length, record.linebases, record.linewidth)
+            for record in records] == [("chr1", 12, 6, 7), ("chr2", 4, 4, 5)]
+    assert FASTA[records[1].offset:].startswith("acgg")
+
+
+def test_gap_spanning_two_chunks_counts_once(tmp_path, monkeypatch):
+    monkeypatch.setattr(assembly_stats, "CHUNK_SIZE", 4)
+    fasta = tmp_path / "genome.fa"
+    fasta.write_text(">chr1\nACNNNNNNGT\n")
+    _, sequences = scan_assembly(fasta)
+    assert sequences == [SequenceStats("chr1", 10, 2, 6, 1)]
+
+
+def test_empty_fasta_has_no_sequences(tmp_path):
+    fasta = tmp_path / "genome.fa"
+    fasta.write_text("")
+    assert scan_assembly(fasta) == ([], [])
+    assert summarize_sequences([])["Assembly Length (bp)"] == 0
+
+
+def test_summary_n50_l50_and_percentages():
+    sequences = [SequenceStats("a", 50, 20, 10, 1), SequenceStats("b", 30, 15, 0, 0),
+                 SequenceStats("c", 20, 10, 0, 0)]
+    stats = summarize_sequences(sequences)
+    assert list(stats) == ASSEMBLY_COLS
+    assert stats["Assembly Length (bp)"] == 100
+    assert stats["Assembly Sequences (N)"] == 3
+    # Half of the 100 bp are in the longest sequence
+    assert (stats["Assembly N50 (bp)"], stats["Assembly L50 (N)"]) == (50, 1)
+    assert stats["Assembly GC (%)"] == pytest.approx(100 * 45 / 90, abs=0.01)
+    assert stats["Assembly N (%)"] == 10.0
+    assert stats["Assembly Gaps (N)"] == 1
+    assert stats["Longest Sequence (bp)"] == 50
+
+
+def test_stage_writes_the_stats_and_a_usable_fai(tmp_path):
+    fasta = tmp_path / "genome.fa"
+    fasta.write_text(FASTA)
+    arguments = {"ref_assembly": fasta, "assembly_dir": tmp_path / "assemblies" / "genome_ab"}
+    arguments["assembly_dir"].mkdir(parents=True)
+
+    result = run_assembly_stats(arguments)
+    assert result["returncode"] == 0
+    assert get_assembly_stats(result)["Assembly Length (bp)"] == 16
+    assert run_assembly_stats(arguments)["returncode"] == 99
+
+    assert read_fai(get_fai_fpath(arguments))["chr2"].length == 4
+    with IndexedFasta(fasta, get_fai_fpath(arguments)) as indexed:
+        assert indexed.fetch("chr1", 3, 8) == b"GTNNNN"
@@ -0,0 +1,95 @@
+"""Tests of the BUSCO batch mode (src/busco.py) with a stub ``busco``."""
+
+import os
+import sys
+
+import pytest
+
+from src.busco import collect_busco_batch, get_busco_batch_dir, get_busco_results, run_busco_batch
+from src.checkpoint import commit
+from src.table import BUSCO_COLS
+
+# Writes a short summary for every FASTA of the input folder, like BUSCO batch mode
+BUSCO_STUB = """#!{python}
+import sys
+from pathlib import Path
+
+args = sys.argv[1:]
+def option(name):
+    return args[args.index(name) + 1]
+
+outdir = Path(option("--out_path")) / option("-o")
+for fasta in sorted(Path(option("-i")).iterdir()):
+    (outdir / fasta.name).mkdir(parents=True)
+    summary = "short_summary.specific.{{}}.{{}}.txt".format(option("-l"), fasta.name)
+    (outdir / fasta.name / summary).write_text(
+        "\\tC:90.0%[S:85.0%,D:5.0%],F:4.0%,M:6.0%,n:100\\n")
+"""
+
+
+@pytest.fixture
+def busco_stub(tmp_path, monkeypatch):
+    bin_dir = tmp_path / "bin"
+    bin_dir.mkdir()
+    stub = bin_dir / "busco"
+    stub.write_text(BUSCO_STUB.format(python=sys.executable))
+    stub.chmod(0o755)
+    monkeypatch.setenv("PATH", "{}{}{}".format(bin_dir, os.pathsep, os.environ["PATH"]))
+
+
+def write_proteins(fpath):
+    fpath.parent.mkdir(parents=True, exist_ok=True)
+    fpath.write_text(">p1\nMKV\n")
+    commit(fpath, 0, "proteins")
+
+
+def make_batch(tmp_path, names):
+    samples = {name: {"name": name, "input": tmp_path / name / "proteins.fasta",
+                      "output": tmp_path / name}
+               for name in names}
+    return {"lineage": "eudicots_odb10", "output": tmp_path / "batch", "threads": 1,
+            "samples": samples}
+
+
+def test_batch_leaves_out_samples_without_proteins(tmp_path, busco_stub):
+    batch = make_batch(tmp_path, ["s1", "s2"])
+    write_proteins(batch["samples"]["s1"]["input"])
+
+    result = run_busco_batch(batch)
+    assert result["returncode"] == 0
+    assert "without s2" in result["msg"]
+    batch_dir = get_busco_batch_dir(batch)
+    assert (batch_dir / "s1.fasta").is_dir()
+    assert not (batch_dir / "s2.fasta").exists()
+
+    values = dict(batch["samples"]["s1"], busco_batch_dir=batch_dir)
+    collected = collect_busco_batch(values)
+    assert collected["returncode"] == 0
+    assert (collected["out_fpath"] / "batch_run").is_symlink()
+    busco = get_busco_results(collected, "eudicots_odb10")
+    assert busco[BUSCO_COLS[0]] == 90.0 and busco[BUSCO_COLS[-1]] == 100
+
+
+def test_done_batch_runs_again_once_a_left_out_sample_has_proteins(tmp_path, busco_stub):
+    batch = make_batch(tmp_path, ["s1", "s2"])
+    write_proteins(batch["samples"]["s1"]["input"])
+    run_busco_batch(batch)
+    assert run_busco_batch(batch)["returncode"] == 99
+
+    write_proteins(batch["samples"]["s2"]["input"])
+    assert run_busco_batch(batch)["returncode"] == 0
+    assert (get_busco_batch_dir(batch) / "s2.fasta").is_dir()
+
+
+def test_batch_without_any_proteins_fails(tmp_path, busco_stub):
+    result = run_busco_batch(make_batch(tmp_path, ["s1", "s2"]))
+    assert result["returncode"] == 1
+
+
+def test_collect_fails_without_a_short_summary(tmp_path):
+    batch_dir = tmp_path / "batch" / "BUSCOBatch"
+    (batch_dir / "s1.fasta").mkdir(parents=True)
+    collected = collect_busco_batch({"name": "s1", "output": tmp_path / "s1",
+                                     "busco_batch_dir": batch_dir})
+    assert collected["returncode"] == 1
+    assert "no short summary" in collected["msg"]
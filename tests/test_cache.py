@@ -0,0 +1,192 @@
+"""Tests of the artifact cache (src/cache.py) and of the pruning it allows (src/pipeline.py)."""
+
+import json
+import os
+from functools import partial
+
+import pytest
+
+from src import cache
+from src.cache import (
+    entry_dir, evict, fetch, get_leased, get_stage_key, has_entry, pin, release_pins, run_cached,
+    store
+)
+from src.checkpoint import commit, is_done, promote, tmp_fpath
+from src.pipeline import make_stage, prune_cached
+
+
+@pytest.fixture(autouse=True)
+def no_pins(monkeypatch):
+    """Each test starts with no pinned entries."""
+    monkeypatch.setattr(cache, "_PINNED", {})
+
+
+def artifacts(arguments):
+    return {"inputs": [arguments["input"]], "tools": [],
+            "params": "test {}".format(arguments["output"].name),
+            "outputs": [arguments["output"]]}
+
+
+def write_output(calls, arguments):
+    """Runner that copies its input to its output, committed."""
+    output = arguments["output"]
+    if is_done(output):
+        return {"msg": "already done", "out_fpath": output, "returncode": 99}
+    calls.append(output)
+    output.parent.mkdir(parents=True, exist_ok=True)
+    tmp = tmp_fpath(output)
+    tmp.write_text(arguments["input"].read_text().upper())
+    promote(tmp, output)
+    commit(output, 0)
+    return {"msg": "ran", "out_fpath": output, "returncode": 0}
+
+
+# ---------------------------------------------------------------------------
+# 1. Store, fetch and evict
+# ---------------------------------------------------------------------------
+def test_store_and_fetch_round_trip(tmp_path):
+    output = tmp_path / "out.txt"
+    output.write_text("result")
+    store(tmp_path / "cache", "ab" * 32, [output])
+    assert has_entry(tmp_path / "cache", "ab" * 32)
+
+    restored = tmp_path / "other" / "out.txt"
+    assert fetch(tmp_path / "cache", "ab" * 32, [restored])
+    assert restored.read_text() == "result"
+    assert not fetch(tmp_path / "cache", "cd" * 32, [restored])
+
+
+def test_evict_removes_least_recently_used_entries_but_not_pinned_ones(tmp_path):
+    cache_dir = tmp_path / "cache"
+    for index, key in enumerate(("aa" * 32, "bb" * 32, "cc" * 32)):
+        output = tmp_path / "out{}".format(index)
+        output.write_bytes(b"x" * 100)
+        store(cache_dir, key, [output])
+        meta = entry_dir(cache_dir, key) / "meta.json"
+        os.utime(meta, (1000 + index, 1000 + index))
+    pin(cache_dir, ["aa" * 32])
+
+    assert evict(cache_dir, 150) == ["bb" * 32, "cc" * 32]
+    assert has_entry(cache_dir, "aa" * 32)
+
+
+def write_lease(cache_dir, key, host, pid, expires):
+    """Write the lease of another process."""
+    lease_dir = cache_dir / "leases"
+    lease_dir.mkdir(parents=True, exist_ok=True)
+    lease_fpath = lease_dir / "{}.{}-{}".format(key, host, pid)
+    lease_fpath.write_text(json.dumps({"host": host, "pid": pid, "expires": expires}))
+    return lease_fpath
+
+
+def test_evict_keeps_entries_leased_by_other_live_processes(tmp_path, monkeypatch):
+    cache_dir = tmp_path / "cache"
+    for index, key in enumerate(("aa" * 32, "bb" * 32, "cc" * 32, "dd" * 32)):
+        output = tmp_path / "out{}".format(index)
+        output.write_bytes(b"x" * 100)
+        store(cache_dir, key, [output])
+        os.utime(entry_dir(cache_dir, key) / "meta.json", (1000 + index, 1000 + index))
+    monkeypatch.setattr(cache.socket, "gethostname", lambda: "node1")
+    # A live process on this host, and one on another host within its lease
+    write_lease(cache_dir, "aa" * 32, "node1", os.getppid(), 0)
+    write_lease(cache_dir, "bb" * 32, "node2", 1, cache.time.time() + 60)
+    # An expired lease of another host
+    expired = write_lease(cache_dir, "cc" * 32, "node2", 1, cache.time.time() - 60)
+
+    assert get_leased(cache_dir) == {"aa" * 32, "bb" * 32}
+    assert not expired.exists()
+    assert evict(cache_dir, 250) == ["cc" * 32, "dd" * 32]
+
+
+def test_pin_leases_end_with_their_process(tmp_path, monkeypatch):
+    cache_dir = tmp_path / "cache"
+    pin(cache_dir, ["aa" * 32])
+    lease_fpath = next((cache_dir / "leases").iterdir())
+    # Seen from another process on this host: the lease holds while the pid lives
+    monkeypatch.setattr(cache, "_PINNED", {})
+    assert get_leased(cache_dir) == {"aa" * 32}
+    lease = json.loads(lease_fpath.read_text())
+    lease_fpath.write_text(json.dumps(dict(lease, pid=2 ** 22 + 1)))
+    assert get_leased(cache_dir) == set()
+    assert not lease_fpath.exists()
+
+    pin(cache_dir, ["bb" * 32])
+    release_pins()
+    assert list((cache_dir / "leases").iterdir()) == []
+
+
+def test_run_cached_restores_outputs_of_another_run(tmp_path):
+    source = tmp_path / "input.txt"
+    source.write_text("sequence")
+    calls = []
+    runner = partial(write_output, calls)
+    first = {"input": source, "output": tmp_path / "run1" / "out.txt",
+             "cache_dir": tmp_path / "cache"}
+    assert run_cached(runner, artifacts, first)["returncode"] == 0
+
+    second = dict(first, output=tmp_path / "run2" / "out.txt")
+    results = run_cached(runner, artifacts, second)
+    assert results["returncode"] == 99
+    assert "(restored from cache)" in results["msg"]
+    assert second["output"].read_text() == "SEQUENCE"
+    assert calls == [first["output"]]
+
+
+# ---------------------------------------------------------------------------
+# 2. Pruning of the stage graph
+# ---------------------------------------------------------------------------
+def cached_graph(tmp_path, cached):
+    """Return an assembly/sample graph shaped like the real one.
+
+    ``asm/assembly_stats`` feeds ``s1/proteins`` and ``asm/LAI``, which also
+    waits for ``asm/LTR_retriever``. The stages in ``cached`` have an entry.
+    """
+    source = tmp_path / "genome.fa"
+    source.write_text(">chr1\nACGT\n")
+    calls = []
+
+    def staged(name, deps, group):
+        arguments = {"input": source, "output": tmp_path / "run" / name,
+                     "cache_dir": tmp_path / "cache"}
+        return make_stage(partial(write_output, calls), arguments, deps, group=group,
+                          artifacts=artifacts)
+
+    stages = {"asm/assembly_stats": staged("assembly_stats", [], "asm"),
+              "asm/LTR_retriever": make_stage(partial(write_output, calls),
+                                              {"input": source,
+                                               "output": tmp_path / "run" / "LTR_retriever"},
+                                              [], group="asm"),
+              "asm/LAI": staged("LAI", ["asm/LTR_retriever", "asm/assembly_stats"], "asm"),
+              "s1/proteins": staged("proteins", ["asm/assembly_stats"], "s1"),
+              "s1/busco": staged("busco", ["s1/proteins"], "s1")}
+    for name in cached:
+        stage = stages[name]
+        output = tmp_path / "earlier" / name.replace("/", "_")
+        output.parent.mkdir(exist_ok=True)
+        output.write_text("cached")
+        store(tmp_path / "cache", get_stage_key(artifacts, stage["args"]), [output])
+    return stages
+
+
+def test_prune_cached_drops_stages_only_needed_by_cached_ones(tmp_path):
+    stages = prune_cached(cached_graph(tmp_path, ["asm/LAI"]))
+    assert "asm/LTR_retriever" not in stages
+    assert stages["asm/LAI"]["deps"] == []
+    assert stages["s1/proteins"]["deps"] == ["asm/assembly_stats"]
+
+
+def test_prune_cached_keeps_summary_stages_whose_dependents_are_cached(tmp_path):
+    graph = cached_graph(tmp_path, ["asm/LAI", "s1/proteins", "s1/busco"])
+    stages = prune_cached(graph)
+    # The summary reads the results of assembly_stats, LAI and busco
+    assert {"asm/assembly_stats", "asm/LAI", "s1/busco"} <= set(stages)
+    assert "s1/proteins" not in stages
+
+
+def test_prune_cached_pins_the_entries_it_relies_on(tmp_path):
+    graph = cached_graph(tmp_path, ["asm/LAI"])
+    key = get_stage_key(artifacts, graph["asm/LAI"]["args"])
+    prune_cached(graph)
+    assert key in cache.get_pinned()
+    assert evict(tmp_path / "cache", 0) == []
+    assert has_entry(tmp_path / "cache", key)
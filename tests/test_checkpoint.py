@@ -0,0 +1,81 @@
+"""Tests of the completion markers (src/checkpoint.py)."""
+
+import pytest
+
+from src.checkpoint import (
+    claim_outputs, commit, discard, is_done, marker_fpath, promote, read_marker, tmp_fpath
+)
+
+
+def test_paths_are_hidden_siblings_of_the_output(tmp_path):
+    output = tmp_path / "report.txt"
+    assert tmp_fpath(output) == tmp_path / ".report.txt.partial"
+    assert marker_fpath(output) == tmp_path / ".report.txt.done"
+
+
+def test_promoted_and_committed_output_is_done(tmp_path):
+    output = tmp_path / "report.txt"
+    tmp = tmp_fpath(output)
+    tmp.write_text("new")
+    assert not is_done(output)
+
+    promote(tmp, output)
+    assert not tmp.exists() and output.read_text() == "new"
+    # Not done until its marker is written
+    assert not is_done(output)
+    commit(output, 0, "tool --run")
+    assert is_done(output)
+    assert read_marker(output)["command"] == "tool --run"
+
+
+def test_failed_or_missing_outputs_are_not_done(tmp_path):
+    output = tmp_path / "report.txt"
+    output.write_text("partial result")
+    commit(output, 1)
+    assert not is_done(output)
+
+    commit(output, 0)
+    output.unlink()
+    assert not is_done(output)
+
+
+def test_promote_replaces_a_stale_folder(tmp_path):
+    output = tmp_path / "busco_run"
+    (output / "old").mkdir(parents=True)
+    tmp = tmp_fpath(output)
+    (tmp / "new").mkdir(parents=True)
+    promote(tmp, output)
+    assert [child.name for child in output.iterdir()] == ["new"]
+
+
+def test_discard_removes_marker_temporary_and_stale_output(tmp_path):
+    output = tmp_path / "report.txt"
+    output.write_text("old")
+    commit(output, 0)
+    tmp_fpath(output).write_text("half written")
+    discard(output)
+    assert not output.exists()
+    assert not tmp_fpath(output).exists()
+    assert not marker_fpath(output).exists()
+
+
+def test_claimed_outputs_get_their_own_temporary_paths(tmp_path):
+    output = tmp_path / "report.txt"
+    with claim_outputs("node1:42", lambda: True):
+        assert tmp_fpath(output) == tmp_path / ".report.txt.node1_42.partial"
+        tmp_fpath(output).write_text("new")
+        promote(tmp_fpath(output), output)
+        commit(output, 0, "tool --run")
+    assert tmp_fpath(output) == tmp_path / ".report.txt.partial"
+    assert is_done(output)
+
+
+def test_outputs_of_a_lost_claim_are_not_promoted_or_committed(tmp_path):
+    output = tmp_path / "report.txt"
+    with claim_outputs("node1:42", lambda: False):
+        tmp_fpath(output).write_text("stale")
+        with pytest.raises(RuntimeError):
+            promote(tmp_fpath(output), output)
+        with pytest.raises(RuntimeError):
+            commit(output, 0, "tool --run")
+    assert not output.exists() and read_marker(output) is None
@@ -0,0 +1,103 @@
+"""Tests of the compressed inputs (src/compression.py)."""
+
+import gzip
+import zlib
+
+import pytest
+
+from src import compression
+from src.checkpoint import is_done
+from src.compression import (
+    decompress_file, get_decompressed_name, is_bgzf, is_gzipped, open_text, remove_decompressed,
+    run_decompress
+)
+
+
+def bgzf_block(data, crc=None):
+    """Return a BGZF block holding ``data``, as written by ``bgzip``."""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, -15)
+    deflated = compressor.compress(data) + compressor.flush()
+    block_size = 18 + len(deflated) + 8
+    header = (b"\x1f\x8b\x08\x04" + bytes(4) + b"\x00\xff" + (6).to_bytes(2, "little") +
+              b"BC" + (2).to_bytes(2, "little") + (block_size - 1).to_bytes(2, "little"))
+    crc = zlib.crc32(data) if crc is None else crc
+    return header + deflated + crc.to_bytes(4, "little") + len(data).to_bytes(4, "little")
+
+
+def write_bgzf(fpath, chunks):
+    # bgzip ends every file with an empty block
+    fpath.write_bytes(b"".join(bgzf_block(chunk) for chunk in chunks) + bgzf_block(b""))
+    return fpath
+
+
+CHUNKS = [">chr{}\n{}\n".format(index, "ACGT" * (index + 1)).encode() for index in range(7)]
+
+
+def test_files_are_recognised_by_their_content(tmp_path):
+    plain = tmp_path / "genome.fa.gz"
+    plain.write_text(">chr1\nACGT\n")
+    gzipped = tmp_path / "genome.fa"
+    gzipped.write_bytes(gzip.compress(b">chr1\nACGT\n"))
+    bgzipped = write_bgzf(tmp_path / "genome.txt", CHUNKS)
+
+    assert not is_gzipped(plain) and not is_bgzf(plain)
+    assert is_gzipped(gzipped) and not is_bgzf(gzipped)
+    assert is_gzipped(bgzipped) and is_bgzf(bgzipped)
+    with open_text(bgzipped) as fhand:
+        assert fhand.readline() == ">chr0\n"
+
+
+def test_decompressed_name_drops_the_compression_suffix():
+    assert get_decompressed_name("data/g1.fa.gz") == "g1.fa"
+    assert get_decompressed_name("data/g1.gff3.BGZ") == "g1.gff3"
+    assert get_decompressed_name("data/g1.fa") == "g1.fa"
+
+
+@pytest.mark.parametrize("threads", [1, 3])
+def test_bgzf_blocks_are_inflated_in_order(tmp_path, monkeypatch, threads):
+    # Several tasks of a few blocks each, more than the threads can hold at once
+    monkeypatch.setattr(compression, "BLOCKS_PER_TASK", 2)
+    source = write_bgzf(tmp_path / "genome.fa.bgz", CHUNKS)
+    decompress_file(source, tmp_path / "genome.fa", threads)
+    assert (tmp_path / "genome.fa").read_bytes() == b"".join(CHUNKS)
+
+
+def test_plain_gzip_is_decompressed_in_one_stream(tmp_path):
+    source = tmp_path / "genome.fa.gz"
+    source.write_bytes(gzip.compress(b"".join(CHUNKS)))
+    decompress_file(source, tmp_path / "genome.fa", 4)
+    assert (tmp_path / "genome.fa").read_bytes() == b"".join(CHUNKS)
+
+
+def test_crc_mismatch_fails_the_stage(tmp_path):
+    source = tmp_path / "genome.fa.gz"
+    source.write_bytes(bgzf_block(CHUNKS[0]) + bgzf_block(CHUNKS[1], crc=0) + bgzf_block(b""))
+    arguments = {"source": source, "scratch_dir": tmp_path / "scratch", "threads": 2}
+
+    result = run_decompress(arguments)
+    assert result["returncode"] == 1
+    assert "CRC mismatch" in result["msg"]
+    assert not result["out_fpath"].exists()
+
+
+def test_truncated_block_fails_the_stage(tmp_path):
+    source = tmp_path / "genome.fa.gz"
+    source.write_bytes(bgzf_block(CHUNKS[0]) + bgzf_block(CHUNKS[1])[:22])
+    result = run_decompress({"source": source, "scratch_dir": tmp_path / "scratch",
+                             "threads": 1})
+    assert result["returncode"] == 1
+    assert "Truncated" in result["msg"]
+
+
+def test_stage_writes_the_copy_once_and_removes_it(tmp_path):
+    arguments = {"source": write_bgzf(tmp_path / "genome.fa.gz", CHUNKS),
+                 "scratch_dir": tmp_path / "scratch" / "g1", "threads": 2}
+    result = run_decompress(arguments)
+    assert result["returncode"] == 0
+    assert result["out_fpath"] == tmp_path / "scratch" / "g1" / "genome.fa"
+    assert is_done(result["out_fpath"])
+    assert run_decompress(arguments)["returncode"] == 99
+
+    remove_decompressed(arguments)
+    assert not result["out_fpath"].exists()
+    assert not (tmp_path / "scratch" / "g1").exists()
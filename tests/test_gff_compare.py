@@ -0,0 +1,63 @@
+"""Tests of the native transcript comparison (src/gff_compare.py)."""
+
+from src.gff_compare import compare_annotations, read_transcripts, write_report
+
+REFERENCE = [
+    "##gff-version 3",
+    "chr1\t.\tmRNA\t100\t400\t.\t+\t.\tID=t1",
+    "chr1\t.\texon\t300\t400\t.\t+\t.\tParent=t1",
+    "chr1\t.\texon\t100\t200\t.\t+\t.\tParent=t1",
+    "chr1\t.\tmRNA\t1000\t1500\t.\t+\t.\tID=t2",
+    "chr1\t.\texon\t1000\t1500\t.\t+\t.\tParent=t2",
+    "chr1\t.\tmRNA\t2000\t2300\t.\t-\t.\tID=t3",
+    "chr1\t.\texon\t2000\t2100\t.\t-\t.\tParent=t3",
+    "chr1\t.\texon\t2200\t2300\t.\t-\t.\tParent=t3",
+]
+
+# StringTie-like GTF: same chain as t1, an unstranded single exon over t2
+# and a novel multi-exon transcript
+QUERY = [
+    'chr1\tStringTie\ttranscript\t100\t400\t.\t+\t.\tgene_id "S1"; transcript_id "q1";',
+    'chr1\tStringTie\texon\t100\t200\t.\t+\t.\tgene_id "S1"; transcript_id "q1";',
+    'chr1\tStringTie\texon\t300\t400\t.\t+\t.\tgene_id "S1"; transcript_id "q1";',
+    'chr1\tStringTie\ttranscript\t1010\t1500\t.\t.\t.\tgene_id "S2"; transcript_id "q2";',
+    'chr1\tStringTie\texon\t1010\t1500\t.\t.\t.\tgene_id "S2"; transcript_id "q2";',
+    'chr1\tStringTie\texon\t5000\t5100\t.\t+\t.\tgene_id "S3"; transcript_id "q3";',
+    'chr1\tStringTie\texon\t5200\t5300\t.\t+\t.\tgene_id "S3"; transcript_id "q3";',
+]
+
+
+def write(fpath, lines):
+    fpath.write_text("".join(line + "\n" for line in lines))
+    return fpath
+
+
+def test_read_transcripts_sorts_exons_per_transcript(tmp_path):
+    data = read_transcripts(write(tmp_path / "ref.gff3", REFERENCE))
+    first, last = data["offsets"][0], data["offsets"][1]
+    assert list(zip(data["starts"][first:last], data["ends"][first:last])) == [(100, 200),
+                                                                               (300, 400)]
+    assert list(data["t_strand"]) == [1, 1, -1]
+
+
+def test_compare_annotations_counts_every_level(tmp_path):
+    counts = compare_annotations(write(tmp_path / "ref.gff3", REFERENCE),
+                                 write(tmp_path / "query.gtf", QUERY))
+    # [reference, query, matched reference, matched query]
+    assert counts["Base"] == [905, 895, 693, 693]
+    assert counts["Exon"] == [5, 5, 2, 2]
+    assert counts["Intron"] == [2, 2, 1, 1]
+    assert counts["Intron chain"] == [2, 2, 1, 1]
+    assert counts["Transcript"] == [3, 3, 2, 2]
+    assert counts["Locus"] == [3, 3, 2, 2]
+
+
+def test_report_has_the_gffcompare_layout(tmp_path):
+    counts = compare_annotations(write(tmp_path / "ref.gff3", REFERENCE),
+                                 write(tmp_path / "query.gtf", QUERY))
+    report_fpath = tmp_path / "query.stats"
+    with open(report_fpath, "w") as report_fhand:
+        write_report(counts, "gff_compare -r ref.gff3 query.gtf", report_fhand)
+    report = report_fpath.read_text()
+    assert "Transcript level:    66.7     |    66.7    |" in report
+    assert "Missed loci:       1/3       ( 33.3%)" in report
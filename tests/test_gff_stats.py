@@ -0,0 +1,90 @@
+"""Tests of the native annotation statistics (src/gff_stats.py)."""
+
+from src.agat import get_agat_stats
+from src.gff_stats import compute_stats, read_annotation, run_gff_stats
+
+GFF3 = [
+    "##gff-version 3",
+    "chr1\t.\tgene\t1\t1000\t.\t+\t.\tID=g1",
+    "chr1\t.\tmRNA\t1\t1000\t.\t+\t.\tID=t1;Parent=g1",
+    "chr1\t.\tfive_prime_UTR\t1\t100\t.\t+\t.\tParent=t1",
+    # Exons and CDS out of order: they are sorted per transcript
+    "chr1\t.\texon\t801\t1000\t.\t+\t.\tParent=t1",
+    "chr1\t.\texon\t1\t200\t.\t+\t.\tParent=t1",
+    "chr1\t.\texon\t401\t600\t.\t+\t.\tParent=t1",
+    "chr1\t.\tCDS\t401\t600\t.\t+\t2\tParent=t1",
+    "chr1\t.\tCDS\t101\t200\t.\t+\t0\tParent=t1",
+    "chr1\t.\tCDS\t801\t900\t.\t+\t0\tParent=t1",
+    "chr1\t.\tthree_prime_UTR\t901\t1000\t.\t+\t.\tParent=t1",
+    # Overlaps g1 on the same strand; no exon lines (exons from the CDS)
+    "chr1\t.\tgene\t500\t700\t.\t+\t.\tID=g2",
+    "chr1\t.\tmRNA\t500\t700\t.\t+\t.\tID=t2;Parent=g2",
+    "chr1\t.\tCDS\t500\t700\t.\t+\t0\tParent=t2",
+    "chr1\t.\tgene\t2000\t2300\t.\t-\t.\tID=g3",
+    "chr1\t.\tmRNA\t2000\t2300\t.\t-\t.\tID=t3;Parent=g3",
+    "chr1\t.\texon\t2000\t2300\t.\t-\t.\tParent=t3",
+    "chr1\t.\tCDS\t2001\t2299\t.\t-\t0\tParent=t3",
+]
+
+GTF = [
+    'chr1\t.\texon\t1\t100\t.\t+\t.\tgene_id "G1"; transcript_id "T1";',
+    'chr1\t.\texon\t201\t300\t.\t+\t.\tgene_id "G1"; transcript_id "T1";',
+    'chr1\t.\texon\t150\t250\t.\t-\t.\tgene_id "G2"; transcript_id "T2";',
+]
+
+
+def write(fpath, lines):
+    fpath.write_text("".join(line + "\n" for line in lines))
+    return fpath
+
+
+def test_mrna_statistics(tmp_path):
+    report = compute_stats(read_annotation(write(tmp_path / "a.gff3", GFF3)))
+    stats = report["stats"]
+    assert report["section"] == "mrna"
+    assert stats["Number of gene"] == 3
+    assert stats["Number of mrna"] == 3
+    assert stats["Number of exon"] == 5
+    assert stats["Number of cds"] == 3
+    assert stats["Number of five_prime_utr"] == 1
+    assert stats["Number of three_prime_utr"] == 1
+    assert stats["Number gene overlapping"] == 2
+    assert stats["Number of single exon gene"] == 2
+    assert stats["Number of single exon mrna"] == 2
+    assert stats["Total gene length (bp)"] == 1000 + 201 + 301
+    assert stats["mean gene length (bp)"] == 501
+    assert stats["Longest gene (bp)"] == 1000
+    assert stats["Shortest gene (bp)"] == 201
+    # Exons 200, 200, 200 (t1), 201 (t2, from its CDS) and 301 (t3)
+    assert stats["mean exon length (bp)"] == 220
+    # CDS of 400 (t1), 201 (t2) and 299 (t3)
+    assert stats["mean cds length (bp)"] == 300
+    assert stats["Longest cds (bp)"] == 400
+    assert stats["Shortest cds piece (bp)"] == 100
+    # Introns between the CDS pieces of t1
+    assert stats["mean intron in cds length (bp)"] == 200
+    assert stats["Longest intron into cds part (bp)"] == 200
+    assert stats["Shortest intron into cds part (bp)"] == 200
+
+
+def test_gtf_with_exons_only_reports_transcripts(tmp_path):
+    report = compute_stats(read_annotation(write(tmp_path / "a.gtf", GTF)))
+    stats = report["stats"]
+    assert report["section"] == "transcript"
+    assert stats["Number of gene"] == 2
+    assert stats["Number of transcript"] == 2
+    assert stats["Number of exon"] == 3
+    assert stats["Number of single exon transcript"] == 1
+    # Different strands do not overlap
+    assert stats["Number gene overlapping"] == 0
+    assert stats["Shortest intron into exon part (bp)"] == 100
+
+
+def test_runner_writes_an_agat_style_report(tmp_path):
+    arguments = {"annotation": write(tmp_path / "a.gff3", GFF3), "output": tmp_path / "sample"}
+    result = run_gff_stats(arguments)
+    assert result["returncode"] == 0
+    stats = get_agat_stats(result)
+    assert stats["Gene_Models (N)"] == 3
+    assert stats["Transcript_Models (N)"] == 3
+    assert run_gff_stats(arguments)["returncode"] == 99
@@ -0,0 +1,93 @@
+"""Tests of the runtime history and the thread plan (src/history.py)."""
+
+import pytest
+
+from src.history import (
+    COMPRESSION_RATIO, MEMORY_MARGIN, estimate_memory, fit_models, get_default_history_fpath,
+    plan_memory, plan_threads, predict, record_history, stage_kind
+)
+
+# Perfectly scalable: one second of work per input byte, split over the threads
+SCALABLE = {"serial": 0.0, "parallel": 1.0, "runs": 4, "scales": True, "rss": None, "disk": None}
+
+
+def sample_stages(n_samples):
+    return {"s{}/busco".format(index): {"run": None, "args": {}, "deps": [], "threads": "multi",
+                                        "group": "s{}".format(index)}
+            for index in range(1, n_samples + 1)}
+
+
+def test_default_history_is_in_the_output_folder(tmp_path, monkeypatch):
+    monkeypatch.delenv("GAQET_HISTORY", raising=False)
+    assert get_default_history_fpath(tmp_path) == tmp_path / "history.sqlite"
+    monkeypatch.setenv("GAQET_HISTORY", "/shared/history.sqlite")
+    assert str(get_default_history_fpath(tmp_path)) == "/shared/history.sqlite"
+
+
+def test_many_samples_keep_one_thread_per_stage():
+    plan = plan_threads(sample_stages(16), 16, {"busco": SCALABLE})
+    assert set(plan.values()) == {1}
+
+
+def test_jobs_limit_spreads_the_threads_over_the_samples_in_flight():
+    stages = sample_stages(16)
+    plan = plan_threads(stages, 16, {"busco": SCALABLE}, max_groups=2,
+                        limited_groups=set(stage["group"] for stage in stages.values()))
+    # Two samples at a time share the 16 threads
+    assert set(plan.values()) == {8}
+
+
+def ran(threads, wall_s, max_rss_mb=None):
+    return {"msg": "ran", "returncode": 0,
+            "profile": {"threads": threads, "wall_s": wall_s, "max_rss_mb": max_rss_mb}}
+
+
+def test_stage_kind_drops_the_group_and_the_shard_number():
+    assert stage_kind("s1/busco") == "busco"
+    assert stage_kind("asm/harvest_shard12") == "harvest_shard"
+
+
+def test_recorded_runs_fit_an_amdahl_model(tmp_path):
+    history = tmp_path / "history.sqlite"
+    genome = tmp_path / "genome.fa"
+    genome.write_bytes(b"A" * 1000)
+    stages = {"asm/finder": {"args": {"ref_assembly": genome}},
+              "asm/LAI": {"args": {"ref_assembly": genome}}}
+    # 2 s of serial work plus 8 s that scale, over 1, 2 and 4 threads
+    for threads in (1, 2, 4):
+        recorded = record_history(history, stages, {
+            "asm/finder": ran(threads, 2 + 8 / threads, max_rss_mb=100 + threads),
+            "asm/LAI": {"msg": "LAI already done", "returncode": 99}})
+        assert recorded == 1
+
+    model = fit_models(history)["finder"]
+    assert model["runs"] == 3 and model["scales"]
+    assert model["serial"] * 1000 == pytest.approx(2)
+    assert model["parallel"] * 1000 == pytest.approx(8)
+    assert predict(model, 1000, 8) == pytest.approx(3)
+    # Cached stages are not timings
+    assert "LAI" not in fit_models(history)
+    # The memory estimate covers the largest recorded peak, plus the margin
+    assert estimate_memory("asm/finder", stages["asm/finder"],
+                           fit_models(history)) == pytest.approx(104 * MEMORY_MARGIN)
+
+
+def test_single_thread_count_does_not_tell_how_a_stage_scales(tmp_path):
+    history = tmp_path / "history.sqlite"
+    stages = {"s1/agat": {"args": {}}}
+    record_history(history, stages, {"s1/agat": ran(1, 5)})
+    record_history(history, stages, {"s1/agat": ran(1, 7)})
+    model = fit_models(history)["agat"]
+    assert not model["scales"]
+    assert model["serial"] == pytest.approx(6) and model["parallel"] == 0
+
+
+def test_default_memory_of_compressed_inputs_counts_their_plain_size(tmp_path):
+    compressed = tmp_path / "genome.fa.gz"
+    compressed.write_bytes(b"x" * 1024 ** 2)
+    stage = {"args": {"ref_assembly": tmp_path / "scratch" / "genome.fa",
+                      "sources": {"ref_assembly": compressed}}}
+    assert estimate_memory("asm/LAI", stage, {}) == pytest.approx(2.0 * COMPRESSION_RATIO)
+    assert estimate_memory("s1/summary", stage, {}) == 0
+    # The memory table of the config is in GB
+    assert plan_memory({"asm/LAI": stage}, {}, {"LAI": 2}) == {"asm/LAI": 2048.0}
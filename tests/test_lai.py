@@ -0,0 +1,103 @@
+"""Tests of the native LAI engine (src/lai.py)."""
+
+import pytest
+
+from src.fasta import FaiRecord
+from src.lai import (
+    IDENTITY_SLOPE, Coverage, compare_LAI, compute_lai, get_native_LAI_fpath, read_intact,
+    read_ltr_hits, write_lai
+)
+from src.LTR_retriever import get_LAI
+
+MOD_OUT = [
+    "   SW   perc perc perc  query     position in query    matching  repeat",
+    "score   div. del. ins.  sequence  begin end  (left)    repeat    class/family",
+    "",
+    " 1000   4.0  0.0  0.0  chr1          1   200 (800) +  LTR_1     LTR/Gypsy   1 200 (0)  1",
+    " 1000   8.0  0.0  0.0  chr1        501   600 (400) C  LTR_2     LTR/Copia   (0) 100 1  2",
+    "  500  20.0  0.0  0.0  chr1        700   750 (250) +  L1_1      LINE/L1     1 51 (0)   3",
+]
+
+
+def write(fpath, lines):
+    fpath.write_text("".join(line + "\n" for line in lines))
+    return fpath
+
+
+def test_coverage_merges_overlapping_and_adjacent_intervals():
+    coverage = Coverage({"chr1": [(15, 30), (10, 20), (31, 40), (100, 100)]})
+    assert coverage.covered("chr1", 1, 200) == 32
+    assert coverage.covered("chr1", 20, 35) == 16
+    assert coverage.covered("chr1", 41, 99) == 0
+    assert coverage.covered("chr1", 100, 100) == 1
+    assert coverage.covered("chr2", 1, 200) == 0
+
+
+def test_read_ltr_outputs(tmp_path):
+    hits, identity = read_ltr_hits(write(tmp_path / "genome.fa.mod.out", MOD_OUT))
+    # Only LTR hits, with their length-weighted identity
+    assert hits == {"chr1": [(1, 200), (501, 600)]}
+    assert identity == pytest.approx((96 * 200 + 92 * 100) / 300)
+    intact = read_intact(write(tmp_path / "genome.fa.mod.pass.list",
+                               ["#LTR_loc\tStatus", "chr1:1..100\tpass", "chr_2:5..50\tpass"]))
+    assert intact == {"chr1": [(1, 100)], "chr_2": [(5, 50)]}
+
+
+def test_compute_lai_whole_genome_and_windows():
+    records = {"chr1": FaiRecord("chr1", 1000, 6, 60, 61),
+               "chr2": FaiRecord("chr2", 100, 1030, 60, 61)}
+    intact = Coverage({"chr1": [(1, 100)]})
+    total = Coverage({"chr1": [(1, 200), (501, 600)]})
+    rows = compute_lai(records, intact, total, identity=90, window=500, step=250)
+
+    correction = IDENTITY_SLOPE * (94 - 90)
+    whole_genome = rows[0]
+    assert whole_genome[:3] == ("whole_genome", 1, 1100)
+    assert whole_genome[5] == pytest.approx(100 * 100 / 300)
+    assert whole_genome[6] == pytest.approx(100 * 100 / 300 + correction)
+    assert [row[:3] for row in rows[1:]] == [("chr1", 1, 500), ("chr1", 251, 750),
+                                             ("chr1", 501, 1000), ("chr2", 1, 100)]
+    assert rows[1][3:6] == (100 / 500, 200 / 500, 50.0)
+    assert rows[2][5] == 0.0
+    # No LTR-RT at all: no LAI
+    assert rows[4][3:] == (0.0, 0.0, None, None)
+
+
+def test_written_table_is_parsed_like_the_lai_script(tmp_path):
+    records = {"chr1": FaiRecord("chr1", 1000, 6, 60, 61)}
+    rows = compute_lai(records, Coverage({"chr1": [(1, 100)]}),
+                       Coverage({"chr1": [(1, 200)]}), identity=94, window=500, step=500)
+    out_fpath = tmp_path / "genome.fa.mod.out.native.LAI"
+    write_lai(rows, out_fpath)
+    lai = get_LAI({"out_fpath": out_fpath})
+    # The native correction is not the one of the LAI script
+    assert lai["LAI"] is None
+    assert lai["LAI_native"] == pytest.approx(50.0)
+    assert lai["Raw LAI"] == pytest.approx(50.0)
+    assert lai["LAI Windows (N)"] == 2
+    assert lai["windows"][0][6:] == (None, pytest.approx(50.0))
+
+
+def test_comparison_sets_lai_against_lai_native(tmp_path):
+    records = {"chr1": FaiRecord("chr1", 1000, 6, 60, 61)}
+    rows = compute_lai(records, Coverage({"chr1": [(1, 100)]}),
+                       Coverage({"chr1": [(1, 200)]}), identity=92, window=500, step=500)
+    arguments = {"ref_assembly": tmp_path / "genome.fa", "LAI_dir": tmp_path}
+    write_lai(rows, get_native_LAI_fpath(arguments))
+    # The LAI script found the same LTR-RTs with an identity of 93
+    write(tmp_path / "genome.fa.mod.out.LAI",
+          ["Chr\tFrom\tTo\tIntact\tTotal\traw_LAI\tLAI",
+           "whole_genome\t1\t1000\t0.1000\t0.2000\t50.00\t52.81",
+           "chr1\t1\t500\t0.2000\t0.4000\t50.00\t52.81",
+           "chr1\t501\t1000\t0.0000\t0.0000\tNA\tNA"])
+
+    result = compare_LAI(arguments)
+    assert "LAI / LAI_native, LTR identity, Windows differing" in result["msg"]
+    table = {line.split("\t")[0]: line.rstrip("\n").split("\t")[1:]
+             for line in open(result["out_fpath"])}
+    assert table["LTR identity source"][0].startswith("BLAST")
+    assert "RepeatMasker" in table["LTR identity source"][1]
+    assert table["Raw LAI"][2] == "yes"
+    assert float(table["LTR identity"][0]) == pytest.approx(93, abs=0.01)
+    assert float(table["LTR identity"][1]) == pytest.approx(92, abs=0.01)
+    assert table["Windows differing"][1] == "1"
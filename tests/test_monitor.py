@@ -0,0 +1,92 @@
+"""Tests of the live progress metrics (src/monitor.py)."""
+
+import urllib.request
+
+import pytest
+
+from src import monitor as monitor_module
+from src.monitor import RunMonitor, serve_metrics, write_status
+
+
+def result(returncode):
+    return {"msg": "returncode {}".format(returncode), "returncode": returncode}
+
+
+@pytest.fixture
+def monitor():
+    """Two samples sharing the LAI of their assembly."""
+    stages = {"s1/busco": {"group": "s1"}, "s2/busco": {"group": "s2"},
+              "asm/LAI": {"group": "asm"}}
+    return RunMonitor(stages, {"s1": {"s1/busco", "asm/LAI"}, "s2": {"s2/busco", "asm/LAI"}},
+                      threads=8, max_mem=1024)
+
+
+def metrics(monitor):
+    """Return ``{metric line without the value: value}`` of the rendered text."""
+    values = {}
+    for line in monitor.render().splitlines():
+        if not line.startswith("#"):
+            name, _, value = line.rpartition(" ")
+            values[name] = value
+    return values
+
+
+def test_stage_and_sample_states_follow_the_run(monitor):
+    monitor.stage_started("asm/LAI", 1, 512)
+    monitor.stage_started("s1/busco", 4, 0)
+    values = metrics(monitor)
+    assert values['gaqet_stages{state="running"}'] == "2"
+    assert values['gaqet_sample_state{sample="s1",state="running"}'] == "1"
+    assert values['gaqet_sample_state{sample="s2",state="running"}'] == "1"
+    assert values["gaqet_threads_reserved"] == "5"
+    assert values["gaqet_memory_reserved_bytes"] == str(512 * 1024 ** 2)
+    assert values["gaqet_memory_budget_bytes"] == str(1024 ** 3)
+
+    monitor.stage_finished("asm/LAI", result(0))
+    monitor.stage_finished("s1/busco", result(99))
+    monitor.stage_started("s2/busco", 4, 0)
+    monitor.stage_finished("s2/busco", result(1))
+    values = metrics(monitor)
+    assert values['gaqet_stages{state="done"}'] == "1"
+    assert values['gaqet_stages{state="cached"}'] == "1"
+    assert values['gaqet_stages{state="failed"}'] == "1"
+    assert values['gaqet_samples{state="done"}'] == "1"
+    assert values['gaqet_samples{state="failed"}'] == "1"
+    assert values["gaqet_threads_reserved"] == "0"
+    assert values["gaqet_eta_seconds"] == "0"
+
+
+def test_eta_is_unknown_until_a_sample_finishes(monitor, monkeypatch):
+    assert metrics(monitor)["gaqet_eta_seconds"] == "NaN"
+
+    # One of two samples finished in the first hour: one more hour to go
+    start = monitor.start
+    monkeypatch.setattr(monitor_module.time, "time", lambda: start + 3600)
+    for name in ("asm/LAI", "s1/busco"):
+        monitor.stage_started(name, 1, 0)
+        monitor.stage_finished(name, result(0))
+    values = metrics(monitor)
+    assert values["gaqet_samples_per_hour"] == "1"
+    assert values["gaqet_eta_seconds"] == "3600"
+
+
+def test_labels_are_escaped():
+    monitor = RunMonitor({'s"1/busco': {"group": 's"1'}}, {}, threads=1)
+    assert 'gaqet_stage_state{stage="s\\"1/busco",group="s\\"1",state="queued"} 1' in \
+        monitor.render()
+
+
+def test_status_file_and_endpoint_serve_the_same_metrics(monitor, tmp_path):
+    status_fpath = tmp_path / "status.prom"
+    write_status(monitor, status_fpath)
+    assert "gaqet_threads 8" in status_fpath.read_text()
+    assert not (tmp_path / ".status.prom.partial").exists()
+
+    server = serve_metrics(monitor, 0)
+    try:
+        url = "http://127.0.0.1:{}/metrics".format(server.server_address[1])
+        with urllib.request.urlopen(url, timeout=10) as response:
+            assert response.headers["Content-Type"].startswith("text/plain; version=0.0.4")
+            assert "gaqet_threads 8" in response.read().decode()
+    finally:
+        server.shutdown()
@@ -0,0 +1,77 @@
+"""Tests of the dry run (src/plan.py)."""
+
+import io
+
+import pytest
+
+from src.checkpoint import commit
+from src.plan import get_makespan, get_stage_status, plan_run, print_plan
+
+
+def model(serial, parallel=0.0):
+    # Stages here read no FOF file, so the times are per run
+    return {"serial": serial, "parallel": parallel, "runs": 2, "scales": True, "rss": None,
+            "disk": None}
+
+
+def stage(deps=(), threads=1, output=None):
+    return {"run": None, "args": {}, "deps": list(deps), "threads": threads, "group": None,
+            "artifacts": None, "checkpoint": (lambda args: output) if output else None}
+
+
+@pytest.fixture
+def graph(tmp_path):
+    """``a`` (done) -> ``b`` (4 threads) and ``c`` (multi) -> ``d``."""
+    done = tmp_path / "a.out"
+    done.write_text("done")
+    commit(done, 0, "a")
+    return {"s1/a": stage(output=done), "s1/b": stage(["s1/a"], threads=4),
+            "s1/c": stage(["s1/a"], threads="multi"), "s1/d": stage(["s1/b", "s1/c"])}
+
+
+MODELS = {"a": model(100), "b": model(0, 400), "c": model(60, 480), "d": model(30)}
+
+
+def test_status_comes_from_the_checkpoint(graph, tmp_path):
+    assert get_stage_status(graph["s1/a"]) == "done"
+    assert get_stage_status(graph["s1/b"]) == "run"
+    assert get_stage_status(stage(output=tmp_path / "missing.out")) == "run"
+
+
+def test_stages_to_run_are_estimated_with_their_threads(graph):
+    rows = plan_run(graph, 8, MODELS)
+    assert rows["s1/a"]["wall_s"] == 0.0 and rows["s1/a"]["estimate"] == "-"
+    assert rows["s1/b"]["wall_s"] == pytest.approx(100) and rows["s1/b"]["threads"] == 4
+    # "multi" stages get all the threads of the run
+    assert rows["s1/c"]["threads"] == 8 and rows["s1/c"]["wall_s"] == pytest.approx(120)
+    assert rows["s1/c"]["cpu_h"] == pytest.approx(120 * 8 / 3600)
+    assert rows["s1/d"]["estimate"] == "history"
+
+
+def test_makespan_is_the_critical_path_or_the_work_over_the_threads(graph):
+    rows = plan_run(graph, 8, MODELS)
+    makespan = get_makespan(graph, rows, 8)
+    assert makespan["critical_path"] == ["s1/c", "s1/d"]
+    assert makespan["critical_s"] == pytest.approx(150)
+    # 400 + 960 + 30 CPU seconds over 8 threads take longer than the path
+    assert makespan["area_s"] == pytest.approx((400 + 960 + 30) / 8)
+    assert makespan["makespan_s"] == pytest.approx(makespan["area_s"])
+
+    # With 32 threads "c" gets shorter than "b", and the path dominates
+    rows = plan_run(graph, 32, MODELS)
+    makespan = get_makespan(graph, rows, 32)
+    assert makespan["critical_path"] == ["s1/b", "s1/d"]
+    assert makespan["makespan_s"] == pytest.approx(130)
+
+
+def test_report_lists_the_stages_and_the_totals(graph):
+    rows = plan_run(graph, 8, {key: value for key, value in MODELS.items() if key != "d"})
+    out_fhand = io.StringIO()
+    print_plan(rows, get_makespan(graph, rows, 8), 8, out_fhand)
+    report = out_fhand.getvalue()
+
+    assert report.startswith("stage\tstatus\tthreads\t")
+    assert "4 stages: 1 done, 0 restored from the cache, 3 to run" in report
+    assert "Critical path: 2 min (s1/c)" in report
+    # "d" has neither history nor default factors: taken as instant
+    assert "s1/d\trun\t1\t0.000" in report
@@ -0,0 +1,52 @@
+"""Tests of the native protein extraction (src/proteins.py)."""
+
+import io
+
+from src.assembly_stats import scan_assembly
+from src.fasta import IndexedFasta, write_fai
+from src.proteins import extract_proteins, read_cds, reverse_complement, translate
+
+# Minus-strand transcript: its CDS, read 5' to 3', is "GC" (phase 2) then
+# ATG AAA TGG TAA, split in two exons of 7 bases
+MINUS_FIRST, MINUS_SECOND = b"GCATGAA", b"ATGGTAA"
+# Plus-strand transcript with phase 1: one base to skip, then ATG TTT TAA
+PLUS = b"GATGTTTTAA"
+
+GENOME = (b"C" * 10 + reverse_complement(MINUS_SECOND)          # 11..17
+          + b"T" * 13 + reverse_complement(MINUS_FIRST)         # 31..37
+          + b"A" * 12 + PLUS[:4] + b"CCCCC" + PLUS[4:])         # 50..53, 59..64
+
+GFF3 = [
+    "chr1\t.\tCDS\t11\t17\t.\t-\t1\tParent=minus",
+    "chr1\t.\tCDS\t31\t37\t.\t-\t2\tParent=minus",
+    # Pieces out of order in the file
+    "chr1\t.\tCDS\t59\t64\t.\t+\t2\tParent=plus",
+    "chr1\t.\tCDS\t50\t53\t.\t+\t1\tParent=plus",
+    "chr9\t.\tCDS\t1\t9\t.\t+\t0\tParent=elsewhere",
+]
+
+
+def test_translate_uses_the_standard_code():
+    assert translate(b"ATGGCCTAA") == "MA."
+    assert translate(b"atgtgg") == "MW"
+    # Ambiguous codons and trailing bases
+    assert translate(b"ATGNNNAA") == "MX"
+
+
+def test_reverse_complement():
+    assert reverse_complement(b"AACGTN") == b"NACGTT"
+
+
+def test_extract_proteins_splices_and_applies_the_phase(tmp_path):
+    fasta_fpath = tmp_path / "genome.fa"
+    fasta_fpath.write_bytes(b">chr1\n" + GENOME + b"\n")
+    records, _ = scan_assembly(fasta_fpath)
+    write_fai(records, tmp_path / "genome.fai")
+    gff_fpath = tmp_path / "a.gff3"
+    gff_fpath.write_text("".join(line + "\n" for line in GFF3))
+
+    out_fhand = io.StringIO()
+    with IndexedFasta(fasta_fpath, tmp_path / "genome.fai") as fasta:
+        written, skipped = extract_proteins(fasta, read_cds(gff_fpath), out_fhand)
+    assert (written, skipped) == (2, 1)
+    assert out_fhand.getvalue() == ">minus\nMKW.\n>plus\nMF.\n"
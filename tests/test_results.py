@@ -0,0 +1,112 @@
+"""Tests of the results store and the summary it writes (src/results.py)."""
+
+import pytest
+
+from src import results
+from src.results import (
+    get_sample_stages, open_store, typed, update_sample, write_columnar, write_summary
+)
+from src.table import LAI_WINDOW_COLS, SUMMARY_COLS
+
+
+def sample_values(tmp_path, name):
+    return {"lineage": "eudicots_odb10", "assembly_key": "asm", "output": tmp_path / name,
+            "alignments": tmp_path / "{}.bam".format(name)}
+
+
+def stage_results(tmp_path, name):
+    """Results whose statistics report is a real file, so its changes are seen."""
+    report = tmp_path / name / "stats.txt"
+    report.parent.mkdir(parents=True, exist_ok=True)
+    if not report.exists():
+        report.write_text("first")
+    return {"{}/gff_stats".format(name): {"out_fpath": report},
+            "asm/LAI": {"out_fpath": tmp_path / "asm.LAI"}}
+
+
+@pytest.fixture
+def parsed(monkeypatch):
+    """Stand-in parser that records the samples it parsed."""
+    calls = []
+
+    def parse_sample(name, values, stage_results, stats_backend):
+        calls.append(name)
+        if name == "broken":
+            raise ValueError("no whole_genome row")
+        return {"Name": name, "Assembly Length (bp)": 1000, "LAI": None, "Raw LAI": 12.5,
+                "windows": [("chr1", 1, 500, 0.1, 0.2, 50.0, None, 55.6)]}
+
+    monkeypatch.setattr(results, "parse_sample", parse_sample)
+    return calls
+
+
+def test_rows_are_parsed_again_only_when_their_reports_change(tmp_path, parsed):
+    store = open_store(tmp_path)
+    values = sample_values(tmp_path, "s1")
+    assert update_sample(store, "s1", values, stage_results(tmp_path, "s1"),
+                         "native")["returncode"] == 0
+    assert update_sample(store, "s1", values, stage_results(tmp_path, "s1"),
+                         "native")["returncode"] == 99
+    assert parsed == ["s1"]
+
+    (tmp_path / "s1" / "stats.txt").write_text("second run")
+    assert update_sample(store, "s1", values, stage_results(tmp_path, "s1"),
+                         "native")["returncode"] == 0
+    assert parsed == ["s1", "s1"]
+    store.close()
+
+
+def test_summary_holds_the_stored_rows_in_fof_order(tmp_path, parsed):
+    store = open_store(tmp_path)
+    for name in ("s2", "broken", "s1"):
+        update_sample(store, name, sample_values(tmp_path, name),
+                      stage_results(tmp_path, name), "native")
+    # A failed row keeps its error and stays out of the summary
+    error = store.execute("SELECT error FROM samples WHERE name = 'broken'").fetchone()[0]
+    assert error == "ValueError: no whole_genome row"
+    out_fpath = tmp_path / "summary.tsv"
+    write_summary(store, ["s1", "broken", "s2", "unfinished"], out_fpath)
+
+    lines = [line.split("\t") for line in out_fpath.read_text().splitlines()]
+    assert lines[0] == SUMMARY_COLS
+    assert [line[0] for line in lines[1:]] == ["s1", "s2"]
+    row = dict(zip(SUMMARY_COLS, lines[1]))
+    assert (row["Assembly Length (bp)"], row["Raw LAI"], row["LAI"]) == ("1000", "12.5", "NA")
+    assert not (tmp_path / "summary.tsv.partial").exists()
+    store.close()
+
+
+def test_samples_of_an_assembly_share_its_windows(tmp_path, parsed):
+    store = open_store(tmp_path)
+    for name in ("s1", "s2"):
+        update_sample(store, name, sample_values(tmp_path, name),
+                      stage_results(tmp_path, name), "native")
+    assert store.execute("SELECT COUNT(*) FROM lai_windows").fetchone()[0] == 1
+    store.close()
+
+
+def test_values_take_the_type_of_their_column():
+    assert typed("Assembly Length (bp)", "1000") == 1000
+    assert typed("Raw LAI", "12.5") == 12.5
+    assert typed("Name", 7) == "7"
+    assert typed("LAI", None) is None
+
+
+def test_sample_waits_for_its_stages_and_its_assembly():
+    stages = {"s1/busco": {"group": "s1"}, "s2/busco": {"group": "s2"},
+              "asm/LAI": {"group": "asm"}, "asm/assembly_stats": {"group": "asm"},
+              "asm/LTR_retriever": {"group": "asm"}}
+    waiting = get_sample_stages(stages, {"s1": {"assembly_key": "asm"}})
+    assert waiting == {"s1": {"s1/busco", "asm/LAI", "asm/assembly_stats"}}
+
+
+def test_columnar_export_is_typed(tmp_path, parsed):
+    pyarrow = pytest.importorskip("pyarrow")
+    store = open_store(tmp_path)
+    update_sample(store, "s1", sample_values(tmp_path, "s1"), stage_results(tmp_path, "s1"),
+                  "native")
+    out_fpaths = write_columnar(store, ["s1"], tmp_path, "arrow")
+    windows = pyarrow.ipc.open_file(str(out_fpaths[1])).read_all()
+    assert windows.column_names == LAI_WINDOW_COLS
+    assert windows.column("LAI_native").to_pylist() == [55.6]
+    store.close()
@@ -0,0 +1,273 @@
+"""Tests of the stage-graph scheduler (src/scheduler.py)."""
+
+import threading
+import time
+
+import pytest
+
+from src import execution
+from src.execution import run_command
+from src.scheduler import MAX_OOM_RETRIES, allocate_threads, check_graph, run_stages
+
+
+def result(returncode=0):
+    return {"msg": "returncode {}".format(returncode), "out_fpath": None,
+            "returncode": returncode}
+
+
+def stage(run, deps=(), threads=1, group=None, memory=None):
+    return {"run": run, "args": {}, "deps": list(deps), "threads": threads,
+            "group": group, "memory": memory}
+
+
+def ok(args):
+    return result(0)
+
+
+def failing(args):
+    return result(1)
+
+
+# ---------------------------------------------------------------------------
+# 1. Graph helpers
+# ---------------------------------------------------------------------------
+def test_check_graph_orders_dependencies_first():
+    stages = {"c": stage(ok, ["b"]), "b": stage(ok, ["a"]), "a": stage(ok), "d": stage(ok, ["a"])}
+    order = check_graph(stages)
+    assert sorted(order) == ["a", "b", "c", "d"]
+    assert order.index("a") < order.index("b") < order.index("c")
+    assert order.index("a") < order.index("d")
+
+
+def test_check_graph_rejects_unknown_dependencies():
+    with pytest.raises(ValueError, match="unknown stage missing"):
+        check_graph({"a": stage(ok, ["missing"])})
+
+
+def test_check_graph_rejects_cycles():
+    with pytest.raises(ValueError, match="Cycle"):
+        check_graph({"a": stage(ok, ["b"]), "b": stage(ok, ["a"])})
+
+
+# ---------------------------------------------------------------------------
+# 2. Thread allocation
+# ---------------------------------------------------------------------------
+def test_allocate_threads_shares_free_threads_between_scalable_stages():
+    assert allocate_threads({"threads": "multi"}, free=8, total=8, multi_waiting=2) == 4
+    assert allocate_threads({"threads": "multi"}, free=3, total=8, multi_waiting=4) == 1
+    assert allocate_threads({"threads": "multi"}, free=0, total=8, multi_waiting=1) == 0
+
+
+def test_allocate_threads_gives_fixed_stages_what_they_ask_for():
+    assert allocate_threads({"threads": 2}, free=8, total=8, multi_waiting=0) == 2
+    # Waits rather than running with fewer threads
+    assert allocate_threads({"threads": 4}, free=3, total=8, multi_waiting=0) == 0
+    # Capped by the threads of the run
+    assert allocate_threads({"threads": 16}, free=8, total=8, multi_waiting=0) == 8
+
+
+# ---------------------------------------------------------------------------
+# 3. Execution
+# ---------------------------------------------------------------------------
+def test_run_stages_runs_dependencies_first_within_the_budget():
+    lock = threading.Lock()
+    events, running, peak = [], [0], [0]
+
+    def run(args):
+        with lock:
+            events.append(args["name"])
+            running[0] += args["threads"]
+            peak[0] = max(peak[0], running[0])
+        time.sleep(0.05)
+        with lock:
+            running[0] -= args["threads"]
+        return result(0)
+
+    stages = {name: stage(run, deps, threads=2) for name, deps in
+              (("a", []), ("b", []), ("c", ["a", "b"]), ("d", []))}
+    for name, values in stages.items():
+        values["args"]["name"] = name
+    finished = []
+    results = run_stages(stages, 4, callback=lambda name, res: finished.append(name))
+
+    assert all(results[name]["returncode"] == 0 for name in stages)
+    assert events.index("c") > max(events.index("a"), events.index("b"))
+    assert peak[0] <= 4
+    assert sorted(finished) == sorted(stages)
+    assert all("profile" in res for res in results.values())
+
+
+def test_run_stages_skips_the_dependents_of_a_failed_stage():
+    stages = {"a": stage(failing), "b": stage(ok, ["a"]), "c": stage(ok, ["b"]),
+              "d": stage(ok)}
+    results = run_stages(stages, 2)
+    assert results["a"]["returncode"] == 1
+    assert results["b"]["returncode"] is None and "a failed" in results["b"]["msg"]
+    assert results["c"]["returncode"] is None
+    assert results["d"]["returncode"] == 0
+
+
+def test_fail_fast_cancels_the_rest_of_the_group_only():
+    def slow(args):
+        time.sleep(0.2)
+        return result(0)
+
+    stages = {"s1/fail": stage(failing, group="s1"),
+              "s1/slow": stage(slow, group="s1"),
+              "s1/after": stage(ok, ["s1/slow"], group="s1"),
+              "s2/slow": stage(slow, group="s2"),
+              "s2/after": stage(ok, ["s2/slow"], group="s2")}
+    results = run_stages(stages, 3, fail_fast=True)
+    assert results["s1/after"]["returncode"] is None
+    assert "cancelled" in results["s1/after"]["msg"]
+    assert results["s2/after"]["returncode"] == 0
+
+
+def test_max_groups_only_counts_the_limited_groups():
+    lock = threading.Lock()
+    running, overlaps = set(), []
+
+    def run(args):
+        with lock:
+            running.add(args["group"])
+            overlaps.append(len(running & {"s1", "s2"}))
+        time.sleep(0.05)
+        with lock:
+            running.discard(args["group"])
+        return result(0)
+
+    stages = {}
+    for group in ("asm", "s1", "s2"):
+        stages["{}/a".format(group)] = stage(run, group=group)
+        stages["{}/a".format(group)]["args"]["group"] = group
+    stages["s1/b"] = stage(run, ["asm/a"], group="s1")
+    stages["s1/b"]["args"]["group"] = "s1"
+    start = time.perf_counter()
+    results = run_stages(stages, 4, max_groups=1, limited_groups={"s1", "s2"})
+    assert all(res["returncode"] == 0 for res in results.values())
+    # One sample at a time, the shared assembly group alongside
+    assert max(overlaps) == 1
+    assert time.perf_counter() - start < 1
+
+
+def test_inputs_are_decompressed_in_the_slot_of_their_first_sample():
+    order = []
+
+    def run(args):
+        order.append(args["name"])
+        return result(0)
+
+    stages = {}
+    for group in ("s1", "s2"):
+        names = {"input": "input_{}/decompress".format(group), "a": "{}/a".format(group),
+                 "b": "{}/b".format(group)}
+        stages[names["input"]] = stage(run, group="input_{}".format(group))
+        stages[names["a"]] = stage(run, [names["input"]], group=group)
+        stages[names["b"]] = stage(run, [names["a"]], group=group)
+    for name, input_stage in stages.items():
+        input_stage["args"]["name"] = name
+    results = run_stages(stages, 4, max_groups=1, limited_groups={"s1", "s2"},
+                         group_slots={"input_s1": "s1", "input_s2": "s2"})
+    assert all(res["returncode"] == 0 for res in results.values())
+    # The second copy is only written once the first sample is done
+    assert order == ["input_s1/decompress", "s1/a", "s1/b", "input_s2/decompress", "s2/a", "s2/b"]
+
+
+def batch_graph(order, proteins_failed=False):
+    """Two samples whose ``busco`` stages wait for one batch over their proteins.
+
+    The stages append their name to ``order`` as they run.
+    """
+    def run(args):
+        order.append(args["name"])
+        return result(1 if proteins_failed and args["name"] == "s2/proteins" else 0)
+
+    stages = {"batch/busco_batch": stage(run)}
+    stages["batch/busco_batch"]["after"] = ["s1/proteins", "s2/proteins"]
+    for group in ("s1", "s2"):
+        stages["{}/proteins".format(group)] = stage(run, group=group)
+        stages["{}/busco".format(group)] = stage(
+            run, ["{}/proteins".format(group), "batch/busco_batch"], group=group)
+    for name, batch_stage in stages.items():
+        batch_stage["args"]["name"] = name
+    return stages
+
+
+def test_samples_waiting_for_a_batch_do_not_hold_a_group_slot():
+    # With -j 1 the second sample must open while the first waits for the batch
+    order = []
+    results = run_stages(batch_graph(order), 2, max_groups=1, limited_groups={"s1", "s2"})
+    assert all(res["returncode"] == 0 for res in results.values())
+    assert order.index("batch/busco_batch") > max(order.index("s1/proteins"),
+                                                   order.index("s2/proteins"))
+
+
+def test_after_stages_run_when_what_they_wait_for_failed():
+    order = []
+    results = run_stages(batch_graph(order, proteins_failed=True), 2)
+    assert order.index("batch/busco_batch") > order.index("s2/proteins")
+    assert results["batch/busco_batch"]["returncode"] == 0
+    assert results["s1/busco"]["returncode"] == 0
+    assert results["s2/busco"]["returncode"] is None
+
+
+def test_stages_that_can_never_start_fail_instead_of_hanging():
+    stages = {"free": stage(ok), "s1/a": stage(ok, group="s1"),
+              "s1/b": stage(ok, ["s1/a"], group="s1")}
+    results = run_stages(stages, 2, max_groups=0)
+    assert results["free"]["returncode"] == 0
+    assert results["s1/a"]["returncode"] == 1
+    assert "could not be scheduled" in results["s1/a"]["msg"]
+    assert results["s1/b"]["returncode"] == 1
+
+
+# ---------------------------------------------------------------------------
+# 4. OOM retries
+# ---------------------------------------------------------------------------
+def oom_until(successful_call):
+    calls = []
+
+    def run(args):
+        calls.append(args["threads"])
+        return result(0 if len(calls) == successful_call else -9)
+    return run, calls
+
+
+def test_oom_killed_stage_is_retried_with_a_larger_reservation():
+    run, calls = oom_until(3)
+    stages = {"a": stage(run, memory=10)}
+    results = run_stages(stages, 1, max_mem=100)
+    assert len(calls) == 3
+    assert results["a"]["returncode"] == 0
+    assert "after 2 OOM retries" in results["a"]["msg"]
+    assert stages["a"]["memory"] == 50
+
+
+def test_oom_retries_are_limited():
+    run, calls = oom_until(None)
+    results = run_stages({"a": stage(run, memory=10)}, 1, max_mem=100)
+    assert len(calls) == MAX_OOM_RETRIES + 1
+    assert results["a"]["returncode"] == -9
+
+
+def test_oom_kills_are_not_retried_without_a_memory_budget():
+    run, calls = oom_until(None)
+    run_stages({"a": stage(run, memory=10)}, 1)
+    assert len(calls) == 1
+
+
+def test_stages_stopped_by_gaqet_are_not_retried(monkeypatch):
+    monkeypatch.setattr(execution, "KILL_GRACE", 0.2)
+    calls = []
+
+    def run(args):
+        calls.append(1)
+        # Ignores SIGTERM, so the timeout ends in a SIGKILL
+        run_command(["bash", "-c", "trap '' TERM; sleep 30"])
+        # ... which a wrapper script reports as its own
+        return result(-9)
+
+    results = run_stages({"a": stage(run, memory=10)}, 1, timeout=0.3, max_mem=100)
+    assert len(calls) == 1
+    assert results["a"]["returncode"] == -9
+    assert "timed out" in results["a"]["stopped"]
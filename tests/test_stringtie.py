@@ -0,0 +1,83 @@
+"""Tests of the chromosome-sharded StringTie stages (src/stringtie.py) with a stub ``samtools``."""
+
+import os
+import sys
+
+import pytest
+
+from src.checkpoint import commit, is_done
+from src.stringtie import (
+    get_stringtie_shard_fpath, merge_stringtie_shards, plan_stringtie_shards, read_shard_chroms,
+    run_stringtie_shard
+)
+
+# Prints the idxstats table of a BAM with reads on chr1 to chr3 only
+SAMTOOLS_STUB = """#!{python}
+import sys
+
+if sys.argv[1] == "idxstats":
+    sys.stdout.write("chr1\\t1000\\t900\\t0\\nchr2\\t800\\t500\\t0\\nchr3\\t600\\t400\\t0\\n"
+                     "chrUn\\t100\\t0\\t0\\n*\\t0\\t0\\t50\\n")
+"""
+
+
+@pytest.fixture
+def samtools_stub(tmp_path, monkeypatch):
+    bin_dir = tmp_path / "bin"
+    bin_dir.mkdir()
+    stub = bin_dir / "samtools"
+    stub.write_text(SAMTOOLS_STUB.format(python=sys.executable))
+    stub.chmod(0o755)
+    monkeypatch.setenv("PATH", "{}{}{}".format(bin_dir, os.pathsep, os.environ["PATH"]))
+
+
+def sample(tmp_path, n_shards):
+    bam = tmp_path / "sample.bam"
+    bam.write_bytes(b"BAM")
+    # An existing index is copied instead of running samtools index
+    (tmp_path / "sample.bam.bai").write_bytes(b"BAI")
+    return {"alignments": bam, "output": tmp_path / "s1", "stringtie_shards": n_shards,
+            "threads": 2}
+
+
+def test_whole_chromosomes_are_balanced_by_mapped_reads(tmp_path, samtools_stub):
+    arguments = sample(tmp_path, 2)
+    assert plan_stringtie_shards(arguments)["returncode"] == 0
+    # chr1 alone weighs as much as chr2 and chr3; chromosomes without reads are left out
+    assert read_shard_chroms(arguments, 1) == ["chr1"]
+    assert read_shard_chroms(arguments, 2) == ["chr2", "chr3"]
+    assert plan_stringtie_shards(arguments)["returncode"] == 99
+
+
+def test_shard_without_chromosomes_is_empty(tmp_path, samtools_stub):
+    arguments = sample(tmp_path, 4)
+    plan_stringtie_shards(arguments)
+    result = run_stringtie_shard(arguments, 4)
+    assert result["returncode"] == 0 and "empty" in result["msg"]
+    assert is_done(get_stringtie_shard_fpath(arguments, 4))
+
+
+def write_shard(arguments, shard, gene):
+    fpath = get_stringtie_shard_fpath(arguments, shard)
+    fpath.parent.mkdir(parents=True, exist_ok=True)
+    fpath.write_text(
+        "# stringtie -o shard{}.gtf\n".format(shard) +
+        'chr{0}\tStringTie\ttranscript\t1\t100\t1000\t+\t.\tgene_id "STRG.{1}"; '
+        'transcript_id "STRG.{1}.1";\n'.format(shard, gene))
+    commit(fpath, 0, "stringtie")
+
+
+def test_merged_shards_prefix_the_gene_ids_with_the_shard(tmp_path):
+    arguments = sample(tmp_path, 2)
+    # Both shards number their genes from STRG.1
+    write_shard(arguments, 1, 1)
+    write_shard(arguments, 2, 1)
+    result = merge_stringtie_shards(arguments)
+    assert result["returncode"] == 0
+
+    lines = (result["out_fpath"] / "sample.gtf").read_text().splitlines()
+    assert lines[0] == "# stringtie -o shard1.gtf"
+    assert len(lines) == 3
+    assert 'gene_id "STRG.1_1"; transcript_id "STRG.1_1.1";' in lines[1]
+    assert 'gene_id "STRG.2_1"; transcript_id "STRG.2_1.1";' in lines[2]
+    assert merge_stringtie_shards(arguments)["returncode"] == 99
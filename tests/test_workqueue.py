@@ -0,0 +1,181 @@
+"""Tests of the shared-filesystem work queue (src/workqueue.py)."""
+
+import threading
+import time
+
+import pytest
+
+from src import workqueue
+from src.checkpoint import commit, is_done, promote, tmp_fpath
+from src.workqueue import (
+    _claim_task, _finish_task, _requeue_stale, _run_claimed, connect, create_queue, run_queue,
+    run_worker
+)
+
+POLL = 0.02
+
+
+def result(returncode=0):
+    return {"msg": "returncode {}".format(returncode), "out_fpath": None,
+            "returncode": returncode}
+
+
+def stage(run, deps=(), threads=1, group=None):
+    return {"run": run, "args": {}, "deps": list(deps), "threads": threads, "group": group}
+
+
+# Runners are pickled into the queue, so they live at module level
+def slow_ok(args):
+    time.sleep(0.1)
+    return result(0)
+
+
+def failing(args):
+    return result(1)
+
+
+def write_report(args):
+    """Write the report once the ``go`` file exists."""
+    tmp = tmp_fpath(args["output_fpath"])
+    tmp.write_text(args["text"])
+    for _ in range(1000):
+        if args["go"].exists():
+            break
+        time.sleep(0.01)
+    promote(tmp, args["output_fpath"])
+    commit(args["output_fpath"], 0, "write")
+    return result(0)
+
+
+def serve(stages, queue_fpath, n_workers=2, **kwargs):
+    """Run the coordinator with ``n_workers`` worker threads; return the results and
+    how many stages each worker ran."""
+    counts = {}
+
+    def work(worker):
+        counts[worker] = run_worker(queue_fpath, 1, poll=POLL, worker=worker)
+
+    workers = [threading.Thread(target=work, args=("worker{}".format(number),))
+               for number in range(n_workers)]
+    for thread in workers:
+        thread.start()
+    results = run_queue(stages, queue_fpath, poll=POLL, **kwargs)
+    for thread in workers:
+        thread.join(timeout=30)
+        assert not thread.is_alive()
+    return results, counts
+
+
+# ---------------------------------------------------------------------------
+# 1. Coordinator and workers
+# ---------------------------------------------------------------------------
+def test_two_workers_run_the_whole_graph(tmp_path):
+    stages = {"root": stage(slow_ok)}
+    stages.update({"leaf{}".format(number): stage(slow_ok, ["root"]) for number in range(6)})
+    stages["sink"] = stage(slow_ok, ["leaf{}".format(number) for number in range(6)])
+    results, counts = serve(stages, tmp_path / "queue.sqlite")
+
+    assert set(results) == set(stages)
+    assert all(results[name]["returncode"] == 0 for name in stages)
+    assert sum(counts.values()) == len(stages)
+    # Both workers took part in the independent leaves
+    assert all(count > 0 for count in counts.values())
+
+
+def test_failed_stage_skips_its_dependents(tmp_path):
+    stages = {"a": stage(failing), "b": stage(slow_ok, ["a"]), "c": stage(slow_ok, ["b"]),
+              "d": stage(slow_ok)}
+    results, counts = serve(stages, tmp_path / "queue.sqlite")
+
+    assert results["a"]["returncode"] == 1
+    assert results["b"]["returncode"] is None and "skipped" in results["b"]["msg"]
+    assert results["c"]["returncode"] is None
+    assert results["d"]["returncode"] == 0
+    assert sum(counts.values()) == 2
+
+
+def test_fail_fast_cancels_the_pending_stages_of_the_group(tmp_path):
+    # "c" waits for "e", which is still running when "a" fails
+    stages = {"a": stage(failing, group="s1"), "e": stage(slow_ok, group="s1"),
+              "c": stage(slow_ok, ["e"], group="s1"), "d": stage(slow_ok, group="s2")}
+    results, _ = serve(stages, tmp_path / "queue.sqlite", fail_fast=True)
+
+    assert results["a"]["returncode"] == 1
+    assert results["e"]["returncode"] == 0
+    assert results["c"]["returncode"] is None and "cancelled" in results["c"]["msg"]
+    assert results["d"]["returncode"] == 0
+
+
+# ---------------------------------------------------------------------------
+# 2. Ownership of the tasks
+# ---------------------------------------------------------------------------
+def test_stale_worker_cannot_overwrite_a_requeued_task(tmp_path, monkeypatch):
+    queue_fpath = tmp_path / "queue.sqlite"
+    create_queue(queue_fpath, {"a": stage(slow_ok)})
+    connection = connect(queue_fpath)
+    connection.execute("INSERT INTO workers (id, heartbeat) VALUES ('old', 0)")
+    assert _claim_task(connection, "old", 1, 1)[0] == "a"
+
+    # "old" stopped beating: its stage goes back to the queue and "new" takes it
+    monkeypatch.setattr(workqueue, "STALE_AFTER", 1)
+    _requeue_stale(connection)
+    assert _claim_task(connection, "new", 1, 1)[0] == "a"
+
+    assert not _finish_task(connection, "a", "done", result(1), "old")
+    assert connection.execute("SELECT state FROM tasks").fetchone()[0] == "running"
+    assert _finish_task(connection, "a", "done", result(0), "new")
+    assert connection.execute("SELECT state, ok, worker FROM tasks").fetchone() == ("done", 1,
+                                                                                    "new")
+    connection.close()
+
+
+def test_stale_worker_does_not_promote_its_outputs(tmp_path, monkeypatch):
+    queue_fpath = tmp_path / "queue.sqlite"
+    output = tmp_path / "report.txt"
+    go = tmp_path / "go"
+    create_queue(queue_fpath, {"a": stage(write_report)})
+    connection = connect(queue_fpath)
+    connection.execute("INSERT INTO workers (id, heartbeat) VALUES ('old', 0)")
+    name, claimed, given, _ = _claim_task(connection, "old", 1, 1)
+    errors = []
+
+    def run_old():
+        args = {"output_fpath": output, "go": go, "text": "old"}
+        try:
+            _run_claimed(queue_fpath, "old", name, dict(claimed, args=args), given, None)
+        except RuntimeError as error:
+            errors.append(error)
+
+    old = threading.Thread(target=run_old)
+    old.start()
+    # "old" is taken as dead while it runs and "new" claims the stage
+    monkeypatch.setattr(workqueue, "STALE_AFTER", 1)
+    _requeue_stale(connection)
+    name, claimed, given, _ = _claim_task(connection, "new", 1, 1)
+    go.touch()
+    old.join(10)
+    assert "another worker" in str(errors[0])
+    assert not output.exists()
+
+    args = {"output_fpath": output, "go": go, "text": "new"}
+    _run_claimed(queue_fpath, "new", name, dict(claimed, args=args), given, None)
+    assert is_done(output) and output.read_text() == "new"
+    connection.close()
+
+
+def test_queue_with_stages_of_live_workers_is_not_replaced(tmp_path):
+    queue_fpath = tmp_path / "queue.sqlite"
+    create_queue(queue_fpath, {"a": stage(slow_ok)})
+    connection = connect(queue_fpath)
+    connection.execute("INSERT INTO workers (id, heartbeat) VALUES ('w1', ?)", (time.time(),))
+    _claim_task(connection, "w1", 1, 1)
+    with pytest.raises(RuntimeError, match="live workers"):
+        create_queue(queue_fpath, {"b": stage(slow_ok)})
+
+    # Once the worker stopped beating the queue can be replaced
+    connection.execute("UPDATE workers SET heartbeat = 0")
+    connection.close()
+    create_queue(queue_fpath, {"b": stage(slow_ok)})
+    connection = connect(queue_fpath)
+    assert connection.execute("SELECT name FROM tasks").fetchall() == [("b",)]
+    connection.close()